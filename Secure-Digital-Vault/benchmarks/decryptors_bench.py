@@ -0,0 +1,92 @@
+"""Benchmarks for decrypting files out of the vault. Run from the Secure-Digital-Vault folder, e.g.:
+
+    python -m benchmarks.decryptors_bench extract --sizes 10G --workers 1 2 4 8
+"""
+from benchmarks.file_io_bench import timed, create_synthetic_vault
+from benchmarks.encryptors_bench import default_workers, VAULT_SIZE
+from crypto.encryptors import encrypt_file_pieces
+from crypto.decryptors import extract_file_from_vault, decrypt_chunks_v2
+from crypto.pool import get_crypto_pool, shutdown_crypto_pool
+from crypto.utils import generate_aes_key, form_file_v2_header
+from file_handle.vault_file import VaultFile
+from threads.mutable_boolean import MutableBoolean
+from utils.constants import FILE_FORMAT_V1, FILE_FORMAT_V2
+from utils.parsers import parse_from_string_to_size, parse_size_to_string
+
+from Crypto.Random import get_random_bytes
+
+import argparse
+import os
+
+PASSWORD = "benchmark"
+
+
+def bench_extract(size : int, file_path : str, workers : list[int], format_version : int) -> list[str]:
+    """Adds a file of the given size into a vault, then extracts it once per worker count.
+    The workers are started and have imported the decryptors before timing.
+    """
+    create_synthetic_vault(file_path, size, [])
+    vault_path = file_path + ".vault"
+    output_path = file_path + ".out"
+    salt = get_random_bytes(16)
+    key = generate_aes_key(password=PASSWORD.encode(), salt=salt, key_length=32)
+    if format_version == FILE_FORMAT_V2:
+        first_bytes = header = form_file_v2_header(salt, get_random_bytes(8))
+        iv = None
+    else:
+        iv = get_random_bytes(16)
+        first_bytes, header = salt + iv, None
+    create_synthetic_vault(vault_path, VAULT_SIZE, [])
+    with open(file_path, "rb") as file, VaultFile(vault_path) as vault_file:
+        vault_file.append(first_bytes)
+        for piece in encrypt_file_pieces(file, size, key, MutableBoolean(True), header=header, iv=iv):
+            vault_file.append(piece)
+        vault_size = vault_file.get_size()
+
+    lines = []
+    baseline = None
+    try:
+        with VaultFile(vault_path) as vault_file:
+            for count in workers:
+                pool = get_crypto_pool(count)
+                if pool:
+                    warm_up = form_file_v2_header(salt, bytes(8))
+                    list(pool.map(decrypt_chunks_v2, [key] * count, [warm_up] * count, [b''] * count, [0] * count, [True] * count))
+                duration, res = timed(extract_file_from_vault, vault_file, VAULT_SIZE, vault_size, output_path, PASSWORD,
+                                      format_version=format_version, workers=count)
+                assert res[0], res[1]
+                speed = size / duration / 1_048_576
+                baseline = baseline or speed
+                lines.append(f"extract v{format_version} {parse_size_to_string(size):>10}  workers: {count:3}  {duration:8.3f}s  "
+                             f"{speed:8.1f} MB/s  x{speed / baseline:.2f}")
+    finally:
+        shutdown_crypto_pool()
+        for path in (vault_path, output_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return lines
+
+BENCHMARKS = {
+    "extract": bench_extract,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="decryptors benchmarks on synthetic vaults")
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--sizes", nargs="+", default=["1G"], help="File sizes, e.g. 1G 10G")
+    parser.add_argument("--workers", nargs="+", type=int, default=default_workers(), help="Worker counts to compare, e.g. 1 2 4 8")
+    parser.add_argument("--formats", nargs="+", type=int, default=[FILE_FORMAT_V2, FILE_FORMAT_V1], help="File formats, 1 and/or 2")
+    parser.add_argument("--path", default="bench_synthetic.file", help="Where to create the synthetic file")
+    args = parser.parse_args()
+    for size in args.sizes:
+        size = parse_from_string_to_size(size[:-1] + " " + size[-1] + "B")
+        for format_version in args.formats:
+            try:
+                for line in BENCHMARKS[args.benchmark](size, args.path, args.workers, format_version):
+                    print(line)
+            finally:
+                if os.path.exists(args.path):
+                    os.remove(args.path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""Benchmarks for encrypting files into the vault. Run from the Secure-Digital-Vault folder, e.g.:
+
+    python -m benchmarks.encryptors_bench import --sizes 4G --workers 1 2 4 8
+    python -m benchmarks.encryptors_bench checksum --sizes 4G
+"""
+from benchmarks.file_io_bench import timed, create_synthetic_vault
+from crypto.encryptors import encrypt_file_pieces, encrypt_chunks_v2
+from crypto.pool import get_crypto_pool, shutdown_crypto_pool
+from crypto.utils import generate_aes_key, form_file_v2_header, get_checksum, format_checksum
+from file_handle.vault_file import VaultFile
+from threads.mutable_boolean import MutableBoolean
+from utils.parsers import parse_from_string_to_size, parse_size_to_string
+
+import argparse
+import hashlib
+import os
+
+VAULT_SIZE = 4096
+
+
+def default_workers() -> list[int]:
+    """Powers of two up to the amount of cores, and the amount of cores itself.
+    """
+    cores = os.cpu_count() or 1
+    workers = [1]
+    while workers[-1] * 2 < cores:
+        workers.append(workers[-1] * 2)
+    if cores > 1:
+        workers.append(cores)
+    return workers
+
+def bench_import(size : int, file_path : str, workers : list[int]) -> list[str]:
+    """Encrypts a file in the v2 format and appends it to a vault through a single ordered writer, once per worker count.
+    The workers are started and have imported the encryptors before timing, so only the encryption and the writing are measured.
+    """
+    create_synthetic_vault(file_path, size, [])
+    vault_path = file_path + ".vault"
+    salt = os.urandom(16)
+    header = form_file_v2_header(salt, os.urandom(8))
+    key = generate_aes_key(password=b"benchmark", salt=salt, key_length=32)
+
+    def encrypt_and_append(count : int) -> int:
+        create_synthetic_vault(vault_path, VAULT_SIZE, [])
+        with open(file_path, "rb") as file, VaultFile(vault_path) as vault_file:
+            vault_file.append(header)
+            for piece in encrypt_file_pieces(file, size, key, MutableBoolean(True), header=header, workers=count):
+                vault_file.append(piece)
+            return vault_file.get_size()
+
+    lines = []
+    baseline = None
+    try:
+        for count in workers:
+            pool = get_crypto_pool(count)
+            if pool:
+                list(pool.map(encrypt_chunks_v2, [key] * count, [header] * count, [b''] * count, [0] * count, [True] * count))
+            duration, vault_size = timed(encrypt_and_append, count)
+            speed = size / duration / 1_048_576
+            baseline = baseline or speed
+            lines.append(f"import {parse_size_to_string(size):>10}  workers: {count:3}  {duration:8.3f}s  {speed:8.1f} MB/s  "
+                         f"x{speed / baseline:.2f}  vault: {parse_size_to_string(vault_size)}")
+    finally:
+        shutdown_crypto_pool()
+        if os.path.exists(vault_path):
+            os.remove(vault_path)
+    return lines
+
+def bench_checksum(size : int, file_path : str, workers : list[int]) -> list[str]:
+    """Imports a v2 file and takes its checksum, once reading the file a second time for get_checksum as imports used to,
+    once hashing inside the read which feeds the encryption. Reads the cold file from disk only if the page cache is dropped
+    between runs, e.g, with a file larger than memory.
+    """
+    create_synthetic_vault(file_path, size, [])
+    vault_path = file_path + ".vault"
+    salt = os.urandom(16)
+    header = form_file_v2_header(salt, os.urandom(8))
+    key = generate_aes_key(password=b"benchmark", salt=salt, key_length=32)
+
+    def import_file(count : int, fused : bool) -> str:
+        create_synthetic_vault(vault_path, VAULT_SIZE, [])
+        sha256 = hashlib.sha256() if fused else None
+        with open(file_path, "rb") as file, VaultFile(vault_path) as vault_file:
+            vault_file.append(header)
+            for piece in encrypt_file_pieces(file, size, key, MutableBoolean(True), header=header, workers=count, sha256=sha256):
+                vault_file.append(piece)
+        return format_checksum(sha256) if fused else get_checksum(file_path, is_file=True)
+
+    lines = []
+    try:
+        for count in workers:
+            pool = get_crypto_pool(count)
+            if pool:
+                list(pool.map(encrypt_chunks_v2, [key] * count, [header] * count, [b''] * count, [0] * count, [True] * count))
+            checksums = set()
+            for fused in (False, True):
+                duration, checksum = timed(import_file, count, fused)
+                checksums.add(checksum)
+                lines.append(f"checksum {'fused' if fused else 'separate':>8} {parse_size_to_string(size):>10}  workers: {count:3}  "
+                             f"{duration:8.3f}s  {size / duration / 1_048_576:8.1f} MB/s  source read: {parse_size_to_string(size * (1 if fused else 2))}")
+            assert len(checksums) == 1
+    finally:
+        shutdown_crypto_pool()
+        if os.path.exists(vault_path):
+            os.remove(vault_path)
+    return lines
+
+BENCHMARKS = {
+    "import": bench_import,
+    "checksum": bench_checksum,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="encryptors benchmarks on synthetic files")
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--sizes", nargs="+", default=["4G"], help="File sizes, e.g. 256M 1G 4G")
+    parser.add_argument("--workers", nargs="+", type=int, default=default_workers(), help="Worker counts to compare, e.g. 1 2 4 8")
+    parser.add_argument("--path", default="bench_synthetic.file", help="Where to create the synthetic file")
+    args = parser.parse_args()
+    for size in args.sizes:
+        size = parse_from_string_to_size(size[:-1] + " " + size[-1] + "B")
+        try:
+            for line in BENCHMARKS[args.benchmark](size, args.path, args.workers):
+                print(line)
+        finally:
+            if os.path.exists(args.path):
+                os.remove(args.path)
+
+if __name__ == "__main__":
+    main()
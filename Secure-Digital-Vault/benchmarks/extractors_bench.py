@@ -0,0 +1,91 @@
+"""Benchmarks for reading files out of the vault. Run from the Secure-Digital-Vault folder, e.g.:
+
+    python -m benchmarks.extractors_bench read --sizes 256M 1G
+"""
+from benchmarks.file_io_bench import timed, create_synthetic_vault
+from utils.extractors import get_file_from_vault, map_file_from_vault
+from utils.parsers import parse_from_string_to_size, parse_size_to_string
+from utils.constants import CHUNK_LIMIT
+
+import argparse
+import hashlib
+import os
+import tracemalloc
+
+FILE_OFFSET = 12345
+
+
+def concatenating_read(vault_path : str, starting_byte : int, ending_byte : int, chunk_size_to_read : int = CHUNK_LIMIT) -> bytes:
+    """The previous get_file_from_vault, which grew its result with += per chunk.
+    """
+    with open(vault_path, "rb") as file:
+        file_size = ending_byte - starting_byte
+        raw_data = b''
+        file.seek(starting_byte)
+        bytes_read = 0
+        while bytes_read < file_size:
+            chunk = file.read(min(chunk_size_to_read, file_size - bytes_read))
+            if not chunk:
+                break
+            raw_data += chunk
+            bytes_read += len(chunk)
+    return raw_data
+
+def measured(function, *args) -> tuple[float, int, object]:
+    """Runs the function once while tracing allocations.
+
+    Returns:
+        tuple[float, int, object]: [0] seconds it took, [1] peak of allocated bytes, [2] the result of the function
+    """
+    tracemalloc.start()
+    duration, result = timed(function, *args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak, result
+
+def bench_read(size : int, file_path : str) -> list[str]:
+    """Reads a file stored in the vault and hashes it, once per read path.
+    """
+    create_synthetic_vault(file_path, size + FILE_OFFSET, [])
+    end = FILE_OFFSET + size
+
+    def sha_of_concatenated():
+        return hashlib.sha256(concatenating_read(file_path, FILE_OFFSET, end)).hexdigest()
+
+    def sha_of_preallocated():
+        return hashlib.sha256(get_file_from_vault(file_path, FILE_OFFSET, end)).hexdigest()
+
+    def sha_of_mapped():
+        with map_file_from_vault(file_path, FILE_OFFSET, end) as view:
+            return hashlib.sha256(view).hexdigest()
+
+    lines = []
+    expected = None
+    for name, function in [("concatenated", sha_of_concatenated), ("preallocated", sha_of_preallocated), ("mapped", sha_of_mapped)]:
+        duration, peak, result = measured(function)
+        expected = expected or result
+        assert result == expected, f"{name} read different bytes"
+        lines.append(f"read {parse_size_to_string(size):>10}  {name:12}  {duration:8.3f}s  peak allocations: {parse_size_to_string(peak):>10}")
+    return lines
+
+BENCHMARKS = {
+    "read": bench_read,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="extractors benchmarks on synthetic vaults")
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--sizes", nargs="+", default=["256M", "1G"], help="File sizes, e.g. 256M 1G 2G")
+    parser.add_argument("--path", default="bench_synthetic.vault", help="Where to create the synthetic vault")
+    args = parser.parse_args()
+    for size in args.sizes:
+        size = parse_from_string_to_size(size[:-1] + " " + size[-1] + "B")
+        try:
+            for line in BENCHMARKS[args.benchmark](size, args.path):
+                print(line)
+        finally:
+            if os.path.exists(args.path):
+                os.remove(args.path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Benchmarks for file_handle.file_io. Run from the Secure-Digital-Vault folder, e.g.:
+
+    python -m benchmarks.file_io_bench magics --sizes 1G 10G
+"""
+from file_handle.file_io import find_magic, find_magics, remove_range_from_file, probe_delete_capabilities
+from crypto.utils import xor_magic
+from utils.constants import MAGIC_HEADER_START, MAGIC_HEADER_PAD, MAGIC_HEADER_END, MAGIC_LOG_START, MAGIC_LOG_END
+from utils.parsers import parse_from_string_to_size, parse_size_to_string
+
+import argparse
+import os
+import time
+
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def timed(function, *args, **kwargs) -> tuple[float, object]:
+    """Runs the function once.
+
+    Returns:
+        tuple[float, object]: [0] seconds it took, [1] the result of the function
+    """
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+def create_synthetic_vault(file_path : str, size : int, markers : list[tuple[int, bytes]]) -> None:
+    """Creates a file of the given size filled with random blocks, placing each marker at its offset.
+
+    Args:
+        file_path (str): Location of the file to create
+        size (int): Size of the file
+        markers (list[tuple[int, bytes]]): (offset, bytes) pairs, must not overlap
+    """
+    block = os.urandom(BLOCK_SIZE)
+    with open(file_path, "wb") as f:
+        written = 0
+        while written < size:
+            written += f.write(block[:min(BLOCK_SIZE, size - written)])
+        for offset, data in markers:
+            f.seek(offset)
+            f.write(data)
+
+def bench_magics(size : int, file_path : str) -> list[str]:
+    """Compares find_magic per marker against a single find_magics pass. The header lies in the middle of the vault
+    and the footer at a quarter of it, so both have to walk far past the first chunk.
+    """
+    start, pad, end = xor_magic(MAGIC_HEADER_START), xor_magic(MAGIC_HEADER_PAD), xor_magic(MAGIC_HEADER_END)
+    log_start, log_end = xor_magic(MAGIC_LOG_START), xor_magic(MAGIC_LOG_END)
+    header_at = size // 2
+    footer_at = size // 4
+    create_synthetic_vault(file_path, size, [(header_at, start), (header_at + 512, pad), (header_at + 4096, end),
+                                             (footer_at, log_start), (footer_at + 1024, log_end)])
+    lines = []
+
+    def per_marker_header():
+        fd = open(file_path, "rb")
+        a = find_magic(file_path, start, fd=fd)
+        b = find_magic(file_path, pad, start_from_index=a, fd=fd)
+        c = find_magic(file_path, end, start_from_index=b, fd=fd)
+        fd.close()
+        return [a, b, c]
+
+    def per_marker_footer():
+        fd = open(file_path, "rb")
+        a = find_magic(file_path, log_start, read_reverse=True, fd=fd)
+        b = find_magic(file_path, log_end, read_reverse=True, fd=fd)
+        fd.close()
+        return [a, b]
+
+    old_time, old_res = timed(per_marker_header)
+    new_time, new_res = timed(find_magics, file_path, [start, pad, end])
+    assert old_res == new_res, f"{old_res} != {new_res}"
+    lines.append(f"header  {parse_size_to_string(size):>10}  find_magic x3: {old_time:8.3f}s  find_magics: {new_time:8.3f}s")
+
+    old_time, old_res = timed(per_marker_footer)
+    new_time, new_res = timed(find_magics, file_path, [log_start, log_end], read_reverse=True)
+    assert old_res == new_res, f"{old_res} != {new_res}"
+    lines.append(f"footer  {parse_size_to_string(size):>10}  find_magic x2: {old_time:8.3f}s  find_magics: {new_time:8.3f}s")
+    return lines
+
+def bench_delete(size : int, file_path : str) -> list[str]:
+    """Deletes a 4KB icon and a 4000 byte note near the front of the vault, once with the kernel paths allowed and
+    once forcing the buffered tail move, reporting the path taken by remove_range_from_file.
+    """
+    create_synthetic_vault(file_path, size, [])
+    lines = [f"capabilities: {probe_delete_capabilities(file_path)}"]
+    for length in [4096, 4000]:
+        for use_kernel in [True, False]:
+            with open(file_path, "rb+") as f:
+                duration, path = timed(remove_range_from_file, f, 12345, length, use_kernel=use_kernel)
+            lines.append(f"delete {length:>5}B  {parse_size_to_string(size):>10}  use_kernel={use_kernel!s:5}  "
+                         f"path: {path:15}  {duration:8.3f}s")
+    return lines
+
+BENCHMARKS = {
+    "magics": bench_magics,
+    "delete": bench_delete,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="file_io benchmarks on synthetic vaults")
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--sizes", nargs="+", default=["1G", "10G"], help="Vault sizes, e.g. 512M 1G 10G")
+    parser.add_argument("--path", default="bench_synthetic.vault", help="Where to create the synthetic vault")
+    args = parser.parse_args()
+    for size in args.sizes:
+        size = parse_from_string_to_size(size[:-1] + " " + size[-1] + "B")
+        try:
+            for line in BENCHMARKS[args.benchmark](size, args.path):
+                print(line)
+        finally:
+            if os.path.exists(args.path):
+                os.remove(args.path)
+
+if __name__ == "__main__":
+    main()
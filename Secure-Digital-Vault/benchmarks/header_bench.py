@@ -0,0 +1,153 @@
+"""Benchmarks for serializing the header of the vault. Run from the Secure-Digital-Vault folder, e.g.:
+
+    python -m benchmarks.header_bench codec --entries 10000 100000 1000000
+    python -m benchmarks.header_bench commit --entries 10000 100000
+    python -m benchmarks.header_bench shift --entries 100000 500000
+    python -m benchmarks.header_bench listing --entries 100000 500000
+"""
+from benchmarks.file_io_bench import timed
+from benchmarks.kdf_bench import create_vault, PASSWORD
+from classes.vault import Vault
+from crypto.decryptors import decrypt_header
+from utils.serialization import formulate_header, serialize_dict, deserialize_dict, serialize_header, deserialize_header, is_binary_header
+from utils.constants import FILE_FORMAT_V2, FILE_KEY_DATA
+from utils.parsers import parse_size_to_string
+
+import argparse
+import hashlib
+import os
+
+FILES_PER_DIRECTORY = 100
+FILES_PER_NOTE = 20
+
+
+def create_synthetic_header(entries : int) -> dict:
+    """Creates a header of the given amount of files the way add_file_to_vault fills it, with a directory per
+    FILES_PER_DIRECTORY files and a note per FILES_PER_NOTE files. Every file and note has its extent.
+    """
+    header = formulate_header("bench", ".vault")
+    the_map = header["map"]
+    position = 4096
+    for directory_id in range(-(-entries // FILES_PER_DIRECTORY)):
+        the_map["directory_ids"].append(directory_id)
+        the_map["directories"][str(directory_id)] = {"id" : directory_id, "name" : f"folder_{directory_id}", "path" : 0,
+                                                     "data_created" : 1_700_000_000, "last_modified" : 1_700_000_000, "files" : []}
+    for file_id in range(entries):
+        size = 1000 + file_id * 7 % 50_000
+        checksum = hashlib.sha256(os.urandom(8)).hexdigest()
+        directory = the_map["directories"][str(file_id // FILES_PER_DIRECTORY)]
+        note_id = file_id // FILES_PER_NOTE if file_id % FILES_PER_NOTE == 0 else -1
+        the_map["file_ids"].append(file_id)
+        the_map["extent_ids"].append(len(the_map["extent_ids"]) + 1)
+        the_map["extents"][str(the_map["extent_ids"][-1])] = [position, position + size + 53]
+        the_map["files"][str(file_id)] = {"id" : file_id, "size" : size, "extent" : the_map["extent_ids"][-1],
+                                          "checksum" : "-".join(checksum[i:i + 16] for i in range(0, 64, 16)), "file_encrypted" : False,
+                                          "path" : directory["id"], "metadata" : {"name" : f"document_{file_id}", "type" : "pdf",
+                                          "data_created" : 1_700_000_000 + file_id, "last_modified" : 1_700_000_000 + file_id,
+                                          "icon_extent" : -1, "note_id" : note_id,
+                                          "format_version" : FILE_FORMAT_V2, "key_version" : FILE_KEY_DATA}}
+        directory["files"].append(file_id)
+        if note_id != -1:
+            the_map["note_ids"].append(note_id)
+            the_map["extent_ids"].append(len(the_map["extent_ids"]) + 1)
+            the_map["extents"][str(the_map["extent_ids"][-1])] = [position + size + 53, position + size + 200]
+            the_map["notes"][str(note_id)] = {"id" : note_id, "owned_by_file" : file_id, "extent" : the_map["extent_ids"][-1],
+                                              "type" : "txt", "checksum" : checksum[:16]}
+        position += size + 200
+    header["vault"]["amount_of_files"] = entries
+    return header
+
+def bench_codec(entries : int) -> list[str]:
+    """Times encoding and decoding a header of the given amount of files as JSON and in the binary format, and compares the sizes.
+    """
+    header = create_synthetic_header(entries)
+    lines = []
+    for name, encode, decode in (("json", serialize_dict, deserialize_dict), ("binary", serialize_header, deserialize_header)):
+        encode_time, data = timed(encode, header)
+        decode_time, decoded = timed(decode, data)
+        assert is_binary_header(data) == (name == "binary")
+        assert decoded["map"] == header["map"]
+        lines.append(f"{name:>6} {entries:>9} entries  encode: {encode_time:8.3f}s  decode: {decode_time:8.3f}s  "
+                     f"size: {parse_size_to_string(len(data)):>10}")
+    return lines
+
+def bench_commit(entries : int) -> list[str]:
+    """Times committing a tail layout vault of the given amount of files, once writing every metadata page and once after
+    renaming a single file, which rewrites its page only.
+    """
+    path = "bench_synthetic.vault"
+    create_vault(path, {})
+    vault = Vault(PASSWORD, path)
+    try:
+        vault.set_header(vault.validate_header(decrypt_header(path, PASSWORD)))
+        vault.get_map().update(create_synthetic_header(entries)["map"])
+        vault.set_map(vault.get_map())
+        lines = []
+        for name in ("all pages", "one file"):
+            if name == "one file":
+                file = vault.get_id_from_vault(entries // 2, "F", as_dict=False)[1]
+                file.get_metadata()["name"] = "renamed"
+                vault.update_file_in_vault(file)
+            pages = len(vault.get_dirty_pages()) if "pages" in vault.get_map() else "all"
+            size = os.path.getsize(path)
+            duration, _ = timed(vault.update_vault_file)
+            lines.append(f"commit {name:>9} {entries:>9} entries  {duration:8.3f}s  pages: {pages!s:>6}  "
+                         f"written: {parse_size_to_string(os.path.getsize(path) - size):>10}")
+        return lines
+    finally:
+        vault.close_vault_file()
+        os.remove(path)
+
+def bench_shift(entries : int) -> list[str]:
+    """Times moving the locations of the map after removing bytes in front of the last file, in the middle of the vault,
+    and in front of everything, e.g, after the header grew. Only the extents move, so no file or note page is marked.
+    The move is written into the extents once the map is read or committed, which is timed on its own.
+    """
+    vault = Vault(PASSWORD, "bench_synthetic.vault")
+    header = create_synthetic_header(entries)
+    build_time, _ = timed(vault.set_header, header)
+    the_map = header["map"]
+    lines = [f"build {entries:>9} entries  {build_time:8.3f}s"]
+    for name, file_id in (("last file", entries - 1), ("middle", entries // 2), ("everything", -1)):
+        at_index = the_map["extents"][str(the_map["files"][str(file_id)]["extent"])][0] - 1 if file_id != -1 else -1
+        vault.get_dirty_pages().clear()
+        duration, _ = timed(vault.data_index_shifter, 100, False, at_index)
+        settle_time, pages = timed(vault.get_dirty_pages)
+        lines.append(f"shift {name:>10} {entries:>9} entries  {duration * 1000:10.3f} ms  settled at commit: {settle_time * 1000:10.3f} ms  "
+                     f"moved pages: {len(pages)}")
+    return lines
+
+def bench_listing(entries : int) -> list[str]:
+    """Times listing one folder and gathering the files under it through the children index of the vault,
+    against scanning the whole map for the folder's children as listing did before.
+    """
+    vault = Vault(PASSWORD, "bench_synthetic.vault")
+    header = create_synthetic_header(entries)
+    build_time, _ = timed(vault.set_header, header)
+    the_map = header["map"]
+    folder_id = len(the_map["directory_ids"]) // 2
+    scan = lambda belong_to: [item for kind in ("directories", "files") for item in the_map[kind].values() if item["path"] == belong_to]
+    lines = [f"build {entries:>9} entries  {build_time:8.3f}s"]
+    for name, function in (("scan", scan), ("listing", vault.get_items_under_id), ("recursive", vault.get_files_belonging_in_id)):
+        duration, items = timed(function, folder_id)
+        lines.append(f"{name:>9} {entries:>9} entries  {duration * 1000:10.3f} ms  items: {len(items)}")
+    return lines
+
+BENCHMARKS = {
+    "codec": bench_codec,
+    "commit": bench_commit,
+    "shift": bench_shift,
+    "listing": bench_listing,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="header serialization benchmarks on synthetic headers")
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--entries", nargs="+", type=int, default=[10_000, 100_000, 1_000_000], help="Files in the header, e.g. 10000 100000")
+    args = parser.parse_args()
+    for entries in args.entries:
+        for line in BENCHMARKS[args.benchmark](entries):
+            print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmarks for the key derivation of the vault password. Run from the Secure-Digital-Vault folder, e.g.:
+
+    python -m benchmarks.kdf_bench derive --costs 1000 100000 600000
+    python -m benchmarks.kdf_bench unlock --target 0.3
+"""
+from benchmarks.file_io_bench import timed
+from crypto.utils import derive_password_key, calibrate_kdf, derive_master_key, KDF_MINIMUM_COST
+from crypto.encryptors import encrypt_header, encrypt_footer
+from crypto.decryptors import decrypt_header, decrypt_footer, get_vault_secret
+from classes.vault import Vault
+from file_handle.file_io import add_footer_and_hint, commit_header_into_slot
+from file_handle.superblock import form_superblock, kdf_as_fields
+from utils.serialization import serialize_dict, formulate_header, formulate_footer
+from utils.constants import KDF_PBKDF2_SHA1, KDF_PBKDF2_SHA256, KDF_SCRYPT, KDF_TARGET_TIME, VAULT_LAYOUT_TAIL
+
+import argparse
+import os
+
+PASSWORD = "benchmark"
+KDF_NAMES = {KDF_PBKDF2_SHA1 : "pbkdf2-sha1", KDF_PBKDF2_SHA256 : "pbkdf2-sha256", KDF_SCRYPT : "scrypt"}
+
+
+def bench_derive(algorithms : list[int], costs : list[int], target : float, path : str) -> list[str]:
+    """Times a single derivation per algorithm and cost. Without costs, each algorithm is calibrated
+    to the target first and timed at the cost it picked.
+    """
+    lines = []
+    for algorithm in algorithms:
+        if costs:
+            algorithm_costs = costs
+        else:
+            duration, kdf = timed(calibrate_kdf, algorithm, target)
+            lines.append(f"calibrate {KDF_NAMES[algorithm]:>14}  target: {target:.3f}s  took: {duration:8.3f}s  cost: {kdf['cost']}")
+            algorithm_costs = [kdf["cost"]]
+        for cost in algorithm_costs:
+            if algorithm == KDF_SCRYPT and cost > 24:
+                continue    # log2 of N, past 2**24 scrypt needs gigabytes
+            duration, _ = timed(derive_password_key, PASSWORD, os.urandom(16), algorithm, cost)
+            lines.append(f"derive    {KDF_NAMES[algorithm]:>14}  cost: {cost:10}  {duration * 1000:10.2f} ms")
+    return lines
+
+def create_vault(path : str, kdf : dict) -> None:
+    """Creates a tail layout vault the way VaultCreate does, without the GUI. An empty kdf creates a vault which does not
+    record its KDF, like the ones created before it existed.
+    """
+    vault_secret = derive_master_key(PASSWORD, kdf["salt"], kdf) if kdf else PASSWORD
+    fields = {"layout" : VAULT_LAYOUT_TAIL}
+    if kdf:
+        fields.update(kdf_as_fields(kdf))
+    with open(path, "wb") as f:
+        f.write(form_superblock(fields))
+    commit_header_into_slot(path, encrypt_header(vault_secret, serialize_dict(formulate_header("bench", ".vault"))))
+    add_footer_and_hint(path, encrypt_footer(vault_secret, serialize_dict(formulate_footer())), "hint")
+
+def unlock(path : str) -> bytes:
+    """What opening the vault derives: the secret of the header and footer in VaultSearch, passed on as the master key of VaultView.
+    """
+    vault_secret = get_vault_secret(path, PASSWORD)
+    decrypt_header(path, PASSWORD, vault_secret)
+    decrypt_footer(path, PASSWORD, vault_secret)
+    vault = Vault(PASSWORD, path, vault_secret if isinstance(vault_secret, bytes) else None)
+    vault.set_header({"vault" : {}, "map" : {}})
+    return vault.get_master_key()
+
+def bench_unlock(algorithms : list[int], costs : list[int], target : float, path : str) -> list[str]:
+    """Times unlocking a vault which does not record its KDF, and one per algorithm calibrated to the target.
+    """
+    configurations = [("legacy", {})]
+    for algorithm in algorithms:
+        kdf = calibrate_kdf(algorithm, target)
+        for cost in costs or [kdf["cost"]]:
+            configurations.append((KDF_NAMES[algorithm], dict(kdf, cost=cost)))
+    lines = []
+    for name, kdf in configurations:
+        try:
+            create_vault(path, kdf)
+            duration, _ = timed(unlock, path)
+            cost = kdf.get("cost", KDF_MINIMUM_COST[KDF_PBKDF2_SHA1])
+            lines.append(f"unlock {name:>14}  cost: {cost:10}  {duration * 1000:10.2f} ms")
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+    return lines
+
+BENCHMARKS = {
+    "derive": bench_derive,
+    "unlock": bench_unlock,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="key derivation benchmarks")
+    parser.add_argument("benchmark", choices=BENCHMARKS.keys())
+    parser.add_argument("--algorithms", nargs="+", type=int, default=list(KDF_NAMES.keys()),
+                        help="1 pbkdf2-sha1, 2 pbkdf2-sha256, 3 scrypt")
+    parser.add_argument("--costs", nargs="+", type=int, default=[], help="Costs to compare, calibrated to the target when empty")
+    parser.add_argument("--target", type=float, default=KDF_TARGET_TIME, help="Seconds a derivation should take")
+    parser.add_argument("--path", default="bench_synthetic.vault", help="Where to create the synthetic vault")
+    args = parser.parse_args()
+    for line in BENCHMARKS[args.benchmark](args.algorithms, args.costs, args.target, args.path):
+        print(line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+class ChildrenIndex:
+    """Adjacency index of the map, from a folder id to the folders and files directly inside it. 0 is the root.
+    Each item is keyed by its kind and id, ('D', id) for a folder and ('F', id) for a file, so listing a folder
+    costs its amount of children instead of a scan of the whole map.
+    """
+    def __init__(self):
+        self.__children = {}
+        self.__parents = {}
+
+    @staticmethod
+    def from_map(the_map : dict) -> "ChildrenIndex":
+        """Builds the index of the given map, keeping the order of the map. Items without a path are left out.
+
+        Args:
+            the_map (dict): The map of the header
+
+        Returns:
+            ChildrenIndex: The index
+        """
+        index = ChildrenIndex()
+        for kind, items in (("D", the_map.get("directories", {})), ("F", the_map.get("files", {}))):
+            for the_id, the_item in items.items():
+                if isinstance(the_item.get("path"), int):
+                    index.place(kind, int(the_id), the_item["path"])
+        return index
+
+    def __len__(self) -> int:
+        return len(self.__parents)
+
+    def get_parent(self, kind : str, the_id : int) -> int:
+        """Gets the folder the item is in.
+
+        Args:
+            kind (str): D for Folder, F for File
+            the_id (int): The id of the item
+
+        Returns:
+            int: The folder id, -1 if the item is not in the index
+        """
+        return self.__parents.get((kind, the_id), -1)
+
+    def get_folders(self, parent : int) -> list[int]:
+        """Gets the ids of the folders directly inside the given folder.
+
+        Args:
+            parent (int): The folder id
+
+        Returns:
+            list[int]: Folder ids
+        """
+        return list(self.__children.get(parent, {}).get("D", ()))
+
+    def get_files(self, parent : int) -> list[int]:
+        """Gets the ids of the files directly inside the given folder.
+
+        Args:
+            parent (int): The folder id
+
+        Returns:
+            list[int]: File ids
+        """
+        return list(self.__children.get(parent, {}).get("F", ()))
+
+    def place(self, kind : str, the_id : int, parent : int):
+        """Places the item inside the given folder, moving it out of the one it was in.
+
+        Args:
+            kind (str): D for Folder, F for File
+            the_id (int): The id of the item
+            parent (int): The folder id it is in now
+        """
+        if self.__parents.get((kind, the_id), -1) == parent:
+            return
+        self.discard(kind, the_id)
+        self.__children.setdefault(parent, {"D" : {}, "F" : {}})[kind][the_id] = None
+        self.__parents[(kind, the_id)] = parent
+
+    def discard(self, kind : str, the_id : int):
+        """Removes the item from the folder it is in, if it is in the index.
+
+        Args:
+            kind (str): D for Folder, F for File
+            the_id (int): The id of the item
+        """
+        parent = self.__parents.pop((kind, the_id), None)
+        if parent is None:
+            return
+        siblings = self.__children[parent]
+        siblings[kind].pop(the_id, None)
+        if not siblings["D"] and not siblings["F"]:
+            self.__children.pop(parent)
@@ -0,0 +1,221 @@
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+from utils.constants import EXTENT_PENDING_LIMIT
+
+
+class ExtentTable:
+    """Where everything the map locates inside the vault is: file data, icons and notes. Items hold the id of their extent,
+    the map holds the extents under 'extents' as [start, end] by id, so data moving inside the vault changes the extents
+    only and no item. The extents are also kept sorted by their start here, data moving after an offset is then a bisect
+    plus a pending shift of the suffix, which is written into the extents by flush.
+    """
+    def __init__(self, extents : dict = None, extent_ids : list = None):
+        self.__extents = {} if extents is None else extents
+        self.__extent_ids = [] if extent_ids is None else extent_ids
+        self.__entries = []     # The [start, end] lists of the map, sorted by their start
+        self.__ids = []
+        self.__pending = []     # (first index, shift) of the moves not yet in the extents
+        self.__moved = set()
+        self.__next_id = 1
+
+    @staticmethod
+    def from_map(the_map : dict) -> "ExtentTable":
+        """Builds the table of the given map, which it keeps updating from then on.
+
+        Args:
+            the_map (dict): The map of the header, 'extents' and 'extent_ids' are added when missing
+
+        Returns:
+            ExtentTable: The table
+        """
+        table = ExtentTable(the_map.setdefault("extents", {}), the_map.setdefault("extent_ids", []))
+        order = sorted(table.__extents.items(), key=lambda item: item[1][0])
+        table.__entries = [extent for _, extent in order]
+        table.__ids = [int(the_id) for the_id, _ in order]
+        table.__next_id = max(table.__ids, default=0) + 1
+        return table
+
+    @staticmethod
+    def is_location(start : int, end : int) -> bool:
+        """Checks whether the offsets locate bytes inside the vault, items without any use -1 or 0 for both.
+
+        Args:
+            start (int): Start offset
+            end (int): End offset, exclusive
+
+        Returns:
+            bool: True if they do
+        """
+        return isinstance(start, int) and isinstance(end, int) and 0 <= start <= end and end > 0
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def get(self, extent_id : int) -> tuple[int, int]:
+        """Gets where the extent is, pending moves included.
+
+        Args:
+            extent_id (int): The id of the extent
+
+        Returns:
+            tuple[int, int]: (start, end), (-1, -1) if the extent is not in the table
+        """
+        extent = self.__extents.get(str(extent_id))
+        if extent is None:
+            return (-1, -1)
+        shift = self.__shift_of(self.__index_of(extent)) if self.__pending else 0
+        return (extent[0] + shift, extent[1] + shift)
+
+    def get_last_end(self) -> int:
+        """Gets the end of the extent which ends last inside the vault.
+
+        Returns:
+            int: The offset, 0 if the table is empty
+        """
+        # Extents never overlap, so only the ones starting last can end last
+        last_end = 0
+        index = len(self.__entries) - 1
+        while index >= 0 and self.__entries[index][0] == self.__entries[-1][0]:
+            last_end = max(last_end, self.__entries[index][1] + self.__shift_of(index))
+            index -= 1
+        return last_end
+
+    def add(self, start : int, end : int) -> int:
+        """Adds an extent.
+
+        Args:
+            start (int): Start offset
+            end (int): End offset, exclusive
+
+        Returns:
+            int: The id of the extent
+        """
+        self.__apply()
+        extent_id = self.__next_id
+        self.__next_id += 1
+        extent = self.__extents[str(extent_id)] = [start, end]
+        self.__extent_ids.append(extent_id)
+        self.__insert(extent_id, extent)
+        return extent_id
+
+    def move(self, extent_id : int, start : int, end : int):
+        """Moves the extent to the given offsets.
+
+        Args:
+            extent_id (int): The id of the extent
+            start (int): Start offset
+            end (int): End offset, exclusive
+        """
+        self.__apply()
+        extent = self.__extents[str(extent_id)]
+        if extent[0] != start:
+            self.__remove(extent)
+            extent[0] = start
+            self.__insert(extent_id, extent)
+        extent[1] = end
+
+    def discard(self, extent_id : int):
+        """Removes the extent, if it is in the table.
+
+        Args:
+            extent_id (int): The id of the extent
+        """
+        self.__apply()
+        extent = self.__extents.pop(str(extent_id), None)
+        if extent is None:
+            return
+        self.__extent_ids.remove(extent_id)
+        self.__remove(extent)
+
+    def shift(self, at_index : int, shift_by : int) -> int:
+        """Moves every extent starting after the given index by the given amount. The move is kept as a shift of the suffix
+        of the table, see flush.
+
+        Args:
+            at_index (int): Extents starting after it move, -1 moves all of them
+            shift_by (int): Amount of bytes, negative to the left
+
+        Returns:
+            int: The amount of extents which moved
+        """
+        first = 0 if at_index == -1 else bisect_right(range(len(self.__entries)), at_index, key=self.__start_of)
+        if first < len(self.__entries) and shift_by:
+            self.__pending.append((first, shift_by))
+            if len(self.__pending) > EXTENT_PENDING_LIMIT:
+                self.__apply()
+        return len(self.__entries) - first
+
+    def remap(self, removed_ranges : list[tuple[int,int]]) -> int:
+        """Moves every extent to the left by the amount of bytes removed before it, see Vault.data_index_remap.
+
+        Args:
+            removed_ranges (list[tuple[int,int]]): Sorted and disjoint (start, end) ranges which got removed from the vault.
+
+        Returns:
+            int: The amount of extents which moved
+        """
+        self.__apply()
+        if not removed_ranges:
+            return 0
+        ends = [end for _, end in removed_ranges]
+        removed_before = [0]
+        for start, end in removed_ranges:
+            removed_before.append(removed_before[-1] + end - start)
+        moved = 0
+        for index in range(bisect_left(self.__entries, ends[0], key=itemgetter(0)), len(self.__entries)):
+            extent = self.__entries[index]
+            shift = removed_before[bisect_right(ends, extent[0])]
+            if shift:
+                extent[0] -= shift
+                extent[1] -= shift
+                self.__moved.add(self.__ids[index])
+                moved += 1
+        return moved
+
+    def flush(self) -> set[int]:
+        """Writes the pending moves into the extents of the map.
+
+        Returns:
+            set[int]: The ids of the extents which moved since the last flush
+        """
+        self.__apply()
+        moved = self.__moved
+        self.__moved = set()
+        return moved
+
+    def __apply(self):
+        if not self.__pending:
+            return
+        bounds = sorted(self.__pending)
+        self.__pending = []
+        shift = 0
+        for position, (first, shift_by) in enumerate(bounds):
+            shift += shift_by
+            last = bounds[position + 1][0] if position + 1 < len(bounds) else len(self.__entries)
+            if shift and first < last:
+                for extent in self.__entries[first:last]:
+                    extent[0] += shift
+                    extent[1] += shift
+                self.__moved.update(self.__ids[first:last])
+
+    def __shift_of(self, index : int) -> int:
+        return sum(shift_by for first, shift_by in self.__pending if index >= first)
+
+    def __start_of(self, index : int) -> int:
+        return self.__entries[index][0] + self.__shift_of(index)
+
+    def __index_of(self, extent : list) -> int:
+        index = bisect_left(self.__entries, extent[0], key=itemgetter(0))
+        while self.__entries[index] is not extent:
+            index += 1
+        return index
+
+    def __insert(self, extent_id : int, extent : list):
+        index = bisect_right(self.__entries, extent[0], key=itemgetter(0))
+        self.__entries.insert(index, extent)
+        self.__ids.insert(index, extent_id)
+
+    def __remove(self, extent : list):
+        index = self.__index_of(extent)
+        del self.__entries[index]
+        del self.__ids[index]
@@ -1,5 +1,6 @@
 from custom_exceptions.classes_exceptions import InvalidMetaData, MissingKeyInJson
 from utils.parsers import parse_size_to_string
+from utils.constants import FILE_FORMAT_V1, FILE_FORMAT_V2, FILE_KEY_PASSWORD, FILE_KEY_MASTER, FILE_KEY_DATA
 
 
 class File:
@@ -11,6 +12,8 @@ class File:
         self.__size           = file_info["size"]
         self.__loc_start      = file_info["loc_start"]
         self.__loc_end        = file_info["loc_end"]
+        self.__icon_start     = file_info["icon_data_start"]
+        self.__icon_end       = file_info["icon_data_end"]
         self.__checksum       = file_info["checksum"]
         self.__file_encrypted = file_info["file_encrypted"]
         self.__path           = file_info["path"]
@@ -32,6 +35,12 @@ class File:
     def get_loc_end(self) -> int:
         return self.__loc_end
 
+    def get_icon_data_start(self) -> int:
+        return self.__icon_start
+
+    def get_icon_data_end(self) -> int:
+        return self.__icon_end
+
     def get_checksum(self) -> str:
         return self.__checksum
 
@@ -49,6 +58,30 @@ class File:
     def get_metadata(self) -> dict:
         return self.__metadata
 
+    def get_format_version(self) -> int:
+        """Gets the format the file is stored in inside the vault, files added before the v2 format do not record it
+
+        Returns:
+            int: FILE_FORMAT_V1 or FILE_FORMAT_V2
+        """
+        return self.__metadata.get("format_version", FILE_FORMAT_V1)
+
+    def get_key_version(self) -> int:
+        """Gets how the key of the file is derived, files added before the session master key do not record it
+
+        Returns:
+            int: FILE_KEY_PASSWORD, FILE_KEY_MASTER or FILE_KEY_DATA
+        """
+        return self.__metadata.get("key_version", FILE_KEY_PASSWORD)
+
+    def get_protection(self) -> dict:
+        """Gets the protection layer of an encrypted file, files encrypted before the layer existed do not record it
+
+        Returns:
+            dict: 'algorithm', 'cost', 'salt' and 'check' of the layer, None if there is none
+        """
+        return self.__metadata.get("protection")
+
     # Setter methods
     def set_id(self, id:int) -> None:
         self.__id = id
@@ -62,6 +95,12 @@ class File:
     def set_loc_end(self, loc_end:int) -> None:
         self.__loc_end = loc_end
 
+    def set_icon_data_start(self, icon_start:int) -> None:
+        self.__icon_start = icon_start
+
+    def set_icon_data_end(self, icon_end:int) -> None:
+        self.__icon_end = icon_end
+
     def set_checksum(self, checksum:str) -> None:
         self.__checksum = checksum
 
@@ -90,6 +129,8 @@ class File:
             "size": int,
             "loc_start": int,
             "loc_end": int,
+            "icon_data_start": int,
+            "icon_data_end": int,
             "checksum": str,
             "file_encrypted": bool,
             "path": int,
@@ -114,8 +155,6 @@ class File:
             "type": str,
             "data_created": int,
             "last_modified": int,
-            "icon_data_start": int,
-            "icon_data_end": int,
             "note_id": int
         }
 
@@ -124,9 +163,20 @@ class File:
                 raise MissingKeyInJson(f"Key: '{key}' is missing from the file metadata")
             if not isinstance(metadata[key], expected_type):
                 raise InvalidMetaData(f"Key: '{key}' with data: {metadata[key]} is of type: '{type(metadata[key])}' but should be '{expected_type}'")
+        if "format_version" in metadata and metadata["format_version"] not in (FILE_FORMAT_V1, FILE_FORMAT_V2):
+            raise InvalidMetaData(f"Key: 'format_version' with data: {metadata['format_version']} is not a known file format")
+        if "key_version" in metadata and metadata["key_version"] not in (FILE_KEY_PASSWORD, FILE_KEY_MASTER, FILE_KEY_DATA):
+            raise InvalidMetaData(f"Key: 'key_version' with data: {metadata['key_version']} is not a known key derivation")
+        if "protection" in metadata:
+            protection_types = {"algorithm": int, "cost": int, "salt": str, "check": str}
+            if not isinstance(metadata["protection"], dict):
+                raise InvalidMetaData(f"Key: 'protection' with data: {metadata['protection']} should be a dict")
+            for key, expected_type in protection_types.items():
+                if not isinstance(metadata["protection"].get(key), expected_type):
+                    raise InvalidMetaData(f"Key: 'protection' is missing '{key}' of type '{expected_type}'")
 
     def get_as_dict(self) -> dict:
-        """Generates the file as a dict existing in the header
+        """Generates the file as a dict holding its offsets, which the vault turns into its record in the header, see Vault.resolve_file
 
         Returns:
             dict: The dict itself which can be added into the header
@@ -136,6 +186,8 @@ class File:
         res["size"] = self.__size
         res["loc_start"] = self.__loc_start
         res["loc_end"] = self.__loc_end
+        res["icon_data_start"] = self.__icon_start
+        res["icon_data_end"] = self.__icon_end
         res["checksum"] = self.__checksum
         res["file_encrypted"] = self.__file_encrypted
         res["path"] = self.__path
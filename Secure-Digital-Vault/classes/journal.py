@@ -0,0 +1,122 @@
+from crypto.utils import xor_magic, derive_journal_key
+from utils.constants import MAGIC_JOURNAL, JOURNAL_EXTENSION
+from utils.serialization import serialize_dict, deserialize_dict
+
+from Crypto.Cipher import AES
+from Crypto.Random import get_random_bytes
+
+import os
+import struct
+
+# Layout: magic(8) | salt(16) | records. Record: length(u32) | nonce(12) | AES-GCM(serialized entry) | tag(16)
+# The sequence number of the record since the last reset is authenticated with it, so records cannot be swapped or reordered
+RECORD_PREFIX = ">L"
+RECORD_SEQUENCE = ">Q"
+RECORD_NONCE_SIZE = 12
+RECORD_TAG_SIZE = 16
+
+
+class Journal:
+    """Encrypted append-only intent journal which lives next to the vault while it is open.
+    Every entry is written and synced before the header commit it stands for, so a crash can be replayed at open.
+    """
+    def __init__(self, vault_path : str, master_key : bytes):
+        self.__path = vault_path + JOURNAL_EXTENSION
+        self.__master_key = master_key
+        self.__key = None
+        self.__size = 0
+        self.__sequence = 0
+
+    def get_path(self) -> str:
+        return self.__path
+
+    def get_size(self) -> int:
+        """Returns the size of the journal on the disk
+
+        Returns:
+            int: Size in bytes, 0 if it was not opened yet
+        """
+        return self.__size
+
+    def is_empty(self) -> bool:
+        """Checks whether anything was recorded since the last reset
+
+        Returns:
+            bool: True if there are no entries
+        """
+        return self.__size <= len(MAGIC_JOURNAL) + 16
+
+    def read_entries(self) -> list[dict]:
+        """Reads the entries left behind by a previous session. A torn record, or one which fails authentication because it
+        was changed or moved, ends the journal.
+
+        Returns:
+            list[dict]: The entries in the order they were recorded, empty if there is no journal
+        """
+        if not os.path.isfile(self.__path):
+            return []
+        entries = []
+        with open(self.__path, "rb") as file:
+            if file.read(len(MAGIC_JOURNAL)) != xor_magic(MAGIC_JOURNAL):
+                return []
+            key = derive_journal_key(self.__master_key, file.read(16))
+            prefix_size = struct.calcsize(RECORD_PREFIX)
+            while True:
+                prefix = file.read(prefix_size)
+                if len(prefix) < prefix_size:
+                    break
+                length, = struct.unpack(RECORD_PREFIX, prefix)
+                record = file.read(length)
+                if len(record) != length or length < RECORD_NONCE_SIZE + RECORD_TAG_SIZE:
+                    break
+                try:
+                    cipher = AES.new(key, AES.MODE_GCM, nonce=record[:RECORD_NONCE_SIZE])
+                    cipher.update(struct.pack(RECORD_SEQUENCE, len(entries)))
+                    plain = cipher.decrypt_and_verify(record[RECORD_NONCE_SIZE:-RECORD_TAG_SIZE], record[-RECORD_TAG_SIZE:])
+                    entries.append(deserialize_dict(plain))
+                except Exception:
+                    break
+        return entries
+
+    def reset(self, master_key : bytes = None) -> None:
+        """Starts an empty journal with a fresh salt, dropping every entry. Called once the header holding them is committed.
+
+        Args:
+            master_key (bytes, optional): Master key of the session after a password change. Defaults to None which keeps the current one.
+        """
+        if master_key:
+            self.__master_key = master_key
+        salt = get_random_bytes(16)
+        self.__key = derive_journal_key(self.__master_key, salt)
+        self.__sequence = 0
+        with open(self.__path, "wb") as file:
+            self.__size = file.write(xor_magic(MAGIC_JOURNAL) + salt)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def record(self, entry : dict) -> None:
+        """Appends the entry and syncs it to the disk before returning.
+
+        Args:
+            entry (dict): JSON serializable entry, 'op' names what it stands for
+        """
+        if not self.__key:
+            self.reset()
+        nonce = get_random_bytes(RECORD_NONCE_SIZE)
+        cipher = AES.new(self.__key, AES.MODE_GCM, nonce=nonce)
+        cipher.update(struct.pack(RECORD_SEQUENCE, self.__sequence))
+        ciphertext, tag = cipher.encrypt_and_digest(serialize_dict(entry))
+        record = nonce + ciphertext + tag
+        with open(self.__path, "ab") as file:
+            self.__size += file.write(struct.pack(RECORD_PREFIX, len(record)) + record)
+            file.flush()
+            os.fsync(file.fileno())
+        self.__sequence += 1
+
+    def delete(self) -> None:
+        """Removes the journal from the disk, only once everything is committed into the vault.
+        """
+        if os.path.isfile(self.__path):
+            os.remove(self.__path)
+        self.__key = None
+        self.__size = 0
@@ -1,28 +1,52 @@
 from utils.constants import *
 from utils.parsers import parse_json_safely
 from utils.id_gen import gen_id
-from utils.serialization import serialize_dict
-from utils.helpers import count_digits
+from utils.serialization import serialize_dict, serialize_header, deserialize_header, is_binary_header, diff_header, apply_header_delta, \
+    METADATA_PAGE_KINDS, get_page_key, get_page_keys, get_delta_page_keys, form_metadata_page, form_header_root, form_pages_view, \
+    merge_metadata_page
+from utils.helpers import count_digits, get_file_size
+from bisect import bisect_right
+from copy import deepcopy
 
 from logger.logging import Logger
 from classes.file import File
 from classes.directory import Directory
 from classes.note import Note
-from custom_exceptions.classes_exceptions import JsonWithInvalidData, MissingKeyInJson
+from classes.journal import Journal
+from classes.extent_table import ExtentTable
+from classes.children_index import ChildrenIndex
+from custom_exceptions.classes_exceptions import JsonWithInvalidData, MissingKeyInJson, DecryptionFailure, FileError
 
-from crypto.encryptors import encrypt_header, encrypt_footer
+from crypto.encryptors import encrypt_header, encrypt_footer, wrap_key, encrypt_file_bytes
+from crypto.decryptors import unwrap_key, decrypt_file_bytes
+from crypto.utils import derive_master_key, to_base64, from_base64
+from Crypto.Random import get_random_bytes
 
-from file_handle.file_io import override_bytes_in_file, add_magic_into_header, header_padder, find_header_pointers, delete_footer_and_hint
+from file_handle.file_io import override_bytes_in_file, add_magic_into_header, header_padder, find_header_pointers, delete_footer_and_hint, \
+    merge_ranges, compact_ranges_in_file, commit_header_into_slot
+from file_handle.vault_file import VaultFile
+from file_handle.superblock import update_superblock, get_superblock, is_tail_layout, get_header_slots, shift_header_slots, kdf_from_fields
 
 
 class Vault:
-    def __init__(self, password : str, vault_path : str):
+    def __init__(self, password : str, vault_path : str, master_key : bytes = None):
         self.__header = {}
         self.__footer = {"error_log" : "", "session_log" : ""}
         self.__map = {}
         self.__vault_path = vault_path
         self.__password = password
         self.__hint = "No Hint"
+        self.__metrics = {"header_shifts" : 0, "header_shifted_bytes" : 0}
+        self.__journal = None
+        self.__committed_header = None
+        self.__data_moved = False
+        self.__vault_file = None
+        self.__master_key = master_key   # Derived while unlocking, see get_vault_secret of the decryptors
+        self.__data_key = None
+        self.__kdf = None
+        self.__dirty_pages = set()
+        self.__extents = ExtentTable()
+        self.__children = ChildrenIndex()
 
     # Getters, Setters and Loaders
     def get_header(self) -> dict:
@@ -31,6 +55,7 @@ class Vault:
         Returns:
             dict: Returns the header as a whole from the Vault
         """
+        self.__settle_extents()
         return self.__header
 
     def set_header(self, header:dict):
@@ -41,6 +66,9 @@ class Vault:
         """
         self.__header = header
         self.__map = self.__header["map"]
+        self.__map.setdefault("free_extents", [])
+        self.__load_extents()
+        self.__children = ChildrenIndex.from_map(self.__map)
 
     def get_footer(self) -> dict:
         """Gets the footer as a dict
@@ -83,6 +111,7 @@ class Vault:
         """
         if footer_start > 0:
             delete_footer_and_hint(self.__vault_path, footer_start)
+            self.__refresh_vault_file_size()   # The session may be open already, e.g, to read the metadata pages
 
     def refresh_header(self, return_it : bool = False) -> bytes:
         """Refreshes the header size and has an optional value to return the header.
@@ -94,17 +123,32 @@ class Vault:
             bytes: serialized new header, but not encrypted
         """
         # Other data is updated in real time, we only need to update the size.
-        old_header_serialized = serialize_dict(self.__header)
+        self.__settle_extents()
+        header = self.__get_header_root()
+        old_header_serialized = serialize_header(header)
+        if is_binary_header(old_header_serialized): # The binary format does not hold its own size, no need to serialize again
+            self.__header["vault"]["header_size"] = len(old_header_serialized)
+            return old_header_serialized if return_it else None
         old_header_len = self.__header["vault"]["header_size"]
         old_digits = count_digits(old_header_len)
         new_header_len = len(old_header_serialized)
         new_digits = count_digits(new_header_len)
         self.__header["vault"]["header_size"] = new_header_len + (new_digits - old_digits)
-        new_header_serialized = serialize_dict(self.__header)
+        new_header_serialized = serialize_dict(header)
         if return_it:
             return new_header_serialized
         return None
 
+    def __get_header_root(self) -> dict:
+        """Gets what is committed into the header slot, see form_header_root.
+
+        Returns:
+            dict: The root for vaults with metadata pages, the whole header otherwise
+        """
+        if "pages" in self.__map:
+            return form_header_root(self.__header)
+        return self.__header
+
     def get_password(self) -> str:
         """Gets the decrypted password of the vault.
 
@@ -114,12 +158,97 @@ class Vault:
         return self.__password
 
     def set_password(self, password : str) -> None:
-        """Sets the password of the vault with the given string.
+        """Sets the password of the vault with the given string. The data key, if the vault has one, gets wrapped by the
+        master key of the new password, which is all files keyed by it need.
 
         Args:
             password (str): The password as a string
         """
+        data_key = self.get_data_key() if "data_key" in self.__header.get("vault", {}) else None
         self.__password = password
+        self.__master_key = None
+        if data_key:
+            self.__header["vault"]["data_key"] = to_base64(wrap_key(data_key, self.get_master_key()))
+
+    def get_kdf(self) -> dict:
+        """Gets the KDF the vault records in its superblock, read once since it never changes.
+
+        Returns:
+            dict: See kdf_from_fields, empty for vaults which do not record one
+        """
+        if self.__kdf is None:
+            self.__kdf = kdf_from_fields(get_superblock(self.__vault_path))
+        return self.__kdf
+
+    def get_master_key(self, password : str = None) -> bytes:
+        """Gets the master key of the session, which keys the files through derive_file_key. The KDF runs on the first
+        call only. Vaults which record their KDF take its salt from the superblock, older ones get a 'key_salt' in the
+        header here, saved with the next commit.
+
+        Args:
+            password (str, optional): Derives the key of another password without keeping it, e.g, for a password change.
+            Defaults to None which is the password of the vault.
+
+        Returns:
+            bytes: 32 bytes key
+        """
+        kdf = self.get_kdf()
+        if kdf:
+            salt = kdf["salt"]
+        else:
+            vault = self.__header["vault"]
+            if "key_salt" not in vault:
+                vault["key_salt"] = to_base64(get_random_bytes(16))
+            salt = from_base64(vault["key_salt"])
+        if password is not None:
+            return derive_master_key(password, salt, kdf)
+        if self.__master_key is None:
+            self.__master_key = derive_master_key(self.__password, salt, kdf)
+        return self.__master_key
+
+    def get_data_key(self) -> bytes:
+        """Gets the data key of the vault, which keys the files through derive_file_key. It is random and kept in the header
+        wrapped by the master key, see wrap_key. Vaults created before it get one here, saved with the next commit.
+
+        Raises:
+            DecryptionFailure incase the wrapped key does not belong to the master key.
+
+        Returns:
+            bytes: 32 bytes key
+        """
+        if self.__data_key is None:
+            vault = self.__header["vault"]
+            if "data_key" in vault:
+                self.__data_key = unwrap_key(from_base64(vault["data_key"]), self.get_master_key())
+            else:
+                self.__data_key = get_random_bytes(32)
+                vault["data_key"] = to_base64(wrap_key(self.__data_key, self.get_master_key()))
+        return self.__data_key
+
+    def get_vault_secret(self) -> str | bytes:
+        """Gets what the header and footer are encrypted with, see get_vault_secret of the decryptors.
+
+        Returns:
+            str | bytes: The master key for vaults which record their KDF, the password otherwise
+        """
+        if self.get_kdf():
+            return self.get_master_key()
+        return self.__password
+
+    def get_file_secret(self, key_version : int) -> str | bytes:
+        """Gets what the files of the given key version are encrypted with, see derive_file_key.
+
+        Args:
+            key_version (int): FILE_KEY_PASSWORD, FILE_KEY_MASTER or FILE_KEY_DATA, see File.get_key_version
+
+        Returns:
+            str | bytes: The password for FILE_KEY_PASSWORD, the master key for FILE_KEY_MASTER, the data key otherwise
+        """
+        if key_version == FILE_KEY_PASSWORD:
+            return self.__password
+        if key_version == FILE_KEY_MASTER:
+            return self.get_master_key()
+        return self.get_data_key()
 
     def get_hint(self) -> str:
         """Gets the password hint of the vault.
@@ -143,6 +272,7 @@ class Vault:
         Returns:
             dict: The map as a dict
         """
+        self.__settle_extents()
         return self.__map
 
     def set_map(self, map:dict):
@@ -152,6 +282,9 @@ class Vault:
             map (dict): map to set
         """
         self.__map = map
+        self.__map.setdefault("free_extents", [])
+        self.__load_extents()
+        self.__children = ChildrenIndex.from_map(self.__map)
 
     def get_vault_path(self) -> str:
         """Returns the path of the saved Vault File.
@@ -167,8 +300,32 @@ class Vault:
         Args:
             new_path (str): The absolute path on the disk
         """
+        self.close_vault_file()
         self.__vault_path = new_path
 
+    def get_vault_file(self) -> VaultFile:
+        """Returns the session over the vault on disk, opening it on first use. It stays open until close_vault_file.
+
+        Returns:
+            VaultFile: The session
+        """
+        if not self.__vault_file or self.__vault_file.is_closed():
+            self.__vault_file = VaultFile(self.__vault_path)
+        return self.__vault_file
+
+    def close_vault_file(self):
+        """Closes the session over the vault, e.g, before renaming it or appending the footer.
+        """
+        if self.__vault_file:
+            self.__vault_file.close()
+            self.__vault_file = None
+
+    def __refresh_vault_file_size(self):
+        """Updates the tracked size of the session after the vault got changed through its path.
+        """
+        if self.__vault_file and not self.__vault_file.is_closed():
+            self.__vault_file.refresh_size()
+
     def get_vault_size(self) -> int:
         """Returns the UNENCRYPTED header_size of the Vault
 
@@ -203,8 +360,9 @@ class Vault:
         elif length == 1 and dir_names[0] == "/":
             return True,0
         else:
-            for some_dir in data_dict.values():
-                if dir_names[0] == some_dir["name"] and some_dir["path"] == level:
+            for folder_id in self.__children.get_folders(level):
+                some_dir = data_dict[str(folder_id)]
+                if dir_names[0] == some_dir["name"]:
                     return self.determine_if_dir_path_is_valid(dir_names[1:], some_dir["id"])
         return False,level
 
@@ -252,7 +410,9 @@ class Vault:
         Args:
             file_dict (dict): The file dict into the header.
         """
-        self.__map["files"][str(file_dict["id"])] = file_dict
+        self.__map["files"][str(file_dict["id"])] = self.__place_file(file_dict)
+        self.__mark_dirty("F", file_dict["id"])
+        self.__children.place("F", file_dict["id"], file_dict["path"])
         size = file_dict["size"]
         self.__header["vault"]["file_size"] += size
         self.__header["vault"]["amount_of_files"] += 1
@@ -268,7 +428,12 @@ class Vault:
         self.__map["file_ids"].remove(file_id)
         if folder_id > 0:
             self.__map["directories"][str(folder_id)]["files"].remove(file_id)
-        self.__map["files"].pop(str(file_id))
+            self.__mark_dirty("D", folder_id)
+        self.__mark_dirty("F", file_id)
+        the_file = self.__map["files"].pop(str(file_id))
+        self.__drop_extent(the_file["extent"])
+        self.__drop_extent(the_file["metadata"].get("icon_extent", -1))
+        self.__children.discard("F", file_id)
         self.__header["vault"]["amount_of_files"] -= 1
 
     def insert_file_id_into_folder(self, folder_id : int , file_id : int):
@@ -280,6 +445,7 @@ class Vault:
         """
         if folder_id > 0:
             self.__map["directories"][str(folder_id)]["files"].append(file_id)
+            self.__mark_dirty("D", folder_id)
 
     def __insert_folder_id(self, folder_id : int):
         """Internal function used after the id generation.
@@ -299,6 +465,8 @@ class Vault:
             self.__map["directory_ids"].remove(folder_id)
             self.__map["directories"][str(folder_id)]["files"].clear()
             self.__map["directories"].pop(str(folder_id))
+            self.__mark_dirty("D", folder_id)
+            self.__children.discard("D", folder_id)
 
     def insert_folder(self, folder_dict : dict):
         """Inserts the given folder dict into the header. No need for byte allocation after the header.
@@ -307,6 +475,8 @@ class Vault:
             file_dict (dict): The folder dict into the header.
         """
         self.__map["directories"][str(folder_dict["id"])] = folder_dict
+        self.__mark_dirty("D", folder_dict["id"])
+        self.__children.place("D", folder_dict["id"], folder_dict["path"])
 
     def __insert_note_id(self, note_id : int):
         """Internal function used after the id generation.
@@ -322,9 +492,11 @@ class Vault:
         Args:
             note_dict (dict): The note dict into the header.
         """
-        self.__map["notes"][str(note_dict["id"])] = note_dict
+        self.__map["notes"][str(note_dict["id"])] = self.__place_note(note_dict)
         self.__map["files"][str(note_dict["owned_by_file"])]["metadata"]["note_id"] = note_dict["id"]
         self.__map["files"][str(note_dict["owned_by_file"])]["metadata"]["last_modified"] = Logger.get_current_time()
+        self.__mark_dirty("V", note_dict["id"])
+        self.__mark_dirty("F", note_dict["owned_by_file"])
         note_size = note_dict["loc_end"] - note_dict["loc_start"]
         self.__header["vault"]["file_size"] += note_size
         self.__header["vault"]["amount_of_files"] += 1 # Counts as a File
@@ -339,8 +511,144 @@ class Vault:
         self.__map["files"][str(owned_by)]["metadata"]["note_id"] = -1
         self.__map["files"][str(owned_by)]["metadata"]["last_modified"] = Logger.get_current_time()
         self.__map["note_ids"].remove(note_id)
-        self.__map["notes"].pop(str(note_id))
-        self.__header["amount_of_files"] -= 1 # Counts as a File
+        self.__drop_extent(self.__map["notes"].pop(str(note_id))["extent"])
+        self.__mark_dirty("V", note_id)
+        self.__mark_dirty("F", owned_by)
+        self.__header["vault"]["amount_of_files"] -= 1 # Counts as a File
+
+    def __mark_dirty(self, type : str, the_id : int):
+        """Marks the metadata page of the given item, so the next commit rewrites it. See update_vault_file.
+
+        Args:
+            type (str): F for File, D for Folder, V for Note, E for Extent
+            the_id (int): The id of the item which changed
+        """
+        self.__dirty_pages.add(get_page_key(type, the_id))
+
+    def __load_extents(self):
+        """Builds the extent table of the map. Files and notes of a header written before the extents existed hold their
+        offsets instead, they are moved onto extents and the whole header is written again by the next commit.
+        """
+        self.__extents = ExtentTable.from_map(self.__map)
+        adopted = False
+        for items, place in ((self.__map.get("files", {}), self.__place_file), (self.__map.get("notes", {}), self.__place_note)):
+            for key, item in items.items():
+                if "extent" not in item:
+                    items[key] = place(item)
+                    adopted = True
+        if adopted:
+            self.__data_moved = True
+            self.__dirty_pages.update(get_page_keys(self.__map))
+
+    def __place_extent(self, extent_id : int, start : int, end : int) -> int:
+        """Moves the extent to the given offsets, adds one if there is none, or drops it when the offsets locate nothing,
+        see ExtentTable.is_location. Its metadata page is marked dirty.
+
+        Args:
+            extent_id (int): The id of the extent, -1 if there is none
+            start (int): Start offset
+            end (int): End offset, exclusive
+
+        Returns:
+            int: The id of the extent, -1 if there is none
+        """
+        if not ExtentTable.is_location(start, end):
+            self.__drop_extent(extent_id)
+            return -1
+        current = self.__extents.get(extent_id)
+        if current == (start, end):
+            return extent_id
+        if current[0] == -1:
+            extent_id = self.__extents.add(start, end)
+        else:
+            self.__extents.move(extent_id, start, end)
+        self.__mark_dirty("E", extent_id)
+        return extent_id
+
+    def __settle_extents(self):
+        """Writes the pending moves of the extent table into the map, see ExtentTable.flush. The metadata pages of the
+        extents which moved are marked dirty.
+        """
+        self.__dirty_pages.update({get_page_key("E", extent_id) for extent_id in self.__extents.flush()})
+
+    def __drop_extent(self, extent_id : int):
+        """Removes the extent from the table, if it is there. Its metadata page is marked dirty.
+
+        Args:
+            extent_id (int): The id of the extent, -1 if there is none
+        """
+        if self.__extents.get(extent_id)[0] != -1:
+            self.__extents.discard(extent_id)
+            self.__mark_dirty("E", extent_id)
+
+    def __place_file(self, file_dict : dict) -> dict:
+        """Turns a file dict holding offsets, see File.get_as_dict, into its record in the map, which holds the ids of its
+        extents instead. The extents the file had are moved to the offsets.
+
+        Args:
+            file_dict (dict): The file dict, files of headers written before the extents existed hold the offsets of their icon in the metadata
+
+        Returns:
+            dict: The record, it shares the metadata with the file dict
+        """
+        record = {key : value for key, value in file_dict.items() if key not in ("loc_start", "loc_end", "icon_data_start", "icon_data_end")}
+        metadata = record["metadata"]
+        old_icon = (metadata.pop("icon_data_start", -1), metadata.pop("icon_data_end", -1))
+        previous = self.__map["files"].get(str(file_dict["id"]), {})
+        record["extent"] = self.__place_extent(previous.get("extent", -1), file_dict["loc_start"], file_dict["loc_end"])
+        metadata["icon_extent"] = self.__place_extent(metadata.get("icon_extent", -1), file_dict.get("icon_data_start", old_icon[0]),
+                                                      file_dict.get("icon_data_end", old_icon[1]))
+        return record
+
+    def __place_note(self, note_dict : dict) -> dict:
+        """Turns a note dict holding offsets, see Note.get_as_dict, into its record in the map, which holds the id of its extent instead.
+
+        Args:
+            note_dict (dict): The note dict
+
+        Returns:
+            dict: The record
+        """
+        record = {key : value for key, value in note_dict.items() if key not in ("loc_start", "loc_end")}
+        previous = self.__map["notes"].get(str(note_dict["id"]), {})
+        record["extent"] = self.__place_extent(previous.get("extent", -1), note_dict["loc_start"], note_dict["loc_end"])
+        return record
+
+    def resolve_file(self, record : dict) -> dict:
+        """Gets the file dict holding offsets out of its record in the map, which File is made of.
+
+        Args:
+            record (dict): The record of the file
+
+        Returns:
+            dict: The file dict, it shares the metadata with the record
+        """
+        file_dict = {key : value for key, value in record.items() if key != "extent"}
+        file_dict["loc_start"], file_dict["loc_end"] = self.__extents.get(record["extent"])
+        file_dict["icon_data_start"], file_dict["icon_data_end"] = self.__extents.get(record["metadata"].get("icon_extent", -1))
+        return file_dict
+
+    def resolve_note(self, record : dict) -> dict:
+        """Gets the note dict holding offsets out of its record in the map, which Note is made of.
+
+        Args:
+            record (dict): The record of the note
+
+        Returns:
+            dict: The note dict
+        """
+        note_dict = {key : value for key, value in record.items() if key != "extent"}
+        note_dict["loc_start"], note_dict["loc_end"] = self.__extents.get(record["extent"])
+        return note_dict
+
+    def get_dirty_pages(self) -> set[str]:
+        """Gets the metadata pages which changed since the last commit
+
+        Returns:
+            set[str]: The page keys, see get_page_key
+        """
+        self.__settle_extents()
+        return self.__dirty_pages
 
     # Header Validators
     def validate_header(self, full_header:bytes) -> dict:
@@ -356,13 +664,64 @@ class Vault:
         Returns:
             dict: the header without magic bytes
         """
-        header = parse_json_safely(full_header)
-        if("error" in header):
-            raise JsonWithInvalidData(str(header["error"]))
+        if is_binary_header(full_header):
+            try:
+                header = deserialize_header(full_header)
+            except ValueError as e:
+                raise JsonWithInvalidData(str(e))
+        else:
+            header = parse_json_safely(full_header)
+            if("error" in header):
+                raise JsonWithInvalidData(str(header["error"]))
+        if isinstance(header.get("map"), dict) and "pages" in header["map"]:
+            self.__load_metadata_pages(header)
         if (self.__validate_header_keys(header)): # Can raise MissingKeyInJson or JsonWithInvalidData
             return header
         raise JsonWithInvalidData(f"JSON has incorrect magic bytes. Obj len: {len(full_header)}, Obj: {str(full_header)}")
 
+    def __load_metadata_pages(self, header : dict) -> None:
+        """Reads the metadata pages the root of a tail layout vault points at, and merges them into its map.
+
+        Args:
+            header (dict): The root, see form_header_root
+
+        Raises:
+            JsonWithInvalidData: Incase the page table or a page is not valid
+            MissingKeyInJson: Incase the root has no data key, which the pages are encrypted with
+        """
+        pages = header["map"]["pages"]
+        if not isinstance(pages, dict):
+            raise JsonWithInvalidData(f"Value for key 'pages' must be a dict but '{pages}' is of type: {type(pages)}.")
+        for key, extent in pages.items():
+            if key[:1] not in METADATA_PAGE_KINDS or not key[1:].lstrip("-").isdigit() or not isinstance(extent, list) or \
+                    len(extent) != 2 or not all(isinstance(v, int) for v in extent):
+                raise JsonWithInvalidData(f"The 'pages' must contain [start, end] integer pairs by page key but got '{key}': '{extent}'.")
+        the_map = header["map"]
+        for ids_key, items_key in METADATA_PAGE_KINDS.values():
+            the_map[ids_key], the_map[items_key] = [], {}
+        if not pages:
+            return
+        if not isinstance(header.get("vault"), dict) or "data_key" not in header["vault"]:
+            raise MissingKeyInJson("Key 'data_key' is missing from the 'vault' header, which the metadata pages need.")
+        previous = self.__header
+        self.__header = header  # The data key and the master key are found through the header
+        try:
+            data_key = self.get_data_key()
+        except DecryptionFailure as e:
+            raise JsonWithInvalidData(f"The data key of the metadata pages is not valid. {e.message}")
+        finally:
+            self.__header = previous
+        vault_file = self.get_vault_file()
+        for key in sorted(pages, key=lambda key: (key[0], int(key[1:]))):
+            start, end = pages[key]
+            try:
+                page = decrypt_file_bytes(bytes(vault_file.read(start, end)), data_key, FILE_FORMAT_V2)
+                merge_metadata_page(the_map, key, deserialize_header(page))
+            except DecryptionFailure as e:
+                raise JsonWithInvalidData(f"Metadata page {key} at {start} is corrupted. {e.message}")
+            except ValueError as e:
+                raise JsonWithInvalidData(f"Metadata page {key} at {start} is not valid. {e}")
+
     def __validate_header_keys(self, header: dict) -> bool:
         """Validates the full header of the vault. (vault + map)
 
@@ -412,6 +771,13 @@ class Vault:
                         raise JsonWithInvalidData(f"Value for key '{key}' must be an integer but '{vault[key]}' is of type: {type(vault[key])}.")
                 except KeyError:
                     raise MissingKeyInJson(f"Key '{key}' does not exist in the 'vault' dict!")
+        for key in OPTIONAL_VAULT_KEYS:
+            if key in vault and (isinstance(vault[key], bool) or not isinstance(vault[key], (int, float)) or vault[key] < 0):
+                raise JsonWithInvalidData(f"Value for key '{key}' must be a positive number but got '{vault[key]}'.")
+        if "key_salt" in vault and (not isinstance(vault["key_salt"], str) or len(vault["key_salt"]) != 24):
+            raise JsonWithInvalidData(f"Value for key 'key_salt' must be a base64 string of 16 bytes but got '{vault['key_salt']}'.")
+        if "data_key" in vault and (not isinstance(vault["data_key"], str) or len(vault["data_key"]) != 80):
+            raise JsonWithInvalidData(f"Value for key 'data_key' must be a base64 string of a wrapped key but got '{vault['data_key']}'.")
 
     def __validate_map_keys(self, map : dict) -> None:
         """Checks if the key 'map' contains valid keys, but does not check the correctness of files, directories, notes
@@ -447,6 +813,18 @@ class Vault:
                                 raise JsonWithInvalidData(f"The '{key}' key must be of type dict only, but '{value}' is of type: {type(value)}.")
                 except KeyError:
                     raise MissingKeyInJson(f"Key '{key}' does not exist in the 'map' dict!")
+        if "extents" in map:
+            if not isinstance(map["extents"], dict) or not isinstance(map.get("extent_ids"), list):
+                raise JsonWithInvalidData("Value for key 'extents' must be a dict along with the list 'extent_ids'.")
+            for key, extent in map["extents"].items():
+                if not key.isdigit() or not isinstance(extent, list) or len(extent) != 2 or not all(isinstance(v, int) for v in extent):
+                    raise JsonWithInvalidData(f"The 'extents' must contain [start, end] integer pairs by id but got '{key}': '{extent}'.")
+        if "free_extents" in map:
+            if not isinstance(map["free_extents"], list):
+                raise JsonWithInvalidData(f"Value for key 'free_extents' must be a list but '{map['free_extents']}' is of type: {type(map['free_extents'])}.")
+            for extent in map["free_extents"]:
+                if not isinstance(extent, list) or len(extent) != 2 or not all(isinstance(v, int) for v in extent):
+                    raise JsonWithInvalidData(f"The 'free_extents' must contain [start, end] integer pairs but got '{extent}'.")
 
     def validate_footer(self, full_footer:bytes) -> dict:
         """Validates the full footer represented in bytes
@@ -474,19 +852,41 @@ class Vault:
                 raise MissingKeyInJson(f"Key: {key} is missing from the Vault Footer.")
         return True
 
-    def update_vault_file(self):
+    def update_vault_file(self, overwrite_previous : bool = False):
         """Updates the vault with the newly encrypted header, and updates the disk.
         This function should only be called after adding the relevant items into the vault, as it
         shifts the location of everything. This function should be called by a thread.
+        Tail layout vaults commit the header into their other slot instead, which never shifts anything.
+
+        Args:
+            overwrite_previous (bool, optional): Tail layout only, commit into both slots so the previous header is gone too,
+            e.g, after a password change. Defaults to False.
         """
+        self.__settle_extents()
+        tail_layout = is_tail_layout(get_superblock(self.__vault_path))
+        if tail_layout:
+            written_pages = set(self.__dirty_pages)
+            # The replaced pages are only read by the previous header from now on, see __write_metadata_pages
+            self.mark_extents_free(self.__write_metadata_pages())
         header = self.refresh_header(return_it=True)
-        header = encrypt_header(self.get_password(), header)
+        header = encrypt_header(self.get_vault_secret(), header)
+        if tail_layout:
+            factor = self.__header["vault"].get("header_growth_factor", HEADER_GROWTH_FACTOR)
+            cap = self.__header["vault"].get("header_growth_cap", HEADER_GROWTH_CAP)
+            for _ in range(2 if overwrite_previous else 1):
+                released = commit_header_into_slot(self.__vault_path, header, factor, cap)
+                if released[0] != -1: # Written with the next commit
+                    self.mark_extents_free([released])
+            self.__refresh_vault_file_size()
+            self.__after_commit(written_pages)
+            return
         encrypted_header_len = len(header)
         header = add_magic_into_header(header, start_only=True, pad_only=True, end_only=False)
 
         res = find_header_pointers(self.__vault_path)
         available_padding = res[0]
         header_on_disk_size = res[1]
+        header_end_loc = res[4]
 
         # If new header is smaller than what is on the disk, zeroize the MAGIC_HEADER_PAD
         if encrypted_header_len < header_on_disk_size:
@@ -495,16 +895,213 @@ class Vault:
                 fd.close()
         # If new header is bigger than what is on the disk
         elif (header_on_disk_size+available_padding) <= (encrypted_header_len+32): # 32 extra bytes to account for magic
-            to_pad = abs((encrypted_header_len+32) - (header_on_disk_size+available_padding)) + VAULT_BUFFER_LIMIT
+            overflow = abs((encrypted_header_len+32) - (header_on_disk_size+available_padding))
+            to_pad = self.calculate_header_growth(overflow, header_on_disk_size+available_padding)
             self.data_index_shifter(shift_by=to_pad, shift_direction=True, at_index=-1)
+            self.__metrics["header_shifts"] += 1
+            self.__metrics["header_shifted_bytes"] += max(get_file_size(self.__vault_path) - header_end_loc, 0)
             header_padder(file_path=self.__vault_path, amount_to_pad=to_pad)
+            header_end_loc += to_pad
             # Need to account for extra digit length by data_index_shifter, thus must to re-encrypt header:
             header = self.refresh_header(return_it=True)
-            header = encrypt_header(self.get_password(), header)    # Cannot avoid encrypting twice for now.
+            header = encrypt_header(self.get_vault_secret(), header)    # Cannot avoid encrypting twice for now.
             header = add_magic_into_header(header, start_only=True, pad_only=True, end_only=False)
-        fd = override_bytes_in_file(file_path=self.__vault_path, given_bytes=header, byte_loss=0, at_location=0)
+        fd = override_bytes_in_file(file_path=self.__vault_path, given_bytes=header, byte_loss=0, at_location=res[2])
         if fd:
             fd.close()
+        header_start = res[2] + len(MAGIC_HEADER_START)
+        pad_start = res[2] + len(header)
+        update_superblock(self.__vault_path, {
+            "header_start"  : header_start,
+            "header_length" : pad_start - len(MAGIC_HEADER_PAD) - header_start,
+            "pad_start"     : pad_start,
+            "pad_length"    : header_end_loc - pad_start
+        })
+        self.__refresh_vault_file_size()
+        self.__after_commit()
+
+    def __write_metadata_pages(self) -> list[tuple[int,int]]:
+        """Writes the dirty metadata pages of a tail layout vault into free extents, or at the end of the vault. Every page
+        is encrypted by the data key on its own, so a commit costs the pages which changed rather than the whole map.
+        Vaults without pages yet get all of them. The new page table is committed by the caller.
+
+        Raises:
+            FileError: Incase a page could not be written
+
+        Returns:
+            list[tuple[int,int]]: (start, end) of the replaced pages, which can be reused
+        """
+        pages = self.__map.get("pages")
+        if pages is None:
+            pages = self.__map["pages"] = {}
+            dirty = get_page_keys(self.__map)
+        else:
+            dirty = self.__dirty_pages
+        released = []
+        if dirty:
+            vault_file = self.get_vault_file()
+            data_key = self.get_data_key()
+            for key in sorted(dirty):
+                page = form_metadata_page(self.__map, key)
+                if page["map"]:
+                    encrypted_page = encrypt_file_bytes(serialize_header(page), data_key, FILE_FORMAT_V2)
+                    start = self.allocate_extent(len(encrypted_page))
+                    res = vault_file.write_at(encrypted_page, start) if start != -1 else vault_file.append(encrypted_page)
+                    if not res[0]:
+                        if start != -1:
+                            self.mark_extents_free([(start, start + len(encrypted_page))])
+                        raise FileError(f"Could not write the metadata page {key}. {res[1]}")
+                if key in pages:
+                    released.append(tuple(pages.pop(key)))
+                if page["map"]:
+                    pages[key] = [res[2], res[3]]
+            vault_file.sync()
+        self.__dirty_pages = set()
+        return released
+
+    def __after_commit(self, pages : set[str] = None):
+        """Drops the journaled entries once the header holding them is on the disk, and remembers what got committed.
+
+        Args:
+            pages (set[str], optional): The metadata pages which got written, only their items are remembered again.
+            Defaults to None which copies the whole header.
+        """
+        if self.__journal:
+            self.__journal.reset(self.get_master_key())
+        if pages is None or not self.__is_committed_paged():
+            self.__committed_header = deepcopy(self.__header)
+        else:
+            apply_header_delta(self.__committed_header, deepcopy(self.__diff_committed(pages)))
+        self.__dirty_pages = set()
+        self.__data_moved = False
+
+    def __is_committed_paged(self) -> bool:
+        """Checks whether both the header and what got committed keep their items in metadata pages.
+        """
+        return self.__committed_header is not None and "pages" in self.__map and "pages" in self.__committed_header["map"]
+
+    def __diff_committed(self, pages : set[str]) -> dict:
+        """Computes the changes since the last commit, see diff_header. With metadata pages, only the items of the given
+        pages are compared, which must hold every item changed since.
+
+        Args:
+            pages (set[str]): The page keys, see get_page_key
+
+        Returns:
+            dict: The delta, empty if nothing changed
+        """
+        if not self.__is_committed_paged():
+            return diff_header(self.__committed_header, self.__header)
+        return diff_header(form_pages_view(self.__committed_header, pages), form_pages_view(self.__header, pages))
+
+    def open_journal(self) -> int:
+        """Starts journaling header changes for this session. Entries left by a session which did not close are replayed first:
+        journaled deltas are applied onto the header, and bytes appended after the last of them are rolled back.
+        Must be called after the header is loaded and the footer detached. The journal is keyed by the master key of the session.
+
+        Returns:
+            int: The amount of replayed entries
+        """
+        fresh_salt = not self.get_kdf() and "key_salt" not in self.__header["vault"]
+        self.__journal = Journal(self.__vault_path, self.get_master_key())
+        if fresh_salt:
+            # The salt of the master key was just made, it must reach the disk before an entry keyed by it does
+            self.update_vault_file()
+            return 0
+        entries = self.__journal.read_entries()
+        rollback_from = -1
+        for entry in entries:
+            if entry.get("op") == "delta":
+                apply_header_delta(self.__header, entry["delta"])
+                self.__dirty_pages.update(get_delta_page_keys(self.__header["map"], entry["delta"]))
+                rollback_from = -1
+            elif entry.get("op") == "append" and rollback_from == -1:
+                rollback_from = entry["start"]
+        if entries:
+            self.__map = self.__header["map"]
+            self.__map.setdefault("free_extents", [])
+            self.__load_extents()
+            self.__children = ChildrenIndex.from_map(self.__map)
+            if rollback_from >= self.get_last_related_idx():
+                self.get_vault_file().rollback(rollback_from)
+            self.truncate_free_tail()
+            self.update_vault_file()
+        else:
+            # A session which died between its truncation and its commit leaves free extents past the end
+            self.truncate_free_tail()
+            self.__journal.reset()
+            self.__committed_header = deepcopy(self.__header)
+        return len(entries)
+
+    def record_append(self) -> int:
+        """Journals that bytes are about to be appended at the end of the vault, so they are rolled back if the session
+        dies before the header holding them is committed.
+
+        Returns:
+            int: Size of the vault before the append
+        """
+        start = self.get_vault_file().get_size()
+        if self.__journal:
+            self.__journal.record({"op" : "append", "start" : start})
+        return start
+
+    def commit(self, force : bool = False):
+        """Commits the header changes since the last commit. Small changes are journaled as a delta, the header itself is
+        rewritten once the journal reaches JOURNAL_COMMIT_LIMIT, or right away after data got moved inside the vault.
+
+        Args:
+            force (bool, optional): Rewrite the header regardless. Defaults to False.
+        """
+        if force or not self.__journal or self.__data_moved or self.__committed_header is None:
+            self.update_vault_file()
+            return
+        self.__settle_extents()
+        delta = self.__diff_committed(self.__dirty_pages)
+        if not delta:
+            return
+        entry = {"op" : "delta", "delta" : delta}
+        if self.__journal.get_size() + len(serialize_dict(entry)) > JOURNAL_COMMIT_LIMIT:
+            self.update_vault_file()
+            return
+        self.__journal.record(entry)
+        apply_header_delta(self.__committed_header, deepcopy(delta))
+
+    def close_journal(self):
+        """Commits whatever the journal holds into the header, then removes the journal.
+        """
+        if not self.__journal:
+            return
+        self.__settle_extents()
+        if self.__data_moved or not self.__journal.is_empty() or \
+                (self.__committed_header is not None and self.__diff_committed(self.__dirty_pages)):
+            self.update_vault_file()
+        self.__journal.delete()
+        self.__journal = None
+
+    def calculate_header_growth(self, overflow : int, region_size : int) -> int:
+        """Calculates by how much the header region grows once the header outgrows it. The region grows geometrically,
+        by header_growth_factor of its size capped by header_growth_cap, so the data behind it is shifted rarely.
+
+        Args:
+            overflow (int): Amount of bytes the new header does not fit by
+            region_size (int): Current size of the header and its padding
+
+        Returns:
+            int: Amount of bytes to pad, at least overflow + VAULT_BUFFER_LIMIT
+        """
+        factor = self.__header["vault"].get("header_growth_factor", HEADER_GROWTH_FACTOR)
+        cap = self.__header["vault"].get("header_growth_cap", HEADER_GROWTH_CAP)
+        growth = int(min(region_size * factor, cap))
+        return overflow + max(growth, VAULT_BUFFER_LIMIT)
+
+    def get_metrics(self) -> dict:
+        """Gets the metrics of the current session
+
+        Returns:
+            dict: 'header_shifts' is the amount of times the data got shifted because the header grew,
+            'header_shifted_bytes' is the amount of data bytes moved by those shifts
+        """
+        return self.__metrics
 
     def generate_id(self, type : str) -> int:
         """Generates a new ID for either a new file or a new folder or a new note
@@ -531,60 +1128,191 @@ class Vault:
 
     def data_index_shifter(self, shift_by : int, shift_direction : bool, at_index : int = -1) :
         """Shifts the data in the header by a given a number. This includes: File location, Note location, and Icon Location.
+        Only the extents after the index move, as a pending shift of the extent table, the items holding them stay as they are.
 
         Args:
             shift_by (int): Amount of bytes to shift by.
             shift_direction (bool): True if to the right (add), False if to the Left (Subtract)
             at_index (int): Shift only those after this index.
         """
-        # Shifting files and their icons locations
-        for f_id in self.__map["files"].keys():
+        # Shifting files, their icons and notes locations
+        signed_shift = shift_by if shift_direction else -shift_by
+        self.__extents.shift(at_index, signed_shift)
+
+        # Shifting the free extents
+        for extent in self.__map.get("free_extents", []):
+            if at_index == -1 or extent[0] > at_index:
+                extent[0] += shift_by if shift_direction else -shift_by
+                extent[1] += shift_by if shift_direction else -shift_by
+
+        # Shifting the metadata pages, their content is rewritten anyway once an item in them moved
+        for extent in self.__map.get("pages", {}).values():
+            if at_index == -1 or extent[0] > at_index:
+                extent[0] += shift_by if shift_direction else -shift_by
+                extent[1] += shift_by if shift_direction else -shift_by
+
+        self.__data_moved = True
+        # Shifting the header slots, only tail layout vaults have them
+        shift_header_slots(self.__vault_path, lambda start: (shift_by if shift_direction else -shift_by) if at_index == -1 or start > at_index else 0)
+
+    def data_index_remap(self, removed_ranges : list[tuple[int,int]]):
+        """Moves every File location, Note location, and Icon Location to the left by the amount of bytes removed before it.
+        This is a single pass over the extent table from the first removed range on, the items holding the extents stay as they are.
+        Free extents are not remapped, they must be part of the removed ranges, see compact. Metadata pages are moved along.
 
-            proceed_file = True
-            proceed_icon = True
+        Args:
+            removed_ranges (list[tuple[int,int]]): Sorted and disjoint (start, end) ranges which got removed from the vault.
+        """
+        ends = [end for _, end in removed_ranges]
+        removed_before = [0]
+        for start, end in removed_ranges:
+            removed_before.append(removed_before[-1] + end - start)
 
-            if at_index != -1:
-                # If shift to the right (after append override), that means the loc_start must be less than the index to be update
-                if self.__map["files"][f_id]["loc_start"] <= at_index:
-                    proceed_file = False
-                if self.__map["files"][f_id]["metadata"]["icon_data_start"] <= at_index:
-                    proceed_icon = False
+        def remap(index : int) -> int:
+            return index - removed_before[bisect_right(ends, index)]
 
-            if proceed_file:
-                if shift_direction:
-                    self.__map["files"][f_id]["loc_start"] += shift_by
-                    self.__map["files"][f_id]["loc_end"]   += shift_by
-                else:
-                    self.__map["files"][f_id]["loc_start"] -= shift_by
-                    self.__map["files"][f_id]["loc_end"]   -= shift_by
-
-            if proceed_icon:
-                icon_start = self.__map["files"][f_id]["metadata"]["icon_data_start"]
-                icon_end = self.__map["files"][f_id]["metadata"]["icon_data_end"]
-                if (icon_start > 0) and (icon_end > 0):
-                    if shift_direction:
-                        self.__map["files"][f_id]["metadata"]["icon_data_start"] += shift_by
-                        self.__map["files"][f_id]["metadata"]["icon_data_end"]   += shift_by
-                    else:
-                        self.__map["files"][f_id]["metadata"]["icon_data_start"] -= shift_by
-                        self.__map["files"][f_id]["metadata"]["icon_data_end"]   -= shift_by
+        self.__extents.remap(removed_ranges)
 
-        # Shifting note notes location
-        for v_id in self.__map["notes"].keys():
+        for extent in self.__map.get("pages", {}).values():
+            shift = extent[0] - remap(extent[0])
+            extent[0] -= shift
+            extent[1] -= shift
 
-            proceed = True
+        self.__data_moved = True
+        shift_header_slots(self.__vault_path, lambda start: remap(start) - start)
 
-            if at_index != -1:
-                if self.__map["notes"][v_id]["loc_start"] <= at_index:
-                    proceed = False
+    def get_free_extents(self) -> list[list[int]]:
+        """Returns the extents of the vault which are not used by any item anymore
 
-            if proceed:
-                if shift_direction:
-                    self.__map["notes"][v_id]["loc_start"] += shift_by
-                    self.__map["notes"][v_id]["loc_end"]   += shift_by
-                else:
-                    self.__map["notes"][v_id]["loc_start"] -= shift_by
-                    self.__map["notes"][v_id]["loc_end"]   -= shift_by
+        Returns:
+            list[list[int]]: Sorted and disjoint [start, end] pairs, end is exclusive
+        """
+        return self.__map["free_extents"]
+
+    def get_free_size(self) -> int:
+        """Returns the amount of free bytes inside the vault which can be reclaimed by compaction
+
+        Returns:
+            int: Sum of the free extents
+        """
+        return sum(end - start for start, end in self.__map["free_extents"])
+
+    def mark_extents_free(self, ranges : list[tuple[int,int]]):
+        """Marks the given ranges as free without touching the vault on disk. This should be called after removing
+        the items owning those ranges from the map.
+
+        Args:
+            ranges (list[tuple[int,int]]): (start, end) pairs, end is exclusive
+        """
+        merged = merge_ranges([tuple(extent) for extent in self.__map["free_extents"]] + list(ranges))
+        self.__map["free_extents"] = [[start, end] for start, end in merged]
+
+    def allocate_extent(self, size : int) -> int:
+        """Reserves the best fitting free extent for the given size, the smallest one that is big enough.
+        The reserved bytes are removed from the free extents right away.
+
+        Args:
+            size (int): Amount of bytes to place inside the vault
+
+        Returns:
+            int: The start index of the reserved range, -1 if no free extent fits and the bytes must be appended
+        """
+        if size <= 0:
+            return -1
+        best = -1
+        for i, (start, end) in enumerate(self.__map["free_extents"]):
+            if end - start >= size and (best == -1 or end - start < self.__map["free_extents"][best][1] - self.__map["free_extents"][best][0]):
+                best = i
+                if end - start == size:
+                    break
+        if best == -1:
+            return -1
+        extent = self.__map["free_extents"][best]
+        start = extent[0]
+        if extent[1] - start == size:
+            self.__map["free_extents"].pop(best)
+        else:
+            extent[0] += size
+        return start
+
+    def truncate_free_tail(self) -> int:
+        """Truncates the vault on disk when its last bytes are a free extent, so the vault does not grow on churn.
+        Free extents past the end of the vault are dropped from the map. Must only be called while the footer is detached from the vault.
+
+        Returns:
+            int: Amount of truncated bytes
+        """
+        free_extents = self.__map["free_extents"]
+        vault_size = self.get_vault_file().get_size()
+        while free_extents and free_extents[-1][0] >= vault_size:
+            free_extents.pop()
+        if not free_extents or free_extents[-1][1] < vault_size:
+            return 0
+        start = free_extents.pop()[0]
+        self.get_vault_file().truncate(start)
+        return vault_size - start
+
+    def truncate_untracked_tail(self) -> int:
+        """Truncates the vault on disk past the last byte it tracks, free extents at the tail included, and drops the free
+        extents past the new end. Must only be called while the footer is detached from the vault.
+
+        Returns:
+            int: Amount of truncated bytes
+        """
+        truncated = self.truncate_free_tail()
+        last_track = self.get_last_related_idx()
+        vault_size = self.get_vault_file().get_size()
+        if last_track != 0 and last_track + 1 < vault_size:
+            self.get_vault_file().truncate(last_track + 1)
+            truncated += vault_size - last_track - 1
+        return truncated + self.truncate_free_tail()
+
+    def get_compaction_ratio(self) -> float:
+        """Returns the ratio of free space to vault data at which compaction is requested
+
+        Returns:
+            float: The ratio, COMPACTION_RATIO by default
+        """
+        return self.__header["vault"].get("compaction_ratio", COMPACTION_RATIO)
+
+    def set_compaction_ratio(self, ratio : float):
+        """Sets the ratio of free space to vault data at which compaction is requested
+
+        Args:
+            ratio (float): The ratio, e.g, 0.25
+        """
+        self.__header["vault"]["compaction_ratio"] = ratio
+
+    def needs_compaction(self) -> bool:
+        """Checks whether the free extents reached the compaction ratio
+
+        Returns:
+            bool: True if compaction should run
+        """
+        free = self.get_free_size()
+        return free > 0 and free >= self.get_compaction_ratio() * (free + self.__header["vault"]["file_size"])
+
+    def compact(self, extra_ranges : list[tuple[int,int]] = None, progress = None) -> int:
+        """Reclaims all the free extents, and the given ranges, in one sequential sweep of the vault and remaps the map once.
+        The header on disk still has to be updated by the caller. This function should be called by a thread.
+
+        Args:
+            extra_ranges (list[tuple[int,int]], optional): Ranges of items which were just removed from the map. Defaults to None.
+            progress (Callable[[int, int], None], optional): Called with (bytes moved so far, total bytes to move)
+
+        Returns:
+            int: The amount of reclaimed bytes
+        """
+        ranges = merge_ranges([tuple(extent) for extent in self.__map["free_extents"]] + (extra_ranges or []))
+        if not ranges:
+            return 0
+        vault_file = self.get_vault_file()
+        with vault_file.get_lock():
+            removed = compact_ranges_in_file(vault_file.get_fd(), ranges, progress=progress)
+            vault_file.refresh_size()
+        self.data_index_remap(ranges)
+        self.__map["free_extents"] = []
+        return removed
 
     def get_files_with(self, name : str, extension : str, match_case : bool, is_encrypted : bool, has_note : bool) -> list[dict]:
         """Gets the files with the given description from the vault.
@@ -617,7 +1345,7 @@ class Vault:
             # Note check.
             if has_note and f["metadata"]["note_id"] == -1:
                 continue
-            res.append(f)
+            res.append(self.resolve_file(f))
         return res
 
     def get_id_from_vault(self, the_id : int, type : str, as_dict : bool = True) -> tuple[bool,object]:
@@ -635,9 +1363,9 @@ class Vault:
         if type == "F":
             if the_id in self.__map["file_ids"]:
                 if as_dict:
-                    res = (True, self.__map["files"][str(the_id)])
+                    res = (True, self.resolve_file(self.__map["files"][str(the_id)]))
                 else:
-                    res = (True, File(self.__map["files"][str(the_id)]))
+                    res = (True, File(self.resolve_file(self.__map["files"][str(the_id)])))
         elif type == "D":
             if the_id in self.__map["directory_ids"]:
                 if as_dict:
@@ -647,9 +1375,9 @@ class Vault:
         elif type == "V":
             if the_id in self.__map["note_ids"]:
                 if as_dict:
-                    res = (True, self.__map["notes"][str(the_id)])
+                    res = (True, self.resolve_note(self.__map["notes"][str(the_id)]))
                 else:
-                    res = (True, Note(self.__map["notes"][str(the_id)]))
+                    res = (True, Note(self.resolve_note(self.__map["notes"][str(the_id)])))
         return res
 
     def get_name_of_id(self, the_id : int, type : str) -> str:
@@ -697,18 +1425,17 @@ class Vault:
         file_list = self.__map["directories"][str(folder_id)]["files"]
         files = []
         for file_id in file_list:
-            f = File(self.__map["files"][str(file_id)])
+            f = File(self.resolve_file(self.__map["files"][str(file_id)]))
             if not get_path_as_int:
                 path_to_set = f'{parent_folder_name+"/" if parent_folder_name else "/"}'
                 f.set_path(path_to_set)
             files.append(f)
 
         # Folders:
-        if folder_id in self.__map["directory_ids"]:
-            for folder in self.__map["directories"].values():
-                if folder["path"] == folder_id:
-                    res = self.get_files_belonging_in_id(folder["id"], get_path_as_int, f'{parent_folder_name+"/" if parent_folder_name else ""}{folder["name"]}')
-                    files.extend(res)
+        for child_id in self.__children.get_folders(folder_id):
+            folder = self.__map["directories"][str(child_id)]
+            res = self.get_files_belonging_in_id(folder["id"], get_path_as_int, f'{parent_folder_name+"/" if parent_folder_name else ""}{folder["name"]}')
+            files.extend(res)
         return files
 
     def get_items_under_id(self, belong_to : int) -> list:
@@ -722,14 +1449,10 @@ class Vault:
         """
         lst = []
         # Check Directories first
-        for some_folder in self.__map["directories"].values():
-            if some_folder["path"] == belong_to:
-                dict = Directory(some_folder)
-                lst.append(dict)
-        for some_file in self.__map["files"].values():
-            if some_file["path"] == belong_to:
-                file = File(some_file)
-                lst.append(file)
+        for folder_id in self.__children.get_folders(belong_to):
+            lst.append(Directory(self.__map["directories"][str(folder_id)]))
+        for file_id in self.__children.get_files(belong_to):
+            lst.append(File(self.resolve_file(self.__map["files"][str(file_id)])))
         return lst
 
     def update_file_in_vault(self, file : File):
@@ -738,7 +1461,9 @@ class Vault:
         Args:
             file (File): The checked File
         """
-        self.__map["files"][str(file.get_id())] = file.get_as_dict()
+        self.__map["files"][str(file.get_id())] = self.__place_file(file.get_as_dict())
+        self.__mark_dirty("F", file.get_id())
+        self.__children.place("F", file.get_id(), file.get_path())
 
     def update_folder_in_vault(self, folder : Directory):
         """Updates a certain folder in the vault. This folder is checked.
@@ -747,6 +1472,8 @@ class Vault:
             folder (Directory): The checked Directory
         """
         self.__map["directories"][str(folder.get_id())] = folder.get_as_dict()
+        self.__mark_dirty("D", folder.get_id())
+        self.__children.place("D", folder.get_id(), folder.get_path())
 
     def safe_remove_folder(self, folder_id : int) -> tuple[bool,str]:
         """Safely removes the folder id from the vault without deleting any files.
@@ -780,7 +1507,7 @@ class Vault:
         self.__header["vault"]["file_size"] += amount_of_bytes
 
     def update_item_index(self, the_id : int , start_loc : int, end_loc : int , type : str):
-        """Updates the item location index
+        """Updates the item location index, which moves its extent. The item itself changes only when it had none.
 
         Args:
             the_id (int): The ID of the item
@@ -789,11 +1516,15 @@ class Vault:
             type (str): The type of item, V for note, F for File
         """
         if type == "F":
-            self.__map["files"][str(the_id)]["loc_start"] = start_loc
-            self.__map["files"][str(the_id)]["loc_end"] = end_loc
+            item = self.__map["files"][str(the_id)]
         elif type == "V":
-            self.__map["notes"][str(the_id)]["loc_start"] = start_loc
-            self.__map["notes"][str(the_id)]["loc_end"] = end_loc
+            item = self.__map["notes"][str(the_id)]
+        else:
+            return
+        extent_id = self.__place_extent(item["extent"], start_loc, end_loc)
+        if extent_id != item["extent"]:
+            item["extent"] = extent_id
+            self.__mark_dirty(type, the_id)
 
     def generate_footer(self) -> bytes:
         """Generates a footer which is encrypted with the current password
@@ -802,7 +1533,7 @@ class Vault:
             bytes: The footer as encrypted bytes
         """
         the_footer = serialize_dict(self.__footer)
-        the_footer = encrypt_footer(self.__password, the_footer)
+        the_footer = encrypt_footer(self.get_vault_secret(), the_footer)
         return the_footer
 
     def get_last_related_idx(self) -> int:
@@ -811,19 +1542,13 @@ class Vault:
         Returns:
             int: The last idx the vault is tracking of
         """
-        biggest_idx = 0
-        for f_id in self.__map["files"].keys():
-            icon_end = self.__map["files"][f_id]["metadata"]["icon_data_end"]
-            file_end = self.__map["files"][f_id]["loc_end"]
-            if icon_end > file_end:
-                if biggest_idx < icon_end:
-                    biggest_idx = icon_end
-            else:
-                if biggest_idx < file_end:
-                    biggest_idx = file_end
+        biggest_idx = self.__extents.get_last_end()
+
+        for _, page_end in self.__map.get("pages", {}).values():
+            if biggest_idx < page_end:
+                biggest_idx = page_end
 
-        for n_id in self.__map["notes"].keys():
-            note_end = self.__map["notes"][n_id]["loc_end"]
-            if biggest_idx < note_end:
-                biggest_idx = note_end
+        for slot_start, slot_length in get_header_slots(get_superblock(self.__vault_path)):
+            if slot_start >= 0 and biggest_idx < slot_start + slot_length:
+                biggest_idx = slot_start + slot_length
         return biggest_idx
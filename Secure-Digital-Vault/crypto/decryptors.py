@@ -2,22 +2,35 @@ from custom_exceptions.utils_exceptions import MagicFailure
 from custom_exceptions.classes_exceptions import DecryptionFailure
 
 from utils.extractors import get_file_from_vault
-from utils.constants import MAGIC_HEADER_START
+from utils.constants import MAGIC_HEADER_START, CHUNK_LIMIT, EXTRACT_MEMORY_LIMIT, FILE_FORMAT_V1, FILE_FORMAT_V2, CRYPTO_WORKERS, \
+    CRYPTO_TASK_SIZE
 
 from file_handle.file_io import find_header_pointers, find_footer_pointers
+from file_handle.superblock import get_superblock, kdf_from_fields
+from file_handle.vault_file import VaultFile
 
-from crypto.utils import generate_aes_key, xor_magic
+from crypto.utils import derive_file_key, derive_master_key, xor_magic, format_checksum, parse_file_v2_header, get_file_v2_nonce, \
+    locate_file_v2_chunk, derive_protection_keys, protection_stream, from_base64, FILE_V2_HEADER_SIZE, FILE_V2_TAG_SIZE, \
+    KEY_WRAP_CONTEXT, KEY_WRAP_NONCE_SIZE
+from crypto.pool import get_worker_count, map_in_order
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import unpad
 
+from concurrent.futures.process import BrokenProcessPool
 
-def decrypt_bytes(ciphertext : bytes, password : str, key : bytes = None, iv : bytes = None) -> bytes:
+import hashlib
+import hmac
+import os
+import tempfile
+
+
+def decrypt_bytes(ciphertext : bytes, password : str | bytes, key : bytes = None, iv : bytes = None) -> bytes:
     """
     Decrypts AES-encrypted bytes.
 
     Args:
         ciphertext (bytes): The ciphertext to decrypt.
-        password (str): The password used for decryption.
+        password (str | bytes): The password used for decryption, or a master key, see derive_file_key.
         key (str, optional): Key generated by generate_aes_key , useful for large file decryption
         iv (bytes, optional): The initialization vector for AES
 
@@ -38,19 +51,453 @@ def decrypt_bytes(ciphertext : bytes, password : str, key : bytes = None, iv : b
             salt = ciphertext[:16]
             iv = ciphertext[16:32]
             ciphertext = ciphertext[32:]
-            key = generate_aes_key(password=password.encode(), salt=salt, key_length=32)
+            key = derive_file_key(password, salt)
             cipher = AES.new(key, AES.MODE_CBC, iv)
             pt_bytes = unpad(cipher.decrypt(ciphertext), AES.block_size)
     except Exception as e:
         raise DecryptionFailure(f"Decryption failed due to: {e}")
     return pt_bytes
 
-def decrypt_header(vault_location : str,  password : str) -> bytes:
+def decrypt_stream(pieces, password : str | bytes, segment_size : int = None):
+    """Decrypts ciphertext which arrives in pieces, holding no more than a piece and a block of it at once.
+    The salt and iv come first, followed by AES-CBC ciphertext. With segment_size, the ciphertext is made of segments which
+    are encrypted and padded one by one with the same key and iv, which is how files are added into the vault.
+
+    Args:
+        pieces (Iterable[bytes]): The ciphertext in order, pieces can have any size
+        password (str | bytes): The password used for encryption, or a file secret, see derive_file_key
+        segment_size (int, optional): Size of each encrypted segment. Defaults to None which means a single segment.
+
+    Raises:
+        DecryptionFailure incase it could not manage to decrypt the given pieces.
+
+    Yields:
+        bytes: The decrypted data in order
+    """
+    pending = bytearray()
+    key = iv = cipher = None
+    left = segment_size # Ciphertext left in the current segment
+    try:
+        for piece in pieces:
+            pending += piece
+            if cipher is None:
+                if len(pending) < 32:
+                    continue
+                key = derive_file_key(password, bytes(pending[:16]))
+                iv = bytes(pending[16:32])
+                del pending[:32]
+                cipher = AES.new(key, AES.MODE_CBC, iv)
+            while left is not None and len(pending) >= left:
+                segment_end = bytes(pending[:left])
+                del pending[:left]
+                yield unpad(cipher.decrypt(segment_end), AES.block_size)
+                cipher = AES.new(key, AES.MODE_CBC, iv)
+                left = segment_size
+            # The last block of a segment holds the padding, thus it waits for the end of the segment
+            ready = (len(pending) - 1) // AES.block_size * AES.block_size
+            if ready > 0:
+                with memoryview(pending) as view:
+                    decrypted = cipher.decrypt(view[:ready])
+                del pending[:ready]
+                if left is not None:
+                    left -= ready
+                yield decrypted
+        if cipher is None:
+            if pending:
+                raise DecryptionFailure(f"Ciphertext of {len(pending)} bytes is shorter than its salt and iv")
+            return
+        if pending:
+            yield unpad(cipher.decrypt(bytes(pending)), AES.block_size)
+        elif segment_size is None:
+            raise DecryptionFailure("Ciphertext has a salt and iv but no data")
+    except ValueError as e:
+        raise DecryptionFailure(f"Decryption failed due to: {e}")
+
+def decrypt_chunks_v2(key : bytes, header : bytes, data : bytes, first_index : int, ends_file : bool) -> bytes:
+    """Decrypts and verifies consecutive chunks of a v2 file, see encrypt_chunks_v2.
+
+    Args:
+        key (bytes): Key generated by derive_file_key with the salt of the header
+        header (bytes): Header of the file
+        data (bytes): Whole chunks with their tags, only the end of the file may be shorter
+        first_index (int): Index of the first chunk in data
+        ends_file (bool): Whether data ends the file
+
+    Raises:
+        DecryptionFailure incase a chunk does not match its tag, e.g, the password is wrong.
+
+    Returns:
+        bytes: The decrypted data
+    """
+    fields = parse_file_v2_header(header)
+    if not fields:
+        raise DecryptionFailure("The v2 file header is not valid")
+    stride = fields["chunk_size"] + FILE_V2_TAG_SIZE
+    res = bytearray()
+    try:
+        for i, offset in enumerate(range(0, len(data), stride)):
+            chunk = data[offset:offset + stride]
+            if len(chunk) <= FILE_V2_TAG_SIZE:
+                raise ValueError(f"Chunk {first_index + i} has no data")
+            is_last = ends_file and offset + stride >= len(data)
+            cipher = AES.new(key, AES.MODE_GCM, nonce=get_file_v2_nonce(fields["nonce_prefix"], first_index + i))
+            cipher.update(header + (b'\x01' if is_last else b'\x00'))
+            res += cipher.decrypt_and_verify(chunk[:-FILE_V2_TAG_SIZE], chunk[-FILE_V2_TAG_SIZE:])
+    except ValueError as e:
+        raise DecryptionFailure(f"Decryption failed due to: {e}")
+    return bytes(res)
+
+def decrypt_stream_v2(pieces, password : str | bytes, total_size : int):
+    """Decrypts a v2 file which arrives in pieces, holding no more than a piece and a chunk of it at once.
+
+    Args:
+        pieces (Iterable[bytes]): The file in order, pieces can have any size
+        password (str | bytes): The password used for encryption, or a file secret, see derive_file_key
+        total_size (int): Size of the whole file inside the vault, the last chunk is authenticated as such
+
+    Raises:
+        DecryptionFailure incase it could not manage to decrypt the given pieces.
+
+    Yields:
+        bytes: The decrypted data in order
+    """
+    pending = bytearray()
+    header = key = None
+    stride = index = 0
+    position = FILE_V2_HEADER_SIZE # Where pending starts inside the file
+    for piece in pieces:
+        pending += piece
+        if header is None:
+            if len(pending) < FILE_V2_HEADER_SIZE:
+                continue
+            header = bytes(pending[:FILE_V2_HEADER_SIZE])
+            fields = parse_file_v2_header(header)
+            if not fields:
+                raise DecryptionFailure("The v2 file header is not valid")
+            key = derive_file_key(password, fields["salt"])
+            stride = fields["chunk_size"] + FILE_V2_TAG_SIZE
+            del pending[:FILE_V2_HEADER_SIZE]
+        ready = len(pending) // stride * stride
+        if ready > 0:
+            with memoryview(pending) as view:
+                decrypted = decrypt_chunks_v2(key, header, view[:ready], index, position + ready >= total_size)
+            del pending[:ready]
+            index += ready // stride
+            position += ready
+            yield decrypted
+    if header is None:
+        if pending:
+            raise DecryptionFailure(f"File of {len(pending)} bytes is shorter than its header")
+        return
+    if pending:
+        yield decrypt_chunks_v2(key, header, bytes(pending), index, True)
+    elif position < total_size:
+        raise DecryptionFailure(f"File ended at {position} out of {total_size} bytes")
+
+def decrypt_file_bytes(data : bytes, password : str | bytes, format_version : int) -> bytes:
+    """Decrypts a whole file the way it is stored inside the vault.
+
+    Args:
+        data (bytes): The file as it is inside the vault
+        password (str | bytes): Password of the vault, or the master key of the session, see derive_file_key
+        format_version (int): FILE_FORMAT_V1 or FILE_FORMAT_V2
+
+    Raises:
+        DecryptionFailure incase it could not manage to decrypt the file.
+
+    Returns:
+        bytes: The plain file
+    """
+    if format_version == FILE_FORMAT_V2:
+        return b''.join(decrypt_stream_v2([data], password, len(data)))
+    return b''.join(decrypt_stream([data], password, CHUNK_LIMIT + AES.block_size))
+
+def read_file_range(vault_file : VaultFile, starting_byte : int, ending_byte : int, password : str | bytes, offset : int, length : int) -> bytes:
+    """Decrypts a range of a v2 file by reading only the chunks which hold it.
+
+    Args:
+        vault_file (VaultFile): The open session of the vault
+        starting_byte (int): File start byte in the vault
+        ending_byte (int): File end byte in the vault
+        password (str | bytes): Password of the vault, or the master key of the session, see derive_file_key
+        offset (int): Offset inside the plain file
+        length (int): Amount of bytes to decrypt
+
+    Raises:
+        DecryptionFailure incase it could not manage to decrypt the range.
+
+    Returns:
+        bytes: The plain bytes, shorter than length if the file ends before
+    """
+    header = bytes(vault_file.read(starting_byte, starting_byte + FILE_V2_HEADER_SIZE))
+    fields = parse_file_v2_header(header)
+    if not fields:
+        raise DecryptionFailure("The v2 file header is not valid")
+    if length <= 0:
+        return b''
+    chunk_size = fields["chunk_size"]
+    first, last = offset // chunk_size, (offset + length - 1) // chunk_size
+    chunks_start = starting_byte + locate_file_v2_chunk(first, chunk_size)
+    chunks_end = min(starting_byte + locate_file_v2_chunk(last + 1, chunk_size), ending_byte)
+    if chunks_start >= chunks_end:
+        return b''
+    key = derive_file_key(password, fields["salt"])
+    data = decrypt_chunks_v2(key, header, vault_file.read(chunks_start, chunks_end), first, chunks_end == ending_byte)
+    skip = offset - first * chunk_size
+    return data[skip:skip + length]
+
+def decrypt_vault_range_v1(vault_path : str, starting_byte : int, ending_byte : int, key : bytes, iv : bytes, ends_segment : bool) -> bytes:
+    """Decrypts a block aligned range of a v1 segment. A CBC block only depends on the ciphertext block before it, so any
+    range can be decrypted on its own. Runs inside the pool workers, which read the vault themselves.
+
+    Args:
+        vault_path (str): Location of the vault
+        starting_byte (int): Start of the range in the vault
+        ending_byte (int): End of the range in the vault
+        key (bytes): Key generated by derive_file_key with the salt of the file
+        iv (bytes): IV of the file if the range starts a segment, None to take the ciphertext block before the range
+        ends_segment (bool): Whether the range ends its segment, which removes the padding
+
+    Raises:
+        DecryptionFailure incase the range could not be decrypted.
+
+    Returns:
+        bytes: The decrypted range
+    """
+    if iv is None:
+        data = get_file_from_vault(vault_path, starting_byte - AES.block_size, ending_byte)
+        iv, data = bytes(data[:AES.block_size]), memoryview(data)[AES.block_size:]
+    else:
+        data = get_file_from_vault(vault_path, starting_byte, ending_byte)
+    if len(data) != ending_byte - starting_byte:
+        raise DecryptionFailure(f"Could only read {len(data)} out of {ending_byte - starting_byte} bytes at {starting_byte}")
+    try:
+        res = AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+        return unpad(res, AES.block_size) if ends_segment else res
+    except ValueError as e:
+        raise DecryptionFailure(f"Decryption failed due to: {e}")
+
+def decrypt_vault_range_v2(vault_path : str, starting_byte : int, ending_byte : int, key : bytes, header : bytes, first_index : int,
+                           ends_file : bool) -> bytes:
+    """Decrypts a range of whole v2 chunks, see decrypt_chunks_v2. Runs inside the pool workers, which read the vault themselves.
+
+    Args:
+        vault_path (str): Location of the vault
+        starting_byte (int): Start of the range in the vault, at a chunk border
+        ending_byte (int): End of the range in the vault
+        key (bytes): Key generated by derive_file_key with the salt of the header
+        header (bytes): Header of the file
+        first_index (int): Index of the first chunk in the range
+        ends_file (bool): Whether the range ends the file
+
+    Raises:
+        DecryptionFailure incase the range could not be decrypted.
+
+    Returns:
+        bytes: The decrypted range
+    """
+    data = get_file_from_vault(vault_path, starting_byte, ending_byte)
+    if len(data) != ending_byte - starting_byte:
+        raise DecryptionFailure(f"Could only read {len(data)} out of {ending_byte - starting_byte} bytes at {starting_byte}")
+    return decrypt_chunks_v2(key, header, data, first_index, ends_file)
+
+def decrypt_file_pieces(vault_file : VaultFile, starting_byte : int, ending_byte : int, password : str | bytes, format_version : int = FILE_FORMAT_V1,
+                        memory_limit : int = EXTRACT_MEMORY_LIMIT, workers : int = CRYPTO_WORKERS):
+    """Decrypts a file of the vault, yielding the plain pieces in order. Ranges of CRYPTO_TASK_SIZE are decrypted at once
+    by the shared process pool, a file of a single range or a single worker is decrypted in the calling thread. The session
+    stays locked until the iteration ends or the generator is closed, so nothing moves the file in between.
+
+    Args:
+        vault_file (VaultFile): The open session of the vault
+        starting_byte (int): File start byte in the vault
+        ending_byte (int): File end byte in the vault
+        password (str | bytes): Password of the vault, or the master key of the session, see derive_file_key
+        format_version (int, optional): Format of the file inside the vault. Defaults to FILE_FORMAT_V1.
+        memory_limit (int, optional): Most memory the pieces in progress take. Defaults to EXTRACT_MEMORY_LIMIT.
+        workers (int, optional): Processes to decrypt with, see get_crypto_pool. Defaults to CRYPTO_WORKERS.
+
+    Raises:
+        DecryptionFailure incase it could not manage to decrypt the file.
+
+    Yields:
+        bytes: The decrypted data in order
+    """
+    if get_worker_count(workers) <= 1 or ending_byte - starting_byte <= CRYPTO_TASK_SIZE:
+        # A piece is held by the reader, the decryption and the caller at the same time
+        piece_size = max(memory_limit // 4 // AES.block_size * AES.block_size, AES.block_size)
+        reader = vault_file.read_chunks(starting_byte, ending_byte, piece_size)
+        try:
+            if format_version == FILE_FORMAT_V2:
+                yield from decrypt_stream_v2(reader, password, ending_byte - starting_byte)
+            else:
+                yield from decrypt_stream(reader, password, CHUNK_LIMIT + AES.block_size)
+        finally:
+            reader.close()
+        return
+
+    vault_path = vault_file.get_path()
+    with vault_file.get_lock():
+        if format_version == FILE_FORMAT_V2:
+            header = bytes(vault_file.read(starting_byte, starting_byte + FILE_V2_HEADER_SIZE))
+            fields = parse_file_v2_header(header)
+            if not fields:
+                raise DecryptionFailure("The v2 file header is not valid")
+            key = derive_file_key(password, fields["salt"])
+            stride = fields["chunk_size"] + FILE_V2_TAG_SIZE
+            task_size = max(CRYPTO_TASK_SIZE // stride, 1) * stride
+            data_start = starting_byte + FILE_V2_HEADER_SIZE
+            function = decrypt_vault_range_v2
+
+            def tasks():
+                for start in range(data_start, ending_byte, task_size):
+                    end = min(start + task_size, ending_byte)
+                    yield (vault_path, start, end, key, header, (start - data_start) // stride, end == ending_byte)
+        else:
+            salt_iv = bytes(vault_file.read(starting_byte, starting_byte + 32))
+            key = derive_file_key(password, salt_iv[:16])
+            segment_size = CHUNK_LIMIT + AES.block_size # Account for padding overhead
+            task_size = max(CRYPTO_TASK_SIZE // AES.block_size, 1) * AES.block_size
+            function = decrypt_vault_range_v1
+
+            def tasks():
+                for segment in range(starting_byte + 32, ending_byte, segment_size):
+                    segment_end = min(segment + segment_size, ending_byte)
+                    for start in range(segment, segment_end, task_size):
+                        end = min(start + task_size, segment_end)
+                        yield (vault_path, start, end, key, salt_iv[16:] if start == segment else None, end == segment_end)
+        pieces = map_in_order(function, tasks(), memory_limit // task_size, workers)
+        try:
+            yield from pieces
+        except BrokenProcessPool as e:
+            raise DecryptionFailure(f"A worker of the decryption pool stopped unexpectedly: {e}")
+        finally:
+            pieces.close()
+
+def extract_file_from_vault(vault_file : VaultFile, starting_byte : int, ending_byte : int, output_path : str, vault_password : str | bytes,
+                            password : str = None, checksum : str = None, memory_limit : int = EXTRACT_MEMORY_LIMIT,
+                            format_version : int = FILE_FORMAT_V1, workers : int = CRYPTO_WORKERS, protection : dict = None) -> tuple[bool,str]:
+    """Streams a file out of the vault. Pieces are decrypted by the shared pool, see decrypt_file_pieces, then hashed and
+    written in order, so memory stays around memory_limit for files of any size. The output goes into a temporary file next
+    to output_path, which replaces it only after the checksum matched.
+
+    Args:
+        vault_file (VaultFile): The open session of the vault
+        starting_byte (int): File start byte in the vault
+        ending_byte (int): File end byte in the vault
+        output_path (str): Where the decrypted file goes
+        vault_password (str | bytes): The password of the vault, or the master key of the session, see derive_file_key
+        password (str, optional): The password of the file, if it was encrypted. Defaults to None.
+        checksum (str, optional): Checksum saved for the file, see get_checksum. Defaults to None which skips the verification.
+        memory_limit (int, optional): Most memory to hold at once. Defaults to EXTRACT_MEMORY_LIMIT.
+        format_version (int, optional): Format of the file inside the vault. Defaults to FILE_FORMAT_V1.
+        workers (int, optional): Processes to decrypt with, see get_crypto_pool. Defaults to CRYPTO_WORKERS.
+        protection (dict, optional): The protection layer of the file, see resolve_protection. Defaults to None, a file
+        encrypted with a password before the layer existed carries its own salt and iv.
+
+    Raises:
+        DecryptionFailure incase either password could not decrypt the file.
+
+    Returns:
+        tuple[bool,str]: [0] True if the file is in place. [1] is the error otherwise.
+    """
+    folder, name = os.path.split(output_path)
+    reader = decrypt_file_pieces(vault_file, starting_byte, ending_byte, vault_password, format_version, memory_limit, workers)
+    temp_path = None
+    try:
+        temp_fd, temp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".part", dir=folder or None)
+        stream = reader
+        if password and protection:
+            stream = protection_stream(stream, resolve_protection(password, protection))
+        elif password:
+            stream = decrypt_stream(stream, password)
+        sha256 = hashlib.sha256()
+        with os.fdopen(temp_fd, "wb") as output:
+            for piece in stream:
+                sha256.update(piece)
+                output.write(piece)
+        output_checksum = format_checksum(sha256)
+        if checksum and output_checksum != checksum:
+            return (False, f"Saved file checksum {checksum} does not correspond to what was taken from the Vault {output_checksum}")
+        os.replace(temp_path, output_path)
+        return (True, "")
+    except OSError as e:
+        return (False, e.__str__())
+    finally:
+        reader.close()
+        if temp_path and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def unwrap_key(wrapped : bytes, kek : bytes) -> bytes:
+    """Decrypts a key which wrap_key wrapped.
+
+    Args:
+        wrapped (bytes): Result of wrap_key
+        kek (bytes): The key it was wrapped with
+
+    Raises:
+        DecryptionFailure incase the kek is wrong or the wrapped key was changed.
+
+    Returns:
+        bytes: The key
+    """
+    try:
+        cipher = AES.new(kek, AES.MODE_GCM, nonce=wrapped[:KEY_WRAP_NONCE_SIZE])
+        cipher.update(KEY_WRAP_CONTEXT)
+        return cipher.decrypt_and_verify(wrapped[KEY_WRAP_NONCE_SIZE:-FILE_V2_TAG_SIZE], wrapped[-FILE_V2_TAG_SIZE:])
+    except Exception as e:
+        raise DecryptionFailure(f"Unwrapping the key failed due to: {e}")
+
+def resolve_protection(password : str, protection : dict) -> bytes:
+    """Gets the key of the protection layer of a file, see generate_protection.
+
+    Args:
+        password (str): Password of the file
+        protection (dict): The record of the layer in the metadata of the file
+
+    Raises:
+        DecryptionFailure incase the password does not match the check of the record.
+
+    Returns:
+        bytes: The key of the layer
+    """
+    try:
+        key, check = derive_protection_keys(password, dict(protection, salt=from_base64(protection["salt"])))
+    except ValueError as e:
+        raise DecryptionFailure(f"Cannot derive the key of the file: {e}")
+    if not hmac.compare_digest(check, from_base64(protection["check"])):
+        raise DecryptionFailure("The password does not match the protection of the file")
+    return key
+
+def get_vault_secret(vault_location : str, password : str) -> str | bytes:
+    """Gets what the header and footer of the vault are encrypted with. Vaults which record their KDF in the superblock use
+    the master key, which unlocking derives once here and passes on to decrypt_header, decrypt_footer and the Vault.
+
+    Args:
+        vault_location (str): Location of the vault
+        password (str): The password
+
+    Raises:
+        DecryptionFailure incase the vault records a KDF which is not known.
+
+    Returns:
+        str | bytes: The password, or the master key
+    """
+    kdf = kdf_from_fields(get_superblock(vault_location))
+    if not kdf:
+        return password
+    try:
+        return derive_master_key(password, kdf["salt"], kdf)
+    except ValueError as e:
+        raise DecryptionFailure(f"Cannot derive the key of the vault: {e}")
+
+def decrypt_header(vault_location : str,  password : str, secret : str | bytes = None) -> bytes:
     """Attempts to decrypt the header with the given password
 
     Args:
         vault_location (str): Location of the vault
         password (str): The password
+        secret (str | bytes, optional): What get_vault_secret returned for the password, so it is not derived again.
+        Defaults to None which derives it.
 
     Raises:
         MagicFailure, DecryptionFailure
@@ -75,15 +522,16 @@ def decrypt_header(vault_location : str,  password : str) -> bytes:
     if len(error) != 0:
         raise MagicFailure(error)
     header = get_file_from_vault(vault_location, header_start+magic_start_len, header_pad)
-    res = decrypt_bytes(header, password)
+    res = decrypt_bytes(header, secret if secret is not None else get_vault_secret(vault_location, password))
     return res
 
-def decrypt_footer(vault_location : str,  password : str) -> list:
+def decrypt_footer(vault_location : str,  password : str, secret : str | bytes = None) -> list:
     """Attempts to decrypt the footer with the given password
 
     Args:
         vault_location (str): Location of the vault
         password (str): The password
+        secret (str | bytes, optional): See decrypt_header. Defaults to None which derives it.
 
     Raises:
         MagicFailure, DecryptionFailure
@@ -97,7 +545,7 @@ def decrypt_footer(vault_location : str,  password : str) -> list:
     footer_start = res[0]
     footer_end   = res[1]
     footer = get_file_from_vault(vault_location, footer_start, footer_end)
-    res = decrypt_bytes(footer, password)
+    res = decrypt_bytes(footer, secret if secret is not None else get_vault_secret(vault_location, password))
     return [footer_start, res]
 
 def resolve_token(token : bytes) -> str:
@@ -1,10 +1,15 @@
 from custom_exceptions.classes_exceptions import FileError, EncryptionFailure
-from file_handle.file_io import append_bytes_into_file, stabilize_after_failed_append
+from file_handle.vault_file import VaultFile
 from utils.extractors import get_icon_from_file
 
-from utils.constants import CHUNK_LIMIT
+from utils.constants import CHUNK_LIMIT, FILE_FORMAT_V2, FILE_V2_CHUNK_SIZE, NEW_FILE_FORMAT, CRYPTO_WORKERS, CRYPTO_TASK_SIZE, \
+    ENCRYPT_IN_FLIGHT_LIMIT
 from utils.helpers import get_file_size
-from crypto.utils import generate_aes_key, xor_magic
+from crypto.utils import derive_file_key, xor_magic, calculate_encrypted_file_size, calculate_v2_file_size, \
+    form_file_v2_header, parse_file_v2_header, get_file_v2_nonce, format_checksum, calibrate_kdf, derive_protection_keys, to_base64, \
+    KEY_WRAP_CONTEXT, KEY_WRAP_NONCE_SIZE, FILE_V2_HEADER_SIZE
+from crypto.decryptors import decrypt_file_pieces
+from crypto.pool import get_worker_count, map_in_order
 
 from threads.mutable_boolean import MutableBoolean
 
@@ -12,13 +17,17 @@ from Crypto.Cipher import AES
 from Crypto.Random import get_random_bytes
 from Crypto.Util.Padding import pad
 
-def encrypt_bytes(data : bytes, password : str, key : bytes = None, iv : bytes = None) -> bytes:
+from concurrent.futures.process import BrokenProcessPool
+
+import hashlib
+
+def encrypt_bytes(data : bytes, password : str | bytes, key : bytes = None, iv : bytes = None) -> bytes:
     """
     Encrypts bytes using AES encryption in CBC mode. Adds salt+iv to the beginning of the encrypted bytes if not key and iv
 
     Args:
         data (bytes): The data to encrypt.
-        password (str): The password used for encryption.
+        password (str | bytes): The password used for encryption, or a master key, see derive_file_key.
         key (str, optional): Key generated by generate_aes_key , useful for large file encryption
         iv (bytes, optional): The initialization vector for AES
 
@@ -36,7 +45,7 @@ def encrypt_bytes(data : bytes, password : str, key : bytes = None, iv : bytes =
         else:
             iv = get_random_bytes(16)
             salt = get_random_bytes(16)
-            key = generate_aes_key(password=password.encode(), salt=salt, key_length=32)
+            key = derive_file_key(password, salt)
             cipher = AES.new(key, AES.MODE_CBC, iv)
             ct_bytes = cipher.encrypt(pad(data, AES.block_size))
             res = salt + iv + ct_bytes
@@ -44,11 +53,189 @@ def encrypt_bytes(data : bytes, password : str, key : bytes = None, iv : bytes =
         raise EncryptionFailure(e)
     return res
 
-def encrypt_header(password : str , header : bytes) -> bytes:
+def encrypt_chunks_v2(key : bytes, header : bytes, data : bytes, first_index : int, ends_file : bool) -> bytes:
+    """Encrypts consecutive chunks of a v2 file with AES-GCM. The header and whether a chunk is the last one are authenticated
+    with every chunk, so chunks cannot be moved, swapped or cut off unnoticed.
+
+    Args:
+        key (bytes): Key generated by derive_file_key with the salt of the header
+        header (bytes): Header of the file, see form_file_v2_header
+        data (bytes): Whole chunks of data, only the end of the file may be shorter than a chunk
+        first_index (int): Index of the first chunk in data
+        ends_file (bool): Whether data ends the file
+
+    Returns:
+        bytes: Every chunk followed by its tag
+    """
+    fields = parse_file_v2_header(header)
+    chunk_size = fields["chunk_size"]
+    res = bytearray()
+    try:
+        for i, offset in enumerate(range(0, len(data), chunk_size)):
+            is_last = ends_file and offset + chunk_size >= len(data)
+            cipher = AES.new(key, AES.MODE_GCM, nonce=get_file_v2_nonce(fields["nonce_prefix"], first_index + i))
+            cipher.update(header + (b'\x01' if is_last else b'\x00'))
+            ct_bytes, tag = cipher.encrypt_and_digest(data[offset:offset + chunk_size])
+            res += ct_bytes
+            res += tag
+    except Exception as e:
+        raise EncryptionFailure(e)
+    return bytes(res)
+
+def encrypt_bytes_v2(data : bytes, password : str | bytes, chunk_size : int = FILE_V2_CHUNK_SIZE) -> bytes:
+    """Encrypts the bytes into the v2 file format.
+
+    Args:
+        data (bytes): The data to encrypt.
+        password (str | bytes): The password used for encryption, or a file secret, see derive_file_key.
+        chunk_size (int, optional): The data size of each chunk. Defaults to FILE_V2_CHUNK_SIZE.
+
+    Returns:
+        bytes: The header followed by the chunks
+    """
+    salt = get_random_bytes(16)
+    header = form_file_v2_header(salt, get_random_bytes(8), chunk_size)
+    key = derive_file_key(password, salt)
+    return header + encrypt_chunks_v2(key, header, data, 0, True)
+
+def encrypt_file_bytes(data : bytes, password : str | bytes, format_version : int) -> bytes:
+    """Encrypts a whole file the way it is stored inside the vault.
+
+    Args:
+        data (bytes): The plain file
+        password (str | bytes): Password of the vault, or the master key of the session, see derive_file_key
+        format_version (int): FILE_FORMAT_V1 or FILE_FORMAT_V2
+
+    Returns:
+        bytes: The file as it goes into the vault
+    """
+    if format_version == FILE_FORMAT_V2:
+        return encrypt_bytes_v2(data, password)
+    salt = get_random_bytes(16)
+    iv = get_random_bytes(16)
+    key = derive_file_key(password, salt)
+    res = bytearray(salt + iv)
+    for offset in range(0, max(len(data), 1), CHUNK_LIMIT):
+        res += encrypt_bytes(data=data[offset:offset + CHUNK_LIMIT], password=password, key=key, iv=iv)
+    return bytes(res)
+
+def encrypt_file_range_v2(file_path : str, offset : int, length : int, key : bytes, header : bytes, first_index : int,
+                          ends_file : bool) -> bytes:
+    """Reads a range of whole chunks from the file and encrypts it, see encrypt_chunks_v2. Runs inside the pool workers,
+    which read the file themselves so only the encrypted bytes travel back.
+
+    Args:
+        file_path (str): Path of the file
+        offset (int): Start of the range, at a chunk border
+        length (int): Size of the range
+        key (bytes): Key generated by derive_file_key with the salt of the header
+        header (bytes): Header of the file
+        first_index (int): Index of the first chunk in the range
+        ends_file (bool): Whether the range ends the file
+
+    Raises:
+        EncryptionFailure incase the range could not be read whole, e.g, the file shrank.
+
+    Returns:
+        bytes: The encrypted chunks
+    """
+    with open(file_path, "rb") as file:
+        file.seek(offset)
+        data = file.read(length)
+    if len(data) != length:
+        raise EncryptionFailure(f"File: {file_path} changed while adding it, read {len(data)} out of {length} bytes at {offset}")
+    return encrypt_chunks_v2(key, header, data, first_index, ends_file)
+
+def encrypt_file_pieces(file, file_size : int, key : bytes, continue_running : MutableBoolean, header : bytes = None, iv : bytes = None,
+                        workers : int = CRYPTO_WORKERS, in_flight_limit : int = ENCRYPT_IN_FLIGHT_LIMIT, sha256 = None):
+    """Reads the file from its current position until file_size and encrypts it, yielding the encrypted pieces in order.
+    A v2 file is split into tasks of CRYPTO_TASK_SIZE which the shared process pool encrypts at once, while the caller
+    writes the finished ones. A v1 file, or a v2 file of a single task, is encrypted in the calling thread.
+    Given sha256, every byte is read once by the calling thread, hashed and handed to the pool. Otherwise the workers read
+    their ranges themselves.
+
+    Args:
+        file (FileDescriptor): The file opened as rb
+        file_size (int): Size of the file
+        key (bytes): Key generated by derive_file_key
+        continue_running (MutableBoolean): Encryption stops once it is turned off
+        header (bytes, optional): Header of a v2 file, see form_file_v2_header. Defaults to None.
+        iv (bytes, optional): IV of a v1 file. Defaults to None.
+        workers (int, optional): Processes to encrypt with, see get_crypto_pool. Defaults to CRYPTO_WORKERS.
+        in_flight_limit (int, optional): Most data handed to the pool but not yet yielded. Defaults to ENCRYPT_IN_FLIGHT_LIMIT.
+        sha256 (hashlib._Hash, optional): Updated with the bytes of the file as they are read, see format_checksum. Defaults to None.
+
+    Raises:
+        EncryptionFailure incase a piece could not be encrypted.
+
+    Yields:
+        bytes: The next encrypted piece
+    """
+    if header is None:
+        while continue_running.get_value():
+            chunk = file.read(CHUNK_LIMIT)
+            if not chunk:
+                break
+            if sha256:
+                sha256.update(chunk)
+            yield encrypt_bytes(data=chunk, password='', key=key, iv=iv)
+            if file.tell() >= file_size:
+                break
+        return
+
+    chunk_size = parse_file_v2_header(header)["chunk_size"]
+    task_size = max(CRYPTO_TASK_SIZE // chunk_size, 1) * chunk_size
+    position = file.tell()
+    if get_worker_count(workers) <= 1 or file_size - position <= task_size:
+        chunk_index = 0
+        while continue_running.get_value():
+            piece = file.read(task_size)
+            if not piece:
+                break
+            if sha256:
+                sha256.update(piece)
+            reached_end = file.tell() >= file_size
+            yield encrypt_chunks_v2(key, header, piece, chunk_index, reached_end)
+            chunk_index += -(-len(piece) // chunk_size)
+            if reached_end:
+                break
+        return
+
+    def tasks():
+        nonlocal position
+        chunk_index = 0
+        while position < file_size:
+            length = min(task_size, file_size - position)
+            ends_file = position + length >= file_size
+            if sha256 is None:
+                yield (file.name, position, length, key, header, chunk_index, ends_file)
+            else:
+                data = file.read(length)
+                if len(data) != length:
+                    raise EncryptionFailure(f"File: {file.name} changed while adding it, read {len(data)} out of {length} bytes at {position}")
+                sha256.update(data)
+                yield (key, header, data, chunk_index, ends_file)
+            position += length
+            chunk_index += -(-length // chunk_size)
+
+    # The writer gets pieces in order, tasks go ahead of it only as far as the budget allows
+    function = encrypt_file_range_v2 if sha256 is None else encrypt_chunks_v2
+    pieces = map_in_order(function, tasks(), in_flight_limit // task_size, workers)
+    try:
+        for piece in pieces:
+            yield piece
+            if not continue_running.get_value():
+                break
+    except BrokenProcessPool as e:
+        raise EncryptionFailure(f"A worker of the encryption pool stopped unexpectedly: {e}")
+    finally:
+        pieces.close()
+
+def encrypt_header(password : str | bytes , header : bytes) -> bytes:
     """Encrypts the header with AES
 
     Args:
-        password (str): Password.
+        password (str | bytes): Password, or the master key for vaults which record their KDF.
         header (bytes): Serialized header.
 
     Info:
@@ -60,11 +247,11 @@ def encrypt_header(password : str , header : bytes) -> bytes:
     result = encrypt_bytes(header, password)
     return result
 
-def encrypt_footer(password : str , footer : bytes) -> bytes:
+def encrypt_footer(password : str | bytes , footer : bytes) -> bytes:
     """Encrypts the footer with AES
 
     Args:
-        password (str): Password.
+        password (str | bytes): Password, or the master key for vaults which record their KDF.
         header (bytes): Serialized header.
 
     Info:
@@ -76,33 +263,177 @@ def encrypt_footer(password : str , footer : bytes) -> bytes:
     result = encrypt_bytes(footer, password)
     return result
 
-def get_file_and_encrypt_and_add_to_vault(password : str, file_path : str, vault_path : str, continue_running : MutableBoolean) -> list:
-    """Gets the file as bytes, encrypts during reading to avoid memory overhead, and adds it to the vault on disk.
-    Also, adds the icon. Chunk size while getting file and encrypting chunk is CHUNK_LIMIT
+def wrap_key(key : bytes, kek : bytes) -> bytes:
+    """Encrypts a key with another one, e.g, the data key of the vault with its master key. AES-GCM authenticates it,
+    so unwrapping with a wrong key fails instead of giving another key.
+
+    Args:
+        key (bytes): The key to wrap
+        kek (bytes): The key to wrap it with, 32 bytes
+
+    Raises:
+        EncryptionFailure incase the kek is not a valid AES key.
+
+    Returns:
+        bytes: nonce(12) | wrapped key | tag(16)
+    """
+    try:
+        nonce = get_random_bytes(KEY_WRAP_NONCE_SIZE)
+        cipher = AES.new(kek, AES.MODE_GCM, nonce=nonce)
+        cipher.update(KEY_WRAP_CONTEXT)
+        ciphertext, tag = cipher.encrypt_and_digest(key)
+    except Exception as e:
+        raise EncryptionFailure(e)
+    return nonce + ciphertext + tag
+
+def generate_protection(password : str) -> tuple[dict, bytes]:
+    """Creates a protection layer for a file with the given password, see apply_protection_layer. The KDF is calibrated
+    the way it is for a new vault.
+
+    Args:
+        password (str): Password of the file
+
+    Returns:
+        tuple[dict, bytes]: The record of the layer which goes into the metadata of the file, and the key of the layer
+    """
+    kdf = calibrate_kdf()
+    key, check = derive_protection_keys(password, kdf)
+    protection = {"algorithm" : kdf["algorithm"], "cost" : kdf["cost"], "salt" : to_base64(kdf["salt"]), "check" : to_base64(check)}
+    return protection, key
+
+def reencrypt_file_copy(vault_file : VaultFile, starting_byte : int, ending_byte : int, password : str | bytes, format_version : int,
+                        transform, allocate = None, release = None, workers : int = CRYPTO_WORKERS,
+                        new_password : str | bytes = None) -> tuple[int, int]:
+    """Encrypts a file of the vault again under a fresh salt into a new copy, passing its plain pieces through transform on the
+    way. The copy goes into a free extent when one fits, otherwise it is appended, so nothing around the file moves and the file
+    is never held whole. The old copy is left as it is: the caller commits the new location into the header, and only then
+    frees the old range. A failure gives back what the copy took, and the old copy stays the file.
+
+    Args:
+        vault_file (VaultFile): The open session of the vault
+        starting_byte (int): File start byte in the vault
+        ending_byte (int): File end byte in the vault
+        password (str | bytes): What the file is encrypted with in the vault, it is kept unless new_password is given, see derive_file_key
+        format_version (int): Format of the file inside the vault, it is kept
+        transform (Callable): Takes the plain pieces in order and yields the new ones, must not grow the data, e.g, protection_stream
+        allocate (Callable[[int], int], optional): Reserves a free extent of the given size, returns its start or -1.
+        release (Callable[[list[tuple[int,int]]], None], optional): Gives back reserved ranges which ended up unused.
+        workers (int, optional): Processes to decrypt with, see get_crypto_pool. Defaults to CRYPTO_WORKERS.
+        new_password (str | bytes, optional): What the copy is encrypted with instead. Defaults to None.
+
+    Raises:
+        DecryptionFailure incase the file could not be decrypted, or the transform failed.
+        EncryptionFailure incase the copy grew past the size of the file, or it could not be written.
+
+    Returns:
+        tuple[int, int]: The starting and ending byte of the copy
+    """
+    with vault_file.get_lock():
+        new_password = password if new_password is None else new_password
+        salt = get_random_bytes(16)
+        key = derive_file_key(new_password, salt)
+        if format_version == FILE_FORMAT_V2:
+            fields = parse_file_v2_header(bytes(vault_file.read(starting_byte, starting_byte + FILE_V2_HEADER_SIZE)))
+            block_size = fields["chunk_size"] if fields else FILE_V2_CHUNK_SIZE # Decrypting fails on it anyway
+            first_bytes = form_file_v2_header(salt, get_random_bytes(8), block_size)
+
+            def encrypt(data : bytes, index : int, ends_file : bool) -> bytes:
+                return encrypt_chunks_v2(key, first_bytes, data, index, ends_file)
+        else:
+            iv = get_random_bytes(16)
+            first_bytes = salt + iv
+            block_size = CHUNK_LIMIT
+
+            def encrypt(data : bytes, index : int, ends_file : bool) -> bytes:
+                return b''.join(encrypt_bytes(data[offset:offset + CHUNK_LIMIT], new_password, key=key, iv=iv)
+                                for offset in range(0, len(data), CHUNK_LIMIT))
+
+        # The transform never grows the data, so the copy fits in the size of the file
+        size = ending_byte - starting_byte
+        init_vault_size = vault_file.get_size()
+        hole_start = allocate(size) if allocate else -1
+        copy_start = hole_start if hole_start != -1 else init_vault_size
+        position = copy_start
+        index = 0
+
+        def put(data : bytes) -> None:
+            nonlocal position
+            if position + len(data) > copy_start + size:
+                raise EncryptionFailure(f"The copy of the file grew past its size of {size} while encrypting it again")
+            res = vault_file.write_at(data, position) if hole_start != -1 else vault_file.append(data)
+            if not res[0]:
+                raise EncryptionFailure(res[1])
+            position += len(data)
+
+        def write(data : bytes, ends_file : bool) -> None:
+            nonlocal index
+            put(encrypt(data, index, ends_file))
+            index += len(data) // block_size
+
+        pieces = decrypt_file_pieces(vault_file, starting_byte, ending_byte, password, format_version, workers=workers)
+        pending = bytearray()
+        try:
+            put(first_bytes)
+            for piece in transform(pieces):
+                pending += piece
+                # The last block waits for the end of the file, which v2 authenticates as such
+                ready = (len(pending) - 1) // block_size * block_size
+                if ready > 0:
+                    write(bytes(pending[:ready]), False)
+                    del pending[:ready]
+            write(bytes(pending), True)
+        except Exception:
+            if hole_start == -1:
+                vault_file.rollback(init_vault_size)
+            elif release:
+                release([(hole_start, hole_start + size)])
+            raise
+        finally:
+            pieces.close()
+        if hole_start != -1 and release and position < hole_start + size:
+            release([(position, hole_start + size)])    # Incase the transform shrank the file
+        return copy_start, position
+
+def get_file_and_encrypt_and_add_to_vault(password : str | bytes, file_path : str, vault_path : str, continue_running : MutableBoolean,
+                                          allocate = None, release = None, vault_file : VaultFile = None,
+                                          format_version : int = NEW_FILE_FORMAT) -> list:
+    """Gets the file as bytes, encrypts and hashes during reading to avoid memory overhead and a second read, and adds it to
+    the vault on disk. Also, adds the icon. A v1 file is read and encrypted per CHUNK_LIMIT, a v2 file is encrypted by the shared process pool,
+    see encrypt_file_pieces.
+    If allocate is given, the file and icon are written into a free extent of the vault when one fits, otherwise they are appended.
+    Every write goes through the vault_file session, one is opened for this call if none is given.
+    The file is stored in the given format_version, which the caller records in the file metadata.
 
     Args:
-        password (str): Password of the vault.
+        password (str | bytes): Password of the vault, or the master key of the session, see derive_file_key.
         file_path (str): File location.
         vault_path (str): Vault path
         keep_running (MutableBoolean): Boolean to abort process
+        allocate (Callable[[int], int], optional): Reserves a free extent of the given size, returns its start or -1.
+        release (Callable[[list[tuple[int,int]]], None], optional): Gives back reserved ranges which ended up unused.
+        vault_file (VaultFile, optional): Open session of the vault, which is not closed by this function.
+        format_version (int, optional): FILE_FORMAT_V1 or FILE_FORMAT_V2. Defaults to NEW_FILE_FORMAT.
 
     Raises:
         FileError, EncryptionFailure incase it was not able to handle failure
 
     Returns:
         list: [0] index is: file_loc_start, [1] index is: file_loc_end, [2] index is: encrypted_file_size,
-        [3] is: icon_loc_start, [4] is: icon_loc_end.
-        If less values than 5 are returned, then an error has occured.
-        4 values indicate that the addition of the file itself was fine, but last value is the error.
+        [3] is: checksum of the file as read, see get_checksum, [4] is: icon_loc_start, [5] is: icon_loc_end.
+        If less values than 6 are returned, then an error has occured.
+        5 values indicate that the addition of the file itself was fine, but last value is the error.
     """
     if not continue_running.get_value():
         return []
+    if not vault_file:
+        with VaultFile(vault_path) as vault_file:
+            return get_file_and_encrypt_and_add_to_vault(password, file_path, vault_path, continue_running, allocate, release, vault_file,
+                                                         format_version)
     ans = []
     encrypted_file_size = 0
-    added_bytes = 0
     chunk_size = CHUNK_LIMIT
 
-    res = get_file_size(vault_path)
+    res = vault_file.get_size()
     if res <= 0:
         raise FileError(f"Vault: {vault_path} at initial stage has size of '{res}'!")
     init_vault_size = res
@@ -113,61 +444,98 @@ def get_file_and_encrypt_and_add_to_vault(password : str, file_path : str, vault
         raise FileError(f"File: {file_path} at initial stage has size of '{res}'!")
     file_size = res
 
+    # Free extent to write into, -1 means append
+    if format_version == FILE_FORMAT_V2:
+        encrypted_size = calculate_v2_file_size(file_size)
+    else:
+        encrypted_size = calculate_encrypted_file_size(file_size, chunk_size)
+    hole_start = allocate(encrypted_size) if allocate else -1
+    if hole_start != -1:
+        loc_start = hole_start
+    def __release_hole(from_index : int):
+        if hole_start != -1 and release and from_index < hole_start + encrypted_size:
+            release([(from_index, hole_start + encrypted_size)])
+
     with open(file_path, "rb") as file:
 
-        # Encrypting a large file, must add salt_iv first, then add the encrypted data
+        # Encrypting a large file, must add salt_iv (v1) or the header (v2) first, then add the encrypted data
         salt = get_random_bytes(16)
-        iv = get_random_bytes(16)
-        salt_iv = salt + iv
-        key = generate_aes_key(password=password.encode(), salt=salt, key_length=32)
-        encrypted_chunk = salt_iv
+        key = derive_file_key(password, salt)
+        if format_version == FILE_FORMAT_V2:
+            header = form_file_v2_header(salt, get_random_bytes(8))
+            encrypted_chunk = header
+        else:
+            iv = get_random_bytes(16)
+            encrypted_chunk = salt + iv
 
-        # Chunk reading
+        # Chunk reading, the pieces arrive encrypted and in order, the checksum is taken from the same read
+        sha256 = hashlib.sha256()
+        if format_version == FILE_FORMAT_V2:
+            pieces = encrypt_file_pieces(file, file_size, key, continue_running, header=header, sha256=sha256)
+        else:
+            pieces = encrypt_file_pieces(file, file_size, key, continue_running, iv=iv, sha256=sha256)
         while continue_running.get_value():
-            chunk = None
-            chunk = file.read(chunk_size)
-            if not chunk:
-                break
 
             # Encrypt chunk
             try:
-                encrypted_chunk += encrypt_bytes(data=chunk, password=password, key=key, iv=iv)
+                piece = next(pieces, None)
+                if piece is None:
+                    break
+                encrypted_chunk += piece
             except EncryptionFailure as e:
                 continue_running.set_value(False)
-                error_str = stabilize_after_failed_append(vault_path, e.message, init_vault_size, added_bytes)
-                raise EncryptionFailure(f"Removed added bytes, but failure happened during encryption: {error_str}")
+                if hole_start != -1:
+                    __release_hole(hole_start)
+                    raise EncryptionFailure(f"Released the free extent, but failure happened during encryption: {e.message}")
+                after_removal = vault_file.rollback(init_vault_size)
+                raise EncryptionFailure(f"Removed added bytes making the vault size {after_removal}, but failure happened during encryption: {e.message}")
 
             encrypted_file_size += len(encrypted_chunk)
             if not continue_running.get_value():
                 break
 
+            # Write into the free extent
+            if hole_start != -1:
+                write_at = loc_start + encrypted_file_size - len(encrypted_chunk)
+                if encrypted_file_size > encrypted_size: # The file grew while reading, never write past the extent
+                    res = (False, f"File: {file_path} grew while adding it", write_at, write_at)
+                else:
+                    res = vault_file.write_at(encrypted_chunk, write_at)
+                if not res[0] or not continue_running.get_value():
+                    continue_running.set_value(False)
+                    __release_hole(hole_start)
+                    raise FileError(f"Released the free extent, but failure happened after writing bytes: {res[1]}")
+                encrypted_chunk = b''
+                continue
+
             # Append
-            res = append_bytes_into_file(file_path=vault_path, the_bytes=encrypted_chunk)
+            res = vault_file.append(encrypted_chunk)
 
             if not res[0] or not continue_running.get_value():
                 continue_running.set_value(False)
-                error_str = stabilize_after_failed_append(vault_path, res[1], res[2], added_bytes)
-                raise FileError(f"Removed added bytes, but failure happened after appending bytes: {error_str}")
+                after_removal = vault_file.rollback(init_vault_size)
+                raise FileError(f"Removed added bytes making the vault size {after_removal}, but failure happened after appending bytes: {res[1]}")
 
-            added_bytes += encrypted_file_size
             # Chunk needs a restart after adding salt_iv
             encrypted_chunk = b''
-            # Quit once reached the end of file
-            if file.tell() >= file_size:
-                break
         # Incase Loop broke because of abort
+        if not continue_running.get_value() and hole_start != -1:
+            __release_hole(hole_start)
+            raise FileError(f"Released the free extent. Expected to add {file_size} + padding")
         if not continue_running.get_value():
-            error_str = stabilize_after_failed_append(vault_path, "appended:0", init_vault_size, added_bytes)
-            raise FileError(f"{error_str}. Expected to add {file_size} + padding")
-
-    res = get_file_size(vault_path)
-    new_vault_size = res
-
-    loc_end = new_vault_size
+            after_removal = vault_file.rollback(init_vault_size)
+            raise FileError(f"Removed added bytes making the vault size {after_removal} while the old size was: {init_vault_size}. Expected to add {file_size} + padding")
+
+    if hole_start != -1:
+        loc_end = loc_start + encrypted_file_size
+        __release_hole(loc_end) # Incase the file shrank while reading
+    else:
+        loc_end = vault_file.get_size()
     ans.append(loc_start)
     ans.append(loc_end)
     ans.append(encrypted_file_size)
-    # From this point onward its fine to add file into vault because the answer list has 3 values at least
+    ans.append(format_checksum(sha256))
+    # From this point onward its fine to add file into vault because the answer list has 4 values at least
 
     if not continue_running.get_value():
         ans.append("Continue running is turned off!")
@@ -175,17 +543,24 @@ def get_file_and_encrypt_and_add_to_vault(password : str, file_path : str, vault
 
     file_icon = get_icon_from_file(file_path)
 
-    icon_start = loc_end
-    res = append_bytes_into_file(file_path=vault_path, the_bytes=file_icon)
-    if not res[0]:
-        prev_error = stabilize_after_failed_append(vault_path, res[1], res[2], res[3]-res[2])
-        prev_error += ", the file has no icon bytes"
-        ans.append(prev_error)
-        return ans
-
-    # Icon tuple + EncryptedFileSize
-    res = get_file_size(vault_path)
-    icon_end = res
+    icon_hole = allocate(len(file_icon)) if allocate and file_icon else -1
+    if icon_hole != -1:
+        res = vault_file.write_at(file_icon, icon_hole)
+        if not res[0]:
+            if release:
+                release([(icon_hole, icon_hole + len(file_icon))])
+            ans.append(f"{res[1]}, the file has no icon bytes")
+            return ans
+        icon_start, icon_end = res[2], res[3]
+    else:
+        icon_start = vault_file.get_size()
+        res = vault_file.append(file_icon)
+        if not res[0]:
+            after_removal = vault_file.rollback(icon_start)
+            ans.append(f"{res[1]}, removed the icon bytes making the vault size {after_removal}, the file has no icon bytes")
+            return ans
+        # Icon tuple + EncryptedFileSize
+        icon_end = vault_file.get_size()
 
     ans.append(icon_start)
     ans.append(icon_end)
@@ -0,0 +1,100 @@
+from utils.constants import CRYPTO_WORKERS
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from collections import deque
+
+import multiprocessing
+import os
+import threading
+
+
+_pool = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def get_worker_count(workers : int = CRYPTO_WORKERS) -> int:
+    """Resolves the amount of workers to use.
+
+    Args:
+        workers (int, optional): Wanted amount, 0 or less means every core. Defaults to CRYPTO_WORKERS.
+
+    Returns:
+        int: The amount of workers, at least 1
+    """
+    if workers > 0:
+        return workers
+    return os.cpu_count() or 1
+
+def get_crypto_pool(workers : int = CRYPTO_WORKERS) -> ProcessPoolExecutor:
+    """Gets the process pool shared by the file encryption and decryption, creating it on first use. Asking for a different
+    amount of workers replaces the pool. Workers are spawned rather than forked, since the GUI process runs Qt threads.
+
+    Args:
+        workers (int, optional): Wanted amount, see get_worker_count. Defaults to CRYPTO_WORKERS.
+
+    Returns:
+        ProcessPoolExecutor: The pool, None if a single worker is asked for and the caller should do the work itself
+    """
+    global _pool, _pool_workers
+    workers = get_worker_count(workers)
+    if workers <= 1:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _pool_workers = workers
+        return _pool
+
+def shutdown_crypto_pool(wait : bool = True) -> None:
+    """Stops the shared pool, e.g, when the application closes or after the pool broke. The next get_crypto_pool creates a new one.
+
+    Args:
+        wait (bool, optional): Whether to wait for the workers to exit. Defaults to True.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=wait, cancel_futures=True)
+        _pool = None
+        _pool_workers = 0
+
+def map_in_order(function, tasks, in_flight : int, workers : int = CRYPTO_WORKERS):
+    """Runs function(*task) for every task on the shared pool and yields the results in the order of the tasks. At most
+    in_flight tasks are submitted ahead of the one being waited for, which bounds the memory held by results. Without a pool
+    the tasks run in the calling thread. Closing the generator cancels the tasks which did not start.
+
+    Args:
+        function (Callable): Module level function, so the workers can import it
+        tasks (Iterable[tuple]): Arguments of each call, consumed lazily
+        in_flight (int): Most tasks submitted at once, at least 1
+        workers (int, optional): See get_crypto_pool. Defaults to CRYPTO_WORKERS.
+
+    Raises:
+        BrokenProcessPool incase a worker died, the pool is shut down so the next call starts a new one.
+
+    Yields:
+        object: The result of each task
+    """
+    pool = get_crypto_pool(workers)
+    if pool is None:
+        for task in tasks:
+            yield function(*task)
+        return
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append(pool.submit(function, *task))
+            if len(pending) >= max(in_flight, 1):
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    except BrokenProcessPool:
+        shutdown_crypto_pool(wait=False)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
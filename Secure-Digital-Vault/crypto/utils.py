@@ -1,8 +1,25 @@
-import struct, hashlib, base64
+import struct, hashlib, base64, time
 
 from Crypto.Cipher import AES
-from Crypto.Protocol.KDF import PBKDF2
-from utils.constants import CHUNK_LIMIT
+from Crypto.Protocol.KDF import PBKDF2, HKDF, scrypt
+from Crypto.Hash import SHA256
+from Crypto.Random import get_random_bytes
+from utils.constants import CHUNK_LIMIT, MAGIC_FILE_V2, FILE_FORMAT_V2, FILE_V2_CHUNK_SIZE, KDF_PBKDF2_SHA1, KDF_PBKDF2_SHA256, \
+    KDF_SCRYPT, NEW_VAULT_KDF, KDF_TARGET_TIME
+
+# v2 file header: magic(8) | version(u8) | chunk size(u32) | salt(16) | nonce prefix(8)
+FILE_V2_HEADER = ">8sBI16s8s"
+FILE_V2_HEADER_SIZE = struct.calcsize(FILE_V2_HEADER)
+FILE_V2_TAG_SIZE = 16
+FILE_KEY_CONTEXT = b"Secure-Digital-Vault file key"
+KEY_WRAP_CONTEXT = b"Secure-Digital-Vault wrapped key"
+KEY_WRAP_NONCE_SIZE = 12
+JOURNAL_KEY_CONTEXT = b"Secure-Digital-Vault journal key"
+PROTECTION_KEY_CONTEXT = b"Secure-Digital-Vault protection key"
+PROTECTION_CHECK_CONTEXT = b"Secure-Digital-Vault protection check"
+PROTECTION_CHECK_SIZE = 16
+# Least cost calibrate_kdf picks, whatever the machine
+KDF_MINIMUM_COST = {KDF_PBKDF2_SHA1 : 1000, KDF_PBKDF2_SHA256 : 1000, KDF_SCRYPT : 10}
 
 
 def is_password_strong(password : str) -> tuple[bool,list[str]]:
@@ -67,12 +84,25 @@ def get_checksum(data : object, is_file : bool, divide_by : int = 4) -> str:
 
     if not is_file:
         sha256.update(data)
-        checksum = sha256.hexdigest()
-        return checksum[:int(len(checksum)/divide_by)]
+        return format_checksum(sha256, divide_by)
 
     with open(data, 'rb') as f:
         for chunk in iter(lambda: f.read(CHUNK_LIMIT), b''):
             sha256.update(chunk)
+    return format_checksum(sha256, divide_by)
+
+def format_checksum(sha256, divide_by : int = 4) -> str:
+    """Formats a SHA-256 which was updated incrementally the same way get_checksum does.
+
+    Args:
+        sha256 (hashlib._Hash): The hash after all the data went into it
+        divide_by (int) optional: 4 by default, return the checksum divided by this num. It cannot be larger than 32
+
+    Returns:
+        str: The hexadecimal representation of the SHA-256 checksum, length is dependent on divide_by argument
+    """
+    if divide_by > 32:
+        divide_by = 4
     checksum = sha256.hexdigest()
     return checksum[:int(len(checksum)/divide_by)]
 
@@ -106,6 +136,157 @@ def generate_aes_key(password : str, salt : bytes, key_length : int) -> bytes:
     """
     return PBKDF2(password=password, salt=salt, dkLen=key_length)
 
+def derive_password_key(password : str, salt : bytes, algorithm : int, cost : int) -> bytes:
+    """Derives a key from the password with the given KDF. Nothing is cached by password, unlocking derives the key once
+    and passes it on, see get_vault_secret of the decryptors.
+
+    Args:
+        password (str): The password
+        salt (bytes): The salt of the KDF
+        algorithm (int): KDF_PBKDF2_SHA1, KDF_PBKDF2_SHA256 or KDF_SCRYPT
+        cost (int): Iterations for PBKDF2, log2 of N for scrypt
+
+    Raises:
+        ValueError incase the algorithm is unknown or the cost is not positive.
+
+    Returns:
+        bytes: 32 bytes key
+    """
+    if cost <= 0:
+        raise ValueError(f"KDF cost must be positive but got {cost}")
+    if algorithm == KDF_PBKDF2_SHA1:
+        return PBKDF2(password=password.encode(), salt=salt, dkLen=32, count=cost)
+    if algorithm == KDF_PBKDF2_SHA256:
+        return PBKDF2(password=password.encode(), salt=salt, dkLen=32, count=cost, hmac_hash_module=SHA256)
+    if algorithm == KDF_SCRYPT:
+        return scrypt(password.encode(), salt, 32, N=2 ** cost, r=8, p=1)
+    raise ValueError(f"Unknown KDF algorithm {algorithm}")
+
+def calibrate_kdf(algorithm : int = NEW_VAULT_KDF, target_time : float = KDF_TARGET_TIME) -> dict:
+    """Picks the cost of the KDF which takes about target_time on this machine, and a random salt for it.
+
+    Args:
+        algorithm (int, optional): See derive_password_key. Defaults to NEW_VAULT_KDF.
+        target_time (float, optional): Seconds a single derivation should take. Defaults to KDF_TARGET_TIME.
+
+    Returns:
+        dict: 'algorithm', 'cost' and 'salt', see kdf_as_fields of the superblock
+    """
+    def measure(cost : int) -> float:
+        start = time.perf_counter()
+        derive_password_key("calibration", b'\0' * 16, algorithm, cost)
+        return time.perf_counter() - start
+
+    cost = KDF_MINIMUM_COST[algorithm]
+    if algorithm == KDF_SCRYPT:
+        # Time and memory double with every step, so stop before the next one overshoots
+        while measure(cost) * 2 <= target_time:
+            cost += 1
+    else:
+        probe = max(cost, 10_000)
+        took = min(measure(probe) for _ in range(3))
+        cost = max(cost, int(probe * target_time / took))
+    return {"algorithm" : algorithm, "cost" : cost, "salt" : get_random_bytes(16)}
+
+def derive_master_key(password : str, salt : bytes, kdf : dict = None) -> bytes:
+    """Derives the master key of an unlocked vault, the only expensive derivation which files keyed by it cost.
+
+    Args:
+        password (str): Password of the vault
+        salt (bytes): The salt of the KDF in the superblock, or the 'key_salt' of the vault header
+        kdf (dict, optional): 'algorithm' and 'cost' of the vault, see calibrate_kdf. Defaults to None which is PBKDF2 with
+        the defaults of generate_aes_key, for vaults which do not record their KDF.
+
+    Raises:
+        ValueError incase the KDF is not known, see derive_password_key.
+
+    Returns:
+        bytes: 32 bytes key
+    """
+    if kdf:
+        return derive_password_key(password, salt, kdf["algorithm"], kdf["cost"])
+    return generate_aes_key(password=password.encode(), salt=salt, key_length=32)
+
+def derive_file_key(secret : str | bytes, salt : bytes) -> bytes:
+    """Derives the key a file, or the header and footer of a vault which records its KDF, is encrypted with.
+
+    Args:
+        secret (str | bytes): The vault password, which goes through PBKDF2 as files always did. Or the master key of
+        the session, see derive_master_key, which goes through HKDF and costs microseconds instead.
+        salt (bytes): The random salt stored at the start of the encrypted bytes, which makes the key unique to them
+
+    Returns:
+        bytes: 32 bytes key
+    """
+    if isinstance(secret, str):
+        return generate_aes_key(password=secret.encode(), salt=salt, key_length=32)
+    return HKDF(secret, 32, salt, SHA256, context=FILE_KEY_CONTEXT)
+
+def derive_journal_key(master_key : bytes, salt : bytes) -> bytes:
+    """Derives the key of the journal which lives next to the vault while it is open. It goes through HKDF from the master
+    key of the session, so guessing the password from the journal costs the KDF of the vault, see derive_master_key.
+
+    Args:
+        master_key (bytes): The master key of the session
+        salt (bytes): The random salt at the start of the journal, new with every reset
+
+    Returns:
+        bytes: 32 bytes key
+    """
+    return HKDF(master_key, 32, salt, SHA256, context=JOURNAL_KEY_CONTEXT)
+
+def derive_protection_keys(password : str, protection : dict) -> tuple[bytes, bytes]:
+    """Derives the keys of the protection layer a user password puts on a single file.
+
+    Args:
+        password (str): Password of the file
+        protection (dict): 'algorithm', 'cost' and 'salt' of the layer, see calibrate_kdf
+
+    Raises:
+        ValueError incase the KDF is not known, see derive_password_key.
+
+    Returns:
+        tuple[bytes, bytes]: The key of the layer, and the check stored next to the salt to recognize a wrong password
+    """
+    password_key = derive_password_key(password, protection["salt"], protection["algorithm"], protection["cost"])
+    key = HKDF(password_key, 32, protection["salt"], SHA256, context=PROTECTION_KEY_CONTEXT)
+    check = HKDF(password_key, PROTECTION_CHECK_SIZE, protection["salt"], SHA256, context=PROTECTION_CHECK_CONTEXT)
+    return key, check
+
+def apply_protection_layer(key : bytes, data : bytes, offset : int) -> bytes:
+    """Adds or removes the protection layer of a file, AES-CTR over the plain file. The layer keeps the size, and any offset
+    can be processed on its own, so a file is protected piece by piece while it is copied. It is not authenticated by itself, the
+    chunks of the vault layer around it are.
+
+    Args:
+        key (bytes): Key of the layer, see derive_protection_keys
+        data (bytes): Bytes of the file starting at offset
+        offset (int): Offset of data inside the file
+
+    Returns:
+        bytes: data with the layer added, or removed
+    """
+    skip = offset % AES.block_size
+    cipher = AES.new(key, AES.MODE_CTR, nonce=b'', initial_value=offset // AES.block_size)
+    if skip:
+        cipher.encrypt(bytes(skip))
+    return cipher.encrypt(data)
+
+def protection_stream(pieces, key : bytes):
+    """Adds or removes the protection layer of a file which arrives in pieces, see apply_protection_layer.
+
+    Args:
+        pieces (Iterable[bytes]): The file in order, pieces can have any size
+        key (bytes): Key of the layer
+
+    Yields:
+        bytes: The pieces with the layer added, or removed
+    """
+    offset = 0
+    for piece in pieces:
+        yield apply_protection_layer(key, piece, offset)
+        offset += len(piece)
+
 def calculate_encrypted_chunk_size(given_size: int) -> int:
     """Calculates the exact encrypted chunk size
 
@@ -124,6 +305,88 @@ def calculate_encrypted_chunk_size(given_size: int) -> int:
     overhead = padding_size + 16 + 16
     return given_size + overhead
 
+def calculate_encrypted_file_size(file_size : int, chunk_size : int = CHUNK_LIMIT) -> int:
+    """Calculates the exact size a file takes inside the vault when it is encrypted chunk by chunk with one salt+iv.
+
+    Args:
+        file_size (int): The size of the plain file
+        chunk_size (int, optional): The chunk size used while encrypting. Defaults to CHUNK_LIMIT.
+
+    Returns:
+        int: salt+iv and every padded chunk
+    """
+    block_size = AES.block_size
+    full_chunks, remainder = divmod(file_size, chunk_size)
+    size = 16 + 16 + full_chunks * (chunk_size - (chunk_size % block_size) + block_size)
+    if remainder:
+        size += remainder - (remainder % block_size) + block_size
+    return size
+
+def calculate_v2_file_size(file_size : int, chunk_size : int = FILE_V2_CHUNK_SIZE) -> int:
+    """Calculates the exact size a file takes inside the vault in the v2 format.
+
+    Args:
+        file_size (int): The size of the plain file
+        chunk_size (int, optional): The data size of each chunk. Defaults to FILE_V2_CHUNK_SIZE.
+
+    Returns:
+        int: The header and every chunk with its tag
+    """
+    return FILE_V2_HEADER_SIZE + file_size + -(-file_size // chunk_size) * FILE_V2_TAG_SIZE
+
+def form_file_v2_header(salt : bytes, nonce_prefix : bytes, chunk_size : int = FILE_V2_CHUNK_SIZE) -> bytes:
+    """Forms the header which starts every v2 file inside the vault.
+
+    Args:
+        salt (bytes): 16 bytes salt of the key
+        nonce_prefix (bytes): 8 random bytes, the chunk index completes the nonce
+        chunk_size (int, optional): The data size of each chunk. Defaults to FILE_V2_CHUNK_SIZE.
+
+    Returns:
+        bytes: The header, FILE_V2_HEADER_SIZE long
+    """
+    return struct.pack(FILE_V2_HEADER, xor_magic(MAGIC_FILE_V2), FILE_FORMAT_V2, chunk_size, salt, nonce_prefix)
+
+def parse_file_v2_header(header : bytes) -> dict:
+    """Parses the header of a v2 file.
+
+    Args:
+        header (bytes): At least the first FILE_V2_HEADER_SIZE bytes of the file
+
+    Returns:
+        dict: 'chunk_size', 'salt' and 'nonce_prefix'. Empty dict if it is not a v2 header.
+    """
+    if len(header) < FILE_V2_HEADER_SIZE:
+        return {}
+    magic, version, chunk_size, salt, nonce_prefix = struct.unpack_from(FILE_V2_HEADER, header)
+    if magic != xor_magic(MAGIC_FILE_V2) or version != FILE_FORMAT_V2 or chunk_size <= 0:
+        return {}
+    return {"chunk_size" : chunk_size, "salt" : salt, "nonce_prefix" : nonce_prefix}
+
+def get_file_v2_nonce(nonce_prefix : bytes, index : int) -> bytes:
+    """Derives the nonce of a chunk, which is never reused since the prefix is random per file.
+
+    Args:
+        nonce_prefix (bytes): The prefix from the file header
+        index (int): Index of the chunk
+
+    Returns:
+        bytes: 12 bytes nonce
+    """
+    return nonce_prefix + struct.pack(">L", index)
+
+def locate_file_v2_chunk(index : int, chunk_size : int = FILE_V2_CHUNK_SIZE) -> int:
+    """Returns where the chunk starts, relative to the start of the file.
+
+    Args:
+        index (int): Index of the chunk
+        chunk_size (int, optional): The data size of each chunk. Defaults to FILE_V2_CHUNK_SIZE.
+
+    Returns:
+        int: Offset of the chunk
+    """
+    return FILE_V2_HEADER_SIZE + index * (chunk_size + FILE_V2_TAG_SIZE)
+
 def to_base64(some_bytes: bytes) -> str:
     """
     Convert bytes to Base64 encoded string.
@@ -2,10 +2,22 @@ from PyQt6.QtCore import QDir, QFile
 from custom_exceptions.classes_exceptions import FileError
 
 from crypto.utils import xor_magic
+from file_handle.superblock import get_superblock, read_superblock, update_superblock, form_superblock, header_pointers_as_fields, \
+    is_tail_layout, get_header_slots
 from utils.helpers import get_file_size, is_location_ok
-from utils.constants import MAGIC_HEADER_START, MAGIC_HEADER_END, MAGIC_HEADER_PAD, CHUNK_LIMIT, MAGIC_LOG_START, MAGIC_LOG_END
+from utils.constants import MAGIC_HEADER_START, MAGIC_HEADER_END, MAGIC_HEADER_PAD, CHUNK_LIMIT, MAGIC_LOG_START, MAGIC_LOG_END, \
+    SUPERBLOCK_SIZE, COPY_RANGE_MIN, VAULT_BUFFER_LIMIT, HEADER_GROWTH_FACTOR, HEADER_GROWTH_CAP, HEADER_SLOT_OVERHEAD
 
 import os
+import re
+import mmap
+import ctypes
+import ctypes.util
+import tempfile
+from functools import lru_cache
+
+FALLOC_FL_COLLAPSE_RANGE = 0x08 # linux/falloc.h
+DEVICE_CAPABILITIES = {}   # Device id -> probe_device result, see probe_delete_capabilities
 
 
 def find_magic(vault_path: str, magic_bytes: bytes, start_from_index: int = -1, read_reverse: bool = False,
@@ -88,8 +100,86 @@ def find_magic(vault_path: str, magic_bytes: bytes, start_from_index: int = -1,
             file.close()
     return result
 
+def find_magics(vault_path : str, patterns : list[bytes], start_from_index : int = 0, read_reverse : bool = False,
+                chunk_size : int = CHUNK_LIMIT, fd = None) -> list[int]:
+    """Finds all the given magic bytes in a single pass over the memory mapped vault. The patterns are combined into one
+    search, so every byte is visited once regardless of the amount of patterns. Patterns must not overlap each other.
+
+    Args:
+        vault_path (str): vault location on disk
+        patterns (list[bytes]): Magic bytes to search (Must be deserialized)
+        start_from_index (int, optional): Index where to start search from, or where to stop if read_reverse. Defaults to 0.
+        read_reverse (bool, optional): Walk from the ending, finding the last occurrence of each pattern. Defaults to False.
+        chunk_size (int, optional): Window size used when walking from the ending. Nothing is copied. Defaults to CHUNK_LIMIT.
+        fd: FileDescriptor. It is given to reduce file opening overhead, and this function does not close it. (rb)
+
+    Returns:
+        list[int]: Ending Index of each magic bytes, in the same order as patterns. -1 for the ones that do not exist.
+    """
+    result = [-1] * len(patterns)
+    if not patterns:
+        return result
+    longest = max(len(p) for p in patterns)
+    if chunk_size < longest:
+        return result
+    searcher = re.compile(b'|'.join(re.escape(p) for p in set(patterns)))
+
+    file = fd if fd else open(vault_path, "rb")
+    try:
+        file.seek(0, 2)
+        file_size = file.tell()
+        if file_size == 0:
+            return result
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pending = set(patterns)
+            if read_reverse:
+                window_end = file_size
+                while pending and window_end > start_from_index:
+                    window_start = max(window_end - chunk_size, start_from_index)
+                    found = {}
+                    for match in searcher.finditer(mm, window_start, min(window_end + longest - 1, file_size)):
+                        if match.group() in pending:
+                            found[match.group()] = match.end()
+                    for pattern, index in found.items():
+                        result = [index if p == pattern else r for p, r in zip(patterns, result)]
+                    pending.difference_update(found)
+                    window_end = window_start
+            else:
+                position = max(start_from_index, 0)
+                while pending:
+                    match = searcher.search(mm, position)
+                    if not match:
+                        break
+                    if match.group() in pending:
+                        result = [match.end() if p == match.group() else r for p, r in zip(patterns, result)]
+                        pending.discard(match.group())
+                    position = match.end()
+    except (OSError, ValueError):
+        result = [-1] * len(patterns)
+    finally:
+        if not fd:
+            file.close()
+    return result
+
+def is_magic_at(fd, index : int, magic_bytes : bytes) -> bool:
+    """Checks whether the given magic bytes are located at the given index.
+
+    Args:
+        fd: FileDescriptor, which is not closed by this function. (rb)
+        index (int): Starting index of the magic bytes
+        magic_bytes (bytes): Magic bytes to check (Must be deserialized)
+
+    Returns:
+        bool: True if the magic bytes are there, False otherwise.
+    """
+    if index < 0:
+        return False
+    fd.seek(index)
+    return fd.read(len(magic_bytes)) == magic_bytes
+
 def find_header_pointers(vault_path : str) -> list[int]:
     """Returns a list related to the indexes of the header. The vault path must be checked before.
+    The superblock is used when present, otherwise the magic bytes are searched.
 
     Args:
         vault_path (str): Location of the vault
@@ -104,15 +194,128 @@ def find_header_pointers(vault_path : str) -> list[int]:
     magic_end   = xor_magic(MAGIC_HEADER_END)
 
     file = open(vault_path, "rb")
-    header_start = find_magic(vault_path, magic_start, fd=file)
-    header_pad   = find_magic(vault_path, magic_pad, start_from_index=header_start, fd=file)
-    header_end   = find_magic(vault_path, magic_end, start_from_index=header_pad, fd=file)
+    superblock = get_superblock(vault_path, fd=file)
+    # Tail layout: the current slot, then the other slot which holds the previous commit
+    if is_tail_layout(superblock):
+        slots = get_header_slots(superblock)
+        if superblock["current_slot"] == 1:
+            slots.reverse()
+        for slot_start, slot_length in slots:
+            res = read_header_slot_pointers(file, slot_start, slot_length)
+            if res:
+                file.close()
+                return res
+    elif superblock and superblock["header_start"] >= 0:
+        header_start = superblock["header_start"]
+        header_pad   = superblock["pad_start"]
+        header_end   = header_pad + superblock["pad_length"] + len(magic_end)
+        if is_magic_at(file, header_start - len(magic_start), magic_start) and \
+            is_magic_at(file, header_pad - len(magic_pad), magic_pad) and \
+            is_magic_at(file, header_end - len(magic_end), magic_end):
+            file.close()
+            return [superblock["pad_length"], superblock["header_length"], header_start-len(magic_start),
+                    header_pad-len(magic_pad), header_end-len(magic_end)]
+
+    header_start, header_pad, header_end = find_magics(vault_path, [magic_start, magic_pad, magic_end], fd=file)
     file.close()
 
     pad_length    = (header_end - len(magic_end)) - header_pad
     header_length = (header_pad - len(magic_pad)) - header_start
     return [pad_length, header_length, header_start-len(magic_start), header_pad-len(magic_pad), header_end-len(magic_end)]
 
+def read_header_slot_pointers(file, slot_start : int, slot_length : int) -> list[int]:
+    """Gets the header pointers of a header slot, verifying every magic of the slot.
+
+    Args:
+        file: FileDescriptor of the vault (rb)
+        slot_start (int): Start of the slot, -1 for a slot never written
+        slot_length (int): Length of the slot
+
+    Returns:
+        list[int]: Same as find_header_pointers, empty list if the slot does not hold a header
+    """
+    magic_start = xor_magic(MAGIC_HEADER_START)
+    magic_pad   = xor_magic(MAGIC_HEADER_PAD)
+    magic_end   = xor_magic(MAGIC_HEADER_END)
+    if slot_start < 0 or slot_length < len(magic_start) + len(magic_pad) + len(magic_end):
+        return []
+    header_end = slot_start + slot_length - len(magic_end)
+    if not is_magic_at(file, slot_start, magic_start) or not is_magic_at(file, header_end, magic_end):
+        return []
+    # The encrypted header length is stored right before the pad magic, see form_header_slot
+    file.seek(header_end - 8)
+    header_length = int.from_bytes(file.read(8), "big")
+    header_pad = slot_start + len(magic_start) + header_length
+    if header_pad + len(magic_pad) > header_end - 8 or not is_magic_at(file, header_pad, magic_pad):
+        return []
+    pad_length = header_end - (header_pad + len(magic_pad))
+    return [pad_length, header_length, slot_start, header_pad, header_end]
+
+def form_header_slot(encrypted_header : bytes, capacity : int) -> bytes:
+    """Forms the bytes of a header slot: START | header | PAD | random pad | header length (8 bytes) | END
+
+    Args:
+        encrypted_header (bytes): The encrypted header
+        capacity (int): Length of the slot, at least len(encrypted_header) + HEADER_SLOT_OVERHEAD
+
+    Returns:
+        bytes: The slot which is exactly capacity long
+    """
+    slot = xor_magic(MAGIC_HEADER_START) + encrypted_header + xor_magic(MAGIC_HEADER_PAD)
+    slot += os.urandom(capacity - len(slot) - 8 - len(MAGIC_HEADER_END))
+    return slot + len(encrypted_header).to_bytes(8, "big") + xor_magic(MAGIC_HEADER_END)
+
+def commit_header_into_slot(vault_path : str, encrypted_header : bytes, growth_factor : float = HEADER_GROWTH_FACTOR,
+                            growth_cap : int = HEADER_GROWTH_CAP) -> tuple[int,int]:
+    """Commits the header of a tail layout vault. The header is written into the slot which is not current, then the superblock
+    is flipped to it. A crash before the flip leaves the previous header current. File data is never moved.
+    If the header does not fit into that slot, the slot is placed at the end of the vault with a geometric reserve.
+
+    Args:
+        vault_path (str): Location of the vault, the footer must be detached
+        encrypted_header (bytes): The encrypted header
+        growth_factor (float, optional): Reserve of a new slot as a factor of its needed size. Defaults to HEADER_GROWTH_FACTOR.
+        growth_cap (int, optional): Most reserve of a new slot. Defaults to HEADER_GROWTH_CAP.
+
+    Raises:
+        FileError: If the vault is not a tail layout vault
+
+    Returns:
+        tuple[int,int]: (start, end) of the bytes the slot used before it moved to the end, which can be reused. (-1, -1) if it did not move.
+    """
+    with open(vault_path, "rb+") as file:
+        superblock = read_superblock(vault_path, fd=file)
+        if not is_tail_layout(superblock):
+            raise FileError(f"Vault: {vault_path} does not keep its header in slots")
+        target = "slot_b" if superblock["current_slot"] == 0 else "slot_a"
+        slot_start, capacity = superblock[f"{target}_start"], superblock[f"{target}_length"]
+        needed = len(encrypted_header) + HEADER_SLOT_OVERHEAD
+        released = (-1, -1)
+        if slot_start < 0 or capacity < needed:
+            if slot_start >= 0:
+                released = (slot_start, slot_start + capacity)
+            file.seek(0, 2)
+            slot_start = file.tell()
+            capacity = needed + max(int(min(needed * growth_factor, growth_cap)), VAULT_BUFFER_LIMIT)
+        file.seek(slot_start)
+        file.write(form_header_slot(encrypted_header, capacity))
+        file.flush()
+        os.fsync(file.fileno())
+        superblock.update({
+            f"{target}_start"  : slot_start,
+            f"{target}_length" : capacity,
+            "current_slot"     : 0 if target == "slot_a" else 1,
+            "header_start"     : slot_start + len(MAGIC_HEADER_START),
+            "header_length"    : len(encrypted_header),
+            "pad_start"        : slot_start + len(MAGIC_HEADER_START) + len(encrypted_header) + len(MAGIC_HEADER_PAD),
+            "pad_length"       : capacity - needed + 8,
+        })
+        file.seek(0)
+        file.write(form_superblock(superblock))
+        file.flush()
+        os.fsync(file.fileno())
+    return released
+
 def add_magic_into_header(bytes_as_dict: bytes, start_only: bool = True, pad_only: bool = True, end_only: bool = True) -> bytes:
     """Adds the relevant magic bytes into the serialized and encrypted dict
 
@@ -154,6 +357,7 @@ def header_padder(file_path : str , amount_to_pad : int) -> None:
 
 def find_footer_pointers(vault_path : str) -> tuple[int,int]:
     """Returns a list related to the indexes of the footer. The vault path must be checked before.
+    The superblock is used when present, otherwise the magic bytes are searched.
 
     Args:
         vault_path (str): Location of the vault
@@ -165,8 +369,18 @@ def find_footer_pointers(vault_path : str) -> tuple[int,int]:
     magic_end   = xor_magic(MAGIC_LOG_END)
     file = open(vault_path, "rb")
 
-    footer_start = find_magic(vault_path, magic_start, read_reverse=True, fd=file)
-    footer_end   = find_magic(vault_path, magic_end, read_reverse=True, fd=file)
+    superblock = get_superblock(vault_path, fd=file)
+    if superblock:
+        footer_start = superblock["footer_start"]
+        footer_end   = footer_start + superblock["footer_length"]
+        if footer_start == -1 and not superblock["is_trailer"]:
+            file.close()
+            return -1, -1
+        if is_magic_at(file, footer_start - len(magic_start), magic_start) and is_magic_at(file, footer_end, magic_end):
+            file.close()
+            return footer_start, footer_end
+
+    footer_start, footer_end = find_magics(vault_path, [magic_start, magic_end], read_reverse=True, fd=file)
     file.close()
     return footer_start, footer_end-len(magic_end)
 
@@ -260,35 +474,140 @@ def append_bytes_into_file(file_path : str , the_bytes : bytes, create_file : bo
     except Exception as e:
         return (False, e.__str__(), init_size, new_size)
 
-def stabilize_after_failed_append(file_path : str, append_error : str, old_size : int, already_add_bytes : int = 0):
-    """Handle scenario incase append_bytes_into_file function returns False.
+def write_bytes_into_file_at(file_path : str, the_bytes : bytes, at_location : int, fd = None) -> tuple[bool,str,int,int]:
+    """Writes the bytes over the given location of the file without shifting anything. Used to fill free extents of the vault.
 
     Args:
-        file_path (str): The location of the file, must be correct by default.
-        append_error (str): Error given by the append_bytes_into_file function.
-        old_size (int): Init size of the file.
-        already_add_bytes (int, optional): Already added bytes. Defaults to 0.
+        file_path (str): File location on the disk
+        the_bytes (bytes): Bytes which are already encrypted and serialized
+        at_location (int): Index to start writing at, must be inside the file
+        fd: FileDescriptor. It is given to reduce file opening overhead, and this function does not close it. (rb+)
 
     Returns:
-        str: Process string error of what happened.
+        tuple[bool,str,int,int]: [0] represents True upon success, False otherwise.
+        [1] is if any error raised.
+        [2] is the start index of the written bytes.
+        [3] is the end index of the written bytes.
     """
-    word = "appended:"
-    location = append_error.rfind(word)
-    num = append_error[location+len(word):].strip()
-    added_bytes = 0
+    file = None
     try:
-        added_bytes = int(num)
-    except ValueError:
-        added_bytes = 0
-    prev_error = append_error
-    prev_error += f", Size is: '{added_bytes}'"
-    added_bytes += already_add_bytes
-    after_removal = remove_bytes_from_ending_of_file(file_path, added_bytes) # To remove anything added to the vault
-    return f'{prev_error}, removal of appended {added_bytes} bytes makes new vault size: {after_removal} while the old size was: {old_size}'
+        file = fd if fd else open(file_path, "rb+")
+        file.seek(0, 2)
+        if at_location < 0 or at_location > file.tell():
+            raise FileError(f"Cannot write at {at_location} of {file_path} which has size of '{file.tell()}'")
+        file.seek(at_location)
+        written_bytes = file.write(the_bytes)
+        file.flush()
+        if written_bytes != len(the_bytes):
+            raise FileError(f"Writing Failure. Total bytes to write: {len(the_bytes)}, written: {written_bytes}")
+        return (True, "", at_location, at_location + written_bytes)
+    except FileError as e:
+        return (False, e.message, at_location, at_location)
+    except Exception as e:
+        return (False, e.__str__(), at_location, at_location)
+    finally:
+        if file and not fd:
+            file.close()
+
+def rollback_append(file_path : str, old_size : int, fd = None) -> int:
+    """Removes anything appended to the file after it had the given size, e.g, after append_bytes_into_file returned False.
+    The size comes from the caller or from an 'append' journal entry, the error message is never parsed.
+
+    Args:
+        file_path (str): The location of the file, must be correct by default.
+        old_size (int): Size of the file before the append started.
+        fd: FileDescriptor. It is given to reduce file opening overhead, and this function does not close it. (rb+)
+
+    Returns:
+        int: The size of the file after the rollback, -1 if old_size is not a valid size to go back to.
+    """
+    size = get_file_size(file_path)
+    if old_size <= 0 or size < 0:
+        return -1
+    if size <= old_size:
+        return size
+    return remove_bytes_from_ending_of_file(file_path, size - old_size, fd=fd)
+
+def copy_range_in_file(file, source : int, destination : int, length : int) -> None:
+    """Copies a range of the file into another non overlapping range of the same file inside the kernel.
+
+    Args:
+        file: FileDescriptor, which is not closed by this function. (rb+)
+        source (int): Index of the first byte to copy
+        destination (int): Index to copy into
+        length (int): Amount of bytes to copy
+
+    Raises:
+        OSError: If the kernel or the filesystem does not support it, or if the file ended before length was copied.
+    """
+    copied = 0
+    while copied < length:
+        res = os.copy_file_range(file.fileno(), file.fileno(), length - copied, source + copied, destination + copied)
+        if res <= 0:
+            raise OSError(f"copy_file_range stopped after {copied} out of {length} bytes")
+        copied += res
+
+def move_bytes_in_file(file, source : int, destination : int, length : int, buffer : bytearray = None, use_kernel : bool = True,
+                       progress = None) -> str:
+    """Moves a range of bytes to another location of the same file iteratively. Moving to the right copies from the end
+    backwards and moving to the left copies from the start forwards, so overlapping ranges are safe.
+    Memory use is bounded by the buffer, which is reused for every chunk. os.copy_file_range is used instead of the
+    buffer when the kernel supports it and the distance is at least COPY_RANGE_MIN, falling back to the buffer if it fails.
+
+    Args:
+        file: FileDescriptor, which is not closed by this function. (rb+)
+        source (int): Index of the first byte to move
+        destination (int): Index where the first byte will be
+        length (int): Amount of bytes to move
+        buffer (bytearray, optional): Reusable buffer, its length is the chunk size. Defaults to None which allocates
+            min(length, CHUNK_LIMIT).
+        use_kernel (bool, optional): False forces the buffer even if os.copy_file_range is usable. Defaults to True.
+        progress (Callable[[int], None], optional): Called with the amount of bytes after every moved chunk. Defaults to None.
+
+    Returns:
+        str: The path which was taken: 'none', 'copy_file_range' if the kernel moved every byte, 'buffer' otherwise
+    """
+    if length <= 0 or source == destination:
+        return "none"
+    if buffer is None:
+        buffer = bytearray(min(length, CHUNK_LIMIT))
+    view = memoryview(buffer)
+    file.flush()
+    raw = getattr(file, "raw", file)
+    distance = abs(destination - source)
+    use_kernel = use_kernel and hasattr(os, "copy_file_range") and distance >= COPY_RANGE_MIN
+
+    remaining = length
+    while remaining > 0:
+        size = min(distance if use_kernel else len(buffer), remaining)
+        offset = remaining - size if destination > source else length - remaining
+        if use_kernel:
+            try:
+                copy_range_in_file(raw, source + offset, destination + offset, size)
+            except OSError:
+                use_kernel = False
+                continue
+        else:
+            raw.seek(source + offset)
+            read = 0
+            while read < size:
+                res = raw.readinto(view[read:size])
+                if not res:
+                    raise FileError(f"Unexpected end of file at {source + offset + read} while moving {length} bytes")
+                read += res
+            raw.seek(destination + offset)
+            raw.write(view[:size])
+        remaining -= size
+        if progress:
+            progress(size)
+
+    file.seek(0, 2) # Resets the buffered state after using the raw file
+    return "copy_file_range" if use_kernel else "buffer"
 
 def override_bytes_in_file(file_path : str , given_bytes : bytes, byte_loss : int,
                            at_location : int = 0, chunk_size : int = CHUNK_LIMIT, fd  = None):
     """Adds the given bytes at a certain location of the file. Shifting is involved. Can be used to insert to the beginning of the file.
+    The bytes after the overwritten part are shifted iteratively by move_bytes_in_file using constant memory.
 
     Args:
         file_path (str): Location of the file
@@ -299,17 +618,15 @@ def override_bytes_in_file(file_path : str , given_bytes : bytes, byte_loss : in
             e.g, 'test123' at_location 3 with the addition of 'hey', will get the result (teshey3)
         - Use byte_loss=len(byte_loss) to add into at_location without any loss and effectively shift the all bytes to the right,
             e.g, 'test123' at_location 4 with the addition of 'okay', will get the result (testokay123)
+        - Any value in between overwrites len(given_bytes)-byte_loss bytes and shifts the rest by byte_loss
 
         at_location (int, optional): Index location to start addition from. Defaults to 0.
-        chunk_size (int): Chunk size to have in memory, if given bytes amount is larger than the CHUNK_LIMIT must be >= given_bytes
+        chunk_size (int): Size of the reusable buffer used for shifting. Defaults to CHUNK_LIMIT.
         fd: FileDescriptor. It is given to reduce file opening overhead. (rb+)
 
         Returns:
             FileDescriptor (fd): FileDescriptor, which is to be closed by the caller. (rb+)
     """
-    if chunk_size < len(given_bytes):
-        chunk_size = len(given_bytes)
-
     if len(given_bytes) == 0:
         return fd
 
@@ -324,54 +641,210 @@ def override_bytes_in_file(file_path : str , given_bytes : bytes, byte_loss : in
     else:
         file = open(file_path, "rb+")
 
-    move = len(given_bytes) - byte_loss
-    if move < 0:
-        move = 0
-    elif file_size < (at_location + move):
-        move = 0
+    file.flush()
+    file.seek(0, 2)
+    file_size = file.tell()
+    byte_loss = min(max(byte_loss, 0), len(given_bytes))
+    tail_start = at_location + len(given_bytes) - byte_loss
+    if byte_loss > 0 and tail_start < file_size:
+        tail_length = file_size - tail_start
+        move_bytes_in_file(file, tail_start, tail_start + byte_loss, tail_length, bytearray(min(chunk_size, tail_length)))
 
-    # Read the chunk that will be displaced by the new data
-    file.seek(at_location + move)
-    lost_chunk = file.read(chunk_size)
     file.seek(at_location)
-
-    # Write the given bytes at the specified location
     file.write(given_bytes)
-    save_location = file.tell()
+    return file
+
+@lru_cache(maxsize=1)
+def load_fallocate():
+    """Loads fallocate from the C library, which is only available on Linux.
+
+    Returns:
+        The fallocate function, None if it is not available.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fallocate = libc.fallocate
+    except (OSError, AttributeError, TypeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+    fallocate.restype = ctypes.c_int
+    return fallocate
+
+def collapse_range_in_file(file, offset : int, length : int) -> bool:
+    """Removes a range of the file inside the kernel with fallocate(FALLOC_FL_COLLAPSE_RANGE), without moving the data after it.
+    Both offset and length must be multiples of the filesystem block size, and the range must end before the end of the file.
+
+    Args:
+        file: FileDescriptor, which is not closed by this function. (rb+)
+        offset (int): Start of the range
+        length (int): Length of the range
+
+    Returns:
+        bool: True upon success, False if it is not supported for this file or range.
+    """
+    fallocate = load_fallocate()
+    if not fallocate:
+        return False
+    file.flush()
+    res = fallocate(file.fileno(), FALLOC_FL_COLLAPSE_RANGE, offset, length) == 0
+    file.seek(0, 2) # Resets the buffered state after changing the file underneath it
+    return res
+
+def probe_delete_capabilities(file_path : str) -> dict:
+    """Probes which kernel accelerated paths are usable for deleting bytes from files located next to the given file.
+    The result is cached per device.
+
+    Args:
+        file_path (str): Location of the file, or the folder, to probe for
+
+    Returns:
+        dict: 'collapse_range' (bool), 'copy_file_range' (bool) and 'block_size' (int) of the filesystem.
+    """
+    folder = file_path if os.path.isdir(file_path) else os.path.dirname(os.path.abspath(file_path))
+    device = os.stat(folder).st_dev
+    if device not in DEVICE_CAPABILITIES:
+        DEVICE_CAPABILITIES[device] = probe_device(folder)
+    return DEVICE_CAPABILITIES[device]
+
+def probe_device(folder : str) -> dict:
+    """Worker of probe_delete_capabilities, it creates a temporary file in the folder and tries each path on it.
+
+    Args:
+        folder (str): Folder located on the device to probe
+
+    Returns:
+        dict: 'collapse_range' (bool), 'copy_file_range' (bool) and 'block_size' (int) of the filesystem.
+    """
+    result = {"collapse_range" : False, "copy_file_range" : False, "block_size" : os.statvfs(folder).f_bsize if hasattr(os, "statvfs") else 4096}
+    block_size = result["block_size"]
+    try:
+        with tempfile.TemporaryFile(dir=folder) as f:
+            f.write(bytes(range(256)) * (block_size // 64))
+            f.flush()
+            if hasattr(os, "copy_file_range"):
+                try:
+                    copy_range_in_file(f, 0, 2 * block_size, block_size)
+                    result["copy_file_range"] = True
+                except OSError:
+                    pass
+            if collapse_range_in_file(f, 0, block_size):
+                f.seek(0, 2)
+                result["collapse_range"] = f.tell() == 3 * block_size
+    except OSError:
+        pass
+    return result
+
+def remove_range_from_file(file, start_index : int, bytes_to_delete : int, chunk_size : int = CHUNK_LIMIT, use_kernel : bool = True) -> str:
+    """Removes a range of bytes from the file, moving everything after it to the left.
+    - If the range reaches the end of the file, the file is truncated.
+    - If the length is a multiple of the block size and collapsing is supported, the range is collapsed in the kernel.
+      An unaligned start is handled by copying the first bytes after the range (less than a block) into the unaligned head.
+    - Otherwise the tail is moved by move_bytes_in_file, which uses copy_file_range where possible, then truncated.
+
+    Args:
+        file: FileDescriptor, which is not closed by this function. (rb+)
+        start_index (int): The location of the index to start the deletion from
+        bytes_to_delete (int): Amount of bytes to delete
+        chunk_size (int, optional): Size of the reusable buffer if the tail has to be moved. Defaults to CHUNK_LIMIT.
+        use_kernel (bool, optional): False forces the buffered tail move. Defaults to True.
+
+    Returns:
+        str: The path which was taken: 'none', 'truncate', 'collapse_range', 'copy_file_range' or 'buffer'
+    """
+    file.flush()
+    file.seek(0, 2)
+    file_size = file.tell()
+    bytes_to_delete = min(bytes_to_delete, file_size - start_index)
+    if bytes_to_delete <= 0:
+        return "none"
+    tail_start = start_index + bytes_to_delete
+    if tail_start == file_size:
+        file.truncate(start_index)
+        return "truncate"
+
+    if use_kernel:
+        capabilities = probe_delete_capabilities(file.name) if isinstance(file.name, str) else {"collapse_range" : False}
+        if capabilities["collapse_range"] and bytes_to_delete % capabilities["block_size"] == 0:
+            block_size = capabilities["block_size"]
+            collapse_start = -(-start_index // block_size) * block_size
+            head = collapse_start - start_index
+            if collapse_start + bytes_to_delete < file_size:
+                move_bytes_in_file(file, tail_start, start_index, head, bytearray(max(head, 1)), use_kernel=False)
+                if collapse_range_in_file(file, collapse_start, bytes_to_delete):
+                    return "collapse_range"
+
+    tail_length = file_size - tail_start
+    path = move_bytes_in_file(file, tail_start, start_index, tail_length, bytearray(min(chunk_size, tail_length)), use_kernel=use_kernel)
+    file.truncate(file_size - bytes_to_delete)
+    return path
+
+def merge_ranges(ranges : list[tuple[int,int]]) -> list[tuple[int,int]]:
+    """Sorts the given ranges and merges the overlapping or touching ones. Empty ranges are dropped.
+
+    Args:
+        ranges (list[tuple[int,int]]): (start, end) pairs, end is exclusive
 
-    # Calculate the next byte loss
-    written = len(given_bytes)
+    Returns:
+        list[tuple[int,int]]: Sorted and disjoint ranges
+    """
+    merged = []
+    for start, end in sorted(r for r in ranges if r[1] > r[0]):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def compact_ranges_in_file(file, ranges : list[tuple[int,int]], chunk_size : int = CHUNK_LIMIT, progress = None) -> int:
+    """Removes all the given ranges from the file in one forward pass. Every live segment between two ranges is moved
+    once to the left by the amount removed before it, then the file is truncated.
+
+    Args:
+        file: FileDescriptor, which is not closed by this function. (rb+)
+        ranges (list[tuple[int,int]]): (start, end) pairs to remove, end is exclusive. They are merged first.
+        chunk_size (int, optional): Size of the reusable buffer. Defaults to CHUNK_LIMIT.
+        progress (Callable[[int, int], None], optional): Called with (bytes moved so far, total bytes to move). Defaults to None.
+
+    Returns:
+        int: The amount of removed bytes
+    """
+    file.flush()
     file.seek(0, 2)
-    remaining = file.tell() - save_location
-    file.seek(save_location)
-    next_byte_loss = len(lost_chunk) - written
-
-    # If next byte loss is negative, handle edge cases
-    if next_byte_loss < 0:
-        if remaining == 0:
-            to_write = abs(next_byte_loss)
-            file.write(lost_chunk[:to_write])
-            return file
-        if next_byte_loss + save_location >= file_size:
-            file.write(lost_chunk)
-            return file
-        return file
-
-    # If lost chunk is empty, return file
-    if len(lost_chunk) == 0:
-        return file
-
-    # Recursively handle the next chunk
-    return override_bytes_in_file(file_path, lost_chunk, next_byte_loss, at_location=save_location, chunk_size=chunk_size, fd=file)
+    file_size = file.tell()
+    ranges = [(start, min(end, file_size)) for start, end in merge_ranges(ranges) if start < file_size]
+    if not ranges:
+        return 0
+
+    segments = []
+    removed = 0
+    for i, (start, end) in enumerate(ranges):
+        removed += end - start
+        segment_end = ranges[i+1][0] if i + 1 < len(ranges) else file_size
+        if segment_end > end:
+            segments.append((end, end - removed, segment_end - end))
+    total = sum(segment[2] for segment in segments)
+    moved = 0
+
+    def on_chunk(size : int):
+        nonlocal moved
+        moved += size
+        progress(moved, total)
+
+    buffer = bytearray(min(chunk_size, max((segment[2] for segment in segments), default=1)))
+    for source, destination, length in segments:
+        move_bytes_in_file(file, source, destination, length, buffer, progress=on_chunk if progress else None)
+    file.truncate(file_size - removed)
+    return removed
 
 def delete_bytes_from_file(file_path : str, bytes_to_delete : int, start_index : int, chunk_size : int = CHUNK_LIMIT, fd = None) -> int:
-    """Deletes bytes from the given spot in the file using recursion and inplace overwrite.
+    """Deletes bytes from the given spot in the file. The range is collapsed inside the kernel when the filesystem supports it,
+    otherwise the bytes after it are moved iteratively. See remove_range_from_file.
 
     Args:
         file_path (str): The location of the file
         bytes_to_delete (int): Amount of bytes to delete
         start_index (int): The location of the index to start the deletion from
-        chunk_size (int, optional): The Size of the chunk to read during every iteration. Defaults to CHUNK_LIMIT and must not be < bytes_to_delete.
+        chunk_size (int, optional): The Size of the chunk to read during every iteration. Defaults to CHUNK_LIMIT.
         fd: FileDescriptor. It is given to reduce file opening overhead. Must be closed if given by the caller (rb+)
 
     Returns:
@@ -382,51 +855,15 @@ def delete_bytes_from_file(file_path : str, bytes_to_delete : int, start_index :
     else:
         file = open(file_path, "rb+")
 
-    if chunk_size < bytes_to_delete:
-        chunk_size = bytes_to_delete
-
-    init_chunk_start = start_index
-    init_chunk_end = start_index+bytes_to_delete
-
-    file.seek(0,2)
-    init_size = file.tell()
-    lst = []
-
-    # Locations of next chunks
-    file.seek(init_chunk_end)
-
-    while True:
-        from_idx = file.tell()
-        to_idx   = file.seek(from_idx+chunk_size)
-        tup = from_idx,to_idx
-        lst.append(tup)
-        if file.tell() >= init_size:
-            break
-
-    # Override
-    file.seek(init_chunk_start)
-    last_saved = init_chunk_start
-    for tup in lst:
-        from_idx = tup[0]
-        to_idx = tup[1]
-        size = to_idx - from_idx
-        file.seek(from_idx)
-        chunk = file.read(size)
-        file.seek(last_saved)
-        file.write(chunk)
-        last_saved = file.tell()
-
-    # Truncate extra
+    remove_range_from_file(file, start_index, bytes_to_delete, chunk_size)
     file.seek(0, 2)
-    cur = file.tell()
-    file.seek(cur-bytes_to_delete)
-    ans = file.truncate()
+    ans = file.tell()
     if not fd:
         file.close()
     return ans
 
 def delete_footer_and_hint(file_path : str, footer_start_index : int):
-    """Deletes the footer including the MAGIC and the hint associated with the vault
+    """Deletes the footer including the MAGIC, the hint and the superblock trailer associated with the vault
 
     Args:
         file_path (str): The location of the vault
@@ -435,18 +872,37 @@ def delete_footer_and_hint(file_path : str, footer_start_index : int):
     the_size = get_file_size(file_path)
     to_remove = the_size - (footer_start_index - len(MAGIC_LOG_START))
     remove_bytes_from_ending_of_file(file_path, to_remove)
+    update_superblock(file_path, {"footer_start" : -1, "footer_length" : -1, "hint_start" : -1, "hint_length" : -1})
 
-def add_footer_and_hint(file_path : str, footer_bytes : bytes, the_hint : str):
-    """Adds the encrypted footer into the vault path
+def add_footer_and_hint(file_path : str, footer_bytes : bytes, the_hint : str) -> tuple[bool,str,int,int]:
+    """Adds the encrypted footer, the hint and the superblock trailer into the vault path.
+    The superblock is updated before the append, so a failed append leaves pointers which do not verify.
 
     Args:
         file_path (str): The location of the vault
         footer_bytes (bytes): The encrypted footer
         the_hint (str): The hint
+
+    Returns:
+        tuple[bool,str,int,int]: Result of append_bytes_into_file
     """
+    hint = xor_magic(the_hint)
+    footer_start = get_file_size(file_path) + len(MAGIC_LOG_START)
+    fields = {
+        "footer_start"  : footer_start,
+        "footer_length" : len(footer_bytes),
+        "hint_start"    : footer_start + len(footer_bytes) + len(MAGIC_LOG_END),
+        "hint_length"   : len(hint)
+    }
+    if not update_superblock(file_path, fields):
+        fields.update(header_pointers_as_fields(find_header_pointers(file_path)))
+    superblock = read_superblock(file_path)
+    if superblock:
+        fields = superblock
     footer = add_magic_into_footer(footer_bytes)
-    footer += xor_magic(the_hint)
-    append_bytes_into_file(file_path, footer, create_file=False)
+    footer += hint
+    footer += form_superblock(fields, trailer=True)
+    return append_bytes_into_file(file_path, footer, create_file=False)
 
 def get_hint(file_path : str) -> str:
     """Gets the hint associated with Vault
@@ -459,12 +915,23 @@ def get_hint(file_path : str) -> str:
     """
     footer_end = xor_magic(MAGIC_LOG_END)
     fd = open(file_path, "rb")
-    loc = find_magic(file_path, footer_end, read_reverse=True, chunk_size=int(CHUNK_LIMIT/10), fd=fd)
+    superblock = get_superblock(file_path, fd=fd)
+    if superblock and superblock["hint_length"] >= 0 and is_magic_at(fd, superblock["hint_start"] - len(footer_end), footer_end):
+        fd.seek(superblock["hint_start"])
+        hint = fd.read(superblock["hint_length"])
+        fd.close()
+        return xor_magic(hint.decode()).decode()
+
+    loc = find_magics(file_path, [footer_end], read_reverse=True, chunk_size=int(CHUNK_LIMIT/10), fd=fd)[0]
     if loc == -1:
         fd.close()
         return "No Hint Detected"
+    fd.seek(0, 2)
+    hint_end = fd.tell()
+    if read_superblock(file_path, from_trailer=True, fd=fd):
+        hint_end -= SUPERBLOCK_SIZE
     fd.seek(loc)
-    hint = fd.read(32)
+    hint = fd.read(max(min(32, hint_end - loc), 0))
     fd.close()
     return xor_magic(hint.decode()).decode()
 
@@ -0,0 +1,232 @@
+from crypto.utils import xor_magic, calc_easy_checksum
+from utils.constants import MAGIC_SUPERBLOCK, MAGIC_SUPERBLOCK_TRAILER, MAGIC_HEADER_START, MAGIC_HEADER_PAD, \
+    SUPERBLOCK_KEYS, SUPERBLOCK_SIZE, SUPERBLOCK_VERSION, VAULT_LAYOUT_TAIL
+
+import struct
+
+# Layout: magic(8) | version(u32) | field count(u32) | fields(i64 each) | reserved zeros | checksum(u32)
+SUPERBLOCK_PREFIX = "<II"
+SUPERBLOCK_FIELD = "<q"
+
+
+def form_superblock(fields : dict = None, trailer : bool = False) -> bytes:
+    """Forms the superblock bytes from the given fields. Missing fields are stored as -1 which means unknown.
+
+    Args:
+        fields (dict, optional): Dict with keys from SUPERBLOCK_KEYS. Defaults to None which creates an empty superblock.
+        trailer (bool, optional): Whether to form the mirrored trailer which lives at the end of the vault. Defaults to False.
+
+    Returns:
+        bytes: The superblock which is exactly SUPERBLOCK_SIZE long
+    """
+    if not fields:
+        fields = {}
+    magic = xor_magic(MAGIC_SUPERBLOCK_TRAILER) if trailer else xor_magic(MAGIC_SUPERBLOCK)
+    block = magic + struct.pack(SUPERBLOCK_PREFIX, SUPERBLOCK_VERSION, len(SUPERBLOCK_KEYS))
+    for key in SUPERBLOCK_KEYS:
+        block += struct.pack(SUPERBLOCK_FIELD, fields.get(key, -1))
+    block += b'\0' * (SUPERBLOCK_SIZE - 4 - len(block))
+    return block + struct.pack(">L", calc_easy_checksum(block))
+
+def parse_superblock(block : bytes, trailer : bool = False) -> dict:
+    """Parses the given superblock bytes.
+
+    Args:
+        block (bytes): The bytes read from the vault
+        trailer (bool, optional): Whether the bytes belong to the trailer. Defaults to False.
+
+    Returns:
+        dict: The fields of the superblock, with the extra key 'version'. Empty dict if the block is not a valid superblock.
+    """
+    magic = xor_magic(MAGIC_SUPERBLOCK_TRAILER) if trailer else xor_magic(MAGIC_SUPERBLOCK)
+    if len(block) != SUPERBLOCK_SIZE or not block.startswith(magic):
+        return {}
+    if struct.unpack(">L", block[-4:])[0] != calc_easy_checksum(block[:-4]):
+        return {}
+    version, field_count = struct.unpack_from(SUPERBLOCK_PREFIX, block, len(magic))
+    offset = len(magic) + struct.calcsize(SUPERBLOCK_PREFIX)
+    if offset + field_count * struct.calcsize(SUPERBLOCK_FIELD) > SUPERBLOCK_SIZE - 4:
+        return {}
+    result = {"version": version}
+    for i, key in enumerate(SUPERBLOCK_KEYS):
+        if i < field_count:
+            result[key] = struct.unpack_from(SUPERBLOCK_FIELD, block, offset + i * struct.calcsize(SUPERBLOCK_FIELD))[0]
+        else:
+            result[key] = -1
+    return result
+
+def read_superblock(vault_path : str, from_trailer : bool = False, fd = None) -> dict:
+    """Reads the superblock at offset 0 or the trailer at the end of the vault. Costs a single seek.
+
+    Args:
+        vault_path (str): Location of the vault
+        from_trailer (bool, optional): Read the mirrored trailer instead. Defaults to False.
+        fd: FileDescriptor. It is given to reduce file opening overhead, and this function does not close it. (rb)
+
+    Returns:
+        dict: The superblock fields, empty dict if there is none.
+    """
+    try:
+        file = fd if fd else open(vault_path, "rb")
+    except OSError:
+        return {}
+    try:
+        file.seek(0, 2)
+        if file.tell() < SUPERBLOCK_SIZE:
+            return {}
+        if from_trailer:
+            file.seek(-SUPERBLOCK_SIZE, 2)
+        else:
+            file.seek(0)
+        return parse_superblock(file.read(SUPERBLOCK_SIZE), trailer=from_trailer)
+    except Exception:
+        return {}
+    finally:
+        if not fd:
+            file.close()
+
+def get_superblock(vault_path : str, fd = None) -> dict:
+    """Gets the superblock of the vault, preferring the one at offset 0 and falling back to the trailer.
+
+    Args:
+        vault_path (str): Location of the vault
+        fd: FileDescriptor. It is given to reduce file opening overhead, and this function does not close it. (rb)
+
+    Returns:
+        dict: The superblock fields with the extra key 'is_trailer', empty dict if the vault has neither.
+    """
+    superblock = read_superblock(vault_path, from_trailer=False, fd=fd)
+    if superblock:
+        superblock["is_trailer"] = False
+        return superblock
+    superblock = read_superblock(vault_path, from_trailer=True, fd=fd)
+    if superblock:
+        superblock["is_trailer"] = True
+    return superblock
+
+def update_superblock(vault_path : str, fields : dict, fd = None) -> bool:
+    """Updates the given fields of the superblock at offset 0. Vaults without a superblock are left untouched.
+
+    Args:
+        vault_path (str): Location of the vault
+        fields (dict): The fields to update, keys from SUPERBLOCK_KEYS
+        fd: FileDescriptor. It is given to reduce file opening overhead, and this function does not close it. (rb+)
+
+    Returns:
+        bool: True if the superblock got updated, False otherwise.
+    """
+    file = fd if fd else open(vault_path, "rb+")
+    try:
+        superblock = read_superblock(vault_path, fd=file)
+        if not superblock:
+            return False
+        superblock.update(fields)
+        file.seek(0)
+        file.write(form_superblock(superblock))
+        file.flush()
+        return True
+    finally:
+        if not fd:
+            file.close()
+
+def header_pointers_as_fields(pointers : list[int]) -> dict:
+    """Converts the result of find_header_pointers into superblock fields.
+
+    Args:
+        pointers (list[int]): [pad_length, header_length, header_start, header_pad, header_end] as magic locations
+
+    Returns:
+        dict: header_start, header_length, pad_start and pad_length as payload locations
+    """
+    return {
+        "header_start"  : pointers[2] + len(MAGIC_HEADER_START),
+        "header_length" : pointers[1],
+        "pad_start"     : pointers[3] + len(MAGIC_HEADER_PAD),
+        "pad_length"    : pointers[0],
+    }
+
+def kdf_as_fields(kdf : dict) -> dict:
+    """Converts the result of calibrate_kdf into superblock fields. The salt is stored as two signed halves.
+
+    Args:
+        kdf (dict): 'algorithm', 'cost' and a 16 bytes 'salt'
+
+    Returns:
+        dict: kdf_algorithm, kdf_cost, kdf_salt_high and kdf_salt_low
+    """
+    high, low = struct.unpack(">qq", kdf["salt"])
+    return {
+        "kdf_algorithm" : kdf["algorithm"],
+        "kdf_cost"      : kdf["cost"],
+        "kdf_salt_high" : high,
+        "kdf_salt_low"  : low,
+    }
+
+def kdf_from_fields(superblock : dict) -> dict:
+    """Gets the KDF the vault derives its keys from the password with.
+
+    Args:
+        superblock (dict): Result of get_superblock or read_superblock
+
+    Returns:
+        dict: 'algorithm', 'cost' and 'salt'. Empty for vaults which do not record one, those use generate_aes_key as is.
+    """
+    if superblock.get("kdf_algorithm", -1) < 0:
+        return {}
+    return {
+        "algorithm" : superblock["kdf_algorithm"],
+        "cost"      : superblock["kdf_cost"],
+        "salt"      : struct.pack(">qq", superblock["kdf_salt_high"], superblock["kdf_salt_low"]),
+    }
+
+def is_tail_layout(superblock : dict) -> bool:
+    """Checks whether the vault keeps its header in the A/B slots after the data.
+
+    Args:
+        superblock (dict): Result of get_superblock or read_superblock
+
+    Returns:
+        bool: True for VAULT_LAYOUT_TAIL, False for the header in front of the data or no superblock at all.
+    """
+    return superblock.get("layout", -1) == VAULT_LAYOUT_TAIL
+
+def get_header_slots(superblock : dict) -> list[tuple[int,int]]:
+    """Gets the header slots of a tail layout vault.
+
+    Args:
+        superblock (dict): Result of get_superblock or read_superblock
+
+    Returns:
+        list[tuple[int,int]]: (start, length) of slot A and slot B, start is -1 for a slot never written. Empty for other layouts.
+    """
+    if not is_tail_layout(superblock):
+        return []
+    return [(superblock["slot_a_start"], superblock["slot_a_length"]), (superblock["slot_b_start"], superblock["slot_b_length"])]
+
+def shift_header_slots(vault_path : str, shift_for, fd = None) -> bool:
+    """Moves the header slots of a tail layout vault after the data in front of them got shifted.
+
+    Args:
+        vault_path (str): Location of the vault
+        shift_for (Callable[[int], int]): Returns by how much the slot starting at the given index moved, negative to the left.
+        fd: FileDescriptor. It is given to reduce file opening overhead, and this function does not close it. (rb+)
+
+    Returns:
+        bool: True if the superblock got updated, False if the vault has no header slots.
+    """
+    superblock = read_superblock(vault_path, fd=fd)
+    if not is_tail_layout(superblock):
+        return False
+    fields = {}
+    for key in ["slot_a", "slot_b"]:
+        start = superblock[f"{key}_start"]
+        if start < 0:
+            continue
+        shift = shift_for(start)
+        fields[f"{key}_start"] = start + shift
+        if superblock["current_slot"] in (0, 1) and ["slot_a", "slot_b"][superblock["current_slot"]] == key:
+            fields["header_start"] = superblock["header_start"] + shift
+            fields["pad_start"] = superblock["pad_start"] + shift
+    if not fields:
+        return False
+    return update_superblock(vault_path, fields, fd=fd)
@@ -0,0 +1,239 @@
+from file_handle.file_io import override_bytes_in_file
+from utils.extractors import get_file_from_vault, map_file_from_vault
+from custom_exceptions.classes_exceptions import FileError
+from utils.constants import CHUNK_LIMIT
+
+from contextlib import contextmanager
+
+import os
+import threading
+
+
+class VaultFile:
+    """Session over the vault on disk. Owns a single unbuffered rb+ descriptor while the vault is open and tracks its size
+    in memory, so appends, reads and truncations skip the open, stat and location checks of the path based helpers.
+    Calls are serialized by a lock since windows and threads share the session.
+    Anything which changes the vault through its path instead must call refresh_size afterwards.
+    """
+    def __init__(self, vault_path : str):
+        self.__path = vault_path
+        self.__file = open(vault_path, "rb+", buffering=0)
+        self.__size = os.fstat(self.__file.fileno()).st_size
+        self.__lock = threading.RLock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_path(self) -> str:
+        return self.__path
+
+    def get_fd(self):
+        """Returns the descriptor for helpers which take an fd. The caller must hold get_lock while using it.
+
+        Returns:
+            FileDescriptor: Unbuffered (rb+), closed only by close
+        """
+        return self.__file
+
+    def get_lock(self) -> threading.RLock:
+        return self.__lock
+
+    def get_size(self) -> int:
+        """Returns the tracked size of the vault, without asking the disk
+
+        Returns:
+            int: Size in bytes
+        """
+        return self.__size
+
+    def refresh_size(self) -> int:
+        """Reads the size from the disk again, after the vault got changed outside of this session
+
+        Returns:
+            int: Size in bytes
+        """
+        with self.__lock:
+            self.__size = os.fstat(self.__file.fileno()).st_size
+            return self.__size
+
+    def is_closed(self) -> bool:
+        return self.__file.closed
+
+    def __write_all(self, the_bytes : bytes) -> int:
+        """Writes every byte, the raw descriptor may write less than asked per call.
+
+        Returns:
+            int: Amount of written bytes
+        """
+        view = memoryview(the_bytes)
+        written = 0
+        while written < len(view):
+            res = self.__file.write(view[written:])
+            if not res:
+                break
+            written += res
+        return written
+
+    def append(self, the_bytes : bytes) -> tuple[bool,str,int,int]:
+        """Appends the bytes at the end of the vault.
+
+        Args:
+            the_bytes (bytes): Bytes which are already encrypted and serialized
+
+        Returns:
+            tuple[bool,str,int,int]: [0] represents True upon success, False otherwise.
+            [1] is if any error raised.
+            [2] is the vault size before append.
+            [3] is the vault size after append.
+        """
+        with self.__lock:
+            init_size = self.__size
+            try:
+                self.__file.seek(init_size)
+                written_bytes = self.__write_all(the_bytes)
+                self.__size = init_size + written_bytes
+                if written_bytes != len(the_bytes):
+                    raise FileError(f"Appending Failure. Total bytes to add: {len(the_bytes)}, appended: {written_bytes}")
+                return (True, "", init_size, self.__size)
+            except FileError as e:
+                return (False, e.message, init_size, self.__size)
+            except Exception as e:
+                self.refresh_size()
+                return (False, e.__str__(), init_size, self.__size)
+
+    def write_at(self, the_bytes : bytes, at_location : int) -> tuple[bool,str,int,int]:
+        """Writes the bytes over the given location without shifting anything, e.g, into a free extent.
+
+        Args:
+            the_bytes (bytes): Bytes which are already encrypted and serialized
+            at_location (int): Index to start writing at, must be inside the vault
+
+        Returns:
+            tuple[bool,str,int,int]: [0] represents True upon success, False otherwise.
+            [1] is if any error raised.
+            [2] is the start index of the written bytes.
+            [3] is the end index of the written bytes.
+        """
+        with self.__lock:
+            try:
+                if at_location < 0 or at_location > self.__size:
+                    raise FileError(f"Cannot write at {at_location} of {self.__path} which has size of '{self.__size}'")
+                self.__file.seek(at_location)
+                written_bytes = self.__write_all(the_bytes)
+                self.__size = max(self.__size, at_location + written_bytes)
+                if written_bytes != len(the_bytes):
+                    raise FileError(f"Writing Failure. Total bytes to write: {len(the_bytes)}, written: {written_bytes}")
+                return (True, "", at_location, at_location + written_bytes)
+            except FileError as e:
+                return (False, e.message, at_location, at_location)
+            except Exception as e:
+                return (False, e.__str__(), at_location, at_location)
+
+    def read(self, starting_byte : int, ending_byte : int, chunk_size : int = CHUNK_LIMIT) -> bytearray:
+        """Reads the given range of the vault into a single preallocated buffer, see get_file_from_vault.
+
+        Args:
+            starting_byte (int): Start index
+            ending_byte (int): End index
+            chunk_size (int, optional): Maximum amount of bytes per read call. Defaults to CHUNK_LIMIT.
+
+        Returns:
+            bytearray: The bytes, shorter than asked if the vault ended before ending_byte
+        """
+        with self.__lock:
+            return get_file_from_vault(self.__path, starting_byte, ending_byte, chunk_size, fd=self.__file)
+
+    def read_chunks(self, starting_byte : int, ending_byte : int, chunk_size : int = CHUNK_LIMIT):
+        """Reads the given range piece by piece. The session is locked around each read only and released before the piece
+        is yielded, so a slow or abandoned iteration never blocks the other windows.
+
+        Args:
+            starting_byte (int): Start index
+            ending_byte (int): End index
+            chunk_size (int, optional): Size of each piece. Defaults to CHUNK_LIMIT.
+
+        Yields:
+            bytes: The next piece, the last one is shorter. Stops early if the vault ended before ending_byte.
+        """
+        position = starting_byte
+        while position < ending_byte:
+            with self.__lock:
+                self.__file.seek(position)
+                piece = self.__file.read(min(chunk_size, ending_byte - position))
+            if not piece:
+                break
+            position += len(piece)
+            yield piece
+
+    @contextmanager
+    def map(self, starting_byte : int, ending_byte : int):
+        """Maps the given range of the vault read-only, see map_file_from_vault. The session is locked while the view is
+        in use, so nothing truncates the vault under it.
+
+        Args:
+            starting_byte (int): Start index
+            ending_byte (int): End index
+
+        Yields:
+            memoryview: The bytes, slices of it must not outlive the block
+        """
+        with self.__lock:
+            with map_file_from_vault(self.__path, starting_byte, ending_byte, fd=self.__file) as view:
+                yield view
+
+    def shift(self, given_bytes : bytes, byte_loss : int, at_location : int) -> None:
+        """Writes the given bytes at the location, shifting whatever comes after by byte_loss. See override_bytes_in_file.
+
+        Args:
+            given_bytes (bytes): The bytes to add
+            byte_loss (int): The amount of bytes to shift the rest of the vault by
+            at_location (int): Index location to start addition from
+        """
+        with self.__lock:
+            override_bytes_in_file(self.__path, given_bytes, byte_loss, at_location=at_location, fd=self.__file)
+            self.__size = os.fstat(self.__file.fileno()).st_size
+
+    def truncate(self, size : int) -> int:
+        """Truncates the vault to the given size.
+
+        Args:
+            size (int): The new size, must not be bigger than the current one
+
+        Returns:
+            int: The size after truncation, -1 if the size is not valid
+        """
+        with self.__lock:
+            if size < 0 or size > self.__size:
+                return -1
+            self.__size = self.__file.truncate(size)
+            return self.__size
+
+    def rollback(self, old_size : int) -> int:
+        """Removes anything appended after the vault had the given size, e.g, after append returned False.
+
+        Args:
+            old_size (int): Size of the vault before the append started
+
+        Returns:
+            int: The size of the vault after the rollback, -1 if old_size is not a valid size to go back to.
+        """
+        with self.__lock:
+            if old_size <= 0:
+                return -1
+            if self.__size <= old_size:
+                return self.__size
+            return self.truncate(old_size)
+
+    def sync(self) -> None:
+        """Forces the written bytes onto the disk.
+        """
+        with self.__lock:
+            os.fsync(self.__file.fileno())
+
+    def close(self) -> None:
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.close()
@@ -9,14 +9,17 @@ from gui.custom_widgets.custom_progressbar import CustomProgressBar
 from gui.custom_widgets.custom_messagebox import CustomMessageBox
 
 from logger.logging import Logger
-from file_handle.file_io import append_bytes_into_file, add_magic_into_header, header_padder, add_magic_into_footer
+from file_handle.file_io import append_bytes_into_file, add_magic_into_header, header_padder, add_footer_and_hint, find_header_pointers, \
+    commit_header_into_slot
+from file_handle.superblock import form_superblock, update_superblock, header_pointers_as_fields, kdf_as_fields
 
-from utils.constants import VAULT_CREATION_KEYS , ICON_8, ICON_3, ICON_5, MINIMUM_WINDOW_WIDTH, MINIMUM_WINDOW_HEIGHT, VAULT_BUFFER_LIMIT
-from utils.serialization import serialize_dict, formulate_header, formulate_footer
+from utils.constants import VAULT_CREATION_KEYS , ICON_8, ICON_3, ICON_5, MINIMUM_WINDOW_WIDTH, MINIMUM_WINDOW_HEIGHT, VAULT_BUFFER_LIMIT, \
+    NEW_VAULT_LAYOUT, VAULT_LAYOUT_TAIL
+from utils.serialization import serialize_dict, serialize_header, formulate_header, formulate_footer
 from utils.helpers import is_proper_extension, is_location_ok
 from utils.parsers import parse_file_name
 
-from crypto.utils import is_password_strong, xor_magic, to_base64
+from crypto.utils import is_password_strong, to_base64, calibrate_kdf, derive_master_key
 from crypto.encryptors import encrypt_header, encrypt_footer, generate_password_token
 
 
@@ -224,11 +227,16 @@ class VaultCreateWindow(QMainWindow):
         # Header
         data = self.__collect_header_data()
         vault = f"{data['Vault Name']}{data['Vault Extension']}"
-        header = serialize_dict(formulate_header(data["Vault Name"] , data["Vault Extension"]))
-        header = encrypt_header(data["Password"], header)
-        header = add_magic_into_header(header)
+        header = serialize_header(formulate_header(data["Vault Name"] , data["Vault Extension"]))
+        # The KDF costs about KDF_TARGET_TIME on this machine, the header and footer are keyed by the master key it derives
+        kdf = calibrate_kdf()
+        vault_secret = derive_master_key(data["Password"], kdf["salt"], kdf)
+        header = encrypt_header(vault_secret, header)
+        first_bytes = form_superblock({"layout" : NEW_VAULT_LAYOUT, **kdf_as_fields(kdf)})
+        if NEW_VAULT_LAYOUT != VAULT_LAYOUT_TAIL:
+            first_bytes += add_magic_into_header(header)
         self.progress_bar.setValue(30)
-        result = append_bytes_into_file(file_path=data['Vault Location'], the_bytes=header,create_file=True, file_name=vault)
+        result = append_bytes_into_file(file_path=data['Vault Location'], the_bytes=first_bytes,create_file=True, file_name=vault)
         if not result[0]:
             QMessageBox.warning(self, "Couldn't create vault", f"Reason: {result[1]}")
             self.progress_bar.setVisible(False)
@@ -236,14 +244,20 @@ class VaultCreateWindow(QMainWindow):
             return
         self.progress_bar.setValue(60)
 
-        # Footer + Hint
+        # Header slot, or padding for a header in front of the data
+        if NEW_VAULT_LAYOUT == VAULT_LAYOUT_TAIL:
+            commit_header_into_slot(f"{data['Vault Location']}/{vault}", header)
+        else:
+            header_padder(file_path=f"{data['Vault Location']}/{vault}", amount_to_pad=VAULT_BUFFER_LIMIT) # buffer size
+            update_superblock(f"{data['Vault Location']}/{vault}", header_pointers_as_fields(find_header_pointers(f"{data['Vault Location']}/{vault}")))
+
+        # Footer + Hint + Superblock trailer
         footer = formulate_footer()
         first_log = Logger.form_log_message(f'Vault {vault} created!\n')
         footer["session_log"] += first_log
         footer = serialize_dict(footer)
-        footer = encrypt_footer(data["Password"], footer)
-        footer = add_magic_into_footer(footer) + xor_magic(data['Password Hint'])
-        result = append_bytes_into_file(file_path=f"{data['Vault Location']}/{vault}", the_bytes=footer, create_file=False)
+        footer = encrypt_footer(vault_secret, footer)
+        result = add_footer_and_hint(f"{data['Vault Location']}/{vault}", footer, data['Password Hint'])
         if not result[0]:
             QMessageBox.warning(self, "Couldn't finish creating the vault", f"Reason: {result[1]}")
             self.progress_bar.setVisible(False)
@@ -251,9 +265,6 @@ class VaultCreateWindow(QMainWindow):
             return
         self.progress_bar.setValue(90)
 
-        # Padding
-        header_padder(file_path=f"{data['Vault Location']}/{vault}", amount_to_pad=VAULT_BUFFER_LIMIT) # buffer size
-
         # Tokens
         location_for_tokens = data["Vault Location"]
 
@@ -4,7 +4,7 @@ from PyQt6.QtGui import QIcon
 
 from utils.constants import ICON_1, ICON_2, ICON_3, ICON_4, ICON_6, ICON_7, ICON_16, MINIMUM_WINDOW_HEIGHT, MINIMUM_WINDOW_WIDTH
 from utils.helpers import is_proper_extension
-from crypto.decryptors import decrypt_header, decrypt_footer, resolve_token
+from crypto.decryptors import decrypt_header, decrypt_footer, resolve_token, get_vault_secret
 from crypto.utils import from_base64
 from file_handle.file_io import get_hint
 
@@ -336,8 +336,9 @@ class VaultSearchWindow(QMainWindow):
         try:
             if is_token:
                 the_password = resolve_token(from_base64(the_password))
-            actual_header = decrypt_header(vault_loc,the_password)
-            actual_footer = decrypt_footer(vault_loc,the_password)
+            vault_secret = get_vault_secret(vault_loc, the_password)  # The only KDF run of the unlock
+            actual_header = decrypt_header(vault_loc,the_password,vault_secret)
+            actual_footer = decrypt_footer(vault_loc,the_password,vault_secret)
         except MagicFailure as e:
             self.__failed_attempts+=1
             message_signal.emit(f'Corrupted Vault#{Logger.form_log_message(e, "ERROR")}#Error')
@@ -350,6 +351,7 @@ class VaultSearchWindow(QMainWindow):
         self.__view_manager.set_special_s(actual_footer[0])
         self.__view_manager.set_special_f(actual_footer[1])
         self.__view_manager.set_special_p(the_password)
+        self.__view_manager.set_special_k(vault_secret if isinstance(vault_secret, bytes) else None)
         self.__view_manager.set_vault_pointer(vault_loc)
         self.__view_manager.signal_to_open_window.emit("VaultView")
         return
@@ -3,10 +3,10 @@ from PyQt6.QtGui import QIcon
 from PyQt6.QtCore import pyqtSignal
 
 from utils.constants import ICON_1, ICON_6, ICON_9, ICON_11, ICON_10, ICON_7, ICON_12, ICON_13, NOTE_LIMIT, MINIMUM_WINDOW_WIDTH, MINIMUM_WINDOW_HEIGHT
-from utils.parsers import parse_directory_string
-from utils.extractors import get_file_from_vault
+from utils.parsers import parse_directory_string, parse_size_to_string
 from crypto.utils import get_checksum
-from file_handle.file_io import append_bytes_into_file, stabilize_after_failed_append, get_hint, add_footer_and_hint, remove_bytes_from_ending_of_file, get_file_size
+from file_handle.file_io import append_bytes_into_file, get_hint, add_footer_and_hint
+from file_handle.vault_file import VaultFile
 
 from classes.vault import Vault
 from classes.note import Note
@@ -14,6 +14,8 @@ from classes.file import File
 from classes.directory import Directory
 from custom_exceptions.classes_exceptions import MissingKeyInJson, JsonWithInvalidData
 from logger.logging import Logger
+from threads.custom_thread import CustomThread, Worker
+from threads.mutable_boolean import MutableBoolean
 
 from gui.custom_widgets.custom_tree_widget import CustomTreeWidget
 from gui.custom_widgets.custom_tree_item import CustomQTreeWidgetItem
@@ -35,7 +37,7 @@ class VaultViewWindow(QMainWindow):
     signal_popup_warn = pyqtSignal(str)
 
     # Settings of the vault, to change password, view vault details, get logs, decrypt vault entirely.
-    def __init__(self, header : bytes, footer : bytes, footer_start : int, password : str, vault_path : str):
+    def __init__(self, header : bytes, footer : bytes, footer_start : int, password : str, vault_path : str, master_key : bytes = None):
         """VaultViewWindow
 
         Args:
@@ -44,15 +46,18 @@ class VaultViewWindow(QMainWindow):
             footer_start (int): Location of where the footer starts after the magic bytes.
             password (str): The given password, Non Encryted
             vault_path (str): The location of the Vault
+            master_key (bytes, optional): The master key VaultSearch derived while unlocking. Defaults to None which derives it here.
         """
         super().__init__()
 
         # Window Data
         self.logger = Logger(self.signal_popup_error, self.signal_popup_warn)
         self.threads = []
+        self.__compaction_is_running = MutableBoolean(False)
+        self.__close_after_compaction = False
 
         # Vault Header
-        self.__vault = Vault(password, vault_path)
+        self.__vault = Vault(password, vault_path, master_key)
         try:
             self.__vault.set_header(self.__vault.validate_header(header))
         except (MissingKeyInJson, JsonWithInvalidData) as e:
@@ -70,6 +75,11 @@ class VaultViewWindow(QMainWindow):
             self.__vault.request_footer_and_hint_delete(footer_start)
         except (MissingKeyInJson, JsonWithInvalidData) as e:
             self.logger.error(f"The Vault did not contain a footer! All saved logs were deleted. {e.message}")
+        # Replay whatever an unfinished session journaled, then journal this session
+        replayed = self.__vault.open_journal()
+        if replayed > 0:
+            self.logger.attention(f"Recovered {replayed} journal entries of a session which did not close properly")
+        self.__vault.get_master_key() # Pay the KDF of the session once, while unlocking
         self.logger.warn_signal.connect(self.open_popup_window)
         self.logger.error_signal.connect(self.open_popup_window)
 
@@ -141,7 +151,7 @@ class VaultViewWindow(QMainWindow):
 
         # Tree widget -> vertical_div
         self.tree_widget = CustomTreeWidget(parent=self.centralwidget, vaultview=True, vaultpath=self.__vault.get_vault_path(),
-                                           header_map=self.__vault.get_map())
+                                           header_map=self.__vault.get_map(), items_under=self.__vault.get_items_under_id)
         self.tree_widget.populate_from_header(self.__vault.get_map(), 0, self.__vault.get_vault_path())
         self.tree_widget.updated_signal.connect(self.address_bar.setText)
         self.vertical_div.addWidget(self.tree_widget)
@@ -390,6 +400,17 @@ class VaultViewWindow(QMainWindow):
         """
         return self.__vault.get_password()
 
+    def request_file_secret(self, key_version : int) -> str | bytes:
+        """Returns what files of the given key version are encrypted with inside the vault, see Vault.get_file_secret.
+
+        Args:
+            key_version (int): FILE_KEY_PASSWORD, FILE_KEY_MASTER or FILE_KEY_DATA
+
+        Returns:
+            str | bytes: The password of the vault, the master key of the session, or the data key of the vault
+        """
+        return self.__vault.get_file_secret(key_version)
+
     def request_vault_path(self) -> str:
         """Returns the location of the vault.
 
@@ -398,6 +419,14 @@ class VaultViewWindow(QMainWindow):
         """
         return self.__vault.get_vault_path()
 
+    def request_vault_file(self) -> VaultFile:
+        """Returns the session over the vault on disk, shared by every window while the vault is open.
+
+        Returns:
+            VaultFile: The open session
+        """
+        return self.__vault.get_vault_file()
+
     def request_new_id(self , for_what : str) -> int:
         """Requests the vault to get a new ID and adds it into the vault
 
@@ -418,7 +447,7 @@ class VaultViewWindow(QMainWindow):
         return self.__vault.get_vault_size()
 
     def request_header_refresh(self, refresh_tree : bool = False): # Called by add_file_window or delete
-        """Refreshes the header of the vault, and updates the vault on disk
+        """Refreshes the header of the vault, and commits it through the journal. The header itself is rewritten once enough changed.
 
         Args:
             refresh_tree (bool, optional): Boolean to indicate whether to refresh the tree. Defaults to False.
@@ -426,7 +455,15 @@ class VaultViewWindow(QMainWindow):
         self.__vault.refresh_header()
         if refresh_tree:
             self.tree_widget.populate_from_header(self.__vault.get_map(), self.tree_widget.current_path, self.__vault.get_vault_path())
-        self.__vault.update_vault_file()
+        self.__vault.commit()
+
+    def request_append_intent(self) -> int:
+        """Journals that bytes are about to be appended to the vault, so a crash before the next commit rolls them back
+
+        Returns:
+            int: Size of the vault before the append
+        """
+        return self.__vault.record_append()
 
     def request_file_id_addition_into_folder(self, folder_id : int , file_id : int):
         """Adds the given file id into the folder
@@ -478,6 +515,91 @@ class VaultViewWindow(QMainWindow):
             return
         self.__vault.data_index_shifter(amount_to_shift, direction, at_index)
 
+    def request_data_remap(self, removed_ranges : list[tuple[int,int]]):
+        """Moves all the byte indexes in the map to the left by the bytes removed before them, after a batched delete
+
+        Args:
+            removed_ranges (list[tuple[int,int]]): Sorted and disjoint (start, end) ranges which got removed
+        """
+        if len(removed_ranges) == 0:
+            return
+        self.__vault.data_index_remap(removed_ranges)
+
+    def request_free_extents(self, ranges : list[tuple[int,int]]):
+        """Marks the given ranges of the vault as free, they are reused by new items or reclaimed by the next compaction.
+        A free tail is truncated right away.
+
+        Args:
+            ranges (list[tuple[int,int]]): (start, end) ranges of the deleted items
+        """
+        self.__vault.mark_extents_free(ranges)
+        self.__vault.truncate_free_tail()
+
+    def request_extent_allocation(self, size : int) -> int:
+        """Reserves a free extent of the vault for new bytes
+
+        Args:
+            size (int): Amount of bytes to place
+
+        Returns:
+            int: Start of the reserved range, -1 if the bytes must be appended instead
+        """
+        return self.__vault.allocate_extent(size)
+
+    def request_compaction(self, extra_ranges : list[tuple[int,int]] = None, progress = None) -> int:
+        """Compacts the vault right away, together with the given ranges. Should be called by a thread.
+
+        Args:
+            extra_ranges (list[tuple[int,int]], optional): Ranges of items which were just removed from the map. Defaults to None.
+            progress (Callable[[int, int], None], optional): Called with (bytes moved so far, total bytes to move)
+
+        Returns:
+            int: The amount of reclaimed bytes
+        """
+        return self.__vault.compact(extra_ranges, progress)
+
+    def request_compaction_if_needed(self):
+        """Starts a background compaction if the free extents passed the compaction ratio of the vault
+        """
+        if self.__vault.needs_compaction():
+            self.start_compaction()
+
+    def start_compaction(self):
+        """Compacts the vault in a thread. Adding, extracting and deleting is disabled until it is done.
+        """
+        if self.__compaction_is_running.get_value() or self.__vault.get_free_size() == 0:
+            return
+        self.__compaction_is_running.set_value(True)
+        self.add_to_vault_button.setDisabled(True)
+        self.extract_from_vault_button.setDisabled(True)
+        self.delete_from_vault_button.setDisabled(True)
+
+        thread = CustomThread(3600, self.start_compaction.__name__)
+        self.threads.append(thread)
+        worker = Worker(self.__vault.compact)
+        worker.moveToThread(thread)
+        thread.started.connect(worker.run)
+
+        def __end_worker_activity(emitted_result):
+            thread.stop_timer(emit_finish=False, emitted_result=emitted_result)
+            self.logger.attention(f"Compacted the vault, reclaimed {parse_size_to_string(emitted_result)}")
+            worker.deleteLater()
+        worker.finished.connect(__end_worker_activity)
+
+        def __end_thread_activity():
+            self.__compaction_is_running.set_value(False)
+            self.request_header_refresh(True)
+            self.add_to_vault_button.setEnabled(True)
+            self.extract_from_vault_button.setEnabled(True)
+            self.delete_from_vault_button.setEnabled(True)
+            thread.quit()
+            if self.__close_after_compaction:
+                self.close()    # The close which was deferred until the compaction is done
+        thread.timeout_signal.connect(__end_thread_activity)
+        thread.finished.connect(thread.deleteLater)
+        self.__compaction_worker = worker
+        thread.start()
+
     def request_files_and_folders_from_vault(self, belong_to: int) -> list:
         """Gets a list of Files and Directories which belong to the given id
 
@@ -567,11 +689,20 @@ class VaultViewWindow(QMainWindow):
         file_bytes = None
         with open (file_loc, "rb") as f:
             file_bytes = f.read()
-        res = append_bytes_into_file(self.__vault.get_vault_path(), file_bytes)
+        hole_start = self.request_extent_allocation(len(file_bytes))
+        if hole_start != -1:
+            res = self.__vault.get_vault_file().write_at(file_bytes, hole_start)
+        else:
+            old_size = self.request_append_intent()
+            res = self.__vault.get_vault_file().append(file_bytes)
+        if not res[0] and hole_start != -1:
+            self.request_free_extents([(hole_start, hole_start + len(file_bytes))])
+            self.logger.error(f"{res[1]}, could not write note {file_loc} into the vault.")
+            self.show_message("Error", "Couldn't add a note note. Check logs.", "Error" , parent=self)
+            return
         if not res[0]:
-            error_str = stabilize_after_failed_append(self.__vault.get_vault_path(), res[1], res[2], res[3]-res[2])
-            error_str += f", could not append note {file_loc} into the vault."
-            self.logger.error(error_str)
+            after_removal = self.__vault.get_vault_file().rollback(old_size)
+            self.logger.error(f"{res[1]}, removal of appended bytes makes the vault size {after_removal}, could not append note {file_loc} into the vault.")
             self.show_message("Error", "Couldn't add a note note. Check logs.", "Error" , parent=self)
             return
         note_id = self.request_new_id("V")
@@ -581,7 +712,7 @@ class VaultViewWindow(QMainWindow):
             "loc_start" : res[2],
             "loc_end" : res[3],
             "type" : extension,
-            "checksum" : get_checksum(file_loc, is_file=True)
+            "checksum" : get_checksum(file_bytes, is_file=False)
         }
         the_note = Note(note_info)
         self.insert_item_into_vault(the_note.get_as_dict(), "V")
@@ -612,7 +743,7 @@ class VaultViewWindow(QMainWindow):
                 self.show_message("Error", msg, "Error", self)
             return
         note_name = f'{file_dict[1]["metadata"]["name"]}_note.{note_dict[1]["type"]}'
-        file_bytes = get_file_from_vault(self.__vault.get_vault_path(), note_dict[1]["loc_start"], note_dict[1]["loc_end"], NOTE_LIMIT)
+        file_bytes = self.__vault.get_vault_file().read(note_dict[1]["loc_start"], note_dict[1]["loc_end"], NOTE_LIMIT)
         res = append_bytes_into_file(file_loc, file_bytes, create_file=True, file_name=note_name)
         msg = f'{file_loc}{note_name}'
         msg_title = "Success"
@@ -691,11 +822,28 @@ class VaultViewWindow(QMainWindow):
     def closeEvent(self, event):
         """Override for close window for safe shutdown.
         """
-        # Clean any extra size:
-        last_track = self.__vault.get_last_related_idx()
-        cur_size = get_file_size(self.__vault.get_vault_path())
-        if last_track != 0 and last_track< cur_size:
-            remove_bytes_from_ending_of_file(self.__vault.get_vault_path(), cur_size-last_track-1)
+        if self.__compaction_is_running.get_value():
+            event.ignore()
+            if self.__close_after_compaction:
+                self.show_message("Compaction is running", "The vault is being compacted, it closes once that is done.")
+            else:
+                self.show_message("Compaction is running", "The vault is being compacted, cannot close this right now.")
+            return
+
+        # Free extents past the compaction ratio are reclaimed in the background first, the rest stay in the map for later
+        if not self.__close_after_compaction and self.__vault.needs_compaction():
+            self.__close_after_compaction = True
+            event.ignore()
+            self.start_compaction()
+            return
+
+        # Clean any extra size, free extents at the tail included, before the free extents left are committed
+        self.__vault.truncate_untracked_tail()
+
+        # Commit everything the journal holds
+        self.__vault.refresh_header()
+        self.__vault.close_journal()
+        self.__vault.close_vault_file()
 
         errors = self.logger.get_all_error_logs()
         for error in errors:
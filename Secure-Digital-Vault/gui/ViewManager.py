@@ -23,6 +23,7 @@ class ViewManager(QMainWindow):
         self.__data_f = None
         self.__data_s = 0
         self.__data_p = None
+        self.__data_k = None
         self.__vault_pointer = ""
         self.signal_to_open_window.connect(self.handle_window)
         # Manager Data
@@ -139,6 +140,9 @@ class ViewManager(QMainWindow):
     def set_special_p(self , data : bytes):
         self.__data_p = data
 
+    def set_special_k(self , data : bytes):
+        self.__data_k = data
+
     def set_vault_pointer(self, file_path : str):
         self.__vault_pointer = file_path
 
@@ -191,7 +195,8 @@ class ViewManager(QMainWindow):
 
     def __show_VaultView(self):
         if not self.__VaultView:
-            self.__VaultView = VaultViewWindow(self.__data_h, self.__data_f, self.__data_s, self.__data_p, self.__vault_pointer)
+            self.__VaultView = VaultViewWindow(self.__data_h, self.__data_f, self.__data_s, self.__data_p, self.__vault_pointer, self.__data_k)
+            self.__data_k = None
 
         # Corruption Handle
         if len(self.__VaultView.threads) != 0 and self.__VaultView.threads[0] == -1:
@@ -212,6 +217,7 @@ class ViewManager(QMainWindow):
         self.__data_h = None
         self.__data_f = None
         self.__data_p = None
+        self.__data_k = None
         self.__vault_pointer = ""
         for t in self.threads:
             t.exit()
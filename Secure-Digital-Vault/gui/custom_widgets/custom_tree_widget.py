@@ -27,7 +27,7 @@ class CustomTreeWidget(QTreeWidget):
     clicked_file_signal = pyqtSignal(object)
     marquee_signal = pyqtSignal()
 
-    def __init__(self, parent: QWidget, vaultview : bool = False , vaultpath : str = None, header_map : dict = None):
+    def __init__(self, parent: QWidget, vaultview : bool = False , vaultpath : str = None, header_map : dict = None, items_under = None):
         """
         Initialize the custom tree widget.
 
@@ -36,6 +36,7 @@ class CustomTreeWidget(QTreeWidget):
             vaultview (bool): boolean indicating that the tree widget is meant for VaultView
             vaultpath (str): location of the vault on the disk
             header_map(dict): the header_map dictionary
+            items_under (callable): returns the Directories and Files inside a folder id, e.g Vault.get_items_under_id. Without it the map is scanned
         """
         super().__init__(parent)
 
@@ -44,6 +45,7 @@ class CustomTreeWidget(QTreeWidget):
         self.vaultview = vaultview
         self.__vaultpath = vaultpath
         self.__header_map = header_map
+        self.__items_under = items_under
         self.current_path = 0
 
         self.headers=None
@@ -140,29 +142,41 @@ class CustomTreeWidget(QTreeWidget):
             self.clear()
             cleard_once = True
 
+        # Only the children of goto_dir are listed, through the vault's index when there is one
+        if self.__items_under is not None:
+            items = self.__items_under(goto_dir)
+        else:
+            items = [Directory(dir) for dir in header_map["directories"].values() if dir["path"] == goto_dir]
+            # The files of the map hold the ids of their extents, see Vault.resolve_file
+            locate = lambda extent_id: header_map.get("extents", {}).get(str(extent_id), [-1, -1])
+            for entry in header_map["files"].values():
+                if entry["path"] == goto_dir:
+                    (loc_start, loc_end), (icon_start, icon_end) = locate(entry["extent"]), locate(entry["metadata"].get("icon_extent", -1))
+                    items.append(File(dict(entry, loc_start=loc_start, loc_end=loc_end, icon_data_start=icon_start, icon_data_end=icon_end)))
+
         # Directories first which exist in goto_dir here
-        for dir in header_map["directories"].values():
-            if dir["path"] == goto_dir:
-
-                # Add upto button first
-                if not cleard_once:
-                    self.clear()
-                    cleard_once = True
-                    upper_level = CustomQTreeWidgetItem([".."])
-                    upper_level.set_path(Directory.determine_parent_by_id(current_id,header_map["directories"]))    # upper_level leads backwards
-                    icon = self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogToParent)
-                    upper_level.setText(1, "UpOneLevel")
-                    upper_level.setIcon(0, icon)
-                    self.addTopLevelItem(upper_level)
-
-                the_directory = Directory(dir)
-                icon = self.style().standardIcon(QStyle.StandardPixmap.SP_DirIcon)
-                directory_item = CustomQTreeWidgetItem([the_directory.get_name()])
-                directory_item.set_path(the_directory.get_id()) # the item must point to what's inside it.
-                directory_item.setIcon(0, icon)
-                directory_item.set_saved_obj(the_directory)
-                self.set_item_text(directory_item, the_directory)
-                self.addTopLevelItem(directory_item)
+        for the_directory in items:
+            if not isinstance(the_directory, Directory):
+                continue
+
+            # Add upto button first
+            if not cleard_once:
+                self.clear()
+                cleard_once = True
+                upper_level = CustomQTreeWidgetItem([".."])
+                upper_level.set_path(Directory.determine_parent_by_id(current_id,header_map["directories"]))    # upper_level leads backwards
+                icon = self.style().standardIcon(QStyle.StandardPixmap.SP_FileDialogToParent)
+                upper_level.setText(1, "UpOneLevel")
+                upper_level.setIcon(0, icon)
+                self.addTopLevelItem(upper_level)
+
+            icon = self.style().standardIcon(QStyle.StandardPixmap.SP_DirIcon)
+            directory_item = CustomQTreeWidgetItem([the_directory.get_name()])
+            directory_item.set_path(the_directory.get_id()) # the item must point to what's inside it.
+            directory_item.setIcon(0, icon)
+            directory_item.set_saved_obj(the_directory)
+            self.set_item_text(directory_item, the_directory)
+            self.addTopLevelItem(directory_item)
 
         # Case incase the directory does not have sub directories
         if not cleard_once:
@@ -179,17 +193,17 @@ class CustomTreeWidget(QTreeWidget):
 
         # Files second which exist in goto_path
         if not skip_files:
-            for entry in header_map["files"].values():
-                if entry["path"] == goto_dir:
-                    file = File(entry)
-                    item = CustomQTreeWidgetItem([file.get_metadata()["name"]])
-                    icon_bytes = get_file_from_vault(vault_path,file.get_metadata()["icon_data_start"],file.get_metadata()["icon_data_end"])
-                    icon = extract_icon_from_bytes(icon_bytes)
-                    item.set_path(file.get_path()) # the file item must point to where it is.
-                    item.setIcon(0, icon)
-                    item.set_saved_obj(file)
-                    self.set_item_text(item, file)
-                    self.addTopLevelItem(item)
+            for file in items:
+                if not isinstance(file, File):
+                    continue
+                item = CustomQTreeWidgetItem([file.get_metadata()["name"]])
+                icon_bytes = get_file_from_vault(vault_path,file.get_icon_data_start(),file.get_icon_data_end())
+                icon = extract_icon_from_bytes(icon_bytes)
+                item.set_path(file.get_path()) # the file item must point to where it is.
+                item.setIcon(0, icon)
+                item.set_saved_obj(file)
+                self.set_item_text(item, file)
+                self.addTopLevelItem(item)
         self.update_columns_with(TREE_COLUMNS)
         self.setCurrentItem(self.topLevelItem(0))
         return True
@@ -216,7 +230,7 @@ class CustomTreeWidget(QTreeWidget):
         for f in file_dicts:
             file = File(f)
             item = CustomQTreeWidgetItem([file.get_metadata()["name"]])
-            icon_bytes = get_file_from_vault(vault_path,file.get_metadata()["icon_data_start"],file.get_metadata()["icon_data_end"])
+            icon_bytes = get_file_from_vault(vault_path,file.get_icon_data_start(),file.get_icon_data_end())
             icon = extract_icon_from_bytes(icon_bytes)
             item.set_path(file.get_path()) # the file item must point to where it is.
             item.setIcon(0, icon)
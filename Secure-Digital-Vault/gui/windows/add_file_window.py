@@ -2,10 +2,9 @@ from PyQt6.QtWidgets import QVBoxLayout, QHBoxLayout, QMainWindow, QWidget, QMes
 from PyQt6.QtGui import QIcon
 from PyQt6.QtCore import pyqtSignal
 
-from utils.constants import ICON_9, ICON_2, ICON_6, ICON_16,  ICON_3, MINIMUM_WINDOW_WIDTH, MINIMUM_WINDOW_HEIGHT
+from utils.constants import ICON_9, ICON_2, ICON_6, ICON_16,  ICON_3, MINIMUM_WINDOW_WIDTH, MINIMUM_WINDOW_HEIGHT, NEW_FILE_FORMAT, NEW_FILE_KEY
 from utils.extractors import get_files_and_folders_paths, get_item_info, get_amount_of_files_or_folders
 from crypto.encryptors import get_file_and_encrypt_and_add_to_vault
-from crypto.utils import get_checksum
 from math import floor
 
 from custom_exceptions.classes_exceptions import FileError, EncryptionFailure
@@ -388,9 +387,12 @@ class AddFileWindow(QMainWindow):
 
                 lst = None
                 try:
-                    # lst will either return: [] , [int,int,int] , [int,int,int,int,int]
-                    lst = get_file_and_encrypt_and_add_to_vault(self.parent().request_vault_password(), file[1],
-                                                                self.parent().request_vault_path(), continue_running)
+                    self.parent().request_append_intent()
+                    # lst will either return: [] , [int,int,int,str,str] , [int,int,int,str,int,int]
+                    lst = get_file_and_encrypt_and_add_to_vault(self.parent().request_file_secret(NEW_FILE_KEY), file[1],
+                                                                self.parent().request_vault_path(), continue_running,
+                                                                self.parent().request_extent_allocation, self.parent().request_free_extents,
+                                                                self.parent().request_vault_file(), NEW_FILE_FORMAT)
                 except (FileError, EncryptionFailure) as e:
                     err = f'Couldnt add: {file[1]} because of error: {e}'
                     logger.error(err)
@@ -400,23 +402,25 @@ class AddFileWindow(QMainWindow):
                 if len(lst) < 3:   # No add and encrypt because continue running is false.
                     logger.warn(f"Couldn't add {file[1]} because operation was cancelled")
                     continue
-                if len(lst) > 3:
+                if len(lst) > 4:
                     res["id"] = self.parent().request_new_id("F")
                     res["loc_start"] = lst[0]
                     res["loc_end"] = lst[1]
                     res["size"] = lst[2]
-                    res["metadata"]["icon_data_start"] = -1
-                    res["metadata"]["icon_data_end"] = -1
-                    res["checksum"] = get_checksum(file[1], is_file=True)
+                    res["icon_data_start"] = -1
+                    res["icon_data_end"] = -1
+                    res["metadata"]["format_version"] = NEW_FILE_FORMAT
+                    res["metadata"]["key_version"] = NEW_FILE_KEY
+                    res["checksum"] = lst[3]
                     res["path"] = id_to_insert_into
                 else:
                     logger.error(f"Couldn't add {file[1]} because list values {lst} are incomplete.")
                     continue
-                if len(lst) == 4:
-                    logger.error(f"Couldn't add {file[1]} icon because {lst[3]}")
-                elif len(lst) == 5:
-                    res["metadata"]["icon_data_start"] = lst[3]
-                    res["metadata"]["icon_data_end"] = lst[4]
+                if len(lst) == 5:
+                    logger.error(f"Couldn't add {file[1]} icon because {lst[4]}")
+                elif len(lst) == 6:
+                    res["icon_data_start"] = lst[4]
+                    res["icon_data_end"] = lst[5]
 
                 self.parent().insert_item_into_vault(res, "F")
                 self.parent().request_file_id_addition_into_folder(id_to_insert_into,res["id"])
@@ -1,4 +1,4 @@
-from PyQt6.QtWidgets import QVBoxLayout, QMainWindow, QWidget, QListWidget, QListWidgetItem, QHBoxLayout, QMessageBox
+from PyQt6.QtWidgets import QVBoxLayout, QMainWindow, QWidget, QListWidget, QListWidgetItem, QHBoxLayout, QMessageBox, QCheckBox
 from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtGui import QIcon
 
@@ -8,8 +8,9 @@ from logger.logging import Logger
 
 from utils.helpers import is_location_ok
 from utils.constants import ICON_11, ICON_16
-from file_handle.file_io import delete_bytes_from_file
-from math import floor, ceil
+from utils.parsers import parse_size_to_string
+from file_handle.file_io import merge_ranges
+from math import floor
 
 from threads.custom_thread import CustomThread, Worker
 from threads.mutable_boolean import MutableBoolean
@@ -58,6 +59,10 @@ class DeleteFileWindow(QMainWindow):
         self.return_button = CustomButton("Return", QIcon(ICON_16), "Return to VaultView", self)
         self.return_button.set_action(self.__open_vault_view)
 
+        # Deleted items only become free extents unless checked, the vault compacts itself once enough space is free
+        self.reclaim_checkbox = QCheckBox("Reclaim space now", self.central_widget)
+        self.reclaim_checkbox.setToolTip("Move the remaining data over the deleted items right away. Slower on big vaults.")
+
         # Progress report
         self.delete_progress_bar = CustomProgressBar(is_visible_at_start=False, parent=self.central_widget)
 
@@ -66,6 +71,7 @@ class DeleteFileWindow(QMainWindow):
         self.horizontal_layout.addWidget(self.return_button)
         self.horizontal_layout.addWidget(self.delete_button)
         self.vertical_layout.addLayout(self.horizontal_layout)
+        self.vertical_layout.addWidget(self.reclaim_checkbox)
         self.vertical_layout.addWidget(self.delete_progress_bar)
 
         # Additional information labels can be added here
@@ -106,7 +112,7 @@ class DeleteFileWindow(QMainWindow):
 
 
         self.worker = Worker(self.__process_delete, lst, self.__vault_loc, cur_path, total_files, removed_files,
-                             total_deleted_bytes, self.__delete_is_running)
+                             total_deleted_bytes, self.__delete_is_running, self.reclaim_checkbox.isChecked())
         self.worker.args += (self.worker.progress, )
 
         self.worker.progress.connect(self.update_delete_progress)
@@ -127,33 +133,36 @@ class DeleteFileWindow(QMainWindow):
             self.__update_header(refresh_tree=True)
             self.__clean_delete()
             self.mythread.quit()
+            self.parent().request_compaction_if_needed()
         self.mythread.timeout_signal.connect(__end_thread_activity)
         self.mythread.finished.connect(self.mythread.deleteLater)
 
         self.delete_progress_bar.setVisible(True)
         self.delete_button.setText("ABORT")
         self.return_button.setDisabled(True)
+        self.reclaim_checkbox.setDisabled(True)
         self.__delete_is_running.set_value(True)
         self.mythread.start()
 
-    def update_delete_progress(self, num_to_update_with : int) -> None:
-        """Updates the delete progress bar with the given value
+    def update_delete_progress(self, progress : tuple[int,int]) -> None:
+        """Updates the delete progress bar with the bytes moved so far. Aborting is no longer possible once bytes are moving.
 
         Args:
-            emitted_num (int): Num to add into bar
+            progress (tuple[int,int]): [0] bytes moved so far, [1] total bytes to move
         """
-        if num_to_update_with == 100 or self.delete_progress_bar.value() >= 100:
+        moved, total = progress
+        self.delete_button.setDisabled(True)
+        if total == 0 or moved >= total:
             self.delete_progress_bar.stop_progress(False)
             return
-        current_value = self.delete_progress_bar.value()
-        if num_to_update_with + current_value >= 100:
-            self.delete_progress_bar.setValue(99)
-        else:
-            self.delete_progress_bar.setValue(num_to_update_with + current_value)
+        self.delete_progress_bar.setValue(min(floor(moved * 100 / total), 99))
+        self.delete_progress_bar.setFormat(f"%p% ({parse_size_to_string(moved)} / {parse_size_to_string(total)} moved)")
 
     def __process_delete(self, items : list, vault_loc : str, cur_path : int, total_files : MutableInteger, removed_files : list[str],
-                       total_deleted_bytes : MutableInteger, continue_running : MutableBoolean, signal : pyqtSignal, delete_cur_folder : bool = False, fd = None):
-        """Starts the delete process of the given items in the list
+                       total_deleted_bytes : MutableInteger, continue_running : MutableBoolean, reclaim_now : bool, signal : pyqtSignal):
+        """Starts the delete process of the given items in the list. All the ranges to remove are planned first. By default the
+        ranges are only marked as free extents (tombstones), otherwise the vault is compacted in a single pass together with
+        the already free extents, and the header is remapped once.
 
         Args:
             items (list): The items to delete, this lists consists of Files and Folders
@@ -162,30 +171,55 @@ class DeleteFileWindow(QMainWindow):
             total_files (MutableInteger) : The TOTAL amount of files including the ones in the subfolders
             removed_files (list[str]) : The names of the removed files
             total_deleted_bytes (MutableInteger) : The TOTAL amount of deleted bytes
-            continue_running (MutableBoolean): The mutuable boolean to abort operation
-            signal (pyqtSignal): Signal to emit for the progress bar to increase
-            delete_cur_folder (bool): Boolean to indicate whether to delete the current folder during the current iteration. ONLY USED BY RECURSION.
-            fd: FileDescriptor. It is given to reduce file opening overhead during recursion
+            continue_running (MutableBoolean): The mutuable boolean to abort operation, only respected while planning
+            reclaim_now (bool): Whether to compact the vault right away instead of leaving free extents behind
+            signal (pyqtSignal): Signal to emit (bytes moved, total bytes to move) for the progress bar
         """
-        if fd:
-            file = fd
-        else:
-            file = open(vault_loc, "rb+")
-
-        if not continue_running.get_value():
-            if not fd:
-                file.close()
-            return
         logger = Logger()
+        plan = {"ranges" : [], "notes" : [], "files" : [], "folders" : []}
+        self.__plan_delete(items, cur_path, plan, continue_running)
+        if not continue_running.get_value(): # Aborted while planning, nothing was touched
+            return
 
-        # Progress bar details
-        if total_files.get_value() > 100:
-            emit_every = floor(total_files.get_value() / 100)
-        elif total_files.get_value() != 0:
-            emit_every = ceil(100 / total_files.get_value())
+        # 1: Remove the items from the map
+        ranges = merge_ranges(plan["ranges"])
+        for note_id in plan["notes"]:
+            self.parent().remove_note_from_vault(note_id)
+        for obj in plan["files"]:
+            self.parent().remove_file_from_vault(obj.get_id())
+            file_name = f'{obj.get_metadata()["name"]}.{obj.get_metadata()["type"]}'
+            removed_files.append(file_name)
+            logger.attention(f"Deleted {file_name} from the Vault")
+        for folder_id in plan["folders"]:
+            self.parent().remove_folder_without_files(folder_id)
+
+        # 2: Either tombstone the ranges, or move the data over them in one pass and remap what is left once
+        if reclaim_now:
+            last_percent = MutableInteger(-1)
+            def on_progress(moved : int, total : int):
+                percent = floor(moved * 100 / total)
+                if percent != last_percent.get_value():
+                    last_percent.set_value(percent)
+                    signal.emit((moved, total))
+            self.parent().request_compaction(ranges, on_progress)
         else:
-            emit_every = 0
+            self.parent().request_free_extents(ranges)
+
+        # 3: Update total_files, amount of deleted_bytes
+        total_files.set_value(0)
+        total_deleted_bytes.set_value(sum(end - start for start, end in ranges))
+        signal.emit((1, 1))
 
+    def __plan_delete(self, items : list, cur_path : int, plan : dict, continue_running : MutableBoolean, delete_cur_folder : bool = False):
+        """Collects the byte ranges and ids to delete for the given items, going through the folders recursively.
+
+        Args:
+            items (list): The items to delete, this lists consists of Files and Folders
+            cur_path (int): The current path (Directory the items belong under)
+            plan (dict): Filled with 'ranges' (start, end), 'notes' ids, 'files' objects and 'folders' ids, children first.
+            continue_running (MutableBoolean): The mutuable boolean to abort operation
+            delete_cur_folder (bool): Boolean to indicate whether to delete the current folder. ONLY USED BY RECURSION.
+        """
         for obj in items:
             if not continue_running.get_value():
                 return
@@ -193,65 +227,24 @@ class DeleteFileWindow(QMainWindow):
             if isinstance(obj , Directory):
                 belong_to = obj.get_id()
                 lst = self.parent().request_files_and_folders_from_vault(belong_to)
-                self.__process_delete(items=lst, vault_loc=vault_loc, cur_path=belong_to, total_files=total_files,
-                                      removed_files=removed_files, total_deleted_bytes=total_deleted_bytes,
-                                      continue_running=continue_running, signal=signal, delete_cur_folder=True, fd = file)
-            # Handle File
+                self.__plan_delete(lst, belong_to, plan, continue_running, delete_cur_folder=True)
+            # Handle File, its Note and its Icon
             elif isinstance(obj, File):
-                deleted_bytes = 0
-                loc_file_start = obj.get_loc_start()
-                loc_file_end   = obj.get_loc_end()
-                loc_icon_start = obj.get_metadata()["icon_data_start"]
-                loc_icon_end   = obj.get_metadata()["icon_data_end"]
-                note_id  = obj.get_metadata()["note_id"]
-
-                # 1: Delete Note
+                note_id = obj.get_metadata()["note_id"]
                 if note_id != -1:
                     item = self.parent().get_item_class_from_vault(note_id,"V")
-                    note_start = item.get_loc_start()
-                    note_end   = item.get_loc_end()
-                    bytes_to_delete = note_end-note_start
-                    delete_bytes_from_file(file_path=vault_loc, bytes_to_delete=bytes_to_delete,
-                                           start_index=note_start, fd=file)
-                    deleted_bytes += bytes_to_delete
-                    self.parent().request_data_shift(bytes_to_delete, False, note_start+1)
-                    self.parent().remove_note_from_vault(note_id)
-
-                # 2: Delete File (No shift because ICON is right after it)
-                bytes_to_delete = loc_file_end-loc_file_start
-                delete_bytes_from_file(file_path=vault_loc, bytes_to_delete=bytes_to_delete,
-                                            start_index=loc_file_start, fd=file)
-                deleted_bytes += bytes_to_delete
-                self.parent().remove_file_from_vault(obj.get_id())
-
-                # 3: Delete Icon
-                if loc_icon_start < 0 or loc_icon_end < 0:
-                    old_delete = bytes_to_delete
-                    bytes_to_delete = loc_icon_end-loc_icon_start
-                    delete_bytes_from_file(file_path=vault_loc,bytes_to_delete=bytes_to_delete,
-                                                start_index=loc_icon_start, fd=file)
-                    deleted_bytes += bytes_to_delete
-                    self.parent().request_data_shift(bytes_to_delete+old_delete, False, loc_file_start+1) # Shift both len icon + len file
-                else:
-                    self.parent().request_data_shift(bytes_to_delete, False, loc_file_start+1)
-
-                # 4 Update signal, removed_files, total_files, amount of deleted_bytes
-                signal.emit(emit_every)
-                file_name = f'{obj.get_metadata()["name"]}.{obj.get_metadata()["type"]}'
-                removed_files.append(file_name)
-                tmp = total_files.get_value()
-                total_files.set_value(tmp-1)
-                tmp = total_deleted_bytes.get_value()
-                total_deleted_bytes.set_value(tmp+deleted_bytes)
-                logger.attention(f"Deleted {file_name} from the Vault")
-
-        # 5: The cur_path, which is the current folder does not have anything
-        if delete_cur_folder and self.__delete_is_running.get_value():
-            self.parent().remove_folder_without_files(cur_path)
-
-        # 6: Close:
-        if not fd:
-            file.close()
+                    plan["ranges"].append((item.get_loc_start(), item.get_loc_end()))
+                    plan["notes"].append(note_id)
+                plan["ranges"].append((obj.get_loc_start(), obj.get_loc_end()))
+                loc_icon_start = obj.get_icon_data_start()
+                loc_icon_end   = obj.get_icon_data_end()
+                if loc_icon_start > 0 and loc_icon_end > 0:
+                    plan["ranges"].append((loc_icon_start, loc_icon_end))
+                plan["files"].append(obj)
+
+        # The cur_path, which is the current folder will not have anything
+        if delete_cur_folder and continue_running.get_value():
+            plan["folders"].append(cur_path)
 
     def get_objects_from_list_view(self) -> list:
         """Gets all the saved objects from the current list.
@@ -299,6 +292,7 @@ class DeleteFileWindow(QMainWindow):
         self.delete_button.button_label = "Delete"
         self.delete_button.context_box_text = "Delete Selected Items"
         self.return_button.setEnabled(True)
+        self.reclaim_checkbox.setEnabled(True)
         self.list_widget.clear()
         self.items.clear()
 
@@ -7,13 +7,12 @@ from classes.file import File
 from custom_exceptions.classes_exceptions import DecryptionFailure
 from logger.logging import Logger
 
-from utils.constants import ICON_10, CHUNK_LIMIT
+from utils.constants import ICON_10, FILE_KEY_PASSWORD, FILE_KEY_MASTER, FILE_KEY_DATA
 from utils.helpers import get_available_drives, is_location_ok
 from utils.parsers import show_as_windows_directory
-from utils.extractors import get_file_from_vault
-from file_handle.file_io import create_folder_on_disk, append_bytes_into_file
-from crypto.decryptors import decrypt_bytes
-from crypto.utils import generate_aes_key, get_checksum
+from file_handle.vault_file import VaultFile
+from file_handle.file_io import create_folder_on_disk
+from crypto.decryptors import extract_file_from_vault
 from math import floor, ceil
 
 from gui import VaultView
@@ -40,8 +39,9 @@ class GetFileWindow(QMainWindow):
 
         # Custom Data
         self.threads = []
-        self.__vault_loc = self.parent().request_vault_path()
-        self.__vault_pass = self.parent().request_vault_password()
+        self.__vault_file = self.parent().request_vault_file()
+        self.__file_secrets = {key_version: self.parent().request_file_secret(key_version)
+                               for key_version in (FILE_KEY_PASSWORD, FILE_KEY_MASTER, FILE_KEY_DATA)}
         self.__dialog = InteractDialog(self)
         self.__interactable = [False, "Skip", ""]
 
@@ -116,7 +116,7 @@ class GetFileWindow(QMainWindow):
         self.mythread = CustomThread(240 , self.on_extract_button_clicked.__name__)
         self.threads.append(self.mythread)
 
-        self.worker = Worker(self.process_extract, all_files, dir_loc, self.__vault_loc, self.__vault_pass, self.__interactable)
+        self.worker = Worker(self.process_extract, all_files, dir_loc, self.__vault_file, self.__file_secrets, self.__interactable)
         self.worker.args += (self.worker.interaction, )
         self.worker.args += (self.worker.progress, )    # Force add signals
 
@@ -157,15 +157,15 @@ class GetFileWindow(QMainWindow):
         else:
             self.extraction_progress_bar.setValue(num_to_update_with + current_value)
 
-    def process_extract(self, lst : list[File], address_location : str, vault_loc : str, vault_password : str, interactable_item : object,
+    def process_extract(self, lst : list[File], address_location : str, vault_file : VaultFile, file_secrets : dict[int, str | bytes], interactable_item : object,
                         interaction_signal : pyqtSignal, progress_signal : pyqtSignal):
         """Starts the extraction process of the given items in the list
 
         Args:
             lst (list[File]): The items to extract, this lists consists of Files.
             address_location (str): The folder location to add the items into, e.g: D:\\Path\\To\\
-            vault_loc (str): The location of the vault
-            vault_password (str): The password used to unlock the vault
+            vault_file (VaultFile): The open session of the vault
+            file_secrets (dict[int, str | bytes]): What the files are encrypted with in the vault, per key version
             interactable_item(object): The item passed around by the itneraction signal
             interaction_signal(pyqtSignal): Signal to interact with the main thread
             progress_signal (pyqtSignal): Signal to emit for the progress bar to increase
@@ -224,49 +224,19 @@ class GetFileWindow(QMainWindow):
             if not res:
                 logger.error(f"Couldn't create location: {folder_location}")
                 continue
-            file_from_vault = get_file_from_vault(vault_loc, file.get_loc_start(), file.get_loc_end())
-            res = file_from_vault
-            # File must not be empty when decrypting
-            if res:
-                # Regular decryption
-                try:
-                    # Large File Scenario
-                    if len(res) > CHUNK_LIMIT:
-                        salt = res[:16]
-                        iv = res[16:32]
-                        key = generate_aes_key(password=vault_password.encode(), salt=salt, key_length=32)
-                        res = res[32:]
-                        decrypted_bytes = bytearray()
-                        while True:
-                            move_amount = CHUNK_LIMIT + 16 # Account for padding overhead
-                            chunk = res[:move_amount]
-                            if not chunk:
-                                break
-                            decrypted_chunk = decrypt_bytes(ciphertext=chunk, password='', key=key, iv=iv)
-                            decrypted_bytes.extend(decrypted_chunk)
-                            # Move Array
-                            res = res[move_amount:]
-                            if len(res) == 0:
-                                break
-                        res = bytes(decrypted_bytes)
-                    # Small File Scenario
-                    else:
-                        res = decrypt_bytes(res, vault_password)
-                except DecryptionFailure as e:
-                    logger.error(f"Unexpected Vault Failure for {full_file_name}. Error: {e}. Retry action after reopening the Vault")
-                    continue
-                # If file is encrypted
+            try:
+                res = extract_file_from_vault(vault_file, file.get_loc_start(), file.get_loc_end(), f'{folder_location}/{full_file_name}',
+                                              file_secrets[file.get_key_version()], password, file.get_checksum(), format_version=file.get_format_version(),
+                                              protection=file.get_protection())
+            except DecryptionFailure as e:
                 if password:
-                    try:
-                        res = decrypt_bytes(res, password)
-                    except DecryptionFailure as e:
-                        logger.warn(f"Password incorrect for {full_file_name}")
-                        continue
-
-            output_checksum = get_checksum(res, is_file=False)
-            res = append_bytes_into_file(folder_location, res, create_file=True, file_name=full_file_name)
-            if file.get_checksum() != output_checksum:
-                logger.error(f"Saved file checksum {file.get_checksum()} does not correspond to what was taken from the Vault {output_checksum}")
+                    logger.warn(f"Password incorrect for {full_file_name}")
+                else:
+                    logger.error(f"Unexpected Vault Failure for {full_file_name}. Error: {e}. Retry action after reopening the Vault")
+                continue
+            if not res[0]:
+                logger.error(f"Couldn't extract {full_file_name}: {res[1]}")
+                continue
 
             # Extract Note:
             if file.get_metadata()["note_id"] != -1:
@@ -2,16 +2,14 @@ from PyQt6.QtWidgets import QVBoxLayout, QHBoxLayout, QMainWindow, QWidget, QLis
 from PyQt6.QtGui import QIcon
 from PyQt6.QtCore import pyqtSignal , Qt
 
-from utils.constants import ICON_5, ICON_7, ICON_8, ICON_12, ICON_14, CHUNK_LIMIT
-from file_handle.file_io import rename_file, override_bytes_in_file, append_bytes_into_file
+from utils.constants import ICON_5, ICON_7, ICON_8, ICON_12, ICON_14, FILE_KEY_PASSWORD, FILE_KEY_MASTER, FILE_KEY_DATA
+from file_handle.file_io import rename_file, append_bytes_into_file
 from utils.parsers import parse_timestamp_to_string, parse_size_to_string, parse_file_name
 from utils.helpers import is_proper_extension
-from utils.extractors import get_file_from_vault
-from crypto.encryptors import encrypt_bytes, generate_password_token
-from crypto.decryptors import decrypt_bytes
-from crypto.utils import is_password_strong, generate_aes_key, to_base64
+from crypto.encryptors import reencrypt_file_copy, generate_password_token
+from crypto.utils import is_password_strong, to_base64
 
-from custom_exceptions.classes_exceptions import DecryptionFailure
+from custom_exceptions.classes_exceptions import DecryptionFailure, EncryptionFailure
 
 from classes.vault import Vault
 from logger.logging import Logger
@@ -27,7 +25,6 @@ from gui.interactions.log_extract_dialog import LogExtractDialog
 from gui import VaultView
 
 from math import ceil, floor
-from Crypto.Random import get_random_bytes
 
 
 class SettingsWindow(QMainWindow):
@@ -100,6 +97,10 @@ class SettingsWindow(QMainWindow):
         self.list_data_vault.addItem(QListWidgetItem(f"Vault Extension: {header['vault']['vault_extension']}"))
         self.list_data_vault.addItem(QListWidgetItem(f"Amount of Files: {header['vault']['amount_of_files']}"))
         self.list_data_vault.addItem(QListWidgetItem(f"Total Size of all Files: {parse_size_to_string(header['vault']['file_size'])}"))
+        self.list_data_vault.addItem(QListWidgetItem(f"Reclaimable Space: {parse_size_to_string(self.__vault.get_free_size())}"))
+        metrics = self.__vault.get_metrics()
+        self.list_data_vault.addItem(QListWidgetItem(f"Header Shifts this Session: {metrics['header_shifts']} "
+                                                     f"({parse_size_to_string(metrics['header_shifted_bytes'])} moved)"))
 
         # GroupBox for Regular Settings
         group_box_regular = QGroupBox("Change Vault Details")
@@ -274,6 +275,7 @@ class SettingsWindow(QMainWindow):
         vault_name = header["vault"]["vault_name"] + header["vault"]["vault_extension"]
 
         if self.__new_dict["new_name"] or self.__new_dict["new_extension"]:
+            self.__vault.close_vault_file() # The vault cannot be renamed while it is open on every system
             res = rename_file(self.__vault.get_vault_path(), vault_name)
             if not res[0]:
                 header["vault"]["vault_name"] = old_name
@@ -306,13 +308,24 @@ class SettingsWindow(QMainWindow):
             self.worker.deleteLater()
         self.worker.finished.connect(__end_worker_activity)
 
-        def __end_thread_activity():
-            self.__vault.set_password(self.__new_dict['new_password'])
-            self.__update_header()  # After import, the vault must have saved information.
+        def __end_thread_activity(emitted_result):
             self.__is_change_password_running.set_value(False)
-            logger.attention("Successfully changed Vault password and hint!")
             self.execute_change_button.setEnabled(True)
             self.save_vault_information_button.setEnabled(True)
+            if not isinstance(emitted_result, list) or not emitted_result[0]:
+                # Files left on the old password cannot be opened by the new one, so the password stays as it was
+                self.__update_header()
+                self.progress_bar.setValue(0)
+                self.progress_bar.setVisible(False)
+                message_box = CustomMessageBox(parent=self)
+                message_box.setIcon(QMessageBox.Icon.Warning)
+                message_box.setWindowTitle("Vault Password Change")
+                message_box.showMessage(f"The password was not changed: {emitted_result[1] if isinstance(emitted_result, list) else emitted_result}")
+                self.mythread.quit()
+                return
+            self.__vault.set_password(self.__new_dict['new_password'])
+            self.__update_header(overwrite_previous=True)  # After import, the vault must have saved information.
+            logger.attention("Successfully changed Vault password and hint!")
             self.__token_activity(self.__vault.get_password(), self.__vault.get_vault_path())
             self.mythread.quit()
         self.mythread.timeout_signal.connect(__end_thread_activity)
@@ -343,24 +356,33 @@ class SettingsWindow(QMainWindow):
         self.progress_bar.setVisible(False)
         self.progress_bar.setValue(0)
 
-    def __update_header(self) -> None:
+    def __update_header(self, overwrite_previous : bool = False) -> None:
         """Refreshes the header, and modifies the vault itself.
+
+        Args:
+            overwrite_previous (bool, optional): Whether no previous header may stay in the vault. Defaults to False.
         """
         self.__vault.refresh_header()
-        self.__vault.update_vault_file()
+        self.__vault.update_vault_file(overwrite_previous)
 
-    def __change_password(self, old_password : str, new_password :str, vault : Vault, progress_signal : pyqtSignal) -> None:
-        """Updates the Vault with the new Password. This process cannot be aborted.
+    def __change_password(self, old_password : str, new_password :str, vault : Vault, progress_signal : pyqtSignal) -> list:
+        """Updates the Vault with the new Password. Files keyed by the data key stay as they are, set_password wraps the data
+        key by the new password afterwards. Files keyed by the password or the master key are moved onto the data key, so
+        the next password change leaves them as they are too. Each file is encrypted again into a new copy, see
+        reencrypt_file_copy, its new location is committed and only then the old copy is freed.
+        The process stops at the first file which cannot be moved, the password must not change then.
 
         Args:
             old_password (str): The original password of the Vault
             new_password (str): The new password
             vault (Vault): The Vault itself.
             progress_signal (pyqtsignal): Signal to update the progress bar
+
+        Returns:
+            list: First index is boolean value whether its successful or not, second is error if yes
         """
         logger = Logger()
         file_ids = self.__vault.get_map()['file_ids']
-        files = self.__vault.get_map()['files']
 
         file_amount = len(file_ids)
         cntr = emitted = 0
@@ -371,79 +393,46 @@ class SettingsWindow(QMainWindow):
         else:
             emit_every = ceil(100 / file_amount)
 
+        old_secrets = {FILE_KEY_PASSWORD : old_password, FILE_KEY_MASTER : vault.get_master_key()}
+        data_key = vault.get_data_key()
+
         for f in file_ids:
-            file = files[str(f)]
-            full_file_name = f"{file['metadata']['name']}.{file['metadata']['type']}"
-            file_from_vault = get_file_from_vault(vault.get_vault_path(), file['loc_start'], file['loc_end'])
-            res = file_from_vault
-            old_size = len(res)
-            # File must not be empty when decrypting
-            # Regular decryption
-            if res:
-                try:
-                    # Large File Scenario
-                    if len(res) > CHUNK_LIMIT:
-                        salt = res[:16]
-                        iv = res[16:32]
-                        key = generate_aes_key(password=old_password.encode(), salt=salt, key_length=32)
-                        res = res[32:]
-                        decrypted_bytes = bytearray()
-                        while True:
-                            move_amount = CHUNK_LIMIT + 16 # Account for padding overhead
-                            chunk = res[:move_amount]
-                            if not chunk:
-                                break
-                            decrypted_chunk = decrypt_bytes(ciphertext=chunk, password='', key=key, iv=iv)
-                            decrypted_bytes.extend(decrypted_chunk)
-                            # Move Array
-                            res = res[move_amount:]
-                            if len(res) == 0:
-                                break
-                        res = bytes(decrypted_bytes)
-                    # Small File Scenario
-                    else:
-                        res = decrypt_bytes(res, old_password)
-                except DecryptionFailure as e:
-                    logger.error(f"Unexpected Vault Failure for {full_file_name}. Error: {e}. Retry action after reopening the Vault")
-                    continue
-            else:
-                logger.warn(f"Unexpected Vault Failure for {full_file_name} because getting it from the Vault returned empty")
-
-            # Encrypting a large file, must add salt_iv first, then add the encrypted data
-            encrypted_file = None
-            if len(res) > CHUNK_LIMIT:
-                # Encryption Data
-                salt = get_random_bytes(16)
-                iv = get_random_bytes(16)
-                salt_iv = salt + iv
-                key = generate_aes_key(password=new_password.encode(), salt=salt, key_length=32)
-
-                # Helper Variables
-                read_bytes = 0
-                encrypted_bytes = bytearray()
-                encrypted_bytes.extend(salt_iv)
-
-                while True:
-                    move_amount = CHUNK_LIMIT
-                    chunk = res[:move_amount]
-                    if len(chunk) == 0:
-                        break
-                    read_bytes+=move_amount
-                    encrypted_chunk = encrypt_bytes(data=chunk, password=new_password, key=key, iv=iv)
-                    encrypted_bytes.extend(encrypted_chunk)
-                    res = res[move_amount:]
-                    if len(res) == 0:
-                        break
-                encrypted_file = bytes(encrypted_bytes)
-                if old_size != len(encrypted_file):
+            file = vault.get_id_from_vault(f, "F", as_dict=False)[1]
+            full_file_name = f"{file.get_metadata()['name']}.{file.get_metadata()['type']}"
+            key_version = file.get_key_version()
+            if key_version != FILE_KEY_DATA:
+                old_range = (file.get_loc_start(), file.get_loc_end())
+                new_range = old_range
+                version = file.get_format_version()
+                # File must not be empty when decrypting
+                if old_range[1] > old_range[0]:
+                    try:
+                        vault.record_append()
+                        new_range = reencrypt_file_copy(vault.get_vault_file(), old_range[0], old_range[1], old_secrets[key_version],
+                                                        version, lambda pieces: pieces, vault.allocate_extent, vault.mark_extents_free,
+                                                        new_password=data_key)
+                    except (DecryptionFailure, EncryptionFailure) as e:
+                        logger.error(f"Unexpected Vault Failure for {full_file_name}. Error: {e.message}. Retry action after reopening the Vault")
+                        return [False, e.message]
+                else:
+                    logger.warn(f"Unexpected Vault Failure for {full_file_name} because getting it from the Vault returned empty")
+
+                # Same format as before, so the copy keeps the size of the file
+                if new_range[1] - new_range[0] != old_range[1] - old_range[0]:
                     # Failure example shouldn't happen.
-                    logger.error(f'File: {full_file_name} length is not the same after re-encrypt. {len(encrypted_file)} != {old_size}')
-            # Small File Scenario
-            else:
-                encrypted_file = encrypt_bytes(data=res, password=new_password)
-            fd = override_bytes_in_file(file_path=vault.get_vault_path(), given_bytes=encrypted_file, byte_loss=0, at_location=file['loc_start'])
-            if fd:
-                fd.close()
+                    vault.mark_extents_free([new_range])
+                    error = f'File: {full_file_name} length is not the same after re-encrypt. {new_range[1] - new_range[0]} != {old_range[1] - old_range[0]}'
+                    logger.error(error)
+                    return [False, error]
+                file.set_loc_start(new_range[0])
+                file.set_loc_end(new_range[1])
+                file.get_metadata()['key_version'] = FILE_KEY_DATA
+                vault.update_file_in_vault(file)
+                # The new location is committed, only then the old copy can be reused
+                vault.refresh_header()
+                vault.commit()
+                if new_range != old_range:
+                    vault.mark_extents_free([old_range])
             cntr+=1
 
             # ProgressBar
@@ -457,6 +446,7 @@ class SettingsWindow(QMainWindow):
                     progress_signal.emit(emit_every)
                     emitted+=emit_every
         progress_signal.emit(100)
+        return [True, ""]
 
     def __generate_tokens(self, password : str, location_for_tokens : str):
         """Generates the Vault Recovery tokens
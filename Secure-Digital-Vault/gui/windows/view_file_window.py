@@ -6,13 +6,13 @@ from classes.file import File
 from classes.directory import Directory
 from logger.logging import Logger
 
-from utils.constants import ICON_17, ICON_11, ICON_9, ICON_10 ,ICON_4, CHUNK_LIMIT
-from utils.parsers import parse_timestamp_to_string, parse_size_to_string
-from utils.extractors import get_file_from_vault
-from file_handle.file_io import override_bytes_in_file
-from crypto.utils import is_password_strong
-from crypto.encryptors import encrypt_bytes
-from crypto.decryptors import decrypt_bytes
+from utils.constants import ICON_17, ICON_11, ICON_9, ICON_10 ,ICON_4
+from utils.parsers import parse_timestamp_to_string
+from file_handle.vault_file import VaultFile
+from crypto.utils import is_password_strong, protection_stream, format_checksum
+from crypto.encryptors import generate_protection, reencrypt_file_copy
+from crypto.decryptors import decrypt_stream, decrypt_file_pieces, resolve_protection
+from custom_exceptions.classes_exceptions import DecryptionFailure, EncryptionFailure
 
 from threads.custom_thread import Worker, CustomThread
 from gui.custom_widgets.custom_button import CustomButton
@@ -22,6 +22,8 @@ from gui.interactions.note_dialog import NoteDialog
 from gui.interactions.interact_dialog import InteractDialog
 from gui import VaultView
 
+import hashlib
+
 
 class ViewFileWindow(QMainWindow):
 
@@ -38,7 +40,6 @@ class ViewFileWindow(QMainWindow):
         self.__encrypted = False
         self.__dialog = InteractDialog(self)
         self.item_updated = False
-        self.__disable_encryption_and_decryption = False
 
         # Central widget and self.vertical_layout
         self.central_widget = QWidget(self)
@@ -51,14 +52,6 @@ class ViewFileWindow(QMainWindow):
         self.decrypt_button = CustomButton("Decrypt", QIcon(ICON_4), "Decrypt file", self.central_widget)
         self.decrypt_button.set_action(self.__encrypt_or_decrypt_file, False)
 
-        # Check for FileSize
-        if isinstance(item.get_saved_obj(), File):
-            size = item.get_saved_obj().get_loc_end() - item.get_saved_obj().get_loc_start()
-            if size > CHUNK_LIMIT:
-                self.encrypt_button.context_box_text = f"This File cannot be encrypted because its over {parse_size_to_string(CHUNK_LIMIT)}"
-                self.decrypt_button.context_box_text = f"This File cannot be decrypted because its over {parse_size_to_string(CHUNK_LIMIT)}"
-                self.__disable_encryption_and_decryption = True
-
         self.remove_note_button = CustomButton("Remove Note", QIcon(ICON_11), "Remove note note from file", self.central_widget)
 
         self.add_note_button = CustomButton("Add Note", QIcon(ICON_9), "Add note to file", self.central_widget)
@@ -94,29 +87,12 @@ class ViewFileWindow(QMainWindow):
         """Updates the buttons according to the data of the item
         """
         if isinstance(self.__item.get_saved_obj(), File):
-            if not self.__disable_encryption_and_decryption:
-                if self.__item.get_saved_obj().get_file_encrypted():
-                    self.encrypt_button.setDisabled(True)
-                    self.decrypt_button.setEnabled(True)
-                else:
-                    self.encrypt_button.setEnabled(True)
-                    self.decrypt_button.setDisabled(True)
+            if self.__item.get_saved_obj().get_file_encrypted():
+                self.encrypt_button.setDisabled(True)
+                self.decrypt_button.setEnabled(True)
             else:
                 self.encrypt_button.setEnabled(True)
-                self.encrypt_button.action_function = None
-                self.encrypt_button.clicked.disconnect()
-                def __on_disable_encrypt():
-                    self.encrypt_button.default_action()
-                    self.parent().open_popup_window(Logger.form_log_message("File too big to encrypt!", level="INFO"))
-                self.encrypt_button.clicked.connect(__on_disable_encrypt)
-
-                self.decrypt_button.setEnabled(True)
-                self.decrypt_button.action_function = None
-                self.decrypt_button.clicked.disconnect()
-                def __on_disable_decrypt():
-                    self.decrypt_button.default_action()
-                    self.parent().open_popup_window(Logger.form_log_message("File too big to decrypt!", level="INFO"))
-                self.decrypt_button.clicked.connect(__on_disable_decrypt)
+                self.decrypt_button.setDisabled(True)
 
             if self.__item.get_saved_obj().get_metadata()["note_id"] != -1:
                 self.remove_note_button.setEnabled(True)
@@ -143,7 +119,7 @@ class ViewFileWindow(QMainWindow):
         for key, value in self.__item.get_saved_obj().get_metadata().items():
             if key == "last_modified" or key == "data_created":
                 element = QListWidgetItem(f"{key}: {parse_timestamp_to_string(value)}")
-            elif key == "icon_data_start" or key == "icon_data_end":
+            elif key == "icon_extent" or key == "protection":
                 continue
             else:
                 element = QListWidgetItem(f"{key}: {value}")
@@ -182,9 +158,11 @@ class ViewFileWindow(QMainWindow):
         name = f'{self.__item.get_saved_obj().get_metadata()["name"]}.{self.__item.get_saved_obj().get_metadata()["type"]}'
         self.mythread = CustomThread(240 , self.__encrypt_or_decrypt_file.__name__)
         self.threads.append(self.mythread)
-        self.worker = Worker(self.__process_file, self.parent().request_vault_path(), self.__item.get_saved_obj().get_loc_start(),
+        self.worker = Worker(self.__process_file, self.parent().request_vault_file(), self.__item.get_saved_obj().get_loc_start(),
                              self.__item.get_saved_obj().get_loc_end(), self.__dialog.get_data(),
-                             self.parent().request_vault_password(), name, encrypt)
+                             self.parent().request_file_secret(self.__item.get_saved_obj().get_key_version()), name, encrypt,
+                             self.__item.get_saved_obj().get_format_version(), self.__item.get_saved_obj().get_protection(),
+                             self.__item.get_saved_obj().get_checksum())
         self.worker.args += (self.worker.progress, )    # Force add signal
 
         self.worker.progress.connect(self.update_progress_bar)
@@ -203,19 +181,23 @@ class ViewFileWindow(QMainWindow):
                         self.__encrypted = True
                     else:
                         self.__encrypted = False
-                    old_end_loc = self.__item.get_saved_obj().get_loc_end()
-                    direction = True
-                    at_index = self.__item.get_saved_obj().get_loc_start() +1 # To account for ICONs
+                    old_range = (self.__item.get_saved_obj().get_loc_start(), self.__item.get_saved_obj().get_loc_end())
                     self.__item.get_saved_obj().set_file_encrypted(self.__encrypted)
-                    self.__item.get_saved_obj().set_loc_end(emitted_result[2])
+                    self.__item.get_saved_obj().set_loc_start(emitted_result[2])
+                    self.__item.get_saved_obj().set_loc_end(emitted_result[3])
+                    if emitted_result[4]:
+                        self.__item.get_saved_obj().get_metadata()["protection"] = emitted_result[4]
+                    else:
+                        self.__item.get_saved_obj().get_metadata().pop("protection", None)
                     self.__item.get_saved_obj().get_metadata()["last_modified"] = Logger.get_current_time()
                     self.item_updated = True
 
                     self.parent().update_item_location(self.__item.get_saved_obj().get_id(), self.__item.get_saved_obj().get_loc_start(),
                                                        self.__item.get_saved_obj().get_loc_end(), "F")
-                    if old_end_loc < self.__item.get_saved_obj().get_loc_end():
-                        self.parent().request_data_shift(self.__item.get_saved_obj().get_loc_end() - old_end_loc, direction, at_index)
+                    # The new location and protection are committed together, only then the old copy can be reused
                     self.parent().update_file_data_in_vault(self.__item.get_saved_obj(), True)
+                    self.parent().request_free_extents([old_range])
+                    self.parent().request_header_refresh()
 
                 self.__dialog.reset_inner_items()
                 self.__fullfill_list()
@@ -231,71 +213,61 @@ class ViewFileWindow(QMainWindow):
         self.mythread.start()
 
 
-    def __process_file(self, vault_path : str, file_start_loc : int, file_end_loc : int, password : str, vault_password : str,
-                       file_name : str, encrypt: bool, progress_signal : pyqtSignal) -> list:
-        """Process the encryption or decryption of the file
+    def __process_file(self, vault_file : VaultFile, file_start_loc : int, file_end_loc : int, password : str, file_secret : str | bytes,
+                       file_name : str, encrypt: bool, format_version : int, protection : dict, checksum : str,
+                       progress_signal : pyqtSignal) -> list:
+        """Process the encryption or decryption of the file. The file is encrypted again into a new copy piece by piece,
+        see reencrypt_file_copy, the old copy stays the file until the caller commits the new location.
 
         Args:
-            vault_path (str): The location of the vault
+            vault_file (VaultFile): The open session of the vault
             file_start_loc (int): The starting index of the file in the vault
             file_end_loc (int): The ending index of the file in the vault
             password (str): The password to encrypt or decrypt with
-            vault_password (str): The password of the vault
+            file_secret (str | bytes): What the file is encrypted with in the vault, it is kept
             file_name (str): The name of the file
             encrypt (bool): To define whether to encrypt or decrypt
+            format_version (int): Format of the file inside the vault, it is kept
+            protection (dict): The protection layer of an encrypted file, None if it was encrypted before the layer existed
+            checksum (str): Checksum of the plain file, verifies the password of a file without a protection layer
             progress_signal (pyqtSignal): signal to update the progress bar
 
         Returns:
             list: First index is boolean value whether its successful or not, second is error if yes,
-            third is new ending loc index, fourth is old ending loc index
+            third is new starting loc index, fourth is new ending loc index, fifth is the new protection layer if encrypted
         """
-        the_file = get_file_from_vault(vault_path, file_start_loc, file_end_loc)
-        vault_decrypted = None
-        custom_file = None
         logger = Logger()
         try:
-            vault_decrypted = decrypt_bytes(the_file, vault_password)
-        except Exception as e:
-            logger.error(f"Vault Failure! Original password failed, retry interaction with {file_name} again after reopening the Vault")
-            return [False, e.message, file_end_loc, file_end_loc]
+            if encrypt:
+                protection, key = generate_protection(password)
+                transform = lambda pieces: protection_stream(pieces, key)
+            elif protection:
+                key = resolve_protection(password, protection)
+                transform = lambda pieces: protection_stream(pieces, key)
+            else:
+                # Encrypted before the protection layer, CBC only fails on the padding so the password is checked in full first
+                sha256 = hashlib.sha256()
+                for piece in decrypt_stream(decrypt_file_pieces(vault_file, file_start_loc, file_end_loc, file_secret, format_version), password):
+                    sha256.update(piece)
+                if format_checksum(sha256) != checksum:
+                    raise DecryptionFailure(f"Checksum of {file_name} does not match")
+                transform = lambda pieces: decrypt_stream(pieces, password)
+        except DecryptionFailure as e:
+            logger.warn(f"Couldn't decrypt '{file_name}! Incorrect Password")
+            return [False, e.message, file_start_loc, file_end_loc, None]
 
         progress_signal.emit(33)
-        # Decrypt from Vault, Custom Encrypt Password, Then Vault Password
-        if encrypt:
-            try:
-                custom_file = encrypt_bytes(vault_decrypted, password)
-            except Exception as e:
-                logger.error(f"Encryption Failure! '{e.message}'")
-                return [False, e.message, file_end_loc, file_end_loc]
-        else:
-            try:
-                custom_file = decrypt_bytes(vault_decrypted, password)
-            except Exception as e:
-                logger.warn(f"Couldn't decrypt '{file_name}! Incorrect Password")
-                return [False, e.message, file_end_loc, file_end_loc]
-        # Encrypt Again
+        # Decrypt from Vault, add or remove the protection layer, then encrypt again into a free extent or at the end
         try:
-            the_file = encrypt_bytes(custom_file, vault_password)
-        except Exception as e:
-            logger.error(f"Vault Encryption Failure! '{e.message}'")
-            return [False, e.message, file_end_loc, file_end_loc]
-        progress_signal.emit(33)
-        # Calc size
-        old_size = file_end_loc-file_start_loc
-        new_size = len(the_file)
-        new_file_end_loc = file_start_loc + new_size
-        byte_loss = new_size - old_size
-
-        fd = None
-        # Bigger means overwrite and shift
-        if byte_loss > 0:
-            fd = override_bytes_in_file(vault_path, the_file, byte_loss, at_location=file_start_loc)
-        else:
-            fd = override_bytes_in_file(vault_path, the_file, 0, at_location=file_start_loc)
-        if fd:
-            fd.close()
-
-        res = [True, "", new_file_end_loc, file_end_loc]
+            self.parent().request_append_intent()
+            new_file_start_loc, new_file_end_loc = reencrypt_file_copy(vault_file, file_start_loc, file_end_loc, file_secret, format_version,
+                                                                       transform, self.parent().request_extent_allocation,
+                                                                       self.parent().request_free_extents)
+        except (DecryptionFailure, EncryptionFailure) as e:
+            logger.error(f"Couldn't process {file_name}, it was left as it was. '{e.message}'")
+            return [False, e.message, file_start_loc, file_end_loc, None]
+
+        res = [True, "", new_file_start_loc, new_file_end_loc, protection if encrypt else None]
         progress_signal.emit(100)
         if encrypt:
             logger.info(f"Encrypted {file_name}")
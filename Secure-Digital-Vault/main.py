@@ -1,7 +1,9 @@
 import sys
+import multiprocessing
 from PyQt6.QtWidgets import QApplication
 from gui.ViewManager import ViewManager
 from utils import images_qrc
+from crypto.pool import shutdown_crypto_pool
 
 def run():
     sys.argv += ['-platform', 'windows:darkmode=1']  # 1 = light theme
@@ -9,7 +11,10 @@ def run():
     app.setStyle("Fusion")
     MainWindow = ViewManager()
     MainWindow.show()
-    sys.exit(app.exec())
+    exit_code = app.exec()
+    shutdown_crypto_pool(wait=False)
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # The frozen executable must act as a pool worker when spawned as one
     run()
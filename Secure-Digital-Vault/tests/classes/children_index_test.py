@@ -0,0 +1,44 @@
+import pytest
+from classes.children_index import ChildrenIndex
+
+@pytest.fixture
+def the_map():
+    return {
+        "directories": {
+            "10": {"id": 10, "path": 0},
+            "11": {"id": 11, "path": 10},
+        },
+        "files": {
+            "1": {"id": 1, "path": 0},
+            "2": {"id": 2, "path": 10},
+            "3": {"id": 3, "path": 10},
+        }
+    }
+
+def test_from_map(the_map):
+    index = ChildrenIndex.from_map(the_map)
+    assert len(index) == 5
+    assert index.get_folders(0) == [10] and index.get_files(0) == [1]
+    assert index.get_folders(10) == [11] and index.get_files(10) == [2, 3]
+    assert index.get_folders(11) == [] and index.get_files(11) == []
+    assert index.get_parent("F", 3) == 10 and index.get_parent("F", 4) == -1
+    # Items without a path are left out
+    assert len(ChildrenIndex.from_map({"files": {"1": {"id": 1, "name": "file1"}}})) == 0
+    assert len(ChildrenIndex.from_map({})) == 0
+
+def test_place_and_discard(the_map):
+    index = ChildrenIndex.from_map(the_map)
+    index.place("F", 4, 11)
+    assert index.get_files(11) == [4]
+    # Placing again moves the item out of its old folder
+    index.place("F", 2, 11)
+    assert index.get_files(10) == [3] and index.get_files(11) == [4, 2] and len(index) == 6
+    index.place("F", 2, 11)
+    assert index.get_files(11) == [4, 2]
+    # Folders and files with the same id are told apart by their kind
+    index.place("D", 2, 0)
+    index.discard("F", 2)
+    index.discard("F", 2)
+    assert index.get_folders(0) == [10, 2] and index.get_files(11) == [4] and index.get_parent("D", 2) == 0
+    index.discard("D", 11)
+    assert index.get_folders(10) == [] and index.get_files(11) == [4]
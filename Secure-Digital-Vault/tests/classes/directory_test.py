@@ -98,6 +98,8 @@ def test_add_file(directory):
                 "size" : 1024,
                 "loc_start" : 2000,
                 "loc_end" : 3024,
+                "icon_data_start": 3665,
+                "icon_data_end" : 15498,
                 "checksum" : "0x6cxf9dd",
                 "file_encrypted" : False,
                 "path" : 1,
@@ -106,8 +108,6 @@ def test_add_file(directory):
                     "type" : ".mp3",
                     "data_created" : 1710081055,
                     "last_modified" : 1710081069,
-                    "icon_data_start": 3665,
-                    "icon_data_end" : 15498,
                     "note_id" : -1
                 }
             })
@@ -121,6 +121,8 @@ def test_remove_file(directory):
                 "size" : 1024,
                 "loc_start" : 2000,
                 "loc_end" : 3024,
+                "icon_data_start": 3665,
+                "icon_data_end" : 15498,
                 "checksum" : "0x6cxf9dd",
                 "file_encrypted" : False,
                 "path" : 1,
@@ -129,8 +131,6 @@ def test_remove_file(directory):
                     "type" : ".mp3",
                     "data_created" : 1710081055,
                     "last_modified" : 1710081069,
-                    "icon_data_start": 3665,
-                    "icon_data_end" : 15498,
                     "note_id" : -1
                 }
             })
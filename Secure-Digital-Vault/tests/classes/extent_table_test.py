@@ -0,0 +1,70 @@
+import pytest
+from classes.extent_table import ExtentTable
+
+@pytest.fixture
+def the_map():
+    return {
+        "extents": {"1": [100, 200], "2": [200, 250], "3": [300, 400], "4": [500, 600], "5": [700, 720]},
+        "extent_ids": [1, 2, 3, 4, 5]
+    }
+
+def test_from_map(the_map):
+    table = ExtentTable.from_map(the_map)
+    assert len(table) == 5
+    assert table.get(2) == (200, 250) and table.get(9) == (-1, -1)
+    assert table.get_last_end() == 720
+    # The map gets the keys when missing
+    empty_map = {}
+    assert len(ExtentTable.from_map(empty_map)) == 0 and empty_map == {"extents": {}, "extent_ids": []}
+    assert ExtentTable().get_last_end() == 0
+
+def test_is_location():
+    assert ExtentTable.is_location(100, 200) and ExtentTable.is_location(5, 5) and ExtentTable.is_location(0, 4)
+    assert not ExtentTable.is_location(-1, -1) and not ExtentTable.is_location(0, 0)
+    assert not ExtentTable.is_location(200, 100) and not ExtentTable.is_location("1", 2)
+
+def test_add_move_and_discard(the_map):
+    table = ExtentTable.from_map(the_map)
+    # New ids follow the largest one and the map is kept updated
+    assert table.add(800, 900) == 6
+    assert the_map["extents"]["6"] == [800, 900] and the_map["extent_ids"][-1] == 6
+    assert table.get_last_end() == 900
+    table.move(6, 50, 60)
+    assert table.get(6) == (50, 60) and table.get_last_end() == 720 and len(table) == 6
+    table.discard(5)
+    table.discard(5)
+    assert table.get_last_end() == 600 and len(table) == 5 and 5 not in the_map["extent_ids"]
+    # Extents starting at the same offset are told apart by their id
+    new_id = table.add(300, 300)
+    table.discard(3)
+    assert table.get(new_id) == (300, 300) and table.get(3) == (-1, -1)
+
+def test_shift(the_map):
+    table = ExtentTable.from_map(the_map)
+    assert table.shift(300, 10) == 2
+    assert table.get(4) == (510, 610) and table.get(3) == (300, 400) and table.get_last_end() == 730
+    # Kept pending until flushed, the map is not touched by the move
+    assert the_map["extents"]["5"] == [700, 720]
+    assert table.shift(-1, -10) == 5
+    assert table.get(1) == (90, 190) and table.get(4) == (500, 600)
+    # Indexes are in the moved offsets
+    assert table.shift(495, 5) == 2
+    assert table.shift(1000, 5) == 0
+    assert table.flush() == {1, 2, 3, 4, 5}
+    assert the_map["extents"] == {"1": [90, 190], "2": [190, 240], "3": [290, 390], "4": [505, 605], "5": [705, 725]}
+    assert table.flush() == set()
+    # Changes apply the pending moves first
+    table.shift(600, 100)
+    new_id = table.add(650, 660)
+    assert the_map["extents"]["5"] == [805, 825] and table.get_last_end() == 825
+    assert table.flush() == {5}
+    assert table.get(new_id) == (650, 660)
+
+def test_remap(the_map):
+    table = ExtentTable.from_map(the_map)
+    assert table.remap([]) == 0
+    # Removing [250, 300) and [400, 500) and [650, 700)
+    assert table.remap([(250, 300), (400, 500), (650, 700)]) == 3
+    assert (table.get(3), table.get(4), table.get(5)) == ((250, 350), (350, 450), (500, 520))
+    assert table.get(2) == (200, 250)
+    assert table.flush() == {3, 4, 5}
@@ -2,6 +2,7 @@ import pytest
 from custom_exceptions.classes_exceptions import InvalidMetaData, MissingKeyInJson
 from utils.parsers import parse_size_to_string
 from classes.file import File
+from utils.constants import FILE_FORMAT_V1, FILE_FORMAT_V2, FILE_KEY_PASSWORD, FILE_KEY_MASTER, FILE_KEY_DATA
 
 @pytest.fixture
 def valid_file_info():
@@ -10,6 +11,8 @@ def valid_file_info():
         "size": 1024,
         "loc_start": 0,
         "loc_end": 1023,
+        "icon_data_start": 10,
+        "icon_data_end": 20,
         "checksum": "abc123",
         "file_encrypted": True,
         "path": 0,
@@ -18,8 +21,6 @@ def valid_file_info():
             "type": "txt",
             "data_created": 1617181920,
             "last_modified": 1617181920,
-            "icon_data_start": 10,
-            "icon_data_end": 20,
             "note_id": 42
         }
     }
@@ -33,6 +34,8 @@ def test_initialization(file, valid_file_info):
     assert file.get_size() == valid_file_info["size"]
     assert file.get_loc_start() == valid_file_info["loc_start"]
     assert file.get_loc_end() == valid_file_info["loc_end"]
+    assert file.get_icon_data_start() == valid_file_info["icon_data_start"]
+    assert file.get_icon_data_end() == valid_file_info["icon_data_end"]
     assert file.get_checksum() == valid_file_info["checksum"]
     assert file.get_file_encrypted() == valid_file_info["file_encrypted"]
     assert file.get_path() == valid_file_info["path"]
@@ -55,6 +58,12 @@ def test_getters_and_setters(file):
     file.set_loc_end(2148)
     assert file.get_loc_end() == 2148
 
+    file.set_icon_data_start(2148)
+    assert file.get_icon_data_start() == 2148
+
+    file.set_icon_data_end(2200)
+    assert file.get_icon_data_end() == 2200
+
     file.set_checksum("def456")
     assert file.get_checksum() == "def456"
 
@@ -69,8 +78,6 @@ def test_getters_and_setters(file):
         "type": "pdf",
         "data_created": 1718192021,
         "last_modified": 1718192021,
-        "icon_data_start": 30,
-        "icon_data_end": 40,
         "note_id": 43
     }
     file.set_metadata(new_metadata)
@@ -82,6 +89,8 @@ def test_validate_mapped_data():
         "size": 1024,
         "loc_start": 0,
         "loc_end": 1023,
+        "icon_data_start": 10,
+        "icon_data_end": 20,
         "checksum": "abc123",
         "file_encrypted": True,
         "path": 0,
@@ -90,8 +99,6 @@ def test_validate_mapped_data():
             "type": "txt",
             "data_created": 1617181920,
             "last_modified": 1617181920,
-            "icon_data_start": 10,
-            "icon_data_end": 20,
             "note_id": 42
         }
     }
@@ -114,8 +121,6 @@ def test_validate_metadata():
         "type": "txt",
         "data_created": 1617181920,
         "last_modified": 1617181920,
-        "icon_data_start": 10,
-        "icon_data_end": 20,
         "note_id": 42
     }
 
@@ -131,5 +136,39 @@ def test_validate_metadata():
     with pytest.raises(InvalidMetaData):
         File.validate_metadata(File, invalid_metadata_wrong_type)
 
+    invalid_metadata_format = valid_metadata.copy()
+    invalid_metadata_format["format_version"] = 3
+
+    with pytest.raises(InvalidMetaData):
+        File.validate_metadata(File, invalid_metadata_format)
+
+    invalid_metadata_key = valid_metadata.copy()
+    invalid_metadata_key["key_version"] = 4
+
+    with pytest.raises(InvalidMetaData):
+        File.validate_metadata(File, invalid_metadata_key)
+
+    valid_metadata["protection"] = {"algorithm": 2, "cost": 1000, "salt": "AAAA", "check": "AAAA"}
+    File.validate_metadata(File, valid_metadata)
+    for invalid_protection in ("AAAA", {"algorithm": 2, "cost": 1000, "salt": "AAAA"}, dict(valid_metadata["protection"], cost="1000")):
+        with pytest.raises(InvalidMetaData):
+            File.validate_metadata(File, dict(valid_metadata, protection=invalid_protection))
+
+def test_get_format_version(file, valid_file_info):
+    assert file.get_format_version() == FILE_FORMAT_V1
+    valid_file_info["metadata"]["format_version"] = FILE_FORMAT_V2
+    assert File(valid_file_info).get_format_version() == FILE_FORMAT_V2
+
+def test_get_key_version(file, valid_file_info):
+    assert file.get_key_version() == FILE_KEY_PASSWORD
+    for key_version in (FILE_KEY_MASTER, FILE_KEY_DATA):
+        valid_file_info["metadata"]["key_version"] = key_version
+        assert File(valid_file_info).get_key_version() == key_version
+
+def test_get_protection(file, valid_file_info):
+    assert file.get_protection() is None
+    valid_file_info["metadata"]["protection"] = {"algorithm": 2, "cost": 1000, "salt": "AAAA", "check": "AAAA"}
+    assert File(valid_file_info).get_protection() == valid_file_info["metadata"]["protection"]
+
 def test_get_as_dict(file, valid_file_info):
     assert file.get_as_dict() == valid_file_info
@@ -0,0 +1,77 @@
+import os
+import struct
+import pytest
+from classes.journal import Journal, RECORD_PREFIX, RECORD_SEQUENCE, RECORD_NONCE_SIZE, RECORD_TAG_SIZE
+from crypto.utils import derive_master_key, generate_aes_key
+from utils.constants import MAGIC_JOURNAL, KDF_PBKDF2_SHA256
+
+from Crypto.Cipher import AES
+
+MASTER_KEY = b'M' * 32
+
+def test_journal_record_and_read():
+    journal = Journal("test_journal_vault", MASTER_KEY)
+    assert journal.read_entries() == []
+    journal.reset()
+    assert journal.is_empty()
+    journal.record({"op" : "append", "start" : 10})
+    journal.record({"op" : "delta", "delta" : {"vault" : {"file_size" : 4}}})
+    assert not journal.is_empty()
+    assert journal.get_size() == os.path.getsize(journal.get_path())
+    entries = Journal("test_journal_vault", MASTER_KEY).read_entries()
+    assert entries == [{"op" : "append", "start" : 10}, {"op" : "delta", "delta" : {"vault" : {"file_size" : 4}}}]
+    assert Journal("test_journal_vault", bytes(32)).read_entries() == []
+    journal.delete()
+    assert not os.path.exists(journal.get_path())
+
+def test_journal_torn_record():
+    journal = Journal("test_journal_torn_vault", MASTER_KEY)
+    journal.record({"op" : "append", "start" : 10})
+    journal.record({"op" : "append", "start" : 20})
+    with open(journal.get_path(), "rb+") as f:
+        f.truncate(journal.get_size() - 5)
+    assert Journal("test_journal_torn_vault", MASTER_KEY).read_entries() == [{"op" : "append", "start" : 10}]
+    journal.reset()
+    assert Journal("test_journal_torn_vault", MASTER_KEY).read_entries() == []
+    journal.delete()
+
+def test_journal_tampered_records():
+    journal = Journal("test_journal_tampered_vault", MASTER_KEY)
+    journal.reset()
+    header_size = journal.get_size()
+    for start in (10, 20, 30):
+        journal.record({"op" : "append", "start" : start})
+    with open(journal.get_path(), "rb") as f:
+        data = f.read()
+    record_size = (len(data) - header_size) // 3
+    first, second, third = (data[header_size + i * record_size : header_size + (i + 1) * record_size] for i in range(3))
+    # Reordered records fail authentication, replay stops before them
+    with open(journal.get_path(), "wb") as f:
+        f.write(data[:header_size] + first + third + second)
+    assert Journal("test_journal_tampered_vault", MASTER_KEY).read_entries() == [{"op" : "append", "start" : 10}]
+    # So does a changed byte of a record, even one the length still covers
+    changed = bytearray(data)
+    changed[header_size + record_size + 10] ^= 1
+    with open(journal.get_path(), "wb") as f:
+        f.write(changed)
+    assert Journal("test_journal_tampered_vault", MASTER_KEY).read_entries() == [{"op" : "append", "start" : 10}]
+    journal.delete()
+
+def test_journal_keyed_by_master_key():
+    # A vault which records a calibrated KDF, the journal is only as cheap to attack as that KDF
+    master_key = derive_master_key("Tester@123", b'S' * 16, {"algorithm" : KDF_PBKDF2_SHA256, "cost" : 2000})
+    journal = Journal("test_journal_keyed_vault", master_key)
+    journal.record({"op" : "append", "start" : 10})
+    assert Journal("test_journal_keyed_vault", master_key).read_entries() == [{"op" : "append", "start" : 10}]
+    with open(journal.get_path(), "rb") as f:
+        f.seek(len(MAGIC_JOURNAL))
+        salt = f.read(16)
+        length, = struct.unpack(RECORD_PREFIX, f.read(struct.calcsize(RECORD_PREFIX)))
+        record = f.read(length)
+    # The key the journal used to have, the default PBKDF2 of the password, does not open it
+    cipher = AES.new(generate_aes_key("Tester@123", salt, 32), AES.MODE_GCM, nonce=record[:RECORD_NONCE_SIZE])
+    cipher.update(struct.pack(RECORD_SEQUENCE, 0))
+    with pytest.raises(ValueError):
+        cipher.decrypt_and_verify(record[RECORD_NONCE_SIZE:-RECORD_TAG_SIZE], record[-RECORD_TAG_SIZE:])
+    assert Journal("test_journal_keyed_vault", generate_aes_key("Tester@123", salt, 32)).read_entries() == []
+    journal.delete()
@@ -1,7 +1,16 @@
 import pytest
+import os
 from classes.vault import Vault
-from utils.serialization import serialize_dict
-from custom_exceptions.classes_exceptions import JsonWithInvalidData, MissingKeyInJson
+from utils.serialization import serialize_dict, deserialize_header
+from custom_exceptions.classes_exceptions import JsonWithInvalidData, MissingKeyInJson, DecryptionFailure
+from crypto.encryptors import encrypt_header
+from crypto.decryptors import decrypt_header
+from file_handle.file_io import add_magic_into_header, header_padder, find_header_pointers
+from file_handle.superblock import form_superblock
+from file_handle.file_io import commit_header_into_slot
+from utils.serialization import formulate_header
+from utils.constants import VAULT_BUFFER_LIMIT, HEADER_GROWTH_CAP, MAGIC_HEADER_END, FILE_KEY_PASSWORD, FILE_KEY_MASTER, FILE_KEY_DATA, \
+    VAULT_LAYOUT_TAIL, METADATA_PAGE_SPAN
 
 def test_vault_initialization():
     vault = Vault(password="password123", vault_path="/path/to/vault")
@@ -39,14 +48,56 @@ def test_refresh_header():
     header = {"vault": {"header_size": 10}, "map": {}}
     vault.set_header(header)
     refreshed_header = vault.refresh_header(return_it=True)
-    assert "vault" in refreshed_header.decode()
-    assert "map" in refreshed_header.decode()
+    assert vault.get_header()["vault"]["header_size"] == len(refreshed_header)
+    assert deserialize_header(refreshed_header) == vault.get_header()
 
 def test_set_and_get_password():
     vault = Vault(password="password123", vault_path="/path/to/vault")
     vault.set_password("newpassword123")
     assert vault.get_password() == "newpassword123"
 
+def test_get_master_key():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_header({"vault": {"header_size": 128}, "map": {}})
+    master_key = vault.get_master_key()
+    # Older vaults get their salt on first use
+    assert len(vault.get_header()["vault"]["key_salt"]) == 24
+    assert vault.get_master_key() is master_key
+    assert vault.get_master_key("password123") == master_key
+    assert vault.get_master_key("newpassword123") != master_key
+    assert vault.get_file_secret(FILE_KEY_PASSWORD) == "password123"
+    assert vault.get_file_secret(FILE_KEY_MASTER) == master_key
+    # The vault does not record its KDF, so the header and footer stay keyed by the password
+    assert vault.get_kdf() == {}
+    assert vault.get_vault_secret() == "password123"
+    vault.set_password("newpassword123")
+    assert vault.get_master_key() == vault.get_master_key("newpassword123")
+    # The key derived while unlocking is passed on instead of derived again
+    unlocked = Vault(password="password123", vault_path="/path/to/vault", master_key=master_key)
+    unlocked.set_header({"vault": {"header_size": 128}, "map": {}})
+    assert unlocked.get_master_key() is master_key
+
+def test_get_data_key():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_header({"vault": {"header_size": 128}, "map": {}})
+    data_key = vault.get_data_key()
+    assert len(data_key) == 32
+    assert vault.get_data_key() is data_key
+    assert vault.get_file_secret(FILE_KEY_DATA) == data_key
+    # Only the wrapped key is kept in the header
+    wrapped = vault.get_header()["vault"]["data_key"]
+    assert len(wrapped) == 80
+    # A password change wraps the same key again
+    vault.set_password("newpassword123")
+    assert vault.get_header()["vault"]["data_key"] != wrapped
+    reopened = Vault(password="newpassword123", vault_path="/path/to/vault")
+    reopened.set_header(vault.get_header())
+    assert reopened.get_data_key() == data_key
+    with pytest.raises(DecryptionFailure):
+        stale = Vault(password="password123", vault_path="/path/to/vault")
+        stale.set_header(vault.get_header())
+        stale.get_data_key()
+
 def test_set_and_get_hint():
     vault = Vault(password="password123", vault_path="/path/to/vault")
     vault.set_hint("New Hint")
@@ -94,11 +145,11 @@ def test_determine_if_dir_path_is_valid():
         "files" : {},
         "directories" : {}
     })
-    vault.get_map()["directories"]["1"] = dir1
-    vault.get_map()["directories"]["2"] = dir2
-    vault.get_map()["directories"]["3"] = dir3
+    vault.insert_folder(dir1)
+    vault.insert_folder(dir2)
+    vault.insert_folder(dir3)
     assert vault.determine_if_dir_path_is_valid(["path","to","somewhere"]) == (False, 2)
-    vault.get_map()["directories"]["4"] = dir4
+    vault.insert_folder(dir4)
     assert vault.determine_if_dir_path_is_valid(["path","to","somewhere"]) == (True, 4)
     assert vault.determine_if_dir_path_is_valid(["path","to","NO"]) == (False, 2)
 
@@ -115,14 +166,18 @@ def test_generate_id():
 
 def test_get_id_from_vault():
     vault = Vault(password="password123", vault_path="/path/to/vault")
-    vault.set_map({"file_ids": [1], "files": {"1": {"id": 1, "name": "file1"}}})
+    vault.set_map({"file_ids": [1], "files": {"1": {"id": 1, "extent": 1, "metadata": {"name": "file1", "icon_extent": -1}}},
+                   "extents": {"1": [100, 200]}, "extent_ids": [1]})
     exists, file = vault.get_id_from_vault(1, "F")
     assert exists is True
-    assert file["name"] == "file1"
+    assert file["metadata"]["name"] == "file1"
+    # Resolved out of the extents, the record itself holds their ids only
+    assert (file["loc_start"], file["loc_end"], file["icon_data_start"], file["icon_data_end"]) == (100, 200, -1, -1)
+    assert "loc_start" not in vault.get_map()["files"]["1"]
 
 def test_get_name_of_id():
     vault = Vault(password="password123", vault_path="/path/to/vault")
-    vault.set_map({"file_ids": [1], "files": {"1": {"id": 1, "metadata": {"name": "file1"}}}})
+    vault.set_map({"file_ids": [1], "files": {"1": {"id": 1, "extent": -1, "metadata": {"name": "file1"}}}})
     assert vault.get_name_of_id(1, "F") == "file1"
 
 def test_validate_header():
@@ -164,3 +219,294 @@ def test_validate_footer():
     invalid_footer = b'{"error_log": ""}'
     with pytest.raises(MissingKeyInJson):
         vault.validate_footer(invalid_footer)
+
+def test_data_index_remap():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_map({
+        "files": {
+            "1": {"id": 1, "extent": 1, "metadata": {"icon_extent": 2}},
+            "2": {"id": 2, "extent": 3, "metadata": {"icon_extent": -1}},
+            "3": {"id": 3, "extent": 4, "metadata": {"icon_extent": 5}},
+        },
+        "notes": {"4": {"id": 4, "extent": 6}},
+        "extents": {"1": [100, 200], "2": [200, 250], "3": [300, 400], "4": [500, 600], "5": [600, 650], "6": [700, 720]},
+        "extent_ids": [1, 2, 3, 4, 5, 6]
+    })
+    files = vault.get_map()["files"]
+    records = repr(vault.get_map()["files"]) + repr(vault.get_map()["notes"])
+    # Removing [250, 300) and [400, 500) and [650, 700)
+    vault.data_index_remap([(250, 300), (400, 500), (650, 700)])
+    resolved = {the_id : vault.resolve_file(files[the_id]) for the_id in files}
+    assert (resolved["1"]["loc_start"], resolved["1"]["icon_data_start"]) == (100, 200)
+    assert (resolved["2"]["loc_start"], resolved["2"]["loc_end"]) == (250, 350)
+    assert resolved["2"]["icon_data_start"] == -1
+    assert (resolved["3"]["loc_start"], resolved["3"]["icon_data_end"]) == (350, 500)
+    assert vault.resolve_note(vault.get_map()["notes"]["4"]) == {"id": 4, "loc_start": 500, "loc_end": 520}
+    # Only the extents moved
+    assert repr(vault.get_map()["files"]) + repr(vault.get_map()["notes"]) == records
+    assert vault.get_dirty_pages() == {"E0"}
+
+def test_data_index_shifter():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_header({"vault": {"file_size": 0, "amount_of_files": 0}, "map": {"file_ids": [1, 2], "directory_ids": [], "note_ids": [3],
+        "directories": {}, "notes": {},
+        "files": {"1": {"id": 1, "size": 1, "extent": 1, "path": 0, "metadata": {"icon_extent": 2, "note_id": -1, "last_modified": 0}}},
+        "extents": {"1": [100, 200], "2": [200, 250]}, "extent_ids": [1, 2]}})
+    vault.insert_file({"id": 2, "size": 1, "loc_start": 300, "loc_end": 400, "icon_data_start": -1, "icon_data_end": -1, "path": 0,
+                       "metadata": {"note_id": -1, "last_modified": 0}})
+    vault.insert_note({"id": 3, "owned_by_file": 2, "loc_start": 400, "loc_end": 420})
+    vault.get_dirty_pages().clear()
+    # Moving an item moves its extent only
+    vault.update_item_index(2, 500, 600, "F")
+    assert vault.get_dirty_pages() == {"E0"}
+    vault.get_dirty_pages().clear()
+    # Only what starts after the index moves, the file moved by update_item_index included
+    files = vault.get_map()["files"]
+    records = repr(files) + repr(vault.get_map()["notes"])
+    vault.data_index_shifter(10, False, 350)
+    assert (vault.resolve_file(files["1"])["loc_start"], vault.resolve_file(files["1"])["icon_data_start"]) == (100, 200)
+    assert (vault.resolve_file(files["2"])["loc_start"], vault.resolve_file(files["2"])["loc_end"]) == (490, 590)
+    assert vault.get_id_from_vault(3, "V")[1]["loc_start"] == 390
+    assert repr(files) + repr(vault.get_map()["notes"]) == records
+    assert vault.get_dirty_pages() == {"E0"}
+    vault.remove_note(3)
+    vault.remove_file(2)
+    assert vault.get_map()["extent_ids"] == [1, 2]
+    vault.data_index_shifter(5, True, -1)
+    assert (vault.resolve_file(files["1"])["loc_start"], vault.resolve_file(files["1"])["icon_data_end"]) == (105, 255)
+
+def test_legacy_offsets_adopted():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_header({"vault": {"file_size": 0, "amount_of_files": 0}, "map": {"file_ids": [1], "directory_ids": [], "note_ids": [2],
+        "directories": {}, "notes": {"2": {"id": 2, "owned_by_file": 1, "loc_start": 300, "loc_end": 320}},
+        "files": {"1": {"id": 1, "size": 1, "loc_start": 100, "loc_end": 200, "checksum": "", "file_encrypted": False, "path": 0,
+                        "metadata": {"name": "file1", "type": "txt", "data_created": 0, "last_modified": 0,
+                                     "icon_data_start": 200, "icon_data_end": 250, "note_id": 2}}}}})
+    record = vault.get_map()["files"]["1"]
+    assert "loc_start" not in record and "icon_data_start" not in record["metadata"]
+    assert vault.get_map()["extents"] == {str(record["extent"]): [100, 200], str(record["metadata"]["icon_extent"]): [200, 250],
+                                          str(vault.get_map()["notes"]["2"]["extent"]): [300, 320]}
+    file = vault.get_id_from_vault(1, "F", as_dict=False)[1]
+    assert (file.get_loc_start(), file.get_icon_data_start(), file.get_icon_data_end()) == (100, 200, 250)
+    # The whole header is written again by the next commit
+    assert {"F0", "V0", "E0"} <= vault.get_dirty_pages()
+
+def test_children_index():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    folder = lambda the_id, path, name: {"id": the_id, "name": name, "path": path, "data_created": 0, "last_modified": 0, "files": []}
+    a_file = lambda the_id, path: {"id": the_id, "size": 1, "loc_start": the_id, "loc_end": the_id + 1, "icon_data_start": -1,
+                                   "icon_data_end": -1, "checksum": "", "file_encrypted": False, "path": path,
+                                   "metadata": {"name": f"file{the_id}", "type": "txt", "data_created": 0, "last_modified": 0, "note_id": -1}}
+    vault.set_header({"vault": {"file_size": 0, "amount_of_files": 0}, "map": {"file_ids": [1], "directory_ids": [10], "note_ids": [],
+        "directories": {"10": folder(10, 0, "docs")}, "notes": {}, "files": {}}})
+    vault.insert_file(a_file(1, 0))
+    # Built at set_header
+    assert [item.get_id() for item in vault.get_items_under_id(0)] == [10, 1]
+    vault.insert_folder(folder(11, 10, "inner"))
+    vault.get_map()["directory_ids"].append(11)
+    for file_id, folder_id in ((2, 10), (3, 11)):
+        vault.insert_file(a_file(file_id, folder_id))
+        vault.get_map()["file_ids"].append(file_id)
+        vault.insert_file_id_into_folder(folder_id, file_id)
+    assert [item.get_id() for item in vault.get_items_under_id(10)] == [11, 2]
+    assert [f.get_id() for f in vault.get_files_belonging_in_id(10)] == [2, 3]
+    assert vault.determine_if_dir_path_is_valid(["docs", "inner"]) == (True, 11)
+    # Moving a file follows its new path
+    moved = vault.get_id_from_vault(2, "F", as_dict=False)[1]
+    moved.set_path(0)
+    vault.update_file_in_vault(moved)
+    assert [item.get_id() for item in vault.get_items_under_id(0)] == [10, 1, 2]
+    assert [item.get_id() for item in vault.get_items_under_id(10)] == [11]
+    vault.remove_file(3)
+    assert vault.safe_remove_folder(11) == (True, "")
+    assert vault.get_items_under_id(10) == [] and vault.get_items_under_id(11) == []
+
+def test_free_extents():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_header({"vault": {"file_size": 300}, "map": {"files": {}, "notes": {}}})
+    assert vault.get_free_extents() == []
+    assert vault.needs_compaction() == False
+    vault.mark_extents_free([(100, 150), (200, 250)])
+    vault.mark_extents_free([(150, 200)])
+    assert vault.get_free_extents() == [[100, 250]]
+    assert vault.get_free_size() == 150
+    assert vault.needs_compaction() == True
+    vault.set_compaction_ratio(0.5)
+    assert vault.needs_compaction() == False
+    vault.data_index_shifter(50, True, 120)
+    assert vault.get_free_extents() == [[100, 250]]
+    vault.data_index_shifter(50, False, 50)
+    assert vault.get_free_extents() == [[50, 200]]
+
+def test_compact():
+    f_name = "test_compact_vault"
+    with open(f_name, "wb") as f:
+        f.write(b'AAAAxxxxBBBBxxCCCC')
+    vault = Vault(password="password123", vault_path=f_name)
+    vault.set_header({"vault": {"file_size": 12}, "map": {
+        "files": {"1": {"id": 1, "extent": 1, "metadata": {"icon_extent": -1}}, "2": {"id": 2, "extent": 2, "metadata": {"icon_extent": -1}}},
+        "notes": {"3": {"id": 3, "extent": 3}},
+        "extents": {"1": [0, 4], "2": [8, 12], "3": [14, 18]}, "extent_ids": [1, 2, 3]
+    }})
+    vault.mark_extents_free([(4, 8)])
+    assert vault.compact(extra_ranges=[(12, 14)]) == 6
+    with open(f_name, "rb") as f:
+        assert f.read() == b'AAAABBBBCCCC'
+    assert vault.get_free_extents() == []
+    assert vault.resolve_file(vault.get_map()["files"]["2"])["loc_start"] == 4
+    assert vault.resolve_note(vault.get_map()["notes"]["3"]) == {"id": 3, "loc_start": 8, "loc_end": 12}
+    assert vault.compact() == 0
+    os.remove(f_name)
+
+def test_allocate_extent():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_header({"vault": {"file_size": 0}, "map": {"files": {}, "notes": {}}})
+    vault.mark_extents_free([(100, 200), (300, 340), (500, 530)])
+    assert vault.allocate_extent(0) == -1
+    assert vault.allocate_extent(500) == -1
+    assert vault.allocate_extent(30) == 500
+    assert vault.allocate_extent(30) == 300
+    assert vault.get_free_extents() == [[100, 200], [330, 340]]
+    assert vault.allocate_extent(50) == 100
+    assert vault.get_free_extents() == [[150, 200], [330, 340]]
+
+def test_truncate_free_tail():
+    f_name = "test_truncate_free_tail_vault"
+    with open(f_name, "wb") as f:
+        f.write(b'AAAAxxxxBBBBxxxx')
+    vault = Vault(password="password123", vault_path=f_name)
+    vault.set_header({"vault": {"file_size": 8}, "map": {"files": {}, "notes": {}}})
+    vault.mark_extents_free([(4, 8)])
+    assert vault.truncate_free_tail() == 0
+    vault.mark_extents_free([(12, 16)])
+    assert vault.truncate_free_tail() == 4
+    assert vault.get_free_extents() == [[4, 8]]
+    with open(f_name, "rb") as f:
+        assert f.read() == b'AAAAxxxxBBBB'
+    vault.close_vault_file()
+    os.remove(f_name)
+
+def test_truncate_untracked_tail():
+    f_name = "test_truncate_untracked_tail_vault"
+    with open(f_name, "wb") as f:
+        f.write(b'AAAAxxxxBBBBxxxxyy')
+    vault = Vault(password="password123", vault_path=f_name)
+    vault.set_header({"vault": {"file_size": 8}, "map": {"files": {"0": {"id": 0, "extent": 1, "metadata": {}}, "1": {"id": 1, "extent": 2, "metadata": {}}}, "notes": {},
+                                                               "extents": {"1": [0, 4], "2": [8, 12]}, "extent_ids": [1, 2]}})
+    vault.mark_extents_free([(4, 8), (12, 16), (20, 24)])
+    assert vault.truncate_free_tail() == 0
+    assert vault.get_free_extents() == [[4, 8], [12, 16]]
+    assert vault.truncate_untracked_tail() == 6
+    assert vault.get_free_extents() == [[4, 8]]
+    assert vault.get_vault_file().get_size() == 12
+    vault.close_vault_file()
+    os.remove(f_name)
+
+def test_calculate_header_growth():
+    vault = Vault(password="password123", vault_path="/path/to/vault")
+    vault.set_header({"vault": {"file_size": 0}, "map": {"files": {}, "notes": {}}})
+    assert vault.calculate_header_growth(100, 10_000) == 10_100
+    assert vault.calculate_header_growth(100, 100) == 100 + VAULT_BUFFER_LIMIT
+    assert vault.calculate_header_growth(100, HEADER_GROWTH_CAP * 4) == 100 + HEADER_GROWTH_CAP
+    vault.get_header()["vault"]["header_growth_factor"] = 0.5
+    vault.get_header()["vault"]["header_growth_cap"] = 8192
+    assert vault.calculate_header_growth(100, 10_000) == 5_100
+    assert vault.calculate_header_growth(100, 100_000) == 8_292
+
+def test_update_vault_file_header_growth():
+    f_name = "test_update_vault_file_header_growth"
+    with open(f_name, "wb") as f:
+        f.write(form_superblock())
+        f.write(add_magic_into_header(encrypt_header("Tester@123", serialize_dict(formulate_header("tester", ".tester")))))
+    header_padder(f_name, VAULT_BUFFER_LIMIT)
+    with open(f_name, "ab") as f:
+        f.write(b'DATA' * 1000)
+    vault = Vault(password="Tester@123", vault_path=f_name)
+    vault.set_header(vault.validate_header(decrypt_header(f_name, "Tester@123")))
+    data_start = find_header_pointers(f_name)[4] + len(MAGIC_HEADER_END)
+    vault.mark_extents_free([(data_start + i * 8, data_start + i * 8 + 4) for i in range(500)])
+    vault.update_vault_file()
+    assert vault.get_metrics() == {"header_shifts" : 1, "header_shifted_bytes" : 4000 + len(MAGIC_HEADER_END)}
+    region = find_header_pointers(f_name)
+    assert region[0] + region[1] >= 2 * VAULT_BUFFER_LIMIT
+    # Growing by a little more fits inside the reserved region
+    vault.mark_extents_free([(0, 2)])
+    vault.update_vault_file()
+    assert vault.get_metrics()["header_shifts"] == 1
+    on_disk = vault.validate_header(decrypt_header(f_name, "Tester@123"))
+    assert on_disk["map"]["free_extents"][1][0] == region[4] + len(MAGIC_HEADER_END)
+    os.remove(f_name)
+
+def test_journal_commit_and_replay():
+    f_name = "test_journal_commit_and_replay"
+    with open(f_name, "wb") as f:
+        f.write(form_superblock())
+        f.write(add_magic_into_header(encrypt_header("Tester@123", serialize_dict(formulate_header("tester", ".tester")))))
+    header_padder(f_name, VAULT_BUFFER_LIMIT)
+    with open(f_name, "ab") as f:
+        f.write(b'DATA' * 10)
+    vault = Vault(password="Tester@123", vault_path=f_name)
+    vault.set_header(vault.validate_header(decrypt_header(f_name, "Tester@123")))
+    assert vault.open_journal() == 0
+    vault.mark_extents_free([(0, 2)])
+    vault.commit()
+    # Journaled, not yet in the header
+    assert vault.validate_header(decrypt_header(f_name, "Tester@123"))["map"]["free_extents"] == []
+    size = vault.record_append()
+    with open(f_name, "ab") as f:
+        f.write(b'ORPHAN')
+    # The session dies here, the next one replays the delta and drops the orphaned append
+    recovered = Vault(password="Tester@123", vault_path=f_name)
+    recovered.set_header(recovered.validate_header(decrypt_header(f_name, "Tester@123")))
+    assert recovered.open_journal() == 2
+    assert os.path.getsize(f_name) == size
+    assert recovered.validate_header(decrypt_header(f_name, "Tester@123"))["map"]["free_extents"] == [[0, 2]]
+    recovered.close_journal()
+    assert not os.path.exists(f_name + ".journal")
+    vault.close_vault_file()
+    recovered.close_vault_file()
+    os.remove(f_name)
+
+def test_metadata_pages():
+    f_name = "test_metadata_pages"
+    with open(f_name, "wb") as f:
+        f.write(form_superblock({"layout" : VAULT_LAYOUT_TAIL}))
+    commit_header_into_slot(f_name, encrypt_header("Tester@123", serialize_dict(formulate_header("tester", ".tester"))))
+    vault = Vault(password="Tester@123", vault_path=f_name)
+    vault.set_header(vault.validate_header(decrypt_header(f_name, "Tester@123")))
+    for _ in range(METADATA_PAGE_SPAN * 2):
+        file_id = vault.generate_id("F")
+        vault.insert_file({"id": file_id, "size": 10, "loc_start": 0, "loc_end": 0, "icon_data_start": 0, "icon_data_end": 0, "checksum": "ab",
+                           "file_encrypted": False, "path": 0,
+                           "metadata": {"name": f"file_{file_id}", "type": "txt", "data_created": 1, "last_modified": 2, "note_id": -1}})
+    vault.update_vault_file()
+    pages = dict(vault.get_map()["pages"])
+    assert set(pages) == {"F0", "F1", "F2"}
+    # The header slot holds the page table only, the files come from the pages
+    assert b"file_1" not in decrypt_header(f_name, "Tester@123")
+    reopened = Vault(password="Tester@123", vault_path=f_name)
+    reopened.set_header(reopened.validate_header(decrypt_header(f_name, "Tester@123")))
+    assert reopened.get_map()["files"] == vault.get_map()["files"]
+    assert reopened.get_map()["file_ids"] == vault.get_map()["file_ids"]
+    # A change rewrites its page only, the replaced page becomes free
+    file = reopened.get_id_from_vault(1, "F", as_dict=False)[1]
+    file.get_metadata()["name"] = "renamed"
+    reopened.update_file_in_vault(file)
+    assert reopened.get_dirty_pages() == {"F0"}
+    reopened.update_vault_file()
+    assert reopened.get_dirty_pages() == set()
+    assert reopened.get_map()["pages"]["F1"] == pages["F1"] and reopened.get_map()["pages"]["F2"] == pages["F2"]
+    assert tuple(pages["F0"]) in [tuple(extent) for extent in reopened.get_free_extents()]
+    assert reopened.get_last_related_idx() >= max(end for _, end in reopened.get_map()["pages"].values())
+    again = Vault(password="Tester@123", vault_path=f_name)
+    assert again.validate_header(decrypt_header(f_name, "Tester@123"))["map"]["files"]["1"]["metadata"]["name"] == "renamed"
+    # A tampered page is detected
+    with open(f_name, "rb+") as f:
+        f.seek(pages["F1"][0] + 100)
+        f.write(b'X')
+    tampered = Vault(password="Tester@123", vault_path=f_name)
+    with pytest.raises(JsonWithInvalidData):
+        tampered.validate_header(decrypt_header(f_name, "Tester@123"))
+    for item in (vault, reopened, again, tampered):
+        item.close_vault_file()
+    os.remove(f_name)
@@ -1,6 +1,12 @@
 import pytest
-from crypto.encryptors import encrypt_bytes, generate_password_token
-from crypto.decryptors import decrypt_bytes, resolve_token
+import os
+from crypto.encryptors import encrypt_bytes, generate_password_token, encrypt_bytes_v2, encrypt_file_bytes, wrap_key, generate_protection
+from crypto.decryptors import decrypt_bytes, resolve_token, decrypt_stream, extract_file_from_vault, decrypt_stream_v2, \
+    decrypt_file_bytes, read_file_range, decrypt_file_pieces, unwrap_key, resolve_protection
+from crypto.pool import shutdown_crypto_pool
+from utils.constants import FILE_FORMAT_V1, FILE_FORMAT_V2, CHUNK_LIMIT
+from crypto.utils import generate_aes_key, get_checksum, derive_master_key, apply_protection_layer
+from file_handle.vault_file import VaultFile
 from custom_exceptions.classes_exceptions import DecryptionFailure
 
 @pytest.fixture
@@ -27,3 +33,190 @@ def test_decrypt_bytes_failure():
     with pytest.raises(DecryptionFailure):
         decrypt_bytes(encrypted_data, password)
 
+
+def split_into_pieces(data : bytes, size : int) -> list[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+def test_decrypt_stream(sample_data):
+    data, password = sample_data
+    data = data * 100
+    encrypted_data = encrypt_bytes(data, password)
+    for size in [1, 7, 16, 33, len(encrypted_data)]:
+        assert b''.join(decrypt_stream(split_into_pieces(encrypted_data, size), password)) == data
+    # CBC has no tag, a wrong key passes the padding check once in a while but never gives the data back
+    try:
+        assert b''.join(decrypt_stream(split_into_pieces(encrypted_data, 7), "wrong_password")) != data
+    except DecryptionFailure:
+        pass
+    with pytest.raises(DecryptionFailure):
+        list(decrypt_stream([encrypted_data[:40]], password))
+    assert list(decrypt_stream([], password)) == []
+
+def test_decrypt_stream_segments(sample_data):
+    data, password = sample_data
+    salt, iv = os.urandom(16), os.urandom(16)
+    key = generate_aes_key(password=password.encode(), salt=salt, key_length=32)
+    # Segments the way files are added into the vault, 64 bytes of data become 80 bytes of ciphertext
+    segments = split_into_pieces(data * 5, 64)
+    encrypted_data = salt + iv + b''.join(encrypt_bytes(segment, password, key=key, iv=iv) for segment in segments)
+    for size in [5, 16, 80, 1000]:
+        assert b''.join(decrypt_stream(split_into_pieces(encrypted_data, size), password, 80)) == data * 5
+
+def test_extract_file_from_vault(sample_data):
+    data, password = sample_data
+    data = data * 1000
+    encrypted_data = encrypt_bytes(encrypt_bytes(data, "file_password"), password)
+    f_name = "test_extract_file_from_vault"
+    with open(f_name, "wb") as f:
+        f.write(b'HEADER' + encrypted_data + b'FOOTER')
+    with VaultFile(f_name) as vault_file:
+        res = extract_file_from_vault(vault_file, 6, 6 + len(encrypted_data), "test_extracted_file", password, "file_password",
+                                      get_checksum(data, is_file=False), memory_limit=256)
+        assert res == (True, "")
+        with open("test_extracted_file", "rb") as f:
+            assert f.read() == data
+        os.remove("test_extracted_file")
+        # A checksum mismatch leaves nothing behind
+        res = extract_file_from_vault(vault_file, 6, 6 + len(encrypted_data), "test_extracted_file", password, "file_password", "0" * 16)
+        assert res[0] == False
+        assert not os.path.exists("test_extracted_file")
+        # A wrong file password fails on the padding, or on the checksum when the padding happens to be valid
+        try:
+            res = extract_file_from_vault(vault_file, 6, 6 + len(encrypted_data), "test_extracted_file", password, "wrong_password",
+                                          get_checksum(data, is_file=False))
+            assert res[0] == False
+        except DecryptionFailure:
+            pass
+        assert not os.path.exists("test_extracted_file")
+        assert [name for name in os.listdir() if name.endswith(".part")] == []
+    os.remove(f_name)
+
+def test_decrypt_file_bytes(sample_data):
+    data, password = sample_data
+    data = data * 100
+    for version in (FILE_FORMAT_V1, FILE_FORMAT_V2):
+        encrypted_data = encrypt_file_bytes(data, password, version)
+        assert decrypt_file_bytes(encrypted_data, password, version) == data
+        # Re-encrypting in the same format keeps the size, which a password change relies on
+        assert len(encrypt_file_bytes(data, "other_password", version)) == len(encrypted_data)
+    # Unlike v1, every v2 chunk carries a tag so a wrong password always fails
+    with pytest.raises(DecryptionFailure):
+        decrypt_file_bytes(encrypted_data, "wrong_password", FILE_FORMAT_V2)
+    # Files keyed by the master key of the session
+    master_key = derive_master_key(password, os.urandom(16))
+    for version in (FILE_FORMAT_V1, FILE_FORMAT_V2):
+        encrypted_data = encrypt_file_bytes(data, master_key, version)
+        assert decrypt_file_bytes(encrypted_data, master_key, version) == data
+    with pytest.raises(DecryptionFailure):
+        decrypt_file_bytes(encrypted_data, password, FILE_FORMAT_V2)
+
+def test_decrypt_stream_v2(sample_data):
+    data, password = sample_data
+    data = data * 100
+    encrypted_data = encrypt_bytes_v2(data, password, chunk_size=64)
+    for size in (1, 37, 80, 1000, len(encrypted_data)):
+        pieces = split_into_pieces(encrypted_data, size)
+        assert b''.join(decrypt_stream_v2(pieces, password, len(encrypted_data))) == data
+    # Tampering with a chunk, swapping chunks or cutting the file at a chunk border is detected
+    tampered = bytearray(encrypted_data)
+    tampered[100] ^= 1
+    swapped = encrypted_data[:37] + encrypted_data[117:197] + encrypted_data[37:117] + encrypted_data[197:]
+    truncated = encrypted_data[:37 + 80 * 10]
+    for broken in (bytes(tampered), swapped, truncated):
+        with pytest.raises(DecryptionFailure):
+            b''.join(decrypt_stream_v2([broken], password, len(broken)))
+
+def test_read_file_range(sample_data):
+    data, password = sample_data
+    data = data * 100
+    encrypted_data = encrypt_bytes_v2(data, password, chunk_size=64)
+    f_name = "test_read_file_range"
+    with open(f_name, "wb") as f:
+        f.write(b'HEADER' + encrypted_data + b'FOOTER')
+    with VaultFile(f_name) as vault_file:
+        end = 6 + len(encrypted_data)
+        for offset, length in [(0, 10), (60, 10), (64, 64), (3000, 500), (len(data) - 5, 100), (len(data), 10)]:
+            assert read_file_range(vault_file, 6, end, password, offset, length) == data[offset:offset + length]
+        with pytest.raises(DecryptionFailure):
+            read_file_range(vault_file, 6, end, "wrong_password", 0, 10)
+    os.remove(f_name)
+
+def test_extract_file_from_vault_v2(sample_data):
+    data, password = sample_data
+    data = data * 1000
+    encrypted_data = encrypt_bytes_v2(encrypt_bytes(data, "file_password"), password, chunk_size=100)
+    f_name = "test_extract_file_from_vault_v2"
+    with open(f_name, "wb") as f:
+        f.write(b'HEADER' + encrypted_data + b'FOOTER')
+    with VaultFile(f_name) as vault_file:
+        res = extract_file_from_vault(vault_file, 6, 6 + len(encrypted_data), "test_extracted_file_v2", password, "file_password",
+                                      get_checksum(data, is_file=False), memory_limit=256, format_version=FILE_FORMAT_V2)
+        assert res == (True, "")
+        with open("test_extracted_file_v2", "rb") as f:
+            assert f.read() == data
+        os.remove("test_extracted_file_v2")
+    os.remove(f_name)
+
+def test_decrypt_file_pieces(sample_data):
+    _, password = sample_data
+    # Past a v1 segment, so ranges start both at segment borders and in the middle of segments
+    data = os.urandom(CHUNK_LIMIT + 10 * 1024 * 1024 + 7)
+    f_name = "test_decrypt_file_pieces"
+    try:
+        for version in (FILE_FORMAT_V1, FILE_FORMAT_V2):
+            encrypted_data = encrypt_file_bytes(data, password, version)
+            with open(f_name, "wb") as f:
+                f.write(b'HEADER' + encrypted_data + b'FOOTER')
+            with VaultFile(f_name) as vault_file:
+                end = 6 + len(encrypted_data)
+                for workers in (1, 2):
+                    pieces = decrypt_file_pieces(vault_file, 6, end, password, version, memory_limit=16 * 1024 * 1024, workers=workers)
+                    assert b''.join(pieces) == data
+        # A tampered chunk in the middle of the file fails inside the pool as well
+        with open(f_name, "r+b") as f:
+            f.seek(6 + len(encrypted_data) // 2)
+            f.write(b'X')
+        with VaultFile(f_name) as vault_file:
+            with pytest.raises(DecryptionFailure):
+                b''.join(decrypt_file_pieces(vault_file, 6, end, password, FILE_FORMAT_V2, workers=2))
+    finally:
+        shutdown_crypto_pool()
+        os.remove(f_name)
+
+def test_unwrap_key():
+    key, kek = os.urandom(32), os.urandom(32)
+    wrapped = wrap_key(key, kek)
+    assert unwrap_key(wrapped, kek) == key
+    # Wrapping twice never gives the same bytes
+    assert wrap_key(key, kek) != wrapped
+    tampered = bytearray(wrapped)
+    tampered[20] ^= 1
+    for broken, broken_kek in ((wrapped, os.urandom(32)), (bytes(tampered), kek), (wrapped[:30], kek)):
+        with pytest.raises(DecryptionFailure):
+            unwrap_key(broken, broken_kek)
+
+def test_resolve_protection(sample_data):
+    data, password = sample_data
+    protection, key = generate_protection(password)
+    assert resolve_protection(password, protection) == key
+    with pytest.raises(DecryptionFailure):
+        resolve_protection("wrong_password", protection)
+    # A file with the protection layer extracts by the record in its metadata
+    data = data * 1000
+    encrypted_data = encrypt_bytes_v2(apply_protection_layer(key, data, 0), password, chunk_size=100)
+    f_name = "test_resolve_protection"
+    with open(f_name, "wb") as f:
+        f.write(b'HEADER' + encrypted_data + b'FOOTER')
+    with VaultFile(f_name) as vault_file:
+        end = 6 + len(encrypted_data)
+        res = extract_file_from_vault(vault_file, 6, end, "test_extracted_protected", password, password, get_checksum(data, is_file=False),
+                                      format_version=FILE_FORMAT_V2, protection=protection)
+        assert res == (True, "")
+        with open("test_extracted_protected", "rb") as f:
+            assert f.read() == data
+        os.remove("test_extracted_protected")
+        with pytest.raises(DecryptionFailure):
+            extract_file_from_vault(vault_file, 6, end, "test_extracted_protected", password, "wrong_password",
+                                    format_version=FILE_FORMAT_V2, protection=protection)
+        assert not os.path.exists("test_extracted_protected")
+    os.remove(f_name)
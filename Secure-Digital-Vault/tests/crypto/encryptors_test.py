@@ -1,6 +1,15 @@
 import pytest
-from crypto.encryptors import encrypt_bytes, encrypt_header, encrypt_footer, generate_password_token
-from crypto.decryptors import decrypt_bytes, resolve_token
+import os
+import hashlib
+from crypto.encryptors import encrypt_bytes, encrypt_header, encrypt_footer, generate_password_token, encrypt_file_pieces, \
+    encrypt_file_bytes, generate_protection, reencrypt_file_copy
+from crypto.decryptors import decrypt_bytes, resolve_token, decrypt_file_bytes, decrypt_stream
+from crypto.utils import generate_aes_key, form_file_v2_header, protection_stream
+from file_handle.vault_file import VaultFile
+from crypto.pool import shutdown_crypto_pool
+from threads.mutable_boolean import MutableBoolean
+from utils.constants import FILE_FORMAT_V1, FILE_FORMAT_V2, CRYPTO_TASK_SIZE
+from custom_exceptions.classes_exceptions import DecryptionFailure
 
 @pytest.fixture
 def sample_data():
@@ -42,3 +51,113 @@ def test_generate_password_token(sample_data):
     d2 = decrypt_bytes(encrypted, resolve_token(token))
     assert d1 == data
     assert d2 == data
+
+def test_encrypt_file_pieces(sample_data):
+    _, password = sample_data
+    data = os.urandom(20 * 1024 * 1024 + 5)
+    f_name = "test_encrypt_file_pieces"
+    with open(f_name, "wb") as f:
+        f.write(data)
+    salt = os.urandom(16)
+    header = form_file_v2_header(salt, os.urandom(8))
+    key = generate_aes_key(password=password.encode(), salt=salt, key_length=32)
+    results = []
+    try:
+        # The pool must give back exactly what the calling thread produces, in the same order, whether it reads or is handed the bytes
+        for workers in (1, 2):
+            for sha256 in (None, hashlib.sha256()):
+                with open(f_name, "rb") as f:
+                    pieces = list(encrypt_file_pieces(f, len(data), key, MutableBoolean(True), header=header, workers=workers,
+                                                      in_flight_limit=1, sha256=sha256))
+                results.append(header + b''.join(pieces))
+                if sha256:
+                    assert sha256.digest() == hashlib.sha256(data).digest()
+        # v1 hashes the same way
+        sha256 = hashlib.sha256()
+        with open(f_name, "rb") as f:
+            list(encrypt_file_pieces(f, len(data), key, MutableBoolean(True), iv=os.urandom(16), sha256=sha256))
+        assert sha256.digest() == hashlib.sha256(data).digest()
+    finally:
+        shutdown_crypto_pool()
+        os.remove(f_name)
+    assert len(set(results)) == 1
+    assert decrypt_file_bytes(results[-1], password, FILE_FORMAT_V2) == data
+
+def test_reencrypt_file_copy(sample_data):
+    _, password = sample_data
+    # Past a single task, so the pool decrypts ahead of the writes
+    data = os.urandom(2 * CRYPTO_TASK_SIZE + 7)
+    protection, key = generate_protection(password)
+    layer = lambda pieces: protection_stream(pieces, key)
+    f_name = "test_reencrypt_file_copy"
+    try:
+        for version in (FILE_FORMAT_V1, FILE_FORMAT_V2):
+            encrypted_data = encrypt_file_bytes(data, password, version)
+            end = 6 + len(encrypted_data)
+            with open(f_name, "wb") as f:
+                f.write(b'HEADER' + encrypted_data + b'FOOTER')
+            with VaultFile(f_name) as vault_file:
+                for workers in (1, 2):
+                    # Without a free extent the copy is appended, under a new salt, and the old copy is left as it is
+                    size = vault_file.get_size()
+                    old_copy = bytes(vault_file.read(6, end))
+                    start, new_end = reencrypt_file_copy(vault_file, 6, end, password, version, layer, workers=workers)
+                    assert (start, new_end) == (size, size + len(encrypted_data))
+                    assert bytes(vault_file.read(6, end)) == old_copy
+                    layered = decrypt_file_bytes(bytes(vault_file.read(start, new_end)), password, version)
+                    assert len(layered) == len(data) and layered != data
+                    # Into a free extent, removing the layer again
+                    released = []
+                    copy = reencrypt_file_copy(vault_file, start, new_end, password, version, layer, allocate=lambda size: 6,
+                                               release=released.extend, workers=workers)
+                    assert copy == (6, end) and released == []
+                    assert decrypt_file_bytes(bytes(vault_file.read(6, end)), password, version) == data
+                    vault_file.rollback(size)
+                assert vault_file.read(0, 6) == b'HEADER' and vault_file.read(end, end + 6) == b'FOOTER'
+
+                # A failure partway through the copy gives back what it took, and the file still extracts
+                def failing(pieces):
+                    pieces = list(layer(pieces))
+                    yield from pieces[:-1]
+                    raise DecryptionFailure("Injected failure")
+                size = vault_file.get_size()
+                with pytest.raises(DecryptionFailure):
+                    reencrypt_file_copy(vault_file, 6, end, password, version, failing)
+                assert vault_file.get_size() == size
+                released = []
+                vault_file.append(bytes(len(encrypted_data)))
+                with pytest.raises(DecryptionFailure):
+                    reencrypt_file_copy(vault_file, 6, end, password, version, failing, allocate=lambda size: end + 6,
+                                        release=released.extend)
+                assert released == [(end + 6, end + 6 + len(encrypted_data))]
+                assert bytes(vault_file.read(end + 6, end + 70)) != bytes(64)  # Bytes of the copy were written before the failure
+                assert decrypt_file_bytes(bytes(vault_file.read(6, end)), password, version) == data
+        # A file encrypted with a password before the layer existed shrinks, its salt, iv and padding go away
+        small_data = data[:1000]
+        encrypted_data = encrypt_file_bytes(encrypt_bytes(small_data, "file_password"), password, FILE_FORMAT_V2)
+        end = 6 + len(encrypted_data)
+        with open(f_name, "wb") as f:
+            f.write(b'HEADER' + encrypted_data + b'FOOTER' + bytes(len(encrypted_data)))
+        with VaultFile(f_name) as vault_file:
+            released = []
+            start, new_end = reencrypt_file_copy(vault_file, 6, end, password, FILE_FORMAT_V2,
+                                                 lambda pieces: decrypt_stream(pieces, "file_password"),
+                                                 allocate=lambda size: end + 6, release=released.extend)
+            assert start == end + 6 and new_end - start < len(encrypted_data)
+            assert released == [(new_end, end + 6 + len(encrypted_data))]
+            assert decrypt_file_bytes(bytes(vault_file.read(start, new_end)), password, FILE_FORMAT_V2) == small_data
+            # A wrong vault password fails before anything is kept
+            size = vault_file.get_size()
+            with pytest.raises(DecryptionFailure):
+                reencrypt_file_copy(vault_file, start, new_end, "wrong_password", FILE_FORMAT_V2, lambda pieces: pieces)
+            assert vault_file.get_size() == size
+            assert decrypt_file_bytes(bytes(vault_file.read(start, new_end)), password, FILE_FORMAT_V2) == small_data
+            # Moved onto another key the copy keeps the size of the file
+            data_key = os.urandom(32)
+            moved = reencrypt_file_copy(vault_file, start, new_end, password, FILE_FORMAT_V2, lambda pieces: pieces, new_password=data_key)
+            assert moved[1] - moved[0] == new_end - start
+            assert decrypt_file_bytes(bytes(vault_file.read(moved[0], moved[1])), data_key, FILE_FORMAT_V2) == small_data
+            assert decrypt_file_bytes(bytes(vault_file.read(start, new_end)), password, FILE_FORMAT_V2) == small_data
+    finally:
+        shutdown_crypto_pool()
+        os.remove(f_name)
@@ -1,5 +1,9 @@
 import pytest
-from crypto.utils import is_password_strong, xor_magic, get_checksum, calc_easy_checksum, generate_aes_key, calculate_encrypted_chunk_size, to_base64, from_base64
+from crypto.utils import is_password_strong, xor_magic, get_checksum, calc_easy_checksum, generate_aes_key, calculate_encrypted_chunk_size, calculate_encrypted_file_size, to_base64, from_base64, \
+    calculate_v2_file_size, form_file_v2_header, parse_file_v2_header, locate_file_v2_chunk, FILE_V2_HEADER_SIZE, \
+    derive_master_key, derive_file_key, derive_password_key, calibrate_kdf, derive_protection_keys, apply_protection_layer, \
+    protection_stream, KDF_MINIMUM_COST
+from utils.constants import KDF_PBKDF2_SHA1, KDF_PBKDF2_SHA256, KDF_SCRYPT
 from utils.helpers import count_digits
 
 @pytest.fixture
@@ -50,6 +54,76 @@ def test_calculate_encrypted_chunk_size():
     encrypted_chunk_size = calculate_encrypted_chunk_size(given_size)
     assert encrypted_chunk_size is not None
 
+def test_calculate_encrypted_file_size():
+    assert calculate_encrypted_file_size(100) == calculate_encrypted_chunk_size(100)
+    assert calculate_encrypted_file_size(96) == calculate_encrypted_chunk_size(96)
+    # Two full chunks of 64 and one of 10, each padded on its own
+    assert calculate_encrypted_file_size(138, chunk_size=64) == 32 + 80 + 80 + 16
+
+def test_calculate_v2_file_size():
+    assert calculate_v2_file_size(0) == FILE_V2_HEADER_SIZE
+    # Two full chunks of 64 and one of 10, each with its tag
+    assert calculate_v2_file_size(138, chunk_size=64) == FILE_V2_HEADER_SIZE + 138 + 3 * 16
+    assert locate_file_v2_chunk(2, chunk_size=64) == FILE_V2_HEADER_SIZE + 2 * 80
+
+def test_form_file_v2_header():
+    header = form_file_v2_header(b'S' * 16, b'N' * 8, 64)
+    assert len(header) == FILE_V2_HEADER_SIZE
+    assert parse_file_v2_header(header) == {"chunk_size" : 64, "salt" : b'S' * 16, "nonce_prefix" : b'N' * 8}
+    assert parse_file_v2_header(header[:-1]) == {}
+    assert parse_file_v2_header(b'X' + header[1:]) == {}
+
+def test_derive_file_key(sample_password):
+    salt, other_salt = b'S' * 16, b'T' * 16
+    # The password goes through PBKDF2 like files always did
+    assert derive_file_key(sample_password, salt) == generate_aes_key(sample_password.encode(), salt, 32)
+    master_key = derive_master_key(sample_password, salt)
+    assert master_key == generate_aes_key(sample_password.encode(), salt, 32)
+    file_key = derive_file_key(master_key, salt)
+    assert len(file_key) == 32
+    assert file_key not in (master_key, derive_file_key(master_key, other_salt), derive_file_key(bytes(32), salt))
+    assert file_key == derive_file_key(master_key, salt)
+
+def test_derive_password_key(sample_password):
+    salt = b'S' * 16
+    # PBKDF2-SHA1 with 1000 iterations is what vaults which do not record their KDF use
+    assert derive_password_key(sample_password, salt, KDF_PBKDF2_SHA1, 1000) == generate_aes_key(sample_password.encode(), salt, 32)
+    keys = {derive_password_key(sample_password, salt, algorithm, cost)
+            for algorithm, cost in [(KDF_PBKDF2_SHA1, 2000), (KDF_PBKDF2_SHA256, 1000), (KDF_SCRYPT, 10)]}
+    assert len(keys) == 3 and all(len(key) == 32 for key in keys)
+    kdf = {"algorithm" : KDF_SCRYPT, "cost" : 10}
+    assert derive_master_key(sample_password, salt, kdf) == derive_password_key(sample_password, salt, KDF_SCRYPT, 10)
+    with pytest.raises(ValueError):
+        derive_password_key(sample_password, salt, 9, 1000)
+    with pytest.raises(ValueError):
+        derive_password_key(sample_password, salt, KDF_PBKDF2_SHA256, 0)
+    # Passwords and their keys are not kept around by a cache
+    assert not hasattr(derive_password_key, "cache_info")
+
+def test_calibrate_kdf():
+    # A target no machine reaches falls back to the least cost
+    for algorithm in (KDF_PBKDF2_SHA256, KDF_SCRYPT):
+        kdf = calibrate_kdf(algorithm, target_time=0)
+        assert kdf["algorithm"] == algorithm
+        assert kdf["cost"] == KDF_MINIMUM_COST[algorithm]
+        assert len(kdf["salt"]) == 16
+    assert calibrate_kdf(KDF_PBKDF2_SHA256, target_time=0.05)["cost"] > KDF_MINIMUM_COST[KDF_PBKDF2_SHA256]
+
+def test_apply_protection_layer(sample_password):
+    protection = {"algorithm" : KDF_PBKDF2_SHA256, "cost" : 1000, "salt" : b'\x01' * 16}
+    key, check = derive_protection_keys(sample_password, protection)
+    assert derive_protection_keys("other_password", protection)[1] != check
+    data = bytes(range(256)) * 40
+    layered = apply_protection_layer(key, data, 0)
+    # The layer keeps the size and removes itself
+    assert len(layered) == len(data) and layered != data
+    assert apply_protection_layer(key, layered, 0) == data
+    # Any offset can be processed on its own, in pieces of any size
+    for offset, length in [(0, 16), (5, 100), (4000, 7), (len(data) - 3, 3)]:
+        assert apply_protection_layer(key, data[offset:offset + length], offset) == layered[offset:offset + length]
+    pieces = [data[i:i + 33] for i in range(0, len(data), 33)]
+    assert b''.join(protection_stream(pieces, key)) == layered
+
 def test_to_base64():
     data = b'TestData'
     base64_str = to_base64(data)
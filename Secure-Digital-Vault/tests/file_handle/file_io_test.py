@@ -1,5 +1,6 @@
 import pytest
 from file_handle.file_io import *
+import file_handle.file_io as file_io
 from utils.constants import *
 from config import BASE_DIR
 import os
@@ -25,6 +26,26 @@ def test_header_points(sample_vault):
     vault_path,vault_password,vault_tokens = sample_vault
     assert [4096, 336, 0, 344, 4448] == find_header_pointers(vault_path)
 
+def test_find_magics():
+    f_name = "test_find_magics"
+    with open(f_name, 'wb') as f:
+        f.write(b'xx@one@xxxx@two@xxxx@one@xx@three@')
+    assert find_magics(f_name, [b'@one@', b'@two@', b'@three@', b'@four@']) == [7, 16, 34, -1]
+    assert find_magics(f_name, [b'@one@', b'@two@'], read_reverse=True) == [25, 16]
+    assert find_magics(f_name, [b'@one@'], start_from_index=8) == [25]
+    # Windows smaller than the file, with magic bytes crossing the window boundaries
+    assert find_magics(f_name, [b'@one@', b'@two@', b'@three@'], chunk_size=8) == [7, 16, 34]
+    assert find_magics(f_name, [b'@one@', b'@two@', b'@three@'], read_reverse=True, chunk_size=8) == [25, 16, 34]
+    assert find_magics(f_name, [b'@three@'], chunk_size=4) == [-1]
+    os.remove(f_name)
+
+def test_find_magics_empty_file():
+    f_name = "test_find_magics_empty_file"
+    with open(f_name, 'wb') as f:
+        f.write(b'')
+    assert find_magics(f_name, [b'@one@', b'@two@']) == [-1, -1]
+    os.remove(f_name)
+
 def test_add_magic_into_header():
     invalid_header = b'suresixteenbytes'
     magic_block = add_magic_into_header(invalid_header)
@@ -51,16 +72,26 @@ def test_append_bytes_into_file():
     assert res == (True, '', 16, 26)
     os.remove(f_name)
 
-def test_stabilize_after_failed_append():
-    f_name = "stabilize_after_failed_append"
+def test_write_bytes_into_file_at():
+    f_name = "test_write_bytes_into_file_at"
+    with open(f_name, 'wb') as f:
+        f.write(b'sure____enbytes!')
+    res = write_bytes_into_file_at(f_name, b'sixte', 4)
+    assert res == (True, '', 4, 9)
+    with open(f_name, 'rb') as f:
+        assert f.read() == b'suresixtenbytes!'
+    assert write_bytes_into_file_at(f_name, b'x', 100)[0] == False
+    os.remove(f_name)
+
+def test_rollback_append():
+    f_name = "test_rollback_append"
     with open(f_name, 'wb') as f:
         f.write(b'suresixteenbytes')
-    res = stabilize_after_failed_append(f_name, "Appending Failure. appended: 10", 16)
-    block = b''
+    assert rollback_append(f_name, 6) == 6
     with open(f_name, 'rb') as f:
-        block = f.read()
-    assert b'suresi' == block
-    assert res == "Appending Failure. appended: 10, Size is: '10', removal of appended 10 bytes makes new vault size: 6 while the old size was: 16"
+        assert f.read() == b'suresi'
+    assert rollback_append(f_name, 16) == 6
+    assert rollback_append(f_name, 0) == -1
     os.remove(f_name)
 
 def test_override_bytes_in_file_no_push_default():
@@ -118,7 +149,63 @@ def test_override_bytes_in_file_push_default_chunk():
     fd.seek(0,0)
     data = fd.read()
     fd.close()
-    assert data == b'some_ten_bytes!_bytes_heree'
+    assert data == b'some_ten_bytes!_bytes_here'
+    os.remove(f_name)
+
+def test_override_bytes_in_file_push_small_chunk():
+    f_name = "test_override_bytes_in_file_push_small_chunk"
+    with open(f_name, 'wb') as f:
+        f.write(b'test123')
+    fd = override_bytes_in_file(file_path=f_name, given_bytes=b'okay', byte_loss=4, at_location=4, chunk_size=2)
+    fd.seek(0,0)
+    data = fd.read()
+    fd.close()
+    assert data == b'testokay123'
+    os.remove(f_name)
+
+def test_override_bytes_in_file_partial_loss():
+    f_name = "test_override_bytes_in_file_partial_loss"
+    with open(f_name, 'wb') as f:
+        f.write(b'AAAABBBBCC')
+    fd = override_bytes_in_file(file_path=f_name, given_bytes=b'XXXXXX', byte_loss=2, at_location=4, chunk_size=1)
+    fd.seek(0,0)
+    data = fd.read()
+    fd.close()
+    assert data == b'AAAAXXXXXXCC'
+    os.remove(f_name)
+
+def test_move_bytes_in_file():
+    f_name = "test_move_bytes_in_file"
+    with open(f_name, 'wb') as f:
+        f.write(b'0123456789')
+    with open(f_name, 'rb+') as f:
+        assert move_bytes_in_file(f, 2, 4, 6, bytearray(3)) == "buffer"
+        f.seek(0)
+        assert f.read() == b'0123234567'
+        move_bytes_in_file(f, 4, 1, 6, bytearray(4))
+        f.seek(0)
+        assert f.read() == b'0234567567'
+    os.remove(f_name)
+
+def test_move_bytes_in_file_large_distance():
+    f_name = "test_move_bytes_in_file_large_distance"
+    data = os.urandom(COPY_RANGE_MIN * 3)
+    with open(f_name, 'wb') as f:
+        f.write(data)
+    fd = override_bytes_in_file(f_name, b'x' * COPY_RANGE_MIN, COPY_RANGE_MIN, at_location=10, chunk_size=4096)
+    fd.seek(0)
+    result = fd.read()
+    fd.close()
+    assert result == data[:10] + b'x' * COPY_RANGE_MIN + data[10:]
+    with open(f_name, 'rb+') as f:
+        path = move_bytes_in_file(f, 10 + COPY_RANGE_MIN, 10, len(data) - 10)
+        assert path == ("copy_file_range" if probe_delete_capabilities(f_name)["copy_file_range"] else "buffer")
+        f.truncate(len(data))
+        f.seek(0)
+        assert f.read() == data
+        # The buffer is reported when the kernel is not allowed, and nothing when there is nothing to move
+        assert move_bytes_in_file(f, 10, 10 + COPY_RANGE_MIN, 10, use_kernel=False) == "buffer"
+        assert move_bytes_in_file(f, 10, 10, 10) == "none"
     os.remove(f_name)
 
 def test_delete_footer_and_hint(sample_vault):
@@ -136,3 +223,72 @@ def test_delete_footer_and_hint(sample_vault):
 def test_get_hint(sample_vault):
     vault_path,vault_password,vault_tokens = sample_vault
     assert get_hint(vault_path) == "TestHint"
+
+def test_delete_bytes_from_file():
+    f_name = "test_delete_bytes_from_file"
+    with open(f_name, 'wb') as f:
+        f.write(b'0123456789')
+    assert delete_bytes_from_file(f_name, 3, 2) == 7
+    with open(f_name, 'rb') as f:
+        assert f.read() == b'0156789'
+    assert delete_bytes_from_file(f_name, 3, 4, chunk_size=1) == 4
+    with open(f_name, 'rb') as f:
+        assert f.read() == b'0156'
+    os.remove(f_name)
+
+def test_remove_range_from_file_paths():
+    f_name = "test_remove_range_from_file_paths"
+    capabilities = probe_delete_capabilities(f_name)
+    block = capabilities["block_size"]
+    data = os.urandom(block * 8 + 123)
+    with open(f_name, 'wb') as f:
+        f.write(data)
+    with open(f_name, 'rb+') as f:
+        # Unaligned start with a block sized length
+        path = remove_range_from_file(f, 100, block)
+        assert path == ("collapse_range" if capabilities["collapse_range"] else "buffer")
+        expected = data[:100] + data[100+block:]
+        f.seek(0)
+        assert f.read() == expected
+        assert remove_range_from_file(f, 10, 7) == "buffer"
+        expected = expected[:10] + expected[17:]
+        assert remove_range_from_file(f, 50, 20, use_kernel=False) == "buffer"
+        expected = expected[:50] + expected[70:]
+        assert remove_range_from_file(f, len(expected) - 5, 5) == "truncate"
+        expected = expected[:-5]
+        f.seek(0)
+        assert f.read() == expected
+    os.remove(f_name)
+
+def test_remove_range_from_file_kernel_fallback(monkeypatch):
+    f_name = "test_remove_range_from_file_kernel_fallback"
+    data = os.urandom(COPY_RANGE_MIN * 3)
+    with open(f_name, 'wb') as f:
+        f.write(data)
+    def unsupported(*args):
+        raise OSError("copy_file_range is not supported")
+    monkeypatch.setattr(file_io, "copy_range_in_file", unsupported)
+    with open(f_name, 'rb+') as f:
+        # The buffer which ran after the kernel failed is reported, not the kernel
+        assert remove_range_from_file(f, 10, COPY_RANGE_MIN + 1) == "buffer"
+        f.seek(0)
+        assert f.read() == data[:10] + data[11 + COPY_RANGE_MIN:]
+    os.remove(f_name)
+
+def test_merge_ranges():
+    assert merge_ranges([(10, 20), (0, 5), (5, 8), (15, 30), (40, 40)]) == [(0, 8), (10, 30)]
+    assert merge_ranges([]) == []
+
+def test_compact_ranges_in_file():
+    f_name = "test_compact_ranges_in_file"
+    with open(f_name, 'wb') as f:
+        f.write(b'0123456789abcdefghij')
+    progress = []
+    with open(f_name, 'rb+') as f:
+        removed = compact_ranges_in_file(f, [(12, 14), (2, 4), (3, 6), (18, 25)], chunk_size=3,
+                                         progress=lambda moved, total: progress.append((moved, total)))
+        f.seek(0)
+        assert f.read() == b'016789abefgh'
+    assert removed == 8
+    assert progress[-1] == (10, 10)
+    os.remove(f_name)
@@ -0,0 +1,209 @@
+import pytest
+from file_handle.superblock import *
+from file_handle.file_io import find_header_pointers, find_footer_pointers, find_magic, add_magic_into_header, header_padder, \
+    add_footer_and_hint, delete_footer_and_hint, get_hint, commit_header_into_slot, compact_ranges_in_file
+from classes.vault import Vault
+from crypto.encryptors import encrypt_header, encrypt_footer
+from crypto.decryptors import decrypt_header, decrypt_footer
+from crypto.utils import derive_master_key
+from custom_exceptions.classes_exceptions import DecryptionFailure
+from utils.serialization import serialize_dict, formulate_header, formulate_footer
+from utils.constants import *
+import os
+
+def create_test_vault(f_name : str, with_superblock : bool) -> str:
+    header = encrypt_header("Tester@123", serialize_dict(formulate_header("tester", ".tester")))
+    with open(f_name, "wb") as f:
+        if with_superblock:
+            f.write(form_superblock())
+        f.write(add_magic_into_header(header))
+    header_padder(f_name, VAULT_BUFFER_LIMIT)
+    update_superblock(f_name, header_pointers_as_fields(find_header_pointers(f_name)))
+    footer = encrypt_footer("Tester@123", serialize_dict(formulate_footer()))
+    add_footer_and_hint(f_name, footer, "TestHint")
+    return f_name
+
+def create_tail_test_vault(f_name : str) -> str:
+    with open(f_name, "wb") as f:
+        f.write(form_superblock({"layout" : VAULT_LAYOUT_TAIL}))
+    commit_header_into_slot(f_name, encrypt_header("Tester@123", serialize_dict(formulate_header("tester", ".tester"))))
+    footer = encrypt_footer("Tester@123", serialize_dict(formulate_footer()))
+    add_footer_and_hint(f_name, footer, "TestHint")
+    return f_name
+
+@pytest.fixture
+def tail_vault():
+    f_name = create_tail_test_vault("test_tail_vault")
+    yield f_name
+    os.remove(f_name)
+
+@pytest.fixture
+def superblock_vault():
+    f_name = create_test_vault("test_superblock_vault", with_superblock=True)
+    yield f_name
+    os.remove(f_name)
+
+@pytest.fixture
+def legacy_vault():
+    f_name = create_test_vault("test_legacy_vault", with_superblock=False)
+    yield f_name
+    os.remove(f_name)
+
+def test_form_and_parse_superblock():
+    fields = {key : i * 10 for i, key in enumerate(SUPERBLOCK_KEYS)}
+    block = form_superblock(fields)
+    assert len(block) == SUPERBLOCK_SIZE
+    parsed = parse_superblock(block)
+    assert parsed["version"] == SUPERBLOCK_VERSION
+    for key in SUPERBLOCK_KEYS:
+        assert parsed[key] == fields[key]
+    assert parse_superblock(block, trailer=True) == {}
+    assert parse_superblock(form_superblock(fields, trailer=True), trailer=True)["pad_length"] == fields["pad_length"]
+    assert parse_superblock(form_superblock())["header_start"] == -1
+
+def test_parse_corrupted_superblock():
+    block = bytearray(form_superblock({"header_start" : 264}))
+    block[20] ^= 0xFF
+    assert parse_superblock(bytes(block)) == {}
+    assert parse_superblock(b'short') == {}
+
+def test_superblock_pointers(superblock_vault):
+    superblock = get_superblock(superblock_vault)
+    assert superblock["is_trailer"] == False
+    assert superblock["header_start"] == SUPERBLOCK_SIZE + len(MAGIC_HEADER_START)
+    assert superblock["pad_length"] == VAULT_BUFFER_LIMIT
+    res = find_header_pointers(superblock_vault)
+    assert res[2] == SUPERBLOCK_SIZE
+    assert res[3] + len(MAGIC_HEADER_PAD) == find_magic(superblock_vault, xor_magic(MAGIC_HEADER_PAD))
+    assert res[4] + len(MAGIC_HEADER_END) == find_magic(superblock_vault, xor_magic(MAGIC_HEADER_END))
+    footer = find_footer_pointers(superblock_vault)
+    assert footer[0] == find_magic(superblock_vault, xor_magic(MAGIC_LOG_START), read_reverse=True)
+    assert footer[1] == superblock["footer_start"] + superblock["footer_length"]
+    assert get_hint(superblock_vault) == "TestHint"
+    assert read_superblock(superblock_vault, from_trailer=True)["hint_start"] == superblock["hint_start"]
+
+def test_superblock_decrypt(superblock_vault):
+    header = decrypt_header(superblock_vault, "Tester@123")
+    assert b'"vault_name": "tester"' in header
+    footer = decrypt_footer(superblock_vault, "Tester@123")
+    assert footer[0] == get_superblock(superblock_vault)["footer_start"]
+
+def test_superblock_footer_delete(superblock_vault):
+    footer_start = find_footer_pointers(superblock_vault)[0]
+    delete_footer_and_hint(superblock_vault, footer_start)
+    assert read_superblock(superblock_vault, from_trailer=True) == {}
+    assert get_superblock(superblock_vault)["footer_start"] == -1
+    assert find_footer_pointers(superblock_vault) == (-1, -1)
+    assert find_header_pointers(superblock_vault)[2] == SUPERBLOCK_SIZE
+
+def test_superblock_mismatch_falls_back(superblock_vault):
+    update_superblock(superblock_vault, {"header_start" : 5, "hint_start" : 7})
+    assert find_header_pointers(superblock_vault)[2] == SUPERBLOCK_SIZE
+    assert get_hint(superblock_vault) == "TestHint"
+
+def test_legacy_vault_trailer(legacy_vault):
+    assert read_superblock(legacy_vault) == {}
+    superblock = get_superblock(legacy_vault)
+    assert superblock["is_trailer"] == True
+    assert find_header_pointers(legacy_vault)[2] == 0
+    assert get_hint(legacy_vault) == "TestHint"
+    footer_start = find_footer_pointers(legacy_vault)[0]
+    delete_footer_and_hint(legacy_vault, footer_start)
+    assert get_superblock(legacy_vault) == {}
+    assert find_header_pointers(legacy_vault)[2] == 0
+
+def test_tail_vault_pointers(tail_vault):
+    superblock = get_superblock(tail_vault)
+    assert is_tail_layout(superblock)
+    assert superblock["current_slot"] == 0
+    assert get_header_slots(superblock)[0][0] == SUPERBLOCK_SIZE
+    assert get_header_slots(superblock)[1][0] == -1
+    res = find_header_pointers(tail_vault)
+    assert res[2] == SUPERBLOCK_SIZE
+    assert res[4] + len(MAGIC_HEADER_END) == SUPERBLOCK_SIZE + superblock["slot_a_length"]
+    assert b'"vault_name": "tester"' in decrypt_header(tail_vault, "Tester@123")
+    assert get_hint(tail_vault) == "TestHint"
+
+def test_tail_vault_commit_flips_slots(tail_vault):
+    delete_footer_and_hint(tail_vault, find_footer_pointers(tail_vault)[0])
+    with open(tail_vault, "ab") as f:
+        f.write(b'DATA' * 100)
+    header = formulate_header("renamed", ".tester")
+    assert commit_header_into_slot(tail_vault, encrypt_header("Tester@123", serialize_dict(header))) == (-1, -1)
+    superblock = get_superblock(tail_vault)
+    assert superblock["current_slot"] == 1
+    assert superblock["slot_b_start"] == superblock["slot_a_start"] + superblock["slot_a_length"] + 400
+    assert b'"vault_name": "renamed"' in decrypt_header(tail_vault, "Tester@123")
+    # A broken current slot falls back to the previous commit
+    with open(tail_vault, "rb+") as f:
+        f.seek(superblock["slot_b_start"])
+        f.write(b'\0' * 8)
+    assert b'"vault_name": "tester"' in decrypt_header(tail_vault, "Tester@123")
+
+def test_tail_vault_slot_relocates(tail_vault):
+    delete_footer_and_hint(tail_vault, find_footer_pointers(tail_vault)[0])
+    header = formulate_header("tester", ".tester")
+    commit_header_into_slot(tail_vault, encrypt_header("Tester@123", serialize_dict(header)))
+    slot_a = get_header_slots(get_superblock(tail_vault))[0]
+    header["map"]["free_extents"] = [[i, i + 1] for i in range(0, 4000, 2)]
+    released = commit_header_into_slot(tail_vault, encrypt_header("Tester@123", serialize_dict(header)))
+    assert released == (slot_a[0], slot_a[0] + slot_a[1])
+    superblock = get_superblock(tail_vault)
+    assert superblock["current_slot"] == 0
+    assert superblock["slot_a_start"] > superblock["slot_b_start"]
+    assert decrypt_header(tail_vault, "Tester@123").count(b'[') > 2000
+
+def test_tail_vault_update_vault_file(tail_vault):
+    delete_footer_and_hint(tail_vault, find_footer_pointers(tail_vault)[0])
+    data_start = os.path.getsize(tail_vault)
+    with open(tail_vault, "ab") as f:
+        f.write(b'AAAAxxxxBBBB')
+    vault = Vault(password="Tester@123", vault_path=tail_vault)
+    vault.set_header(vault.validate_header(decrypt_header(tail_vault, "Tester@123")))
+    vault.mark_extents_free([(i, i + 1) for i in range(0, 4000, 2)])
+    vault.update_vault_file()
+    assert vault.get_metrics()["header_shifts"] == 0
+    with open(tail_vault, "rb") as f:
+        f.seek(data_start)
+        assert f.read(12) == b'AAAAxxxxBBBB'
+    slot_b = get_header_slots(get_superblock(tail_vault))[1]
+    assert slot_b[0] == data_start + 12
+    assert vault.get_last_related_idx() == slot_b[0] + slot_b[1]
+    # Removing data in front of the slots moves them
+    with open(tail_vault, "rb+") as f:
+        compact_ranges_in_file(f, [(data_start + 4, data_start + 8)])
+    vault.data_index_remap([(data_start + 4, data_start + 8)])
+    assert get_header_slots(get_superblock(tail_vault))[1][0] == slot_b[0] - 4
+    assert len(vault.validate_header(decrypt_header(tail_vault, "Tester@123"))["map"]["free_extents"]) == 2000
+
+def test_kdf_fields():
+    kdf = {"algorithm" : KDF_PBKDF2_SHA256, "cost" : 1000, "salt" : b'\xff' * 8 + b'\x01' * 8}
+    parsed = parse_superblock(form_superblock({"layout" : VAULT_LAYOUT_TAIL, **kdf_as_fields(kdf)}))
+    assert kdf_from_fields(parsed) == kdf
+    # Superblocks written before the KDF fields existed
+    assert kdf_from_fields(parse_superblock(form_superblock({"layout" : VAULT_LAYOUT_TAIL}))) == {}
+
+def test_kdf_vault():
+    f_name = "test_kdf_vault"
+    kdf = {"algorithm" : KDF_PBKDF2_SHA256, "cost" : 1000, "salt" : os.urandom(16)}
+    master_key = derive_master_key("Tester@123", kdf["salt"], kdf)
+    try:
+        with open(f_name, "wb") as f:
+            f.write(form_superblock({"layout" : VAULT_LAYOUT_TAIL, **kdf_as_fields(kdf)}))
+        commit_header_into_slot(f_name, encrypt_header(master_key, serialize_dict(formulate_header("tester", ".tester"))))
+        add_footer_and_hint(f_name, encrypt_footer(master_key, serialize_dict(formulate_footer())), "TestHint")
+        assert kdf_from_fields(get_superblock(f_name)) == kdf
+        header = decrypt_header(f_name, "Tester@123")
+        assert b'"vault_name": "tester"' in header
+        assert decrypt_footer(f_name, "Tester@123")[0] == get_superblock(f_name)["footer_start"]
+        with pytest.raises(DecryptionFailure):
+            decrypt_header(f_name, "Wrong@123")
+        # The vault keeps the master key for its commits, and needs no 'key_salt' in the header
+        vault = Vault(password="Tester@123", vault_path=f_name)
+        vault.set_header(vault.validate_header(header))
+        assert vault.get_vault_secret() == vault.get_master_key() == master_key
+        assert "key_salt" not in vault.get_header()["vault"]
+        vault.update_vault_file()
+        assert b'"vault_name": "tester"' in decrypt_header(f_name, "Tester@123")
+    finally:
+        os.remove(f_name)
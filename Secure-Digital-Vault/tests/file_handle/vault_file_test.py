@@ -0,0 +1,66 @@
+import os
+import threading
+from file_handle.vault_file import VaultFile
+
+def test_vault_file_append_and_read():
+    f_name = "test_vault_file_append"
+    with open(f_name, "wb") as f:
+        f.write(b'HEADER')
+    with VaultFile(f_name) as vault_file:
+        assert vault_file.get_size() == 6
+        assert vault_file.append(b'AAAA') == (True, "", 6, 10)
+        assert vault_file.append(b'BBBB') == (True, "", 10, 14)
+        assert vault_file.read(6, 14, chunk_size=3) == b'AAAABBBB'
+        assert vault_file.read(12, 20) == b'BB'
+        assert vault_file.write_at(b'CC', 8) == (True, "", 8, 10)
+        assert vault_file.write_at(b'CC', 20)[0] == False
+        # Changes through the path are picked up once refreshed
+        with open(f_name, "ab") as f:
+            f.write(b'DD')
+        assert vault_file.get_size() == 14
+        assert vault_file.refresh_size() == 16
+    assert vault_file.is_closed()
+    with open(f_name, "rb") as f:
+        assert f.read() == b'HEADERAACCBBBBDD'
+    os.remove(f_name)
+
+def test_vault_file_shift_truncate_and_rollback():
+    f_name = "test_vault_file_shift"
+    with open(f_name, "wb") as f:
+        f.write(b'test123')
+    with VaultFile(f_name) as vault_file:
+        vault_file.shift(b'okay', 4, at_location=4)
+        assert vault_file.get_size() == 11
+        assert vault_file.read(0, 11) == b'testokay123'
+        assert vault_file.rollback(0) == -1
+        assert vault_file.rollback(20) == 11
+        assert vault_file.rollback(8) == 8
+        assert vault_file.truncate(9) == -1
+        assert vault_file.truncate(4) == 4
+        assert os.path.getsize(f_name) == 4
+    os.remove(f_name)
+
+def test_vault_file_read_chunks():
+    f_name = "test_vault_file_read_chunks"
+    with open(f_name, "wb") as f:
+        f.write(b'HEADERAAAABBBBCC')
+    with VaultFile(f_name) as vault_file:
+        assert list(vault_file.read_chunks(6, 20, 4)) == [b'AAAA', b'BBBB', b'CC']
+        # A reader left in the middle does not hold the session, another thread still reads and writes
+        reader = vault_file.read_chunks(6, 16, 4)
+        assert next(reader) == b'AAAA'
+        done = []
+        def other_window():
+            done.append(vault_file.write_at(b'XX', 0)[0])
+            done.append(bytes(vault_file.read(0, 2)))
+        thread = threading.Thread(target=other_window, daemon=True)
+        thread.start()
+        thread.join(timeout=5)
+        assert done == [True, b'XX']
+        # Resumed and closed from another thread than the one which started it
+        resumed = []
+        thread = threading.Thread(target=lambda: (resumed.append(next(reader)), reader.close()), daemon=True)
+        thread.start()
+        thread.join(timeout=5)
+        assert resumed == [b'BBBB']
+    os.remove(f_name)
@@ -0,0 +1,35 @@
+import mmap
+import os
+from utils.extractors import get_file_from_vault, map_file_from_vault
+
+def create_test_file(f_name : str) -> bytes:
+    data = os.urandom(mmap.ALLOCATIONGRANULARITY * 3 + 100)
+    with open(f_name, "wb") as f:
+        f.write(data)
+    return data
+
+def test_get_file_from_vault():
+    f_name = "test_get_file_from_vault"
+    data = create_test_file(f_name)
+    assert get_file_from_vault(f_name, 10, 5000) == data[10:5000]
+    assert get_file_from_vault(f_name, 10, 5000, chunk_size_to_read=7) == data[10:5000]
+    assert get_file_from_vault(f_name, len(data) - 5, len(data) + 50) == data[-5:]
+    with open(f_name, "rb") as f:
+        assert get_file_from_vault(f_name, 0, len(data), fd=f) == data
+        assert not f.closed
+    os.remove(f_name)
+
+def test_map_file_from_vault():
+    f_name = "test_map_file_from_vault"
+    data = create_test_file(f_name)
+    start = mmap.ALLOCATIONGRANULARITY + 3
+    with map_file_from_vault(f_name, start, start + 5000) as view:
+        assert view == data[start:start + 5000]
+    with map_file_from_vault(f_name, start, len(data) + 50) as view:
+        assert bytes(view) == data[start:]
+        kept = view[:16]
+    # A slice outliving the block does not break it
+    assert kept == data[start:start + 16]
+    with map_file_from_vault(f_name, len(data), len(data) + 5) as view:
+        assert len(view) == 0
+    os.remove(f_name)
@@ -1,6 +1,12 @@
 import pytest
 import json
-from utils.serialization import formulate_header, formulate_footer, serialize_dict, deserialize_dict
+import struct
+from utils.serialization import formulate_header, formulate_footer, serialize_dict, deserialize_dict, diff_header, apply_header_delta, \
+    serialize_header, iter_serialize_header, deserialize_header, deserialize_header_stream, is_binary_header, get_page_key, get_page_keys, \
+    get_delta_page_keys, form_metadata_page, form_header_root, form_pages_view, merge_metadata_page, HEADER_PREFIX, HEADER_BLOCK, \
+    HEADER_BLOCK_STRINGS, HEADER_BLOCK_VAULT, HEADER_BLOCK_FILES, HEADER_BLOCK_NOTES, HEADER_BLOCK_END, HEADER_FILE_RECORD_V1, \
+    HEADER_NOTE_RECORD_V1, HEADER_NO_STRING
+from utils.constants import METADATA_PAGE_SPAN, MAGIC_HEADER_BINARY
 
 def test_formulate_header():
     vault_name = "TestVault"
@@ -20,6 +26,7 @@ def test_formulate_header():
     assert result["map"]["directories"] == {}
     assert result["map"]["files"] == {}
     assert result["map"]["notes"] == {}
+    assert result["map"]["extent_ids"] == [] and result["map"]["extents"] == {}
 
 def test_formulate_footer():
     result = formulate_footer()
@@ -39,3 +46,112 @@ def test_deserialize_dict():
     result = deserialize_dict(bytes_dict)
     assert isinstance(result, dict)
     assert result == test_dict
+
+def test_diff_and_apply_header_delta():
+    old = formulate_header("TestVault", ".vault")
+    new = deserialize_dict(serialize_dict(old))
+    assert diff_header(old, new) == {}
+    new["vault"]["amount_of_files"] = 1
+    new["map"]["file_ids"].append(7)
+    new["map"]["files"]["7"] = {"loc_start": 10, "loc_end": 20}
+    new["map"]["free_extents"] = [[20, 30]]
+    delta = diff_header(old, new)
+    assert delta["vault"] == {"amount_of_files": 1}
+    assert delta["map"]["file_ids"] == {"add": [7], "remove": []}
+    assert delta["map"]["files"] == {"set": {"7": {"loc_start": 10, "loc_end": 20}}, "remove": []}
+    assert "directories" not in delta["map"]
+    replayed = deserialize_dict(serialize_dict(old))
+    apply_header_delta(replayed, deserialize_dict(serialize_dict(delta)))
+    assert replayed == new
+
+    newer = deserialize_dict(serialize_dict(new))
+    newer["map"]["file_ids"].remove(7)
+    newer["map"]["files"].pop("7")
+    apply_header_delta(replayed, diff_header(new, newer))
+    assert replayed == newer
+
+def sample_header() -> dict:
+    header = formulate_header("TestVault", ".vault")
+    header["map"]["file_ids"] = [3, 8]
+    header["map"]["directory_ids"] = [0]
+    header["map"]["note_ids"] = [4]
+    header["map"]["free_extents"] = [[100, 200], [300, 310]]
+    header["map"]["extent_ids"] = [1, 2, 3]
+    header["map"]["extents"] = {"1": [5, 50], "2": [50, 60], "3": [1, 2]}
+    for file_id, extent_id in ((3, 1), (8, 2)):
+        header["map"]["files"][str(file_id)] = {"id": file_id, "size": 10, "extent": extent_id, "checksum": "ab-cd",
+                                                "file_encrypted": file_id == 8, "path": 0, "metadata": {"name": "ñame", "type": "txt",
+                                                "data_created": 1, "last_modified": 2, "icon_extent": -1, "note_id": -1}}
+    header["map"]["files"]["8"]["metadata"].update({"format_version": 2, "key_version": 3, "protection": {"algorithm": 2, "cost": 1000,
+                                                                                                      "salt": "AAAA", "check": "AAAA"}})
+    header["map"]["directories"]["0"] = {"id": 0, "name": "/", "path": 0, "data_created": 1, "last_modified": 1, "files": [3, 8]}
+    header["map"]["notes"]["4"] = {"id": 4, "owned_by_file": 3, "extent": 3, "type": "txt", "checksum": "ef"}
+    return header
+
+def test_serialize_header():
+    header = sample_header()
+    serialized = serialize_header(header)
+    assert is_binary_header(serialized) and not is_binary_header(serialize_dict(header))
+    assert len(serialized) < len(serialize_dict(header))
+    header["vault"]["header_size"] = len(serialized)
+    assert deserialize_header(serialized) == header
+    # Blocks of a single record, decoded from pieces of a few bytes
+    pieces = b''.join(iter_serialize_header(header, batch_size=1))
+    assert deserialize_header_stream(pieces[i:i + 3] for i in range(0, len(pieces), 3)) == dict(header, vault=dict(header["vault"], header_size=len(pieces)))
+    # Headers written as JSON are still read
+    assert deserialize_header(serialize_dict(header)) == header
+
+def test_deserialize_header_version_1():
+    # Version 1 records held the offsets of the items, they are decoded as they were and adopted by Vault.set_header
+    strings = [b'{"vault_name": "TestVault"}', b'ab', b'name', b'txt']
+    data = HEADER_PREFIX.pack(MAGIC_HEADER_BINARY.encode(), 1) + HEADER_BLOCK.pack(HEADER_BLOCK_STRINGS, len(strings)) + \
+        struct.pack(">4I", *map(len, strings)) + b''.join(strings) + HEADER_BLOCK.pack(HEADER_BLOCK_VAULT, 0) + struct.pack(">I", 0) + \
+        HEADER_BLOCK.pack(HEADER_BLOCK_FILES, 1) + HEADER_FILE_RECORD_V1.pack(3, 10, 5, 50, 0, 1, 2, 50, 60, 4, 1, 2, 3, HEADER_NO_STRING, 1, 2, 0) + \
+        HEADER_BLOCK.pack(HEADER_BLOCK_NOTES, 1) + HEADER_NOTE_RECORD_V1.pack(4, 3, 1, 2, 3, 1) + HEADER_BLOCK.pack(HEADER_BLOCK_END, 0)
+    header = deserialize_header(data)
+    assert header["vault"] == {"vault_name": "TestVault"}
+    assert header["map"]["files"]["3"] == {"id": 3, "size": 10, "loc_start": 5, "loc_end": 50, "checksum": "ab", "file_encrypted": True,
+                                           "path": 0, "metadata": {"name": "name", "type": "txt", "data_created": 1, "last_modified": 2,
+                                           "icon_data_start": 50, "icon_data_end": 60, "note_id": 4, "format_version": 2}}
+    assert header["map"]["notes"]["4"] == {"id": 4, "owned_by_file": 3, "loc_start": 1, "loc_end": 2, "type": "txt", "checksum": "ab"}
+
+def test_serialize_header_fallback():
+    header = sample_header()
+    header["map"]["files"]["3"]["unexpected"] = True
+    serialized = serialize_header(header)
+    assert not is_binary_header(serialized)
+    assert deserialize_header(serialized) == header
+
+def test_deserialize_header_invalid():
+    serialized = serialize_header(sample_header())
+    for invalid in (serialized[:-5], serialized[:8] + b'\x09' + serialized[9:], b'xxx'):
+        with pytest.raises(ValueError):
+            deserialize_header(invalid)
+
+def test_metadata_pages():
+    header = sample_header()
+    far = METADATA_PAGE_SPAN * 3 + 1
+    header["map"]["file_ids"].append(far)
+    header["map"]["files"][str(far)] = dict(header["map"]["files"]["3"], id=far)
+    assert get_page_key("F", far) == "F3" and get_page_key("V", 4) == "V0"
+    assert get_page_keys(header["map"]) == {"F0", "F3", "D0", "V0", "E0"}
+    root = form_header_root(header)
+    assert root["vault"] is header["vault"] and set(root["map"]) == {"free_extents"}
+    # Merging every page back into the root gives the map again
+    merged = {"file_ids" : [], "directory_ids" : [], "note_ids" : [], "extent_ids" : [], "files" : {}, "directories" : {}, "notes" : {},
+              "extents" : {}}
+    for key in sorted(get_page_keys(header["map"])):
+        page = form_metadata_page(header["map"], key)
+        merge_metadata_page(merged, key, deserialize_header(serialize_header(page)))
+    assert all(merged[key] == header["map"][key] for key in merged)
+    assert form_metadata_page(header["map"], "F1") == {"vault" : {}, "map" : {}}
+    view = form_pages_view(header, {"V0"})
+    assert view["map"]["notes"] == header["map"]["notes"] and view["map"]["files"] == {} and view["map"]["free_extents"] == [[100, 200], [300, 310]]
+    with pytest.raises(ValueError):
+        merge_metadata_page(merged, "F1", form_metadata_page(header["map"], "F0"))
+    # Only the pages of the changed items are in a delta
+    changed = deserialize_dict(serialize_dict(header))
+    changed["map"]["files"][str(far)]["metadata"]["name"] = "renamed"
+    changed["map"]["note_ids"].remove(4)
+    changed["map"]["notes"].pop("4")
+    assert get_delta_page_keys(changed["map"], diff_header(header, changed)) == {"F3", "V0"}
@@ -7,12 +7,24 @@ MAGIC_HEADER_PAD = "@padhdr@"
 MAGIC_LOG_START = "$bgnlog$"
 MAGIC_LOG_END = "$endlog$"
 
+MAGIC_SUPERBLOCK = "@supblk@"
+MAGIC_SUPERBLOCK_TRAILER = "@suptrl@"
+MAGIC_JOURNAL = "@jrnlhd@"
+MAGIC_FILE_V2 = "@filev2@"
+MAGIC_HEADER_BINARY = "@hdrbin@"
+
 # All keys representing the structure of the vault
 
 VAULT_CREATION_KEYS = ["Vault Name" , "Vault Extension", "Vault Location", "Password Hint"]
 VAULT_KEYS = ["vault_name", "vault_extension", "header_size", "file_size", "trusted_timestamp", "amount_of_files", "is_vault_encrypted"]
 MAP_KEYS = ["file_ids", "directory_ids" , "note_ids", "directories", "files", "notes"]
+OPTIONAL_VAULT_KEYS = ["compaction_ratio", "header_growth_factor", "header_growth_cap"]  # Vaults created before these keys existed do not have them
+OPTIONAL_MAP_KEYS = ["free_extents", "pages", "extent_ids", "extents"]   # "pages" only in the header of tail layout vaults, see form_header_root
 FOOTER_KEYS = ["error_log", "session_log"]
+SUPERBLOCK_KEYS = ["header_start", "header_length", "pad_start", "pad_length",
+                   "footer_start", "footer_length", "hint_start", "hint_length",
+                   "layout", "slot_a_start", "slot_a_length", "slot_b_start", "slot_b_length", "current_slot",
+                   "kdf_algorithm", "kdf_cost", "kdf_salt_high", "kdf_salt_low"]
 
 # Utils
 TREE_COLUMNS = ["Name", "Type", "Size", "Data Created", "Data Modified"]
@@ -20,6 +32,39 @@ DEFAULT_ICON_SIZE = 16      # 16x16
 NOTE_LIMIT = 7_340_032      # 7MB
 CHUNK_LIMIT = 52_428_800    # 50MB
 VAULT_BUFFER_LIMIT = 4096   # 4KB
+COMPACTION_RATIO = 0.25     # Compact once the free extents reach 25% of the vault data
+HEADER_GROWTH_FACTOR = 1.0  # When the header outgrows its region, grow the region by 100% of its size
+HEADER_GROWTH_CAP = 16_777_216  # 16MB, most the header region grows by at once on top of the overflow
+FILE_FORMAT_V1 = 1          # salt | iv | AES-CBC segments of CHUNK_LIMIT, each padded on its own with the same key and iv
+FILE_FORMAT_V2 = 2          # header | AES-GCM chunks of FILE_V2_CHUNK_SIZE, each with its own nonce and tag
+NEW_FILE_FORMAT = FILE_FORMAT_V2
+FILE_V2_CHUNK_SIZE = 1_048_576  # 1MB of data per chunk, any chunk can be decrypted on its own
+FILE_KEY_PASSWORD = 1       # The file key is derived from the vault password with PBKDF2, once per file
+FILE_KEY_MASTER = 2         # The file key is derived with HKDF from the session master key and the salt of the file
+FILE_KEY_DATA = 3           # The file key is derived with HKDF from the random data key of the vault, which the master key wraps
+NEW_FILE_KEY = FILE_KEY_DATA
+KDF_PBKDF2_SHA1 = 1         # PBKDF2-HMAC-SHA1, cost is the iteration count. Vaults without KDF fields use it with 1000 iterations
+KDF_PBKDF2_SHA256 = 2       # PBKDF2-HMAC-SHA256, cost is the iteration count
+KDF_SCRYPT = 3              # scrypt with r=8 and p=1, cost is log2 of N
+NEW_VAULT_KDF = KDF_PBKDF2_SHA256
+KDF_TARGET_TIME = 0.3       # Seconds the key derivation of a new vault takes at unlock on the machine which created it
+CRYPTO_WORKERS = 0          # Processes shared by file encryption and decryption, 0 uses every core, 1 works in the calling thread
+CRYPTO_TASK_SIZE = 8_388_608    # 8MB of data per task handed to a worker of the crypto pool
+ENCRYPT_IN_FLIGHT_LIMIT = 134_217_728  # 128MB, most data read ahead of the vault writer while importing a v2 file
+EXTRACT_MEMORY_LIMIT = 67_108_864  # 64MB, most memory a single file extraction holds regardless of the file size
+COPY_RANGE_MIN = 1_048_576  # 1MB, smallest shift distance worth moving with os.copy_file_range
+SUPERBLOCK_SIZE = 256       # 256B, at offset 0 and mirrored as a trailer at the end of the vault
+SUPERBLOCK_VERSION = 1
+VAULT_LAYOUT_FRONT = 1      # Header in front of the data, growing it shifts the data. Superblocks without a layout are this.
+VAULT_LAYOUT_TAIL = 2       # Header in one of two slots after the data, a commit writes the other slot and flips the superblock
+NEW_VAULT_LAYOUT = VAULT_LAYOUT_TAIL
+JOURNAL_EXTENSION = ".journal"  # The journal lives next to the vault while it is open
+JOURNAL_COMMIT_LIMIT = 1_048_576    # 1MB, journaled header changes before they are committed into the vault
+HEADER_SLOT_OVERHEAD = 32   # START, PAD, the 8 bytes header length and END magic of a header slot
+HEADER_BINARY_VERSION = 2   # Headers starting with MAGIC_HEADER_BINARY, JSON headers have no version. Version 1 items held offsets
+HEADER_BATCH_SIZE = 4096    # Records per block of a binary header, the most the encoder and decoder hold at once
+METADATA_PAGE_SPAN = 256    # Ids per metadata page of a tail layout vault, a commit rewrites only the pages which changed
+EXTENT_PENDING_LIMIT = 64   # Moves the extent table holds as suffix shifts before writing them into the extents
 MINIMUM_WINDOW_WIDTH = 640  # 640x480
 MINIMUM_WINDOW_HEIGHT = 480 # 640x480
 
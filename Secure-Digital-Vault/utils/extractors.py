@@ -2,41 +2,88 @@ from PyQt6.QtCore import QByteArray, QFileInfo, QBuffer, QSize, QDir, QFile
 from PyQt6.QtGui import QIcon, QPixmap
 from PyQt6.QtWidgets import QFileIconProvider
 from utils.constants import CHUNK_LIMIT, DEFAULT_ICON_SIZE
+from contextlib import contextmanager
 
+import mmap
+import os
 
-def get_file_from_vault(vault_path : str, starting_byte : int , ending_byte : int, chunk_size_to_read : int = CHUNK_LIMIT, fd = None):
-    """Gets raw bytes from vault location on machine
+
+def get_file_from_vault(vault_path : str, starting_byte : int , ending_byte : int, chunk_size_to_read : int = CHUNK_LIMIT, fd = None) -> bytearray:
+    """Gets raw bytes from vault location on machine. They are read straight into a single buffer of the exact size, so
+    nothing is concatenated or copied after the read.
 
     Args:
         vault_path (str): vault location on disk
         starting_byte (int): file start byte
         ending_byte (int): file end byte
-        chunk_size_to_read(int): optional int parameter to determine the amount of chunks to read per file
+        chunk_size_to_read(int): optional int parameter to determine the amount of bytes per read call
         FileDescriptor (fd) optional: FileDescriptor, which is to be closed by the caller if provided.
+
+    Returns:
+        bytearray: The bytes, shorter than asked if the vault ended before ending_byte
     """
     if fd:
         file = fd
     else:
         file = open(vault_path, "rb")
 
-    file_size = ending_byte - starting_byte
-    raw_data = b''
-    file.seek(starting_byte)
-    if file_size > chunk_size_to_read:
+    try:
+        raw_data = bytearray(max(ending_byte - starting_byte, 0))
+        view = memoryview(raw_data)
         bytes_read = 0
-        while bytes_read < file_size:
-            chunk_size = min(chunk_size_to_read, file_size - bytes_read)
-            chunk = file.read(chunk_size)
-            if not chunk:
+        file.seek(starting_byte)
+        while bytes_read < len(raw_data):
+            res = file.readinto(view[bytes_read:bytes_read + chunk_size_to_read])
+            if not res:
                 break
-            raw_data += chunk
-            bytes_read += len(chunk)
-    else:
-        raw_data = file.read(ending_byte - starting_byte)
+            bytes_read += res
+        view.release()
+        if bytes_read < len(raw_data):
+            del raw_data[bytes_read:]
+        return raw_data
+    finally:
+        if not fd:
+            file.close()
 
-    if not fd:
-        file.close()
-    return raw_data
+@contextmanager
+def map_file_from_vault(vault_path : str, starting_byte : int, ending_byte : int, fd = None):
+    """Maps raw bytes of the vault read-only, for consumers which only read them once, e.g, decryption or checksum
+    verification. Nothing is read or copied up front, the pages are loaded as they are touched.
+    The vault must not be truncated while the view is in use.
+
+    Args:
+        vault_path (str): vault location on disk
+        starting_byte (int): file start byte
+        ending_byte (int): file end byte
+        FileDescriptor (fd) optional: FileDescriptor, which is to be closed by the caller if provided.
+
+    Yields:
+        memoryview: The bytes, shorter than asked if the vault ended before ending_byte. Slices of it must not outlive the block.
+    """
+    file = fd if fd else open(vault_path, "rb")
+    mapped = None
+    view = None
+    try:
+        file_size = os.fstat(file.fileno()).st_size
+        ending_byte = min(ending_byte, file_size)
+        if ending_byte <= starting_byte:
+            yield memoryview(b'')
+            return
+        # mmap offsets must be a multiple of the allocation granularity
+        offset = starting_byte - starting_byte % mmap.ALLOCATIONGRANULARITY
+        mapped = mmap.mmap(file.fileno(), ending_byte - offset, access=mmap.ACCESS_READ, offset=offset)
+        view = memoryview(mapped)[starting_byte - offset:]
+        yield view
+    finally:
+        if view is not None:
+            view.release()
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError: # A slice is still referenced, the map is closed once it is collected
+                pass
+        if not fd:
+            file.close()
 
 def get_icon_from_file(file_loc : str) -> bytes:
     """Gets the icon from the given file and returns its pixelmap as raw bytes.
@@ -149,6 +196,8 @@ def get_item_info(path : str) -> dict:
         res["size"] = item.size()
         res["loc_start"] = -1
         res["loc_end"] = -1
+        res["icon_data_start"] = -1
+        res["icon_data_end"] = -1
         res["checksum"] = "Unknown"
         res["file_encrypted"] = False
         res["path"] = 0
@@ -157,8 +206,6 @@ def get_item_info(path : str) -> dict:
             "type" : item.suffix(), # The actual extension
             "data_created": item.birthTime().toSecsSinceEpoch(),
             "last_modified" : item.lastModified().toSecsSinceEpoch(),
-            "icon_data_start": -1,
-            "icon_data_end" : -1,
             "note_id" : -1
         }
     return res
@@ -1,4 +1,38 @@
-import json, time
+import json, struct, time
+from utils.constants import COMPACTION_RATIO, HEADER_GROWTH_FACTOR, HEADER_GROWTH_CAP, MAGIC_HEADER_BINARY, HEADER_BINARY_VERSION, \
+    HEADER_BATCH_SIZE, METADATA_PAGE_SPAN
+
+# Binary header: magic(8) | version(u8), then blocks of kind(u8) | count(u32) | payload until HEADER_BLOCK_END.
+# Strings are stored once in STRINGS blocks, which come before the first record using them, and referenced by index.
+HEADER_PREFIX = struct.Struct(">8sB")
+HEADER_BLOCK = struct.Struct(">BI")
+HEADER_BLOCK_END, HEADER_BLOCK_STRINGS, HEADER_BLOCK_VAULT, HEADER_BLOCK_MAP_EXTRAS = 0, 1, 2, 3
+HEADER_BLOCK_FILE_IDS, HEADER_BLOCK_DIRECTORY_IDS, HEADER_BLOCK_NOTE_IDS, HEADER_BLOCK_FREE_EXTENTS = 4, 5, 6, 7
+HEADER_BLOCK_FILES, HEADER_BLOCK_DIRECTORIES, HEADER_BLOCK_NOTES, HEADER_BLOCK_EXTENT_IDS, HEADER_BLOCK_EXTENTS = 8, 9, 10, 11, 12
+HEADER_NO_STRING = 0xFFFFFFFF
+# id, size, extent, path, data_created, last_modified, icon_extent, note_id,
+# checksum, name, type, other metadata as JSON, file_encrypted, format_version, key_version (0 when not recorded)
+HEADER_FILE_RECORD = struct.Struct(">8q4I3B")
+# Version 1 held loc_start, loc_end in place of extent, and icon_data_start, icon_data_end in place of icon_extent
+HEADER_FILE_RECORD_V1 = struct.Struct(">10q4I3B")
+# id, path, data_created, last_modified, name, amount of file ids, which follow the records of the block
+HEADER_DIRECTORY_RECORD = struct.Struct(">4q2I")
+# id, owned_by_file, extent, type, checksum
+HEADER_NOTE_RECORD = struct.Struct(">3q2I")
+# Version 1 held loc_start, loc_end in place of extent
+HEADER_NOTE_RECORD_V1 = struct.Struct(">4q2I")
+# id, start, end
+HEADER_EXTENT_RECORD = struct.Struct(">3q")
+HEADER_FILE_KEYS = {"id", "size", "extent", "checksum", "file_encrypted", "path", "metadata"}
+HEADER_FILE_METADATA_KEYS = ("name", "type", "data_created", "last_modified", "icon_extent", "note_id")
+HEADER_DIRECTORY_KEYS = {"id", "name", "path", "data_created", "last_modified", "files"}
+HEADER_NOTE_KEYS = {"id", "owned_by_file", "extent", "type", "checksum"}
+HEADER_ID_BLOCKS = {"file_ids" : HEADER_BLOCK_FILE_IDS, "directory_ids" : HEADER_BLOCK_DIRECTORY_IDS, "note_ids" : HEADER_BLOCK_NOTE_IDS,
+                    "extent_ids" : HEADER_BLOCK_EXTENT_IDS}
+# Metadata pages are keyed by the type of their items, as in generate_id, followed by id // METADATA_PAGE_SPAN, e.g, 'F12'.
+# The extents the items are located by are paged as 'E' as well
+METADATA_PAGE_KINDS = {"F" : ("file_ids", "files"), "D" : ("directory_ids", "directories"), "V" : ("note_ids", "notes"),
+                       "E" : ("extent_ids", "extents")}
 
 
 def formulate_header(vault_name : str , extension : str) -> dict:
@@ -18,7 +52,10 @@ def formulate_header(vault_name : str , extension : str) -> dict:
         "file_size" : 0,
         "trusted_timestamp" : int(time.time()),
         "amount_of_files" : 0,
-        "is_vault_encrypted" : True
+        "is_vault_encrypted" : True,
+        "compaction_ratio" : COMPACTION_RATIO,
+        "header_growth_factor" : HEADER_GROWTH_FACTOR,
+        "header_growth_cap" : HEADER_GROWTH_CAP
     }
     map_dict = {
         "file_ids" : [],
@@ -26,7 +63,10 @@ def formulate_header(vault_name : str , extension : str) -> dict:
         "note_ids" : [],
         "directories" : {},
         "files" : {},
-        "notes" : {}
+        "notes" : {},
+        "free_extents" : [],
+        "extent_ids" : [],
+        "extents" : {}
     }
     final_result = {
         "vault" : vault_dict,
@@ -69,3 +109,469 @@ def deserialize_dict(bytes_as_dict: bytes) -> dict:
         dict: Python dictionary
     """
     return json.loads(bytes_as_dict.decode())
+
+def iter_serialize_header(header : dict, batch_size : int = HEADER_BATCH_SIZE):
+    """Encodes the header into the binary format piece by piece, holding no more than a batch of records at once. Files,
+    directories, notes and extents become fixed records, every string they hold is stored once. The 'header_size' of the vault is
+    not stored, decoding sets it to the size of the encoding.
+
+    Args:
+        header (dict): The header, files and notes must be records holding extent ids, see Vault.resolve_file
+        batch_size (int, optional): Records per block. Defaults to HEADER_BATCH_SIZE.
+
+    Raises:
+        ValueError incase the header does not fit the binary format, see serialize_header.
+
+    Yields:
+        bytes: The encoding in order
+    """
+    strings = {}
+    new_strings = []
+
+    def index(value : str) -> int:
+        if not isinstance(value, str):
+            raise ValueError(f"Expected a string but got '{value}' of type: {type(value)}")
+        position = strings.get(value)
+        if position is None:
+            position = strings[value] = len(strings)
+            new_strings.append(value.encode())
+        return position
+
+    def block(kind : int, count : int, payload : bytes) -> bytes:
+        if new_strings:
+            lengths = struct.pack(f">{len(new_strings)}I", *map(len, new_strings))
+            payload = HEADER_BLOCK.pack(HEADER_BLOCK_STRINGS, len(new_strings)) + lengths + b''.join(new_strings) + \
+                HEADER_BLOCK.pack(kind, count) + payload
+            new_strings.clear()
+            return payload
+        return HEADER_BLOCK.pack(kind, count) + payload
+
+    def batches(items : dict):
+        items = list(items.items())
+        for start in range(0, max(len(items), 1), batch_size): # An empty block keeps the key of an empty dict
+            yield items[start:start + batch_size]
+
+    def check_entry(key : str, entry : dict, keys : set, kind : str) -> None:
+        if not isinstance(entry, dict) or entry.keys() != keys or key != str(entry["id"]):
+            raise ValueError(f"The {kind} '{key}' does not fit the binary header")
+
+    def pack_file(key : str, file : dict) -> bytes:
+        check_entry(key, file, HEADER_FILE_KEYS, "file")
+        metadata = file["metadata"]
+        if not isinstance(file["file_encrypted"], bool) or not isinstance(metadata, dict):
+            raise ValueError(f"The file '{key}' does not fit the binary header")
+        others = {k : v for k, v in metadata.items() if k not in HEADER_FILE_METADATA_KEYS}
+        versions = []
+        for version_key in ("format_version", "key_version"):
+            version = others.get(version_key, 0)
+            if type(version) is int and 0 < version < 256:
+                others.pop(version_key)
+                versions.append(version)
+            else:
+                versions.append(0)
+        return HEADER_FILE_RECORD.pack(file["id"], file["size"], file["extent"], file["path"], metadata["data_created"],
+                                       metadata["last_modified"], metadata["icon_extent"], metadata["note_id"], index(file["checksum"]),
+                                       index(metadata["name"]), index(metadata["type"]),
+                                       index(json.dumps(others)) if others else HEADER_NO_STRING, file["file_encrypted"], *versions)
+
+    def pack_extent(key : str, extent : list) -> bytes:
+        if not isinstance(extent, list) or len(extent) != 2 or not key.isdigit():
+            raise ValueError(f"The extent '{key}' must be a [start, end] pair by id")
+        return HEADER_EXTENT_RECORD.pack(int(key), *extent)
+
+    try:
+        yield HEADER_PREFIX.pack(MAGIC_HEADER_BINARY.encode(), HEADER_BINARY_VERSION)
+        vault = {k : v for k, v in header["vault"].items() if k != "header_size"}
+        yield block(HEADER_BLOCK_VAULT, int("header_size" in header["vault"]), struct.pack(">I", index(json.dumps(vault))))
+        the_map = header["map"]
+        others = {k : v for k, v in the_map.items() if k not in HEADER_ID_BLOCKS and k not in ("free_extents", "files", "directories", "notes", "extents")}
+        if others:
+            yield block(HEADER_BLOCK_MAP_EXTRAS, 1, struct.pack(">I", index(json.dumps(others))))
+        for key, kind in HEADER_ID_BLOCKS.items():
+            if key in the_map:
+                ids = the_map[key]
+                yield block(kind, len(ids), struct.pack(f">{len(ids)}q", *ids))
+        if "free_extents" in the_map:
+            extents = the_map["free_extents"]
+            if any(len(extent) != 2 for extent in extents):
+                raise ValueError("Free extents must be [start, end] pairs")
+            yield block(HEADER_BLOCK_FREE_EXTENTS, len(extents), struct.pack(f">{len(extents) * 2}q", *(v for extent in extents for v in extent)))
+        if "files" in the_map:
+            for batch in batches(the_map["files"]):
+                yield block(HEADER_BLOCK_FILES, len(batch), b''.join([pack_file(key, file) for key, file in batch]))
+        if "directories" in the_map:
+            for batch in batches(the_map["directories"]):
+                records, children = [], []
+                for key, directory in batch:
+                    check_entry(key, directory, HEADER_DIRECTORY_KEYS, "directory")
+                    records.append(HEADER_DIRECTORY_RECORD.pack(directory["id"], directory["path"], directory["data_created"],
+                                                                directory["last_modified"], index(directory["name"]), len(directory["files"])))
+                    children.extend(directory["files"])
+                yield block(HEADER_BLOCK_DIRECTORIES, len(batch), b''.join(records) + struct.pack(f">{len(children)}q", *children))
+        if "notes" in the_map:
+            for batch in batches(the_map["notes"]):
+                records = []
+                for key, note in batch:
+                    check_entry(key, note, HEADER_NOTE_KEYS, "note")
+                    records.append(HEADER_NOTE_RECORD.pack(note["id"], note["owned_by_file"], note["extent"], index(note["type"]),
+                                                           index(note["checksum"])))
+                yield block(HEADER_BLOCK_NOTES, len(batch), b''.join(records))
+        if "extents" in the_map:
+            for batch in batches(the_map["extents"]):
+                yield block(HEADER_BLOCK_EXTENTS, len(batch), b''.join([pack_extent(key, extent) for key, extent in batch]))
+        yield HEADER_BLOCK.pack(HEADER_BLOCK_END, 0)
+    except (struct.error, TypeError, KeyError, AttributeError) as e:
+        raise ValueError(f"The header does not fit the binary format: {e}")
+
+def serialize_header(header : dict) -> bytes:
+    """Serializes the header into the binary format, see iter_serialize_header. A header which does not fit it, e.g, a file
+    with an unexpected key, is serialized as JSON instead, which deserialize_header reads as well.
+
+    Args:
+        header (dict): The header
+
+    Returns:
+        bytes: Bytes which can be encrypted into the vault
+    """
+    try:
+        return b''.join(iter_serialize_header(header))
+    except ValueError:
+        return serialize_dict(header)
+
+def is_binary_header(data : bytes) -> bool:
+    """Checks whether the serialized header is in the binary format rather than JSON.
+
+    Args:
+        data (bytes): The serialized header, or its start
+
+    Returns:
+        bool: True if it starts with MAGIC_HEADER_BINARY
+    """
+    return bytes(data[:len(MAGIC_HEADER_BINARY)]) == MAGIC_HEADER_BINARY.encode()
+
+def deserialize_header_stream(pieces) -> dict:
+    """Decodes a binary header which arrives in pieces, see iter_serialize_header. Files and notes of a version 1 header
+    hold their offsets, the vault moves them onto extents once it loads them.
+
+    Args:
+        pieces (Iterable[bytes]): The encoding in order, pieces can have any size
+
+    Raises:
+        ValueError incase the encoding is not valid, or of a version which is not known.
+
+    Returns:
+        dict: The header
+    """
+    pieces = iter(pieces)
+    buffer = bytearray()
+    position = consumed = 0
+
+    def read(size : int) -> bytes:
+        nonlocal buffer, position, consumed
+        while len(buffer) - position < size:
+            piece = next(pieces, None)
+            if piece is None:
+                raise ValueError(f"The binary header ended after {consumed + len(buffer) - position} bytes")
+            del buffer[:position]
+            position = 0
+            buffer += piece
+        data = bytes(buffer[position:position + size])
+        position += size
+        consumed += size
+        return data
+
+    magic, version = HEADER_PREFIX.unpack(read(HEADER_PREFIX.size))
+    if magic != MAGIC_HEADER_BINARY.encode():
+        raise ValueError("The header is not in the binary format")
+    if version not in (1, HEADER_BINARY_VERSION):
+        raise ValueError(f"Binary header version {version} is not known")
+    strings = []
+    vault, the_map = None, {}
+    has_header_size = False
+    try:
+        while True:
+            kind, count = HEADER_BLOCK.unpack(read(HEADER_BLOCK.size))
+            if kind == HEADER_BLOCK_END:
+                break
+            elif kind == HEADER_BLOCK_STRINGS:
+                lengths = struct.unpack(f">{count}I", read(4 * count))
+                data = read(sum(lengths))
+                offset = 0
+                for length in lengths:
+                    strings.append(data[offset:offset + length].decode())
+                    offset += length
+            elif kind == HEADER_BLOCK_VAULT:
+                vault = json.loads(strings[struct.unpack(">I", read(4))[0]])
+                has_header_size = count == 1
+            elif kind == HEADER_BLOCK_MAP_EXTRAS:
+                the_map.update(json.loads(strings[struct.unpack(">I", read(4))[0]]))
+            elif kind in HEADER_ID_BLOCKS.values():
+                key = next(k for k, v in HEADER_ID_BLOCKS.items() if v == kind)
+                the_map[key] = list(struct.unpack(f">{count}q", read(8 * count)))
+            elif kind == HEADER_BLOCK_FREE_EXTENTS:
+                values = struct.unpack(f">{count * 2}q", read(16 * count))
+                the_map["free_extents"] = [[values[i], values[i + 1]] for i in range(0, len(values), 2)]
+            elif kind == HEADER_BLOCK_FILES and version == 1:
+                files = the_map.setdefault("files", {})
+                for (the_id, size, loc_start, loc_end, path, data_created, last_modified, icon_data_start, icon_data_end, note_id,
+                     checksum, name, the_type, others, file_encrypted, format_version, key_version) in \
+                        HEADER_FILE_RECORD_V1.iter_unpack(read(HEADER_FILE_RECORD_V1.size * count)):
+                    metadata = {"name" : strings[name], "type" : strings[the_type], "data_created" : data_created,
+                                "last_modified" : last_modified, "icon_data_start" : icon_data_start, "icon_data_end" : icon_data_end,
+                                "note_id" : note_id}
+                    if format_version:
+                        metadata["format_version"] = format_version
+                    if key_version:
+                        metadata["key_version"] = key_version
+                    if others != HEADER_NO_STRING:
+                        metadata.update(json.loads(strings[others]))
+                    files[str(the_id)] = {"id" : the_id, "size" : size, "loc_start" : loc_start, "loc_end" : loc_end,
+                                          "checksum" : strings[checksum], "file_encrypted" : bool(file_encrypted), "path" : path,
+                                          "metadata" : metadata}
+            elif kind == HEADER_BLOCK_FILES:
+                files = the_map.setdefault("files", {})
+                for (the_id, size, extent, path, data_created, last_modified, icon_extent, note_id,
+                     checksum, name, the_type, others, file_encrypted, format_version, key_version) in \
+                        HEADER_FILE_RECORD.iter_unpack(read(HEADER_FILE_RECORD.size * count)):
+                    metadata = {"name" : strings[name], "type" : strings[the_type], "data_created" : data_created,
+                                "last_modified" : last_modified, "icon_extent" : icon_extent, "note_id" : note_id}
+                    if format_version:
+                        metadata["format_version"] = format_version
+                    if key_version:
+                        metadata["key_version"] = key_version
+                    if others != HEADER_NO_STRING:
+                        metadata.update(json.loads(strings[others]))
+                    files[str(the_id)] = {"id" : the_id, "size" : size, "extent" : extent, "checksum" : strings[checksum],
+                                          "file_encrypted" : bool(file_encrypted), "path" : path, "metadata" : metadata}
+            elif kind == HEADER_BLOCK_DIRECTORIES:
+                directories = the_map.setdefault("directories", {})
+                records = list(HEADER_DIRECTORY_RECORD.iter_unpack(read(HEADER_DIRECTORY_RECORD.size * count)))
+                total = sum(record[5] for record in records)
+                children = struct.unpack(f">{total}q", read(8 * total))
+                offset = 0
+                for the_id, path, data_created, last_modified, name, amount in records:
+                    directories[str(the_id)] = {"id" : the_id, "name" : strings[name], "path" : path, "data_created" : data_created,
+                                                "last_modified" : last_modified, "files" : list(children[offset:offset + amount])}
+                    offset += amount
+            elif kind == HEADER_BLOCK_NOTES and version == 1:
+                notes = the_map.setdefault("notes", {})
+                for the_id, owned_by_file, loc_start, loc_end, the_type, checksum in \
+                        HEADER_NOTE_RECORD_V1.iter_unpack(read(HEADER_NOTE_RECORD_V1.size * count)):
+                    notes[str(the_id)] = {"id" : the_id, "owned_by_file" : owned_by_file, "loc_start" : loc_start,
+                                          "loc_end" : loc_end, "type" : strings[the_type], "checksum" : strings[checksum]}
+            elif kind == HEADER_BLOCK_NOTES:
+                notes = the_map.setdefault("notes", {})
+                for the_id, owned_by_file, extent, the_type, checksum in \
+                        HEADER_NOTE_RECORD.iter_unpack(read(HEADER_NOTE_RECORD.size * count)):
+                    notes[str(the_id)] = {"id" : the_id, "owned_by_file" : owned_by_file, "extent" : extent,
+                                          "type" : strings[the_type], "checksum" : strings[checksum]}
+            elif kind == HEADER_BLOCK_EXTENTS:
+                extents = the_map.setdefault("extents", {})
+                for the_id, start, end in HEADER_EXTENT_RECORD.iter_unpack(read(HEADER_EXTENT_RECORD.size * count)):
+                    extents[str(the_id)] = [start, end]
+            else:
+                raise ValueError(f"Binary header block of kind {kind} is not known")
+    except (struct.error, IndexError, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"The binary header is not valid: {e}")
+    if not isinstance(vault, dict):
+        raise ValueError("The binary header has no vault")
+    if has_header_size:
+        vault["header_size"] = consumed
+    return {"vault" : vault, "map" : the_map}
+
+def deserialize_header(data : bytes) -> dict:
+    """Deserializes a header in either format, JSON for headers written before the binary format or which did not fit it.
+
+    Args:
+        data (bytes): The serialized header
+
+    Raises:
+        ValueError incase the header is not valid.
+
+    Returns:
+        dict: The header
+    """
+    if is_binary_header(data):
+        return deserialize_header_stream([data])
+    try:
+        return deserialize_dict(data)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"The header is not valid: {e}")
+
+def diff_header(old : dict, new : dict) -> dict:
+    """Computes the changes from the old header to the new one, item by item, so they can be journaled instead of the whole header.
+
+    Args:
+        old (dict): The header as it was
+        new (dict): The header as it is now
+
+    Returns:
+        dict: 'vault' holds the changed vault keys. 'map' holds per changed key either {'set', 'remove'} for dicts,
+        {'add', 'remove'} for id lists, or {'value'} for anything else. Empty dict if nothing changed.
+    """
+    delta = {}
+    vault = {key : value for key, value in new["vault"].items() if key not in old["vault"] or old["vault"][key] != value}
+    if vault:
+        delta["vault"] = vault
+    map_delta = {}
+    for key, value in new["map"].items():
+        before = old["map"].get(key)
+        if before == value:
+            continue
+        if isinstance(value, dict) and isinstance(before, dict):
+            map_delta[key] = {"set" : {k : v for k, v in value.items() if k not in before or before[k] != v},
+                              "remove" : [k for k in before if k not in value]}
+        elif key.endswith("_ids") and isinstance(before, list):
+            before_set, value_set = set(before), set(value)
+            map_delta[key] = {"add" : [i for i in value if i not in before_set], "remove" : [i for i in before if i not in value_set]}
+        else:
+            map_delta[key] = {"value" : value}
+    if map_delta:
+        delta["map"] = map_delta
+    return delta
+
+def apply_header_delta(header : dict, delta : dict) -> None:
+    """Applies a delta made by diff_header onto the header in place.
+
+    Args:
+        header (dict): The header to update
+        delta (dict): The delta
+    """
+    header["vault"].update(delta.get("vault", {}))
+    for key, change in delta.get("map", {}).items():
+        if "value" in change:
+            header["map"][key] = change["value"]
+        elif "set" in change:
+            target = header["map"].setdefault(key, {})
+            for k in change["remove"]:
+                target.pop(k, None)
+            target.update(change["set"])
+        else:
+            removed = set(change["remove"])
+            header["map"][key] = [i for i in header["map"].get(key, []) if i not in removed] + change["add"]
+
+def get_page_key(kind : str, the_id : int) -> str:
+    """Gets the key of the metadata page which holds the given item.
+
+    Args:
+        kind (str): F for File, D for Folder, V for Note, E for Extent
+        the_id (int): The id of the item
+
+    Returns:
+        str: The page key, e.g, 'F0' for the files 0 to METADATA_PAGE_SPAN - 1
+    """
+    return f"{kind}{the_id // METADATA_PAGE_SPAN}"
+
+def get_page_keys(the_map : dict) -> set[str]:
+    """Gets the keys of every metadata page needed to hold the items of the map.
+
+    Args:
+        the_map (dict): The map of the header
+
+    Returns:
+        set[str]: The page keys
+    """
+    keys = set()
+    for kind, (_, items_key) in METADATA_PAGE_KINDS.items():
+        keys.update(get_page_key(kind, int(the_id)) for the_id in the_map.get(items_key, {}))
+    return keys
+
+def get_delta_page_keys(the_map : dict, delta : dict) -> set[str]:
+    """Gets the keys of the metadata pages a delta made by diff_header changes.
+
+    Args:
+        the_map (dict): The map of the header after the delta
+        delta (dict): The delta
+
+    Returns:
+        set[str]: The page keys
+    """
+    keys = set()
+    changes = delta.get("map", {})
+    for kind, (ids_key, items_key) in METADATA_PAGE_KINDS.items():
+        for key in (ids_key, items_key):
+            change = changes.get(key)
+            if change is None:
+                continue
+            if "value" in change:
+                keys.update(key for key in get_page_keys(the_map) if key[0] == kind)
+            else:
+                ids = list(change.get("set", {})) + list(change.get("add", [])) + list(change["remove"])
+                keys.update(get_page_key(kind, int(the_id)) for the_id in ids)
+    return keys
+
+def form_metadata_page(the_map : dict, key : str) -> dict:
+    """Forms the metadata page of the given key out of the map. A page looks like a header holding only the ids and the
+    items of its range, so it is serialized by serialize_header.
+
+    Args:
+        the_map (dict): The map of the header
+        key (str): The page key, see get_page_key
+
+    Returns:
+        dict: The page, its map is empty when the range holds no items
+    """
+    ids_key, items_key = METADATA_PAGE_KINDS[key[0]]
+    first = int(key[1:]) * METADATA_PAGE_SPAN
+    items = the_map[items_key]
+    page_items = {str(the_id) : items[str(the_id)] for the_id in range(first, first + METADATA_PAGE_SPAN) if str(the_id) in items}
+    if not page_items:
+        return {"vault" : {}, "map" : {}}
+    return {"vault" : {}, "map" : {ids_key : [int(the_id) for the_id in page_items], items_key : page_items}}
+
+def form_header_root(header : dict) -> dict:
+    """Forms the root of a paged header, which is the header without the ids and items the metadata pages hold.
+
+    Args:
+        header (dict): The header, its map holds the page table under 'pages'
+
+    Returns:
+        dict: The root, sharing its values with the header
+    """
+    paged = {key for keys in METADATA_PAGE_KINDS.values() for key in keys}
+    return {"vault" : header["vault"], "map" : {key : value for key, value in header["map"].items() if key not in paged}}
+
+def form_pages_view(header : dict, keys : set[str]) -> dict:
+    """Forms the root of the header along with the items of the given metadata pages, e.g, to diff only the pages
+    which changed with diff_header.
+
+    Args:
+        header (dict): The header
+        keys (set[str]): The page keys, see get_page_key
+
+    Returns:
+        dict: The view, sharing its values with the header
+    """
+    view = form_header_root(header)
+    for ids_key, items_key in METADATA_PAGE_KINDS.values():
+        view["map"][ids_key], view["map"][items_key] = [], {}
+    for key in sorted(keys):
+        for page_key, value in form_metadata_page(header["map"], key)["map"].items():
+            if isinstance(value, list):
+                view["map"][page_key].extend(value)
+            else:
+                view["map"][page_key].update(value)
+    return view
+
+def merge_metadata_page(the_map : dict, key : str, page : dict) -> None:
+    """Merges a metadata page read from the vault into the map.
+
+    Args:
+        the_map (dict): The map to merge into, must hold the ids and items keys
+        key (str): The page key, see get_page_key
+        page (dict): The deserialized page
+
+    Raises:
+        ValueError incase the page holds anything but the items of its range.
+    """
+    ids_key, items_key = METADATA_PAGE_KINDS[key[0]]
+    page_map = page.get("map")
+    if not isinstance(page_map, dict) or not set(page_map) <= {ids_key, items_key}:
+        raise ValueError(f"Metadata page {key} holds unexpected keys")
+    ids, items = page_map.get(ids_key, []), page_map.get(items_key, {})
+    if not isinstance(ids, list) or not isinstance(items, dict) or \
+            any(not isinstance(the_id, int) or get_page_key(key[0], the_id) != key for the_id in ids) or \
+            set(items) != {str(the_id) for the_id in ids}:
+        raise ValueError(f"Metadata page {key} holds items of other pages")
+    the_map[ids_key].extend(ids)
+    the_map[items_key].update(items)